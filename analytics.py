@@ -0,0 +1,172 @@
+# วิเคราะห์ความต้องการใช้เครื่องมือและจุดสั่งซื้อ (reorder point) ต่อเครื่องมือและแผนก
+# คำนวณแบบ vectorized ด้วย pandas/NumPy จาก rollup รายวัน (เครื่องมือ, แผนก, วัน) ไม่วนลูปทีละแถว
+#
+# ความต้องการสุทธิรายวัน = จำนวนที่เบิก - จำนวนที่คืนในวันนั้น (ของสิ้นเปลืองแทบไม่มีการคืน)
+# จุดสั่งซื้อ = μ·L + z·σ·√L  (μ, σ = ค่าเฉลี่ย/ส่วนเบี่ยงเบนของความต้องการรายวัน, L = ระยะเวลารอของ)
+# ความเสี่ยงของหมด = P(ความต้องการช่วงรอของ > คงเหลือ) โดยประมาณด้วยการแจกแจงปกติ
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from typed_frames import DATE_FORMAT
+
+DEMAND_WINDOW_DAYS = 90
+LEAD_TIME_DAYS = 7
+REVIEW_DAYS = 7
+SERVICE_LEVEL_Z = 1.65  # ระดับบริการ ~95%
+
+GROUP_KEYS = ["equipment_id", "borrower_dept"]
+
+
+# Φ(x) ของการแจกแจงปกติมาตรฐาน (สูตรประมาณ Abramowitz-Stegun 7.1.26 ใช้กับ array ได้ทั้งก้อน)
+def normal_cdf(x):
+    x = np.asarray(x, dtype="float64")
+    z = np.abs(x) / np.sqrt(2.0)
+    t = 1.0 / (1.0 + 0.3275911 * z)
+    poly = ((((1.061405429 * t - 1.453152027) * t + 1.421413741) * t - 0.284496736) * t + 0.254829592) * t
+    erf = np.sign(x) * (1.0 - poly * np.exp(-z * z))
+    return 0.5 * (1.0 + erf)
+
+
+# เหตุการณ์คืนในช่วงเวลา พร้อมเครื่องมือ แผนก และวันที่เบิกของรายการนั้น
+def _return_events(df_transactions, df_history, start, end):
+    if df_history is None or df_history.empty:
+        return pd.DataFrame({
+            "equipment_id": pd.Categorical([]), "borrower_dept": pd.Categorical([]),
+            "returned_quantity": np.array([], dtype="int64"),
+            "return_date": pd.to_datetime([]), "date": pd.to_datetime([]),
+        })
+    events = df_history[["transaction_id", "returned_quantity", "return_date"]].copy()
+    events["return_date"] = pd.to_datetime(events["return_date"], format=DATE_FORMAT, errors="coerce")
+    events = events[(events["return_date"] >= start) & (events["return_date"] < end)]
+    loans = df_transactions[["id", "equipment_id", "borrower_dept", "date"]]
+    return events.merge(loans, left_on="transaction_id", right_on="id", how="inner")
+
+
+# rollup รายวัน: จำนวนที่เบิกและคืนต่อ (เครื่องมือ, แผนก, วัน)
+def daily_rollup(df_transactions, events, start, end):
+    in_window = (df_transactions["date"] >= start) & (df_transactions["date"] < end)
+    borrowed = (df_transactions.loc[in_window, GROUP_KEYS + ["quantity"]]
+                .assign(day=df_transactions.loc[in_window, "date"].dt.floor("D"))
+                .groupby(GROUP_KEYS + ["day"], observed=True)["quantity"].sum()
+                .rename("borrowed"))
+    returned = (events[GROUP_KEYS + ["returned_quantity"]]
+                .assign(day=events["return_date"].dt.floor("D"))
+                .groupby(GROUP_KEYS + ["day"], observed=True)["returned_quantity"].sum()
+                .rename("returned"))
+    rollup = pd.concat([borrowed, returned], axis=1).fillna(0)
+    rollup["net"] = rollup["borrowed"] - rollup["returned"]
+    return rollup
+
+
+# จำนวน "ชิ้น-วัน" ที่ถูกเบิกออกไปภายในช่วงเวลา ต่อ (เครื่องมือ, แผนก)
+# ส่วนที่คืนแล้วนับถึงวันคืน ส่วนที่ยังไม่คืนนับถึงสิ้นช่วง
+def _unit_days(df_transactions, events, start, end):
+    day = np.timedelta64(1, "D")
+    returned_days = ((np.minimum(events["return_date"], end) - np.maximum(events["date"], start)) / day).clip(lower=0)
+    returned = (events[GROUP_KEYS]
+                .assign(unit_days=returned_days * events["returned_quantity"])
+                .groupby(GROUP_KEYS, observed=True)["unit_days"].sum())
+
+    open_loans = df_transactions[(df_transactions["remaining_quantity"] > 0) & (df_transactions["date"] < end)]
+    open_days = ((end - np.maximum(open_loans["date"], start)) / day).clip(lower=0)
+    outstanding = (open_loans[GROUP_KEYS]
+                   .assign(unit_days=open_days * open_loans["remaining_quantity"])
+                   .groupby(GROUP_KEYS, observed=True)["unit_days"].sum())
+    return returned.add(outstanding, fill_value=0)
+
+
+# ระยะเวลาตั้งแต่เบิกถึงคืน (วัน) เปอร์เซ็นไทล์ที่ 50 และ 90
+def _latency_quantiles(events, keys):
+    if events.empty:
+        return pd.DataFrame(columns=keys + ["latency_p50", "latency_p90"], dtype="float64").set_index(keys)
+    latency = (events["return_date"] - events["date"]) / np.timedelta64(1, "D")
+    quantiles = (events[keys].assign(latency=latency)
+                 .groupby(keys, observed=True)["latency"].quantile([0.5, 0.9])
+                 .unstack())
+    quantiles.columns = ["latency_p50", "latency_p90"]
+    return quantiles
+
+
+# คำนวณทุกตัวชี้วัด คืนค่า {'by_equipment': DataFrame, 'by_department': DataFrame}
+# df_history ต้องมีประวัติการคืนอย่างน้อยตั้งแต่ต้นช่วง window_days (ดู demand_window_start)
+def demand_analytics(df_equipment, df_transactions, df_history, now=None, window_days=DEMAND_WINDOW_DAYS,
+                     lead_time_days=LEAD_TIME_DAYS, review_days=REVIEW_DAYS, z=SERVICE_LEVEL_Z):
+    end = pd.Timestamp(now or datetime.now())
+    start = end - pd.Timedelta(days=window_days)
+
+    events = _return_events(df_transactions, df_history, start, end)
+    rollup = daily_rollup(df_transactions, events, start, end)
+    unit_days = _unit_days(df_transactions, events, start, end)
+
+    # ต่อ (เครื่องมือ, แผนก)
+    by_department = rollup.groupby(level=GROUP_KEYS, observed=True)[["borrowed", "returned", "net"]].sum()
+    by_department = by_department.join(unit_days.rename("unit_days"), how="outer").fillna(0)
+    by_department["consumption_per_day"] = by_department["net"] / window_days
+    by_department = by_department.join(_latency_quantiles(events, GROUP_KEYS))
+
+    # ต่อเครื่องมือ: ความต้องการรายวัน μ, σ (วันที่ไม่มีการเคลื่อนไหวนับเป็น 0 โดยไม่ต้องสร้างแถว)
+    daily_net = rollup.groupby(level=["equipment_id", "day"], observed=True)["net"].sum()
+    demand = pd.DataFrame({"net_total": daily_net, "net_sq": np.square(daily_net)}).groupby(
+        level="equipment_id", observed=True
+    ).sum()
+    n = float(window_days)
+    demand["demand_per_day"] = demand["net_total"] / n
+    variance = (demand["net_sq"] - n * demand["demand_per_day"] ** 2) / max(n - 1, 1)
+    demand["demand_std"] = np.sqrt(variance.clip(lower=0))
+    demand.index = demand.index.astype(str)
+
+    equipment_unit_days = by_department.groupby(level="equipment_id", observed=True)["unit_days"].sum()
+    equipment_unit_days.index = equipment_unit_days.index.astype(str)
+    latency = _latency_quantiles(events, ["equipment_id"])
+    latency.index = latency.index.astype(str)
+
+    not_returned = (df_transactions.loc[~df_transactions["fully_returned"]]
+                    .groupby("equipment_id", observed=True)["remaining_quantity"].sum())
+    not_returned.index = not_returned.index.astype(str)
+
+    by_equipment = df_equipment[["id", "name", "category", "quantity", "unit"]].set_index("id")
+    by_equipment = by_equipment.join(demand[["demand_per_day", "demand_std"]]).join(latency)
+    by_equipment["borrowed_quantity"] = not_returned.reindex(by_equipment.index).fillna(0).astype(int)
+    by_equipment["total_quantity"] = by_equipment["quantity"] + by_equipment["borrowed_quantity"]
+    by_equipment[["demand_per_day", "demand_std"]] = by_equipment[["demand_per_day", "demand_std"]].fillna(0.0)
+
+    total_unit_days = by_equipment["total_quantity"].to_numpy(dtype="float64") * window_days
+    used = equipment_unit_days.reindex(by_equipment.index).fillna(0).to_numpy()
+    by_equipment["utilization"] = np.divide(used, total_unit_days, out=np.zeros_like(used), where=total_unit_days > 0)
+
+    # จุดสั่งซื้อและความเสี่ยงของหมดช่วงรอของ (เฉพาะเครื่องมือที่มีความต้องการสุทธิ > 0)
+    mu = by_equipment["demand_per_day"].clip(lower=0).to_numpy()
+    sigma = by_equipment["demand_std"].to_numpy()
+    stock = by_equipment["quantity"].to_numpy(dtype="float64")
+    lead_mean = mu * lead_time_days
+    lead_std = sigma * np.sqrt(lead_time_days)
+    by_equipment["reorder_point"] = np.ceil(lead_mean + z * lead_std)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        risk = 1.0 - normal_cdf((stock - lead_mean) / lead_std)
+    by_equipment["stockout_risk"] = np.where(lead_std > 0, risk, (lead_mean > stock).astype(float))
+    by_equipment["days_of_cover"] = np.divide(stock, mu, out=np.full_like(stock, np.inf), where=mu > 0)
+    cover_days = lead_time_days + review_days
+    order_up_to = mu * cover_days + z * sigma * np.sqrt(cover_days)
+    by_equipment["suggested_order"] = np.ceil(np.clip(order_up_to - stock, 0, None)).astype(int)
+    by_equipment["needs_reorder"] = (mu > 0) & (stock <= by_equipment["reorder_point"].to_numpy())
+
+    by_equipment = by_equipment.rename_axis("id").reset_index()
+    by_equipment = by_equipment.sort_values(["needs_reorder", "stockout_risk"], ascending=False, kind="stable")
+    by_department = by_department.reset_index()
+    by_department["equipment_id"] = by_department["equipment_id"].astype(str)
+    by_department = by_department.merge(
+        df_equipment[["id", "name", "unit"]], left_on="equipment_id", right_on="id", how="left"
+    ).drop(columns="id")
+    return {
+        "by_equipment": by_equipment.reset_index(drop=True),
+        "by_department": by_department.sort_values("consumption_per_day", ascending=False).reset_index(drop=True),
+        "window_start": start.to_pydatetime(),
+        "window_end": end.to_pydatetime(),
+    }
+
+
+# วันที่เริ่มของช่วงวิเคราะห์ (ใช้กำหนดช่วงประวัติการคืนที่ต้องโหลด)
+def demand_window_start(now=None, window_days=DEMAND_WINDOW_DAYS):
+    return (now or datetime.now()) - timedelta(days=window_days)
@@ -1,21 +1,49 @@
 # เพิ่มที่ต้นไฟล์
-# ลบฐานข้อมูลเก่าทิ้งเพื่อแก้ปัญหา schema
+# ลบฐานข้อมูลเก่าทิ้งเพื่อแก้ปัญหา schema: python cli.py init --reset-db (แอพไม่ลบฐานข้อมูลเอง)
 import os
 import sys
 
 import streamlit as st
 import pandas as pd
 import qrcode
-import cv2
-from PIL import Image
 import json
 import sqlite3
 from datetime import datetime
-import numpy as np
 from io import BytesIO
 import base64
+import socket
 import warnings
 
+from equipment_index import EquipmentIndex
+from changefeed import (
+    CheckpointRecorder, IncrementalTransactions, cache_version, compact_change_log, current_version, table_versions
+)
+from snapshots import SNAPSHOT_DIR, export_snapshot, load_manifest, read_snapshot
+from reports import DISPLAY_COLUMNS, OVERDUE_DAYS, build_report_bundle, equipment_overview
+from scheduler import PrecomputeScheduler
+from history import read_return_history_batch, read_timeline, summarize_timeline
+from sharding import ShardRouter
+from replica import ReadReplica, max_age_from_env
+from return_queue import (
+    RETURN_APPLIED, RETURN_DUPLICATE, RETURN_REJECTED, ReturnQueue, apply_return, is_database_busy, new_idempotency_key
+)
+from dimensions import TRANSACTIONS_VIEW, DimensionLookup, dimension_names
+from charts import CHART_ACTIVITY, CHART_STATUS_PIE, CHART_TOP_EQUIPMENT, build_figure_json
+from typed_frames import merge_shard_transactions, read_transactions_typed
+from analytics import LEAD_TIME_DAYS, demand_analytics, demand_window_start
+from maintenance import (
+    VACUUM_PAGES_PER_RUN, MaintenanceService, analyze, incremental_vacuum, optimize, page_stats, table_stats
+)
+from database import (
+    DB_PATH, dump_database, init_database, insert_equipment, insert_withdrawal, restore_database, set_equipment_quantity
+)
+from ledger import STOCK_CAUSE_LABELS, stock_as_of, stock_history
+from reconcile import ISSUE_LABELS, RECONCILE_INTERVAL, open_issues, run_reconcile
+from shared_cache import SharedCache
+from qr_decode import REASON_LABELS, SCAN_DONE, QrDecoder
+from report_jobs import (FORMAT_CSV, FORMAT_XLSX, JOB_DONE, JOB_FAILED, JOB_PENDING, JOB_RUNNING, SOURCE_DATABASE,
+                         SOURCE_SNAPSHOT, STAGE_LABELS, ReportJobs)
+
 # ปิด FutureWarning ของ pandas
 warnings.filterwarnings('ignore', category=FutureWarning)
 pd.set_option('future.no_silent_downcasting', True)
@@ -24,13 +52,14 @@ pd.set_option('future.no_silent_downcasting', True)
 if not os.path.exists('data'):
     os.makedirs('data')
 
-# ใช้ path ของฐานข้อมูลที่ชัดเจน
-DB_PATH = 'data/medical_equipment.db'
+# ฐานข้อมูลแยกตามหอผู้ป่วย/ไซต์ (โหมด shard) หรือฐานข้อมูลเดียวถ้าไม่ได้ตั้งค่า
+SHARD_ROUTER = ShardRouter.from_env(DB_PATH)
 
-# ลบฐานข้อมูลเก่าทิ้งเพื่อแก้ปัญหา schema (ใช้เมื่อมีปัญหาเท่านั้น)
-if os.path.exists(DB_PATH):
-    os.remove(DB_PATH)
-    print("ลบฐานข้อมูลเก่าแล้ว จะสร้างใหม่")
+# รายงานและ export อ่านจากสำเนาอ่านอย่างเดียว ข้อมูลล่าช้าได้ไม่เกินกี่วินาที
+REPLICA_MAX_AGE = max_age_from_env()
+
+# คำนวณรายงานล่วงหน้าใหม่อย่างน้อยทุกกี่วินาที แม้ข้อมูลไม่เปลี่ยน
+PRECOMPUTE_INTERVAL = 300.0
 
 # ตั้งค่าหน้าเว็บ
 st.set_page_config(
@@ -39,6 +68,13 @@ st.set_page_config(
     layout="wide"
 )
 
+# cache บนดิสก์ที่ใช้ร่วมกันทุก worker process (data/cache) โหลด/คำนวณครั้งเดียวต่อเวอร์ชันข้อมูล
+@st.cache_resource
+def get_shared_cache():
+    return SharedCache()
+
+SHARED_CACHE = get_shared_cache()
+
 # ฟังก์ชันตรวจสอบคอลัมน์
 def column_exists(cursor, table_name, column_name):
     try:
@@ -48,131 +84,308 @@ def column_exists(cursor, table_name, column_name):
     except sqlite3.OperationalError:
         return False
 
-# ฟังก์ชันสร้างฐานข้อมูล
-# ฟังก์ชันสร้างฐานข้อมูล - เวอร์ชันง่าย
-def init_database():
-    conn = sqlite3.connect(DB_PATH, timeout=30.0)
-    cursor = conn.cursor()
-    
+# shard ที่เลือกใน session นี้ (โหมด shard เลือกจาก sidebar)
+def current_shard():
+    return st.session_state.get('ward', SHARD_ROUTER.default_key)
+
+def current_db_path():
+    return SHARD_ROUTER.path_for(current_shard())
+
+# ฟังก์ชันดึงเวอร์ชันข้อมูลปัจจุบัน (เปลี่ยนทุกครั้งที่มีการเขียนข้อมูล)
+# รวมรหัสฐานข้อมูลไว้ด้วย ใช้เป็น key ของ cache ทั้งใน process และ cache ที่ใช้ร่วมกันหลาย process ได้
+def get_data_version(db_path=None):
+    conn = sqlite3.connect(db_path or current_db_path(), timeout=30.0)
     try:
-        # สร้างตาราง equipment
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS equipment (
-                id TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                category TEXT NOT NULL,
-                quantity INTEGER NOT NULL,
-                unit TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # สร้างตาราง transactions (สมบูรณ์)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS transactions (
-                id TEXT PRIMARY KEY,
-                equipment_id TEXT NOT NULL,
-                equipment_name TEXT NOT NULL,
-                borrower_name TEXT NOT NULL,
-                borrower_dept TEXT NOT NULL,
-                quantity INTEGER NOT NULL,
-                returned_quantity INTEGER DEFAULT 0,
-                remaining_quantity INTEGER NOT NULL,
-                unit TEXT NOT NULL,
-                date TEXT NOT NULL,
-                status TEXT NOT NULL,
-                notes TEXT,
-                fully_returned BOOLEAN DEFAULT FALSE,
-                last_return_date TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # สร้างตาราง return_history
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS return_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                transaction_id TEXT NOT NULL,
-                returned_quantity INTEGER NOT NULL,
-                return_date TEXT NOT NULL,
-                notes TEXT
-            )
-        ''')
-        
-        # ใส่ข้อมูลเริ่มต้น (ถ้ายังไม่มี)
-        cursor.execute("SELECT COUNT(*) FROM equipment")
-        if cursor.fetchone()[0] == 0:
-            initial_equipment = [
-                ("EQ001", "เครื่องวัดความดัน", "การตรวจ", 10, "เครื่อง"),
-                ("EQ002", "หูฟังแพทย์", "การตรวจ", 5, "อัน"),
-                ("EQ003", "เทอร์โมมิเตอร์", "การตรวจ", 15, "อัน"),
-                ("EQ004", "ถุงมือยาง", "อุปกรณ์ความปลอดภัย", 100, "คู่"),
-                ("EQ005", "แอลกอฮอล์เจล", "อุปกรณ์ความปลอดภัย", 50, "ขวด")
-            ]
-            
-            cursor.executemany('''
-                INSERT INTO equipment (id, name, category, quantity, unit)
-                VALUES (?, ?, ?, ?, ?)
-            ''', initial_equipment)
-            print("เพิ่มข้อมูลเครื่องมือเริ่มต้นสำเร็จ")
-        
-        conn.commit()
-        print("เริ่มต้นฐานข้อมูลสำเร็จ")
-        
-    except Exception as e:
-        print(f"เกิดข้อผิดพลาดในการเริ่มต้นฐานข้อมูล: {e}")
-        conn.rollback()
+        return cache_version(conn)
     finally:
         conn.close()
 
-# ฟังก์ชันโหลดข้อมูลเครื่องมือ
-@st.cache_data
+# ฟังก์ชันโหลดข้อมูลเครื่องมือ (cache ตามเวอร์ชันข้อมูล ทุก worker ใช้ผลเดียวกันจาก cache ร่วม)
+@st.cache_data(max_entries=8)
+def load_equipment_from(db_path, data_version=None):
+    def read():
+        conn = sqlite3.connect(db_path, timeout=30.0)
+        try:
+            return pd.read_sql_query("SELECT * FROM equipment ORDER BY id", conn)
+        finally:
+            conn.close()
+    return SHARED_CACHE.get_or_compute('equipment', db_path, data_version, read)
+
 def load_equipment():
-    conn = sqlite3.connect(DB_PATH, timeout=30.0)
+    db_path = current_db_path()
+    return load_equipment_from(db_path, get_data_version(db_path))
+
+# สำเนาอ่านอย่างเดียวของแต่ละ shard สำหรับงานอ่านที่ใช้เวลานาน (ไม่ถือ lock ของไฟล์หลัก)
+@st.cache_resource
+def get_replica(db_path):
+    return ReadReplica(db_path, max_age=REPLICA_MAX_AGE)
+
+# เวอร์ชันข้อมูลของสำเนาทุก shard (คัดลอกใหม่ถ้าสำเนาเก่ากว่า REPLICA_MAX_AGE)
+def get_all_replica_versions():
+    return tuple(get_replica(path).ensure_fresh().version for path in SHARD_ROUTER.paths())
+
+# DataFrame รายการเบิกที่ใช้ร่วมกันทุก session อัพเดทแบบ incremental จาก change feed (หนึ่งตัวต่อ shard)
+# การโหลดทั้งหมด (เริ่ม process / log ถูกบีบอัด) อ่านจาก cache ร่วม worker ที่เริ่มทีหลังจึงไม่ต้องอ่าน SQLite ทั้งตาราง
+# แต่ละ worker บันทึก checkpoint ของตัวเอง การบีบอัด log ในงานดูแลฐานข้อมูลจึงไม่ลบส่วนที่ยังไม่ได้อ่าน
+@st.cache_resource
+def get_transactions_feed(db_path):
+    return IncrementalTransactions(
+        load_full=lambda conn: SHARED_CACHE.get_or_compute(
+            'transactions', db_path, cache_version(conn), lambda: read_transactions_typed(conn)
+        ),
+        checkpoint=CheckpointRecorder(db_path, f"cache:{socket.gethostname()}:{os.getpid()}"),
+    )
+
+# ฟังก์ชันโหลดข้อมูลการเบิก (แบบ typed: categorical / datetime64 / int32 / bool)
+# อ่านเฉพาะแถวที่เปลี่ยนตั้งแต่ครั้งก่อน ทุก session ได้ DataFrame ตัวเดียวกันโดยไม่ copy
+# ผู้เรียกห้ามแก้ไข DataFrame ที่ได้โดยตรง ให้ .copy() ก่อนถ้าต้องการแก้
+# อ่านจากสำเนาอ่านอย่างเดียว ข้อมูลอาจล่าช้าได้ไม่เกิน REPLICA_MAX_AGE วินาที
+def load_transactions(db_path=None):
+    db_path = db_path or current_db_path()
+    conn = get_replica(db_path).connect()
     try:
-        df = pd.read_sql_query("SELECT * FROM equipment ORDER BY id", conn)
-        return df
+        return get_transactions_feed(db_path).refresh(conn)
     finally:
         conn.close()
 
-# ฟังก์ชันโหลดข้อมูลการเบิก
-@st.cache_data
-def load_transactions():
-    conn = sqlite3.connect(DB_PATH, timeout=30.0)
+# ฟังก์ชันโหลดข้อมูลการเบิกจากทุก shard แบบขนานแล้วรวมกัน (สำหรับรายงาน)
+def load_all_transactions():
+    frames = SHARD_ROUTER.fan_out(lambda key, path: load_transactions(path))
+    return merge_shard_transactions(frames.values())
+
+# โฟลเดอร์ snapshot ของแต่ละ shard
+def snapshot_dir_for(shard_key):
+    return os.path.join(SNAPSHOT_DIR, shard_key) if SHARD_ROUTER.sharded else SNAPSHOT_DIR
+
+def load_snapshot_manifests():
+    return {key: load_manifest(snapshot_dir_for(key)) for key in SHARD_ROUTER.keys()}
+
+def export_all_snapshots():
+    return SHARD_ROUTER.fan_out(lambda key, path: export_snapshot(path, snapshot_dir_for(key)))
+
+# ฟังก์ชันโหลดข้อมูลการเบิกจาก snapshot (Arrow แบบ memory-map) แทนการอ่านจาก SQLite
+@st.cache_resource(max_entries=2)
+def load_transactions_snapshot(snapshot_key):
+    frames = SHARD_ROUTER.fan_out(lambda key, path: read_snapshot('transactions', snapshot_dir_for(key)))
+    return merge_shard_transactions(frames.values())
+
+# ฟังก์ชันโหลดรายชื่อแผนก (จากตารางมิติ departments ไม่ต้องโหลดรายการเบิกทั้งตาราง)
+@st.cache_data(max_entries=8)
+def load_department_names(db_path, data_version=None):
+    conn = sqlite3.connect(db_path, timeout=30.0)
+    try:
+        return dimension_names(conn, "departments")
+    finally:
+        conn.close()
+
+# ฟังก์ชันโหลดไทม์ไลน์เหตุการณ์เบิก-คืนของเครื่องมือหรือแผนก
+@st.cache_data(max_entries=32)
+def load_timeline(db_path, equipment_id=None, borrower_dept=None, start=None, end=None, data_version=None):
+    conn = sqlite3.connect(db_path, timeout=30.0)
+    try:
+        return read_timeline(conn, equipment_id, borrower_dept, start, end)
+    finally:
+        conn.close()
+
+# ยอดคงเหลือ ณ เวลาที่เลือก จากสมุดบัญชีสต็อก (snapshot ล่าสุดก่อนเวลานั้น + delta หลัง snapshot)
+@st.cache_data(max_entries=32)
+def load_stock_as_of(db_path, as_of, data_version=None):
+    conn = sqlite3.connect(db_path, timeout=30.0)
     try:
-        df = pd.read_sql_query('''
-            SELECT * FROM transactions 
-            ORDER BY created_at DESC
-        ''', conn)
-        return df
+        quantities = stock_as_of(conn, as_of)
     finally:
         conn.close()
+    return pd.DataFrame({'id': list(quantities.keys()), 'quantity_as_of': list(quantities.values())})
 
-# ฟังก์ชันโหลดประวัติการคืน
-@st.cache_data
-def load_return_history(transaction_id):
-    conn = sqlite3.connect(DB_PATH, timeout=30.0)
+# ประวัติการเปลี่ยนจำนวนของเครื่องมือหนึ่งรายการ
+@st.cache_data(max_entries=32)
+def load_stock_history(db_path, equipment_id, data_version=None):
+    conn = sqlite3.connect(db_path, timeout=30.0)
     try:
-        df = pd.read_sql_query('''
-            SELECT * FROM return_history 
-            WHERE transaction_id = ?
-            ORDER BY return_date DESC
-        ''', conn, params=(transaction_id,))
-        return df
+        return pd.DataFrame(stock_history(conn, equipment_id), columns=['seq', 'delta', 'cause', 'reference', 'at'])
     finally:
         conn.close()
 
+# ดัชนีเครื่องมือ สร้างครั้งเดียวต่อเวอร์ชันข้อมูลและใช้ร่วมกันทุก session (ไม่ copy)
+# สร้างจากข้อมูลที่โหลดด้วย data_version เดียวกับ key ของดัชนี (ไม่มีทางได้ข้อมูลของเวอร์ชันเก่า)
+@st.cache_resource(max_entries=8)
+def get_equipment_index(db_path, data_version):
+    return EquipmentIndex(load_equipment_from(db_path, data_version))
+
+# ตัวเลือกเครื่องมือแบบค้นหา แสดงเฉพาะรายการที่ตรงกับคำค้นไม่เกิน limit รายการ
+def equipment_picker(label, query, key, in_stock_only=False, limit=50):
+    db_path = current_db_path()
+    index = get_equipment_index(db_path, get_data_version(db_path))
+    matches = index.search(query, limit=limit, in_stock_only=in_stock_only)
+    
+    if not matches:
+        st.warning("ไม่พบเครื่องมือที่ตรงกับคำค้น")
+        return None, index
+    
+    selected_id = st.selectbox(
+        label,
+        [row['id'] for row in matches],
+        format_func=lambda eq_id: index.label(eq_id, show_stock=in_stock_only),
+        key=key
+    )
+    return selected_id, index
+
+# โหลดข้อมูลตั้งต้นสำหรับ background scheduler จากสำเนาของทุก shard แบบขนาน
+# (อ่านจาก SQLite โดยตรง ไม่ผ่าน st.cache เพราะทำงานนอก session)
+# ประวัติการคืนโหลดเฉพาะช่วงที่ใช้วิเคราะห์ความต้องการ
+def load_precompute_inputs(transactions_feeds, replicas):
+    history_start = demand_window_start()
+    
+    def load_shard(key, path):
+        conn = replicas[key].connect()
+        try:
+            return (
+                table_versions(conn),
+                pd.read_sql_query("SELECT * FROM equipment ORDER BY id", conn),
+                transactions_feeds[key].refresh(conn),
+                read_return_history_batch(conn, start=history_start),
+            )
+        finally:
+            conn.close()
+    
+    shards = SHARD_ROUTER.fan_out(load_shard)
+    keys = SHARD_ROUTER.keys()
+    return {
+        # เวอร์ชันของแต่ละตารางรวมทุก shard (job คำนวณใหม่เฉพาะเมื่อตารางที่ใช้เปลี่ยน)
+        'input_versions': {
+            table: tuple(shards[key][0][table] for key in keys)
+            for table in ('equipment', 'transactions', 'return_history')
+        },
+        'equipment': {key: equipment for key, (_, equipment, _, _) in shards.items()},
+        'transactions': {key: transactions for key, (_, _, transactions, _) in shards.items()},
+        'return_history': {key: history for key, (_, _, _, history) in shards.items()},
+    }
+
+# job คำนวณล่วงหน้าที่ใช้ผลร่วมกันทุก worker: worker แรกที่ถึงรอบเป็นคนคำนวณ worker อื่นอ่านผลจาก cache ร่วม
+# key คือเวอร์ชันของตารางที่ job ใช้ รวมช่วงเวลา (ทุก PRECOMPUTE_INTERVAL) เพราะผลบางอย่างขึ้นกับเวลาปัจจุบัน
+def shared_job(name, func, inputs):
+    def run(data):
+        period = int(datetime.now().timestamp() // PRECOMPUTE_INTERVAL)
+        versions = tuple(data['input_versions'][table] for table in inputs)
+        return SHARED_CACHE.get_or_compute('precompute', name, (versions, period), lambda: func(data))
+    return run
+
+# ลงทะเบียน job พร้อมตารางที่ใช้ (คำนวณใหม่เฉพาะเมื่อตารางเหล่านั้นเปลี่ยน หรือครบรอบเวลา)
+def register_shared_job(scheduler, name, func, inputs):
+    scheduler.register(name, shared_job(name, func, inputs), inputs=inputs)
+
+# scheduler คำนวณรายงานล่วงหน้า เริ่มครั้งเดียวต่อ process
+# รายงานรวมทุก shard, ภาพรวมเครื่องมือและการวิเคราะห์ความต้องการแยกตาม shard
+# เวอร์ชันข้อมูลอ้างอิงจากสำเนา การตรวจเวอร์ชันทุกรอบจึงเป็นตัวคัดลอกสำเนาใหม่ตามรอบด้วย
+@st.cache_resource
+def get_precompute_scheduler():
+    transactions_feeds = {key: get_transactions_feed(path) for key, path in SHARD_ROUTER.shards.items()}
+    replicas = {key: get_replica(path) for key, path in SHARD_ROUTER.shards.items()}
+    scheduler = PrecomputeScheduler(
+        lambda: tuple(replica.ensure_fresh().version for replica in replicas.values()),
+        lambda: load_precompute_inputs(transactions_feeds, replicas),
+        interval=PRECOMPUTE_INTERVAL
+    )
+    register_shared_job(scheduler, 'report', lambda data: build_report_bundle(
+        merge_shard_transactions(data['transactions'].values()), include_exports=False
+    ), ('transactions',))
+    register_shared_job(scheduler, 'equipment_overview', lambda data: {
+        key: equipment_overview(data['equipment'][key], data['transactions'][key])
+        for key in data['equipment']
+    }, ('equipment', 'transactions'))
+    register_shared_job(scheduler, 'demand', lambda data: {
+        key: demand_analytics(data['equipment'][key], data['transactions'][key], data['return_history'][key])
+        for key in data['equipment']
+    }, ('equipment', 'transactions', 'return_history'))
+    return scheduler.start()
+
+# อ่านผลที่คำนวณไว้ ถ้าข้อมูลเพิ่งเปลี่ยนให้รอผลรอบใหม่สักครู่ ถ้าไม่ทันให้ใช้ผลเดิมไปก่อน
+def get_precomputed(name, wait=5.0):
+    scheduler = get_precompute_scheduler()
+    data_version = get_all_replica_versions()
+    result = scheduler.get(name, wait=wait)
+    if result is not None and result.data_version != data_version:
+        scheduler.refresh_now()
+        result = scheduler.get(name, wait=wait, data_version=data_version) or result
+    return result
+
+# แสดงเวลาที่คำนวณผลล่วงหน้า
+def show_precomputed_freshness(result):
+    if result is None:
+        return
+    stale = " (กำลังอัพเดท)" if result.data_version != get_all_replica_versions() else ""
+    st.caption(
+        f"⏱️ คำนวณล่วงหน้าเมื่อ {result.computed_at.strftime('%d/%m/%Y %H:%M:%S')} "
+        f"ใช้เวลา {result.duration:.2f} วินาที{stale} "
+        f"(จากสำเนาฐานข้อมูล ล่าช้าไม่เกิน {REPLICA_MAX_AGE:.0f} วินาที)"
+    )
+
+# คำนวณรายงานจาก snapshot ครั้งเดียวต่อ snapshot
+@st.cache_resource(max_entries=2)
+def build_snapshot_report(snapshot_key):
+    return build_report_bundle(load_transactions_snapshot(snapshot_key), include_exports=False)
+
+# งานสร้างไฟล์รายงาน (Excel / CSV) เบื้องหลังใน process pool หนึ่งตัวต่อ process
+@st.cache_resource
+def get_report_jobs():
+    return ReportJobs()
+
+# ส่งงานสร้างไฟล์รายงานจากแหล่งข้อมูลเดียวกับที่แสดงบนหน้า (snapshot หรือฐานข้อมูลทุก shard)
+# คืนค่า path ของไฟล์รายงาน ถ้าเคยสร้างไว้แล้วสำหรับพารามิเตอร์และเวอร์ชันข้อมูลเดียวกันจะได้ไฟล์เดิม
+def submit_report_job(params, snapshot_key=None):
+    if snapshot_key is not None:
+        sources = [(SOURCE_SNAPSHOT, snapshot_dir_for(key)) for key in SHARD_ROUTER.keys()]
+        data_version = ('snapshot', snapshot_key)
+    else:
+        sources = [(SOURCE_DATABASE, path) for path in SHARD_ROUTER.paths()]
+        data_version = tuple(get_data_version(path) for path in SHARD_ROUTER.paths())
+    return get_report_jobs().submit(params, data_version, sources)
+
+# ความคืบหน้าของงานสร้างไฟล์รายงาน อัพเดทเฉพาะส่วนนี้ของหน้าทุกวินาทีจนงานจบ
+@st.fragment(run_every=1.0)
+def show_report_job_progress(artifact_path):
+    status = get_report_jobs().status(artifact_path)
+    if status['state'] not in (JOB_PENDING, JOB_RUNNING):
+        st.rerun()
+    fraction = status['done'] / status['total'] if status['total'] else 0.0
+    st.progress(
+        min(fraction, 1.0),
+        text=f"⏳ กำลังสร้างไฟล์รายงาน: {STAGE_LABELS.get(status['stage'], status['stage'])} "
+             f"({status['done']:,}/{status['total']:,})"
+    )
+
+# ปุ่มดาวน์โหลดเมื่อไฟล์รายงานพร้อม หรือความคืบหน้าถ้ายังสร้างไม่เสร็จ
+def show_report_job(job):
+    status = get_report_jobs().status(job['path'])
+    if status['state'] == JOB_DONE:
+        with open(job['path'], 'rb') as f:
+            data = f.read()
+        st.download_button(
+            label=f"💾 ดาวน์โหลด {job['file_name']}",
+            data=data,
+            file_name=job['file_name'],
+            mime=job['mime']
+        )
+        if 'rows' in status:
+            st.caption(f"{status['rows']:,} รายการ ขนาด {status['bytes'] / 1024:,.1f} KB")
+    elif status['state'] == JOB_FAILED:
+        st.error(f"❌ สร้างไฟล์รายงานไม่สำเร็จ: {status.get('error')}")
+    elif status['state'] in (JOB_PENDING, JOB_RUNNING):
+        show_report_job_progress(job['path'])
+
+# กราฟของหน้ารายงานเก็บเป็น JSON ตามชนิดกราฟ ตัวกรอง และเวอร์ชันข้อมูล
+# (ข้อมูลที่ขึ้นต้นด้วย _ ไม่ใช้เป็น key ของ cache)
+@st.cache_data(max_entries=64)
+def get_report_figure(chart_type, status_filter, data_version, _report, _df_transactions):
+    fig_json = build_figure_json(chart_type, _report, _df_transactions, status_filter)
+    return json.loads(fig_json) if fig_json else None
+
 # ฟังก์ชันเพิ่มเครื่องมือใหม่
-def add_equipment(eq_id, name, category, quantity, unit):
-    conn = sqlite3.connect(DB_PATH, timeout=30.0)
-    cursor = conn.cursor()
+def add_equipment(eq_id, name, category, quantity, unit, db_path=None):
+    conn = sqlite3.connect(db_path or current_db_path(), timeout=30.0)
     
     try:
-        cursor.execute('''
-            INSERT INTO equipment (id, name, category, quantity, unit)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (eq_id, name, category, quantity, unit))
+        insert_equipment(conn, eq_id, name, category, quantity, unit)
         conn.commit()
         return True
     except sqlite3.IntegrityError:
@@ -184,44 +397,32 @@ def add_equipment(eq_id, name, category, quantity, unit):
         conn.close()
 
 # ฟังก์ชันอัพเดทจำนวนเครื่องมือ
-def update_equipment_quantity(eq_id, new_quantity):
-    conn = sqlite3.connect(DB_PATH, timeout=30.0)
-    cursor = conn.cursor()
+def update_equipment_quantity(eq_id, new_quantity, db_path=None):
+    conn = sqlite3.connect(db_path or current_db_path(), timeout=30.0)
     
     try:
-        cursor.execute('''
-            UPDATE equipment 
-            SET quantity = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (new_quantity, eq_id))
+        set_equipment_quantity(conn, eq_id, new_quantity)
         conn.commit()
     finally:
         conn.close()
 
+# cache รหัสผู้เบิก/แผนกของแต่ละฐานข้อมูล (ใช้ร่วมกันทุก session)
+@st.cache_resource
+def get_dimension_lookup(db_path):
+    return DimensionLookup()
+
 # ฟังก์ชันเบิกเครื่องมือ
 def withdraw_equipment(transaction_id, equipment_id, equipment_name, borrower_name, 
                       borrower_dept, quantity, unit, notes):
-    conn = sqlite3.connect(DB_PATH, timeout=30.0)
-    cursor = conn.cursor()
+    # shard ของรายการเบิกดูจาก prefix ของรหัสการเบิก
+    db_path = SHARD_ROUTER.path_for_transaction(transaction_id)
+    conn = sqlite3.connect(db_path, timeout=30.0)
     
     try:
-        # เพิ่มรายการเบิก
-        cursor.execute('''
-            INSERT INTO transactions 
-            (id, equipment_id, equipment_name, borrower_name, borrower_dept, 
-             quantity, returned_quantity, remaining_quantity, unit, date, status, notes, fully_returned)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (transaction_id, equipment_id, equipment_name, borrower_name, 
-              borrower_dept, quantity, 0, quantity, unit, datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-              "เบิกแล้ว", notes, False))
-        
-        # ลดจำนวนเครื่องมือ
-        cursor.execute('''
-            UPDATE equipment 
-            SET quantity = quantity - ?, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (quantity, equipment_id))
-        
+        insert_withdrawal(
+            conn, get_dimension_lookup(db_path), transaction_id, equipment_id, borrower_name, borrower_dept,
+            quantity, notes, equipment_name=equipment_name, unit=unit
+        )
         conn.commit()
         return True
     except Exception as e:
@@ -232,91 +433,114 @@ def withdraw_equipment(transaction_id, equipment_id, equipment_name, borrower_na
         conn.close()
 
 # ฟังก์ชันคืนเครื่องมือบางส่วน
-def partial_return_equipment(transaction_id, return_quantity, notes=""):
-    conn = sqlite3.connect(DB_PATH, timeout=30.0)
-    cursor = conn.cursor()
+def partial_return_equipment(transaction_id, return_quantity, notes="", idempotency_key=None):
+    try:
+        conn = sqlite3.connect(SHARD_ROUTER.path_for_transaction(transaction_id), timeout=30.0)
+    except sqlite3.Error as e:
+        return False, f"เกิดข้อผิดพลาด: {str(e)}"
     
     try:
-        # ดึงข้อมูลการเบิก
-        cursor.execute('''
-            SELECT equipment_id, remaining_quantity, quantity FROM transactions 
-            WHERE id = ? AND fully_returned = FALSE
-        ''', (transaction_id,))
-        
-        result = cursor.fetchone()
-        if not result:
-            return False, "ไม่พบรายการเบิกหรือคืนครบแล้ว"
-        
-        equipment_id, current_remaining, total_quantity = result
-        
-        # ตรวจสอบจำนวนที่คืน
-        if return_quantity > current_remaining:
-            return False, f"จำนวนที่คืนเกินกว่าที่เหลือ (เหลือ {current_remaining} ชิ้น)"
-        
-        if return_quantity <= 0:
-            return False, "จำนวนที่คืนต้องมากกว่า 0"
-        
-        # คำนวณจำนวนใหม่
-        new_returned_quantity = total_quantity - current_remaining + return_quantity
-        new_remaining_quantity = current_remaining - return_quantity
-        is_fully_returned = new_remaining_quantity == 0
-        
-        # อัพเดทข้อมูลการเบิก
-        cursor.execute('''
-            UPDATE transactions 
-            SET returned_quantity = ?,
-                remaining_quantity = ?,
-                fully_returned = ?,
-                last_return_date = ?,
-                status = ?
-            WHERE id = ?
-        ''', (new_returned_quantity, new_remaining_quantity, is_fully_returned,
-              datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-              "คืนครบแล้ว" if is_fully_returned else "คืนบางส่วน",
-              transaction_id))
-        
-        # บันทึกประวัติการคืน
-        cursor.execute('''
-            INSERT INTO return_history (transaction_id, returned_quantity, return_date, notes)
-            VALUES (?, ?, ?, ?)
-        ''', (transaction_id, return_quantity, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), notes))
-        
-        # เพิ่มจำนวนเครื่องมือกลับ
-        cursor.execute('''
-            UPDATE equipment 
-            SET quantity = quantity + ?, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (return_quantity, equipment_id))
-        
+        status, message = apply_return(conn, transaction_id, return_quantity, notes, idempotency_key)
         conn.commit()
-        return True, f"คืนสำเร็จ {return_quantity} ชิ้น (เหลือ {new_remaining_quantity} ชิ้น)"
+        if status == RETURN_DUPLICATE:
+            return True, f"{message} (บันทึกไปแล้วก่อนหน้านี้)"
+        return status == RETURN_APPLIED, message
         
+    except sqlite3.OperationalError as e:
+        conn.rollback()
+        # เข้าคิวเฉพาะเมื่อฐานข้อมูลถูกล็อก/busy (ลองใหม่ภายหลังจะสำเร็จ) error อื่นแจ้งผู้ใช้ทันที
+        if is_database_busy(e):
+            return queue_return(transaction_id, return_quantity, notes, idempotency_key, e)
+        return False, f"เกิดข้อผิดพลาด: {str(e)}"
     except Exception as e:
         conn.rollback()
         return False, f"เกิดข้อผิดพลาด: {str(e)}"
     finally:
         conn.close()
 
+# คิวลองใหม่ของการคืนที่เจอฐานข้อมูลไม่ว่าง (journal บนเซิร์ฟเวอร์ ใช้ร่วมกันทุก session และทุก worker)
+@st.cache_resource
+def get_return_queue():
+    return ReturnQueue()
+
+# ฐานข้อมูลกลางไม่ว่าง (ถูกล็อกนานเกินไป) เก็บการคืนไว้ในคิวแล้วซิงค์ภายหลัง
+def queue_return(transaction_id, return_quantity, notes, idempotency_key, error):
+    if idempotency_key is None:
+        return False, f"เกิดข้อผิดพลาด: {str(error)}"
+    get_return_queue().enqueue(transaction_id, return_quantity, notes, idempotency_key)
+    return True, f"บันทึกการคืน {return_quantity} ชิ้นไว้ในคิวแล้ว จะซิงค์เข้าฐานข้อมูลอัตโนมัติ"
+
+# ซิงค์คิวการคืนที่ค้างอยู่ (ถ้ามี)
+def sync_return_queue():
+    queue = get_return_queue()
+    if not os.path.exists(queue.journal_path) or os.path.getsize(queue.journal_path) == 0:
+        return None
+    result = queue.sync(SHARD_ROUTER.path_for_transaction)
+    if result[RETURN_APPLIED]:
+        st.cache_data.clear()
+    return result
+
+# generation ของ cache ร่วมที่ process นี้เห็นล่าสุด
+@st.cache_resource
+def get_seen_cache_generation():
+    return {'generation': SHARED_CACHE.generation()}
+
+# ถ้า process อื่นสั่งล้าง cache (generation เปลี่ยน) ให้ล้าง cache ในหน่วยความจำของ process นี้ด้วย
+# (เช่น หลังกู้คืนฐานข้อมูล เวอร์ชันข้อมูลอาจซ้ำกับของเดิม จึงต้องคัดลอกสำเนาและโหลดใหม่ทั้งหมด)
+def sync_cache_generation():
+    seen = get_seen_cache_generation()
+    generation = SHARED_CACHE.generation()
+    if generation == seen['generation']:
+        return False
+    seen['generation'] = generation
+    st.cache_data.clear()
+    get_equipment_index.clear()
+    for path in SHARD_ROUTER.paths():
+        get_replica(path).refresh()
+        get_transactions_feed(path).reset()
+        get_dimension_lookup(path).reset()
+    return True
+
+# ล้าง cache ทั้งหมดของทุก worker (worker อื่นจะล้าง cache ของตัวเองใน rerun ถัดไป)
+def clear_all_caches():
+    SHARED_CACHE.clear()
+    sync_cache_generation()
+
+# งานดูแลฐานข้อมูลทุก shard ทำงานใน background thread เริ่มครั้งเดียวต่อ process
+@st.cache_resource
+def get_maintenance_service():
+    return MaintenanceService(SHARD_ROUTER.paths()).start()
+
+# ตรวจความสอดคล้องของยอดทุก shard เฉพาะแถวที่เปลี่ยนตั้งแต่รอบก่อน (รายงานอย่างเดียว ไม่ซ่อมอัตโนมัติ)
+@st.cache_resource
+def get_reconcile_service():
+    return MaintenanceService(
+        SHARD_ROUTER.paths(), interval=RECONCILE_INTERVAL, task=run_reconcile, name="db-reconcile"
+    ).start()
+
 # ฟังก์ชันลบรายการเบิกทั้งหมด
-def clear_all_transactions():
-    conn = sqlite3.connect(DB_PATH, timeout=30.0)
+def clear_all_transactions(db_path=None):
+    conn = sqlite3.connect(db_path or current_db_path(), timeout=30.0)
     cursor = conn.cursor()
     
     try:
         cursor.execute("DELETE FROM transactions")
         cursor.execute("DELETE FROM return_history")
+        cursor.execute("DELETE FROM applied_returns")
         conn.commit()
+        # คืนหน้าว่างที่เกิดจากการลบส่วนแรกทันที (จำกัดจำนวนหน้าไม่ให้ล็อกนาน) ที่เหลือให้งานดูแลฐานข้อมูลทำต่อ
+        incremental_vacuum(conn, VACUUM_PAGES_PER_RUN)
     finally:
         conn.close()
 
 # ฟังก์ชันดึงข้อมูลการเบิกเฉพาะ
 def get_transaction(transaction_id):
-    conn = sqlite3.connect(DB_PATH, timeout=30.0)
+    conn = sqlite3.connect(SHARD_ROUTER.path_for_transaction(transaction_id), timeout=30.0)
     cursor = conn.cursor()
     
     try:
-        cursor.execute('''
-            SELECT * FROM transactions 
+        cursor.execute(f'''
+            SELECT * FROM {TRANSACTIONS_VIEW} 
             WHERE id = ? AND fully_returned = FALSE
         ''', (transaction_id,))
         
@@ -327,8 +551,8 @@ def get_transaction(transaction_id):
             return dict(zip(columns, result))
         
         # ถ้าไม่พบหรือคืนครบแล้ว ให้ดูข้อมูลทั้งหมด
-        cursor.execute('''
-            SELECT * FROM transactions 
+        cursor.execute(f'''
+            SELECT * FROM {TRANSACTIONS_VIEW} 
             WHERE id = ?
         ''', (transaction_id,))
         
@@ -355,48 +579,54 @@ def generate_qr_code(data):
     img = qr.make_image(fill_color="black", back_color="white")
     return img
 
-# ฟังก์ชันอ่าน QR Code จากรูปภาพ
-def read_qr_code(image):
-    try:
-        # แปลง PIL Image เป็น numpy array
-        img_array = np.array(image)
-        
-        # แปลงเป็น grayscale ถ้าเป็นรูปสี
-        if len(img_array.shape) == 3:
-            gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+# pool อ่าน QR Code ใน worker process แยก (จำกัดจำนวน เวลา และหน่วยความจำต่องาน) ใช้ร่วมกันทุก session
+@st.cache_resource
+def get_qr_decoder():
+    return QrDecoder()
+
+# เริ่มอ่านรูปที่อัพโหลด (ส่งงานครั้งเดียวต่อไฟล์ rerun ถัดไปใช้งานเดิม) คืนค่า ScanJob
+def start_qr_scan(file_id, image_bytes):
+    decoder = get_qr_decoder()
+    scan = st.session_state.get('qr_scan')
+    job = decoder.job(scan['job_id']) if scan is not None and scan['file_id'] == file_id else None
+    if job is None:
+        cancel_qr_scan()
+        job = decoder.submit(image_bytes)
+        st.session_state.qr_scan = {'file_id': file_id, 'job_id': job.id}
+    return job
+
+# ยกเลิกการอ่านที่ค้างอยู่ของ session นี้ (ออกจากหน้าสแกน / เอารูปออก / อัพโหลดรูปใหม่)
+def cancel_qr_scan():
+    scan = st.session_state.pop('qr_scan', None)
+    if scan is not None:
+        get_qr_decoder().cancel(scan['job_id'])
+
+# สถานะระหว่างอ่าน QR Code (rerun เฉพาะส่วนนี้จนอ่านเสร็จ แล้ว rerun ทั้งหน้าเพื่อแสดงผล)
+@st.fragment(run_every=0.5)
+def show_qr_scan_progress(job_id):
+    job = get_qr_decoder().job(job_id)
+    if job is None or job.finished:
+        st.rerun()
+    st.info(f"⏳ กำลังอ่าน QR Code... ({job.elapsed():.1f} วินาที)")
+    if st.button("✖️ ยกเลิก", key="cancel_qr_scan"):
+        get_qr_decoder().cancel(job_id)
+        st.rerun()
+
+# ช่องป้อนข้อมูล QR Code ด้วยมือ (หน้าป้อนข้อมูลจากมือถือ และเมื่ออ่านจากรูปไม่สำเร็จ)
+def show_manual_qr_entry(key):
+    qr_text_input = st.text_area(
+        "ข้อมูล QR Code ที่สแกนได้:",
+        placeholder="วางข้อมูลที่ได้จากการสแกน QR Code ด้วยมือถือที่นี่...",
+        height=100,
+        key=f"{key}_text"
+    )
+    
+    # ปุ่มประมวลผล
+    if st.button("🔍 ตรวจสอบข้อมูลการคืน", type="primary", key=f"{key}_check"):
+        if qr_text_input.strip():
+            process_qr_return(qr_text_input.strip())
         else:
-            gray = img_array
-        
-        # ปรับปรุงคุณภาพภาพ
-        gray = cv2.convertScaleAbs(gray, alpha=1.5, beta=0)
-        gray = cv2.medianBlur(gray, 5)
-        
-        # ใช้ cv2 อ่าน QR Code
-        detector = cv2.QRCodeDetector()
-        data, vertices_array, binary_qrcode = detector.detectAndDecode(gray)
-        
-        if vertices_array is not None and data:
-            return data
-        
-        # ลองวิธีอื่นถ้าไม่ได้
-        _, thresh = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY)
-        data, vertices_array, binary_qrcode = detector.detectAndDecode(thresh)
-        
-        if vertices_array is not None and data:
-            return data
-        
-        # ลองกลับสี
-        thresh_inv = cv2.bitwise_not(thresh)
-        data, vertices_array, binary_qrcode = detector.detectAndDecode(thresh_inv)
-        
-        if vertices_array is not None and data:
-            return data
-            
-        return None
-        
-    except Exception as e:
-        st.error(f"เกิดข้อผิดพลาดในการอ่าน QR Code: {str(e)}")
-        return None
+            st.error("❌ กรุณาป้อนข้อมูล QR Code")
 
 # ฟังก์ชันประมวลผลการคืนเครื่องมือ
 def process_qr_return(qr_data):
@@ -456,6 +686,11 @@ def process_qr_return(qr_data):
             # ฟอร์มการคืน
             st.subheader("🔄 คืนเครื่องมือ")
             
+            # idempotency key ของการคืนครั้งนี้ (เปลี่ยนใหม่หลังคืนสำเร็จ)
+            return_key = f"return_key_{transaction_id}"
+            if return_key not in st.session_state:
+                st.session_state[return_key] = new_idempotency_key()
+            
             with st.form("return_form"):
                 col1, col2 = st.columns(2)
                 
@@ -483,10 +718,13 @@ def process_qr_return(qr_data):
                     # กำหนดจำนวนที่คืน
                     qty_to_return = transaction['remaining_quantity'] if full_return_submitted else return_quantity
                     
-                    # ประมวลผลการคืน
-                    success, message = partial_return_equipment(transaction_id, qty_to_return, return_notes)
+                    # ประมวลผลการคืน (กดซ้ำด้วย key เดิมจะไม่คืนซ้ำ)
+                    success, message = partial_return_equipment(
+                        transaction_id, qty_to_return, return_notes, st.session_state[return_key]
+                    )
                     
                     if success:
+                        del st.session_state[return_key]
                         st.success(f"✅ {message}")
                         st.balloons()
                         st.cache_data.clear()
@@ -504,10 +742,23 @@ def process_qr_return(qr_data):
 
 # เริ่มต้นฐานข้อมูล
 try:
-    init_database()
+    for shard_path in SHARD_ROUTER.paths():
+        init_database(shard_path)
 except Exception as e:
     st.error(f"❌ เกิดข้อผิดพลาดในการเริ่มต้นฐานข้อมูล: {str(e)}")
 
+# ล้าง cache ของ process นี้ถ้า worker อื่นสั่งล้าง cache ทั้งหมด
+sync_cache_generation()
+
+# ซิงค์การคืนที่ค้างอยู่ในคิวลองใหม่
+return_sync_result = sync_return_queue()
+
+# งานดูแลฐานข้อมูลตามรอบ (คืนพื้นที่ว่าง, checkpoint, อัพเดทสถิติ)
+maintenance_service = get_maintenance_service()
+
+# ตรวจความสอดคล้องของยอดคงเหลือ รายการเบิก และประวัติการคืนตามรอบ
+reconcile_service = get_reconcile_service()
+
 # หัวข้อหลัก
 st.title("🏥 ระบบเบิกเครื่องมือแพทย์")
 
@@ -515,7 +766,7 @@ st.title("🏥 ระบบเบิกเครื่องมือแพท
 col1, col2, col3 = st.columns([1, 1, 8])
 with col1:
     if st.button("🔄 รีเฟรช", help="รีเฟรชข้อมูลทั้งหมด"):
-        st.cache_data.clear()
+        clear_all_caches()
         st.rerun()
 
 with col2:
@@ -527,28 +778,36 @@ st.markdown("---")
 st.sidebar.title("เมนูหลัก")
 menu = st.sidebar.selectbox(
     "เลือกหน้าที่ต้องการ",
-    ["📋 รายการเครื่องมือ", "📤 เบิกเครื่องมือ", "📱 สแกน QR Code", "📊 รายงาน", "⚙️ จัดการระบบ"]
+    ["📋 รายการเครื่องมือ", "📤 เบิกเครื่องมือ", "📱 สแกน QR Code", "📊 รายงาน", "🕒 ไทม์ไลน์", "⚙️ จัดการระบบ"]
 )
 
+# ออกจากหน้าสแกนแล้ว ยกเลิกการอ่าน QR Code ที่ยังค้างอยู่
+if menu != "📱 สแกน QR Code":
+    cancel_qr_scan()
+
+# สถานะคิวลองใหม่ของการคืน
+if return_sync_result is not None:
+    if return_sync_result[RETURN_APPLIED]:
+        st.sidebar.success(f"📥 ซิงค์การคืนจากคิวแล้ว {return_sync_result[RETURN_APPLIED]} รายการ")
+    if return_sync_result['pending']:
+        st.sidebar.warning(f"📥 มีการคืนค้างในคิว {return_sync_result['pending']} รายการ (รอฐานข้อมูลว่าง)")
+
+# เลือกหอผู้ป่วย/ไซต์ (เฉพาะโหมด shard) หน้าอื่นนอกจากรายงานจะทำงานกับ shard ที่เลือก
+if SHARD_ROUTER.sharded:
+    st.sidebar.selectbox("หอผู้ป่วย / ไซต์", SHARD_ROUTER.keys(), key='ward')
+
 # หน้ารายการเครื่องมือ
 if menu == "📋 รายการเครื่องมือ":
     st.header("📋 รายการเครื่องมือทั้งหมด")
     
-    # โหลดข้อมูลเครื่องมือและการเบิก
-    df_equipment = load_equipment()
-    df_transactions = load_transactions()
+    # โหลดข้อมูลเครื่องมือพร้อมจำนวนที่เบิกไป (คำนวณล่วงหน้าโดย background scheduler)
+    overview_result = get_precomputed('equipment_overview')
+    if overview_result is not None:
+        df_display = overview_result.value[current_shard()]
+    else:
+        df_display = equipment_overview(load_equipment(), load_transactions())
     
-    if not df_equipment.empty:
-        # คำนวณจำนวนที่ยังไม่คืนของแต่ละเครื่องมือ
-        not_returned = df_transactions[df_transactions['fully_returned'] == False].groupby('equipment_id')['remaining_quantity'].sum().reset_index()
-        not_returned.columns = ['id', 'borrowed_quantity']
-        
-        # รวมข้อมูลเครื่องมือกับจำนวนที่เบิกไปแล้ว
-        df_display = df_equipment.merge(not_returned, on='id', how='left')
-        df_display['borrowed_quantity'] = df_display['borrowed_quantity'].fillna(0)
-        df_display['borrowed_quantity'] = df_display['borrowed_quantity'].astype(int)
-        df_display['total_quantity'] = df_display['quantity'] + df_display['borrowed_quantity']
-        
+    if not df_display.empty:
         # จัดเรียงคอลัมน์สำหรับแสดงผล
         display_cols = df_display[['id', 'name', 'category', 'total_quantity', 'quantity', 'borrowed_quantity', 'unit']].copy()
         display_cols.columns = ["รหัส", "ชื่อเครื่องมือ", "หมวดหมู่", "จำนวนรวม", "คงเหลือ", "เบิกไปแล้ว", "หน่วย"]
@@ -561,7 +820,7 @@ if menu == "📋 รายการเครื่องมือ":
         # สถิติรวม
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.metric("จำนวนประเภทเครื่องมือ", len(df_equipment))
+            st.metric("จำนวนประเภทเครื่องมือ", len(df_display))
         with col2:
             total_items = df_display['total_quantity'].sum()
             st.metric("จำนวนรวมทั้งหมด", total_items)
@@ -571,6 +830,90 @@ if menu == "📋 รายการเครื่องมือ":
         with col4:
             borrowed_items = df_display['borrowed_quantity'].sum()
             st.metric("จำนวนเบิกไปแล้ว", borrowed_items)
+        
+        show_precomputed_freshness(overview_result)
+        
+        # จำนวนคงเหลือย้อนหลัง ณ เวลาที่เลือก (จากสมุดบัญชีสต็อก)
+        with st.expander("🕰️ จำนวนคงเหลือ ณ เวลาที่ผ่านมา"):
+            now = datetime.now()
+            col1, col2 = st.columns(2)
+            with col1:
+                as_of_date = st.date_input("วันที่", value=now.date(), max_value=now.date(), key="stock_as_of_date")
+            with col2:
+                as_of_time = st.time_input("เวลา", value=now.time().replace(second=0, microsecond=0), key="stock_as_of_time")
+            as_of = datetime.combine(as_of_date, as_of_time).replace(second=59)
+            
+            df_as_of = load_stock_as_of(current_db_path(), as_of.strftime('%Y-%m-%d %H:%M:%S'), data_version=get_data_version())
+            as_of_cols = df_display[['id', 'name', 'quantity', 'unit']].merge(df_as_of, on='id', how='left')
+            as_of_cols['quantity_as_of'] = as_of_cols['quantity_as_of'].astype('Int64')
+            as_of_cols['change'] = as_of_cols['quantity'] - as_of_cols['quantity_as_of']
+            as_of_cols = as_of_cols[['id', 'name', 'quantity_as_of', 'quantity', 'change', 'unit']]
+            as_of_cols.columns = ["รหัส", "ชื่อเครื่องมือ", f"คงเหลือ ณ {as_of.strftime('%d/%m/%Y %H:%M')}", "คงเหลือปัจจุบัน", "เปลี่ยนแปลง", "หน่วย"]
+            st.dataframe(as_of_cols, use_container_width=True)
+            st.caption("เครื่องมือที่ยังไม่มีในระบบ ณ เวลานั้นจะแสดงเป็นค่าว่าง")
+            
+            history_id = st.selectbox(
+                "ประวัติการเปลี่ยนจำนวนของ",
+                df_display['id'].tolist(),
+                format_func=lambda eq_id: f"{eq_id} - {df_display.loc[df_display['id'] == eq_id, 'name'].iloc[0]}",
+                key="stock_history_equipment"
+            )
+            if history_id:
+                df_history = load_stock_history(current_db_path(), history_id, data_version=get_data_version())
+                if df_history.empty:
+                    st.info("ยังไม่มีการเปลี่ยนแปลงจำนวน")
+                else:
+                    df_history['cause'] = df_history['cause'].map(STOCK_CAUSE_LABELS).fillna(df_history['cause'])
+                    df_history = df_history[['at', 'cause', 'delta', 'reference']]
+                    df_history.columns = ["เวลา", "สาเหตุ", "เปลี่ยนแปลง", "อ้างอิง"]
+                    st.dataframe(df_history, use_container_width=True)
+        
+        # การใช้งานและจุดสั่งซื้อ (คำนวณล่วงหน้าจากข้อมูลย้อนหลังตามช่วงที่กำหนด)
+        st.subheader("📈 การใช้งานและจุดสั่งซื้อ")
+        demand_result = get_precomputed('demand')
+        if demand_result is None:
+            st.info("⏳ กำลังคำนวณการใช้งานและจุดสั่งซื้อ...")
+        else:
+            demand = demand_result.value[current_shard()]
+            df_demand = demand['by_equipment']
+            st.caption(
+                f"ข้อมูลช่วง {demand['window_start'].strftime('%d/%m/%Y')} - {demand['window_end'].strftime('%d/%m/%Y')} "
+                f"ระยะเวลารอของ {LEAD_TIME_DAYS} วัน"
+            )
+            
+            need_reorder = int(df_demand['needs_reorder'].sum())
+            col1, col2 = st.columns(2)
+            with col1:
+                st.metric("ควรสั่งซื้อเพิ่ม", f"{need_reorder} รายการ")
+            with col2:
+                st.metric("อัตราการใช้งานเฉลี่ย", f"{df_demand['utilization'].mean() * 100:.1f}%")
+            
+            demand_cols = df_demand[[
+                'id', 'name', 'quantity', 'demand_per_day', 'days_of_cover', 'utilization',
+                'latency_p50', 'latency_p90', 'stockout_risk', 'reorder_point', 'suggested_order', 'needs_reorder'
+            ]].copy()
+            demand_cols['utilization'] = demand_cols['utilization'] * 100
+            demand_cols['stockout_risk'] = demand_cols['stockout_risk'] * 100
+            demand_cols.columns = [
+                "รหัส", "ชื่อเครื่องมือ", "คงเหลือ", "ใช้ต่อวัน", "พอใช้ (วัน)", "อัตราการใช้งาน (%)",
+                "คืนภายใน p50 (วัน)", "คืนภายใน p90 (วัน)", "ความเสี่ยงของหมด (%)", "จุดสั่งซื้อ",
+                "แนะนำสั่งเพิ่ม", "ควรสั่งซื้อ"
+            ]
+            st.dataframe(demand_cols.round(2), use_container_width=True)
+            
+            with st.expander("📊 การใช้งานแยกตามแผนก"):
+                dept_cols = demand['by_department'][[
+                    'equipment_id', 'name', 'borrower_dept', 'borrowed', 'returned',
+                    'consumption_per_day', 'latency_p50', 'latency_p90', 'unit'
+                ]].copy()
+                dept_cols.columns = [
+                    "รหัส", "ชื่อเครื่องมือ", "แผนก", "เบิก", "คืน", "ใช้สุทธิต่อวัน",
+                    "คืนภายใน p50 (วัน)", "คืนภายใน p90 (วัน)", "หน่วย"
+                ]
+                st.dataframe(dept_cols.round(2), use_container_width=True)
+            
+            st.info("💡 **จุดสั่งซื้อ** = ใช้ต่อวัน × ระยะเวลารอของ + สต็อกสำรองเผื่อความผันผวน "
+                    "ควรสั่งซื้อเมื่อคงเหลือไม่เกินจุดสั่งซื้อ")
     else:
         st.info("ไม่มีข้อมูลเครื่องมือ")
 
@@ -583,6 +926,13 @@ elif menu == "📤 เบิกเครื่องมือ":
         st.session_state.withdrawal_success = False
         st.session_state.transaction_data = None
 
+    # ช่องค้นหาอยู่นอก form เพื่อให้รายการตัวเลือกอัพเดททันทีที่พิมพ์
+    equipment_query = st.text_input(
+        "🔍 ค้นหาเครื่องมือ",
+        placeholder="พิมพ์รหัสหรือชื่อเครื่องมือ",
+        key="withdraw_equipment_query"
+    )
+
     with st.form("withdrawal_form"):
         col1, col2 = st.columns(2)
         
@@ -592,21 +942,15 @@ elif menu == "📤 เบิกเครื่องมือ":
             borrower_dept = st.text_input("แผนก", placeholder="แผนกที่สังกัด")
             
         with col2:
-            # โหลดข้อมูลเครื่องมือที่มีสต็อก
-            df_equipment = load_equipment()
-            available_equipment = df_equipment[df_equipment['quantity'] > 0]
+            # เลือกเครื่องมือที่มีสต็อกจากดัชนี
+            selected_equipment_id, equipment_index = equipment_picker(
+                "เลือกเครื่องมือ", equipment_query, key="withdraw_equipment_id", in_stock_only=True
+            )
             
-            if not available_equipment.empty:
-                equipment_options = [
-                    f"{row['id']} - {row['name']} (คงเหลือ: {row['quantity']} {row['unit']})" 
-                    for _, row in available_equipment.iterrows()
-                ]
-                
-                selected_equipment = st.selectbox("เลือกเครื่องมือ", equipment_options)
+            if selected_equipment_id is not None:
                 quantity = st.number_input("จำนวนที่ต้องการเบิก", min_value=1, value=1)
-            else:
+            elif equipment_index.in_stock_count() == 0:
                 st.warning("ไม่มีเครื่องมือที่สามารถเบิกได้")
-                equipment_options = []
         
         # หมายเหตุ
         notes = st.text_area("หมายเหตุ", placeholder="หมายเหตุเพิ่มเติม (ถ้ามี)")
@@ -614,15 +958,15 @@ elif menu == "📤 เบิกเครื่องมือ":
         # ปุ่มยืนยันการเบิก
         submitted = st.form_submit_button("ยืนยันการเบิก", type="primary")
         
-        if submitted and equipment_options:
+        if submitted and selected_equipment_id is not None:
             if borrower_name and borrower_dept:
                 # ดึงข้อมูลเครื่องมือที่เลือก
-                equipment_id = selected_equipment.split(" - ")[0]
-                equipment_row = df_equipment[df_equipment['id'] == equipment_id].iloc[0]
+                equipment_id = selected_equipment_id
+                equipment_row = equipment_index.get(equipment_id)
                 
                 if equipment_row['quantity'] >= quantity:
                     # สร้างรายการเบิก
-                    transaction_id = f"TX{datetime.now().strftime('%Y%m%d%H%M%S')}"
+                    transaction_id = SHARD_ROUTER.new_transaction_id(current_shard())
                     
                     # บันทึกการเบิก
                     success = withdraw_equipment(
@@ -731,24 +1075,37 @@ elif menu == "📱 สแกน QR Code":
             help="อัพโหลดรูป QR Code ที่ได้รับตอนเบิกเครื่องมือ"
         )
         
-        if uploaded_file is not None:
-            # แสดงรูปที่อัพโหลด
-            image = Image.open(uploaded_file)
+        if uploaded_file is None:
+            cancel_qr_scan()
+        else:
+            image_bytes = uploaded_file.getvalue()
+            # อ่าน QR Code ใน worker process
+            job = start_qr_scan(uploaded_file.file_id, image_bytes)
             col1, col2 = st.columns([1, 2])
             
             with col1:
-                st.image(image, caption="รูป QR Code ที่อัพโหลด", width=300)
+                # แสดงรูปย่อที่ worker สร้างให้ (ไม่ถอดรหัสรูปเต็มขนาดใน script thread)
+                if job.preview:
+                    st.image(job.preview, caption="รูป QR Code ที่อัพโหลด", width=300)
+                else:
+                    st.caption(f"📄 {uploaded_file.name} ({len(image_bytes) / 1024:,.0f} KB)")
             
             with col2:
-                # อ่าน QR Code
-                qr_data = read_qr_code(image)
-                
-                if qr_data:
-                    process_qr_return(qr_data)
+                if not job.finished:
+                    show_qr_scan_progress(job.id)
+                elif job.state == SCAN_DONE and job.data:
+                    process_qr_return(job.data)
                 else:
-                    st.error("❌ ไม่สามารถอ่าน QR Code ได้ กรุณาตรวจสอบรูปภาพ")
+                    if job.state == SCAN_DONE:
+                        st.error("❌ ไม่สามารถอ่าน QR Code ได้ กรุณาตรวจสอบรูปภาพ")
+                    else:
+                        st.error(f"❌ ไม่สามารถอ่าน QR Code ได้: {REASON_LABELS[job.reason]}")
+                    st.info("💡 สแกน QR Code ด้วยมือถือ แล้ววางข้อมูลในช่องด้านล่างแทนได้")
+                    show_manual_qr_entry("qr_fallback")
     
     else:  # ป้อนข้อมูลจากการสแกนด้วยมือถือ
+        cancel_qr_scan()
+        
         st.info("💡 **วิธีใช้:** สแกน QR Code ด้วยมือถือ แล้ว Copy ข้อมูลมาวางในช่องด้านล่าง")
         
         # แสดงคำแนะนำการสแกนด้วยมือถือ
@@ -769,18 +1126,7 @@ elif menu == "📱 สแกน QR Code":
             """)
         
         # ช่องป้อนข้อมูล QR Code
-        qr_text_input = st.text_area(
-            "ข้อมูล QR Code ที่สแกนได้:",
-            placeholder="วางข้อมูลที่ได้จากการสแกน QR Code ด้วยมือถือที่นี่...",
-            height=100
-        )
-        
-        # ปุ่มประมวลผล
-        if st.button("🔍 ตรวจสอบข้อมูลการคืน", type="primary"):
-            if qr_text_input.strip():
-                process_qr_return(qr_text_input.strip())
-            else:
-                st.error("❌ กรุณาป้อนข้อมูล QR Code")
+        show_manual_qr_entry("qr_manual")
         
         # ปุ่มทดสอบระบบ
         st.markdown("---")
@@ -794,36 +1140,74 @@ elif menu == "📱 สแกน QR Code":
 elif menu == "📊 รายงาน":
     st.header("📊 รายงานการเบิก-คืนเครื่องมือ")
     
-    # โหลดข้อมูลการเบิก
-    df_transactions = load_transactions()
+    # เลือกแหล่งข้อมูล: ฐานข้อมูลหลัก หรือ snapshot สำหรับงานรายงาน (ไม่แย่งใช้ไฟล์ SQLite)
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        report_source = st.radio(
+            "แหล่งข้อมูลรายงาน",
+            ["ฐานข้อมูลหลัก (SQLite)", "Snapshot (Parquet/Arrow)"],
+            horizontal=True
+        )
+    with col2:
+        if st.button("📸 อัพเดท Snapshot", help="ส่งออกเฉพาะรายการที่เปลี่ยนตั้งแต่ snapshot ล่าสุด"):
+            try:
+                results = export_all_snapshots()
+                exported = sum(result['transactions'] for result in results.values())
+                st.success(f"✅ อัพเดท snapshot สำเร็จ (รายการเบิก {exported} รายการ)")
+            except Exception as e:
+                st.error(f"❌ ไม่สามารถสร้าง snapshot ได้: {str(e)}")
+    
+    # โหลดข้อมูลการเบิกและผลคำนวณรายงาน
+    # ฐานข้อมูลหลัก: ใช้ผลที่ background scheduler คำนวณไว้แล้ว / snapshot: คำนวณครั้งเดียวต่อ snapshot
+    report_result = None
+    report = None
+    report_version = None
+    snapshot_key = None
+    if report_source == "Snapshot (Parquet/Arrow)":
+        manifests = load_snapshot_manifests()
+        if any(manifest is None for manifest in manifests.values()):
+            st.warning("⚠️ ยังไม่มี snapshot กรุณากด 'อัพเดท Snapshot' ก่อน")
+        else:
+            # snapshot ของหลาย shard อาจถ่ายไม่พร้อมกัน แสดงเวลาของ shard ที่เก่าที่สุด
+            taken_at = min(manifest['taken_at'] for manifest in manifests.values())
+            snapshot_key = tuple(manifest['seq'] for manifest in manifests.values())
+            st.caption(f"📸 ข้อมูล ณ {taken_at} (snapshot #{'/'.join(str(seq) for seq in snapshot_key)})")
+            df_transactions = load_transactions_snapshot(snapshot_key)
+            if df_transactions is not None:
+                report = build_snapshot_report(snapshot_key)
+                report_version = ('snapshot', snapshot_key)
+    
+    if report is None:
+        # รายงานรวมทุก shard
+        snapshot_key = None
+        df_transactions = load_all_transactions()
+        report_result = get_precomputed('report')
+        if report_result:
+            report = report_result.value
+            report_version = ('replica', report_result.data_version)
+        else:
+            report = build_report_bundle(df_transactions, include_exports=False)
+            report_version = ('replica', get_all_replica_versions())
+    
+    summary = report['summary']
     
-    if not df_transactions.empty:
+    if summary['total'] > 0:
         # สถิติรวม
         col1, col2, col3, col4 = st.columns(4)
         
-        total_transactions = len(df_transactions)
-        fully_returned_count = len(df_transactions[df_transactions['fully_returned'] == True])
-        partial_returned_count = len(df_transactions[(df_transactions['returned_quantity'] > 0) & (df_transactions['fully_returned'] == False)])
-        not_returned_count = len(df_transactions[df_transactions['returned_quantity'] == 0])
-        
         with col1:
-            st.metric("รายการเบิกทั้งหมด", total_transactions)
+            st.metric("รายการเบิกทั้งหมด", summary['total'])
         with col2:
-            st.metric("คืนครบแล้ว", fully_returned_count)
+            st.metric("คืนครบแล้ว", summary['fully_returned'])
         with col3:
-            st.metric("คืนบางส่วน", partial_returned_count)
+            st.metric("คืนบางส่วน", summary['partial_returned'])
         with col4:
-            st.metric("ยังไม่คืน", not_returned_count)
+            st.metric("ยังไม่คืน", summary['not_returned'])
         
         # ตารางรายการเบิก-คืน
         st.subheader("รายการเบิก-คืนล่าสุด")
         
-        display_columns = [
-            "id", "equipment_name", "borrower_name", "borrower_dept", 
-            "quantity", "returned_quantity", "remaining_quantity", "unit", "date", "status", "notes"
-        ]
-        
-        df_display = df_transactions[display_columns].copy()
+        df_display = df_transactions[DISPLAY_COLUMNS].copy()
         df_display.columns = [
             "รหัสการเบิก", "ชื่อเครื่องมือ", "ผู้เบิก", "แผนก", 
             "จำนวนเบิก", "จำนวนคืนแล้ว", "จำนวนเหลือ", "หน่วย", "วันที่เบิก", "สถานะ", "หมายเหตุ"
@@ -844,110 +1228,163 @@ elif menu == "📊 รายงาน":
         
         with col1:
             # กราฟวงกลมแสดงสถานะ
-            status_counts = df_transactions['status'].value_counts()
-            if not status_counts.empty:
-                import plotly.express as px
-                fig_pie = px.pie(
-                    values=status_counts.values, 
-                    names=status_counts.index,
-                    title="สัดส่วนสถานะการเบิก-คืน"
-                )
+            fig_pie = get_report_figure(CHART_STATUS_PIE, None, report_version, report, df_transactions)
+            if fig_pie is not None:
                 st.plotly_chart(fig_pie, use_container_width=True)
         
         with col2:
             # กราฟแท่งแสดงเครื่องมือที่เบิกมากที่สุด
-            equipment_counts = df_transactions['equipment_name'].value_counts().head(10)
-            if not equipment_counts.empty:
-                fig_bar = px.bar(
-                    x=equipment_counts.values,
-                    y=equipment_counts.index,
-                    orientation='h',
-                    title="เครื่องมือที่เบิกมากที่สุด (Top 10)",
-                    labels={'x': 'จำนวนครั้ง', 'y': 'เครื่องมือ'}
-                )
-                fig_bar.update_layout(yaxis={'categoryorder': 'total ascending'})
+            fig_bar = get_report_figure(CHART_TOP_EQUIPMENT, None, report_version, report, df_transactions)
+            if fig_bar is not None:
                 st.plotly_chart(fig_bar, use_container_width=True)
         
+        # กราฟแนวโน้มการเบิกตามช่วงเวลา (ตามตัวกรองสถานะด้านบน)
+        fig_activity = get_report_figure(
+            CHART_ACTIVITY, None if status_filter == "ทั้งหมด" else status_filter,
+            report_version, report, df_transactions
+        )
+        if fig_activity is not None:
+            st.plotly_chart(fig_activity, use_container_width=True)
+        
         # แสดงสถิติการคืนบางส่วน
         st.subheader("📊 สถิติการคืนบางส่วน")
         
-        partial_returns = df_transactions[df_transactions['returned_quantity'] > 0]
-        if not partial_returns.empty:
+        if summary['has_returns']:
             col1, col2, col3 = st.columns(3)
             
             with col1:
-                total_borrowed = partial_returns['quantity'].sum()
-                st.metric("จำนวนเบิกรวม", total_borrowed)
+                st.metric("จำนวนเบิกรวม", summary['returns_borrowed'])
             
             with col2:
-                total_returned = partial_returns['returned_quantity'].sum()
-                st.metric("จำนวนคืนแล้ว", total_returned)
+                st.metric("จำนวนคืนแล้ว", summary['returns_returned'])
             
             with col3:
-                total_remaining = partial_returns['remaining_quantity'].sum()
-                st.metric("จำนวนที่เหลือ", total_remaining)
-        
-        # เตรียมข้อมูลสำหรับ export
-        df_export = df_transactions[display_columns].copy()
-        
-        # แปลงข้อมูลสถานะให้อ่านง่าย
-        df_export['status_eng'] = df_export['status'].map({
-            'เบิกแล้ว': 'Not Returned',
-            'คืนบางส่วน': 'Partial Return', 
-            'คืนครบแล้ว': 'Fully Returned'
-        })
-        
-        # แปลงวันที่ให้อ่านง่าย
-        df_export['date_formatted'] = pd.to_datetime(df_export['date']).dt.strftime('%d/%m/%Y %H:%M')
-        
-        # จัดเรียงคอลัมน์ใหม่
-        df_export = df_export[['id', 'equipment_name', 'borrower_name', 'borrower_dept', 
-                              'quantity', 'returned_quantity', 'remaining_quantity', 
-                              'unit', 'date_formatted', 'status_eng', 'notes']].copy()
-        
-        df_export.columns = [
-            "Transaction_ID", "Equipment_Name", "Borrower_Name", "Department", 
-            "Total_Quantity", "Returned_Quantity", "Remaining_Quantity", 
-            "Unit", "Borrow_Date", "Status", "Notes"
-        ]
+                st.metric("จำนวนที่เหลือ", summary['returns_remaining'])
         
-        # สร้างไฟล์ Excel
-        output = BytesIO()
+        # รายการค้างคืนเกินกำหนด
+        st.subheader(f"⏰ รายการค้างคืนเกิน {OVERDUE_DAYS} วัน")
         
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            # Sheet ข้อมูลหลัก
-            df_export.to_excel(writer, sheet_name='รายการเบิก-คืน', index=False)
-            
-            # Sheet สรุป
-            summary_data = {
-                'รายการ': ['รายการเบิกทั้งหมด', 'คืนครบแล้ว', 'คืนบางส่วน', 'ยังไม่คืน'],
-                'จำนวน': [total_transactions, fully_returned_count, partial_returned_count, not_returned_count]
-            }
-            summary_df = pd.DataFrame(summary_data)
-            summary_df.to_excel(writer, sheet_name='สรุป', index=False)
-        
-        output.seek(0)
+        df_overdue = report['overdue']
+        if not df_overdue.empty:
+            df_overdue_display = df_overdue.copy()
+            df_overdue_display.columns = [
+                "รหัสการเบิก", "ชื่อเครื่องมือ", "ผู้เบิก", "แผนก", "จำนวนเหลือ", "หน่วย", "วันที่เบิก", "ค้างมาแล้ว (วัน)"
+            ]
+            st.dataframe(df_overdue_display, use_container_width=True)
+        else:
+            st.success("✅ ไม่มีรายการค้างคืนเกินกำหนด")
+        
+        # ดาวน์โหลดรายงาน: สร้างไฟล์เบื้องหลัง (ไม่บล็อกหน้าเว็บ) ตามช่วงวันที่และตัวกรองสถานะด้านบน
+        # ไฟล์ที่สร้างแล้วใช้ซ้ำได้ทุกคนจนกว่าข้อมูลจะเปลี่ยน
+        st.subheader("💾 ดาวน์โหลดรายงาน")
+        today = datetime.now().date()
+        first_date = df_transactions['date'].min()
+        first_date = first_date.date() if pd.notna(first_date) else today
+        col1, col2 = st.columns(2)
+        with col1:
+            export_range = st.date_input("ช่วงวันที่เบิก", value=(min(first_date, today), today), key="report_export_range")
+        with col2:
+            export_format = st.radio("รูปแบบไฟล์", ["Excel", "CSV"], horizontal=True, key="report_export_format")
+        
+        if st.button("📦 สร้างไฟล์รายงาน", help=f"สถานะ: {status_filter}"):
+            if len(export_range) == 2:
+                start_date, end_date = export_range
+                file_format = FORMAT_XLSX if export_format == "Excel" else FORMAT_CSV
+                params = {
+                    'format': file_format,
+                    'start': start_date.strftime('%Y-%m-%d'),
+                    'end': end_date.strftime('%Y-%m-%d'),
+                    'status': None if status_filter == "ทั้งหมด" else status_filter,
+                }
+                period = f"{params['start']}_{params['end']}"
+                st.session_state.report_job = {
+                    'path': submit_report_job(params, snapshot_key),
+                    'file_name': (f"รายงานเบิกเครื่องมือแพทย์_{period}.xlsx" if file_format == FORMAT_XLSX
+                                  else f"medical_equipment_report_{period}.csv"),
+                    'mime': ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                             if file_format == FORMAT_XLSX else "text/csv"),
+                }
+            else:
+                st.error("❌ กรุณาเลือกวันที่เริ่มต้นและสิ้นสุด")
         
-        # ดาวน์โหลด Excel
-        st.download_button(
-            label="💾 ดาวน์โหลดรายงาน (Excel)",
-            data=output.getvalue(),
-            file_name=f"รายงานเบิกเครื่องมือแพทย์_{datetime.now().strftime('%Y-%m-%d')}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+        if st.session_state.get('report_job'):
+            show_report_job(st.session_state.report_job)
         
-        # ดาวน์โหลด CSV
-        csv_simple = df_export.to_csv(index=False, encoding='utf-8-sig')
-        st.download_button(
-            label="📄 ดาวน์โหลดรายงาน (CSV)",
-            data=csv_simple,
-            file_name=f"medical_equipment_report_{datetime.now().strftime('%Y-%m-%d')}.csv",
-            mime="text/csv"
-        )
+        show_precomputed_freshness(report_result)
     
     else:
         st.info("ยังไม่มีรายการเบิกเครื่องมือ")
 
+# หน้าไทม์ไลน์การเบิก-คืน (ตรวจสอบหลายรายการพร้อมกันโดยไม่ต้องดึงทีละรายการ)
+elif menu == "🕒 ไทม์ไลน์":
+    st.header("🕒 ไทม์ไลน์การเบิก-คืน")
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        timeline_by = st.radio("ดูตาม", ["เครื่องมือ", "แผนก"], horizontal=True)
+    
+    with col2:
+        today = datetime.now().date()
+        date_range = st.date_input(
+            "ช่วงวันที่",
+            value=(today - pd.Timedelta(days=90), today),
+            max_value=today
+        )
+    
+    timeline_equipment_id = None
+    timeline_dept = None
+    
+    if timeline_by == "เครื่องมือ":
+        timeline_query = st.text_input(
+            "🔍 ค้นหาเครื่องมือ",
+            placeholder="พิมพ์รหัสหรือชื่อเครื่องมือ",
+            key="timeline_equipment_query"
+        )
+        timeline_equipment_id, _ = equipment_picker("เลือกเครื่องมือ", timeline_query, key="timeline_equipment_id")
+    else:
+        db_path = current_db_path()
+        departments = load_department_names(db_path, get_data_version(db_path))
+        if departments:
+            timeline_dept = st.selectbox("เลือกแผนก", departments)
+        else:
+            st.info("ยังไม่มีรายการเบิกเครื่องมือ")
+    
+    if (timeline_equipment_id or timeline_dept) and len(date_range) == 2:
+        start_date, end_date = date_range
+        db_path = current_db_path()
+        df_timeline = load_timeline(
+            db_path, timeline_equipment_id, timeline_dept, start_date, end_date,
+            data_version=get_data_version(db_path)
+        )
+        
+        if not df_timeline.empty:
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("จำนวนรายการเบิก", df_timeline['transaction_id'].nunique())
+            with col2:
+                st.metric("เหตุการณ์เบิก", int((df_timeline['event'] == "เบิก").sum()))
+            with col3:
+                st.metric("เหตุการณ์คืน", int((df_timeline['event'] == "คืน").sum()))
+            
+            df_timeline_display = df_timeline[[
+                "event_date", "event", "transaction_id", "equipment_name",
+                "borrower_name", "borrower_dept", "quantity", "unit", "notes"
+            ]].copy()
+            df_timeline_display.columns = [
+                "วันที่", "เหตุการณ์", "รหัสการเบิก", "ชื่อเครื่องมือ",
+                "ผู้เบิก", "แผนก", "จำนวน", "หน่วย", "หมายเหตุ"
+            ]
+            st.dataframe(df_timeline_display, use_container_width=True)
+            
+            # สรุปยอดต่อรายการเบิก
+            st.subheader("สรุปต่อรายการเบิก (ในช่วงที่เลือก)")
+            df_summary = summarize_timeline(df_timeline)
+            df_summary.columns = ["รหัสการเบิก", "ผู้เบิก", "แผนก", "จำนวนเบิก", "จำนวนคืน"]
+            st.dataframe(df_summary, use_container_width=True)
+        else:
+            st.info("ไม่มีเหตุการณ์เบิก-คืนในช่วงที่เลือก")
+
 # หน้าจัดการระบบ
 elif menu == "⚙️ จัดการระบบ":
     st.header("⚙️ จัดการระบบ")
@@ -986,36 +1423,36 @@ elif menu == "⚙️ จัดการระบบ":
     with tab2:
         st.subheader("แก้ไขจำนวนเครื่องมือ")
         
-        df_equipment = load_equipment()
-        if not df_equipment.empty:
-            equipment_options = [f"{row['id']} - {row['name']}" for _, row in df_equipment.iterrows()]
-            equipment_to_edit = st.selectbox(
-                "เลือกเครื่องมือที่ต้องการแก้ไข",
-                equipment_options
+        edit_query = st.text_input(
+            "🔍 ค้นหาเครื่องมือ",
+            placeholder="พิมพ์รหัสหรือชื่อเครื่องมือ",
+            key="edit_equipment_query"
+        )
+        equipment_id, equipment_index = equipment_picker(
+            "เลือกเครื่องมือที่ต้องการแก้ไข", edit_query, key="edit_equipment_id"
+        )
+        if equipment_id is not None:
+            equipment_row = equipment_index.get(equipment_id)
+            
+            new_qty = st.number_input(
+                f"จำนวนใหม่ (ปัจจุบัน: {equipment_row['quantity']} {equipment_row['unit']})",
+                min_value=0,
+                value=int(equipment_row['quantity'])
             )
             
-            if equipment_to_edit:
-                equipment_id = equipment_to_edit.split(" - ")[0]
-                equipment_row = df_equipment[df_equipment['id'] == equipment_id].iloc[0]
-                
-                new_qty = st.number_input(
-                    f"จำนวนใหม่ (ปัจจุบัน: {equipment_row['quantity']} {equipment_row['unit']})",
-                    min_value=0,
-                    value=int(equipment_row['quantity'])
-                )
-                
-                if st.button("อัพเดทจำนวน", type="primary"):
-                    update_equipment_quantity(equipment_id, new_qty)
-                    st.success("✅ อัพเดทจำนวนสำเร็จ!")
-                    st.cache_data.clear()
-                    st.rerun()
-    
+            if st.button("อัพเดทจำนวน", type="primary"):
+                update_equipment_quantity(equipment_id, new_qty)
+                st.success("✅ อัพเดทจำนวนสำเร็จ!")
+                st.cache_data.clear()
+                st.rerun()
+
     with tab3:
         st.subheader("ลบข้อมูล")
         st.warning("⚠️ การลบข้อมูลไม่สามารถย้อนกลับได้!")
         
         if st.button("🗑️ ลบรายการเบิกทั้งหมด", type="secondary"):
             clear_all_transactions()
+            maintenance_service.run_now()
             st.success("✅ ลบรายการเบิกและประวัติการคืนทั้งหมดแล้ว!")
             st.cache_data.clear()
             st.rerun()
@@ -1023,30 +1460,45 @@ elif menu == "⚙️ จัดการระบบ":
     with tab4:
         st.subheader("📊 ข้อมูลฐานข้อมูล")
         
-        # แสดงข้อมูลฐานข้อมูล
-        conn = sqlite3.connect(DB_PATH, timeout=30.0)
+        # แสดงข้อมูลฐานข้อมูล (shard ที่เลือก)
+        db_path = current_db_path()
+        if SHARD_ROUTER.sharded:
+            st.caption(f"หอผู้ป่วย / ไซต์: {current_shard()} ({db_path})")
+        conn = sqlite3.connect(db_path, timeout=30.0)
         
         try:
-            # ขนาดไฟล์ฐานข้อมูล
-            if os.path.exists(DB_PATH):
-                db_size = os.path.getsize(DB_PATH) / 1024  # KB
+            # ขนาดไฟล์และสถิติระดับหน้า (อ่านจาก header ไม่สแกนตาราง)
+            if os.path.exists(db_path):
+                db_size = os.path.getsize(db_path) / 1024  # KB
                 st.metric("ขนาดฐานข้อมูล", f"{db_size:.2f} KB")
             else:
                 st.metric("ขนาดฐานข้อมูล", "ไม่พบไฟล์")
             
-            # จำนวนตาราง
-            cursor = conn.cursor()
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-            tables = cursor.fetchall()
+            stats = page_stats(conn)
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric("จำนวนหน้า", f"{stats['page_count']:,}")
+            with col2:
+                st.metric("หน้าว่าง", f"{stats['freelist_count']:,}")
+            with col3:
+                st.metric("พื้นที่ว่าง (fragmentation)", f"{stats['fragmentation'] * 100:.1f}%")
+            with col4:
+                st.metric("พื้นที่คืนได้", f"{stats['free_bytes'] / 1024:.2f} KB")
+            st.caption(
+                f"ขนาดหน้า {stats['page_size']:,} ไบต์ | auto_vacuum: {stats['auto_vacuum']} | "
+                f"journal_mode: {stats['journal_mode']}"
+            )
+            if stats['auto_vacuum'] != 'INCREMENTAL':
+                st.info("💡 ฐานข้อมูลนี้ยังคืนพื้นที่แบบ incremental ไม่ได้ รัน `python cli.py vacuum` นอกเวลาใช้งานหนึ่งครั้ง")
             
+            cursor = conn.cursor()
             col1, col2 = st.columns(2)
             
             with col1:
-                st.write("**ตารางในฐานข้อมูล:**")
-                for table in tables:
-                    cursor.execute(f"SELECT COUNT(*) FROM {table[0]}")
-                    count = cursor.fetchone()[0]
-                    st.write(f"- {table[0]}: {count} รายการ")
+                # จำนวนแถวโดยประมาณจาก sqlite_stat1 (ไม่ COUNT(*) ทุกตารางทุกครั้งที่เปิดหน้า)
+                st.write("**ตารางในฐานข้อมูล (จำนวนโดยประมาณ):**")
+                for table, rows in table_stats(conn).items():
+                    st.write(f"- {table}: {'ยังไม่มีสถิติ' if rows is None else f'~{rows:,} รายการ'}")
             
             with col2:
                 # แสดงโครงสร้างตาราง
@@ -1055,6 +1507,114 @@ elif menu == "⚙️ จัดการระบบ":
                 trans_info = cursor.fetchall()
                 for info in trans_info:
                     st.write(f"- {info[1]} ({info[2]})")
+            
+            # งานดูแลฐานข้อมูล
+            st.markdown("---")
+            st.subheader("🧰 ดูแลฐานข้อมูล")
+            
+            if maintenance_service.last_run is not None:
+                last_result = maintenance_service.last_results.get(db_path)
+                vacuumed = f" คืนพื้นที่ {last_result['vacuumed_pages']:,} หน้า" if last_result else ""
+                st.caption(f"🕐 ดูแลอัตโนมัติล่าสุด: {maintenance_service.last_run.strftime('%d/%m/%Y %H:%M:%S')}{vacuumed}")
+            
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                if st.button("🧹 คืนพื้นที่ว่าง"):
+                    freed = incremental_vacuum(conn, VACUUM_PAGES_PER_RUN)
+                    st.success(f"✅ คืนพื้นที่แล้ว {freed:,} หน้า ({freed * stats['page_size'] / 1024:.2f} KB)")
+            with col2:
+                if st.button("📈 อัพเดทสถิติ (ANALYZE)"):
+                    analyze(conn)
+                    st.success("✅ อัพเดทสถิติทุกตารางแล้ว")
+            with col3:
+                if st.button("⚡ PRAGMA optimize"):
+                    optimize(conn)
+                    st.success("✅ optimize แล้ว")
+            
+            # ตรวจความสอดคล้องของยอด (ผลค้างอยู่ในตาราง reconcile_issues จนกว่ายอดจะตรงกัน)
+            st.markdown("---")
+            st.subheader("🩺 ตรวจสอบความถูกต้องของยอด")
+            
+            last_check = reconcile_service.last_results.get(db_path)
+            if last_check is not None:
+                st.caption(
+                    f"🕐 ตรวจอัตโนมัติล่าสุด: {last_check['checked_at']} "
+                    f"({'ตรวจทั้งหมด' if last_check['full'] else 'เฉพาะที่เปลี่ยน'} เครื่องมือ {last_check['equipment_checked']:,} "
+                    f"รายการเบิก {last_check['transactions_checked']:,} รายการ ใช้เวลา {last_check['duration'] * 1000:.1f} ms)"
+                )
+            
+            reconcile_result = None
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                if st.button("🔍 ตรวจรายการที่เปลี่ยน"):
+                    reconcile_result = run_reconcile(db_path)
+            with col2:
+                if st.button("🔎 ตรวจทั้งหมด"):
+                    reconcile_result = run_reconcile(db_path, full=True)
+            with col3:
+                if st.button("🛠️ ซ่อมยอดที่ไม่ตรงกัน", help="คำนวณจำนวนคืน/ค้างคืนใหม่จากประวัติการคืน และบันทึกรายการปรับยอดในสมุดบัญชีสต็อก"):
+                    reconcile_result = run_reconcile(db_path, repair=True)
+            if reconcile_result is not None:
+                st.success(
+                    f"✅ ตรวจแล้ว เครื่องมือ {reconcile_result['equipment_checked']:,} "
+                    f"รายการเบิก {reconcile_result['transactions_checked']:,} รายการ "
+                    f"({reconcile_result['duration'] * 1000:.1f} ms) พบ {len(reconcile_result['found']):,} "
+                    f"ซ่อมแล้ว {reconcile_result['repaired']:,} รายการ"
+                )
+            
+            issues = open_issues(conn)
+            if issues:
+                st.warning(f"⚠️ ยอดไม่ตรงกัน {len(issues):,} รายการ")
+                df_issues = pd.DataFrame(issues)
+                df_issues['kind'] = df_issues['kind'].map(ISSUE_LABELS)
+                df_issues = df_issues.rename(columns={
+                    'kind': 'ปัญหา', 'row_id': 'รหัส', 'expected': 'ค่าที่ควรเป็น', 'actual': 'ค่าในระบบ',
+                    'first_seen': 'พบครั้งแรก', 'last_seen': 'ตรวจล่าสุด'
+                })
+                st.dataframe(df_issues, use_container_width=True)
+            else:
+                st.success("✅ ยอดคงเหลือ รายการเบิก และประวัติการคืนตรงกันทั้งหมด")
+            
+            # cache ที่ใช้ร่วมกันทุก worker
+            cache_stats = SHARED_CACHE.stats()
+            st.caption(
+                f"🗄️ cache ร่วม ({SHARED_CACHE.cache_dir}): {cache_stats['entries']:,} รายการ "
+                f"{cache_stats['bytes'] / 1024 ** 2:.1f} MB | generation {cache_stats['generation']} | "
+                f"process นี้ใช้ซ้ำ {cache_stats['hits']:,} ครั้ง คำนวณเอง {cache_stats['misses']:,} ครั้ง"
+            )
+            
+            # change feed
+            st.markdown("---")
+            st.subheader("🔁 Change Feed")
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                st.metric("เวอร์ชันข้อมูลปัจจุบัน", current_version(conn))
+            with col2:
+                cursor.execute("SELECT compacted_through FROM change_log_state WHERE id = 1")
+                st.metric("บีบอัด log ถึงเวอร์ชัน", cursor.fetchone()[0])
+            
+            keep_days = st.number_input("เก็บ log ย้อนหลัง (วัน)", min_value=0, value=7)
+            if st.button("🧹 บีบอัด change log"):
+                removed = compact_change_log(conn, keep_days=keep_days)
+                maintenance_service.run_now()
+                st.success(f"✅ ลบ log เก่าแล้ว {removed} รายการ")
+            
+            # คิวลองใหม่ของการคืน (การคืนที่เจอฐานข้อมูลไม่ว่าง)
+            st.markdown("---")
+            st.subheader("📥 คิวการคืน (รอฐานข้อมูลว่าง)")
+            
+            st.metric("รายการค้างซิงค์", get_return_queue().pending_count())
+            if st.button("🔁 ซิงค์คิวการคืนตอนนี้"):
+                result = get_return_queue().sync(SHARD_ROUTER.path_for_transaction)
+                st.cache_data.clear()
+                if result['error']:
+                    st.error(f"❌ ซิงค์ไม่สำเร็จ: {result['error']} (ค้าง {result['pending']} รายการ)")
+                else:
+                    st.success(
+                        f"✅ คืนสำเร็จ {result[RETURN_APPLIED]} รายการ, ซ้ำ {result[RETURN_DUPLICATE]} รายการ, "
+                        f"ถูกปฏิเสธ {result[RETURN_REJECTED]} รายการ"
+                    )
         finally:
             conn.close()
         
@@ -1062,10 +1622,9 @@ elif menu == "⚙️ จัดการระบบ":
         st.markdown("---")
         st.subheader("💾 สำรองข้อมูล")
         
-        # อ่านไฟล์ฐานข้อมูล
-        if os.path.exists(DB_PATH):
-            with open(DB_PATH, 'rb') as f:
-                db_data = f.read()
+        # อ่านฐานข้อมูลผ่าน SQLite (รวมส่วนที่ยังอยู่ในไฟล์ WAL)
+        if os.path.exists(db_path):
+            db_data = dump_database(db_path)
             
             st.download_button(
                 label="📥 ดาวน์โหลดไฟล์ฐานข้อมูล",
@@ -1089,18 +1648,14 @@ elif menu == "⚙️ จัดการระบบ":
         if uploaded_db is not None:
             if st.button("🔄 กู้คืนข้อมูล", type="secondary"):
                 try:
-                    # สำรองไฟล์เดิม
-                    if os.path.exists(DB_PATH):
-                        import shutil
-                        backup_path = f'data/medical_equipment_backup_{datetime.now().strftime("%Y%m%d_%H%M%S")}.db'
-                        shutil.copy(DB_PATH, backup_path)
-                    
-                    # เขียนไฟล์ใหม่
-                    with open(DB_PATH, 'wb') as f:
-                        f.write(uploaded_db.read())
+                    # สำรองฐานข้อมูลเดิมแล้วกู้คืนผ่าน backup API (ไม่เขียนทับไฟล์ที่ใช้ WAL อยู่ตรง ๆ)
+                    backup_path = None
+                    if os.path.exists(db_path):
+                        backup_path = f'{os.path.splitext(db_path)[0]}_backup_{datetime.now().strftime("%Y%m%d_%H%M%S")}.db'
+                    restore_database(db_path, uploaded_db.read(), backup_path)
                     
                     st.success("✅ กู้คืนข้อมูลสำเร็จ!")
-                    st.cache_data.clear()
+                    clear_all_caches()
                     st.rerun()
                     
                 except Exception as e:
@@ -1114,7 +1669,7 @@ st.markdown("🗄️ **ฐานข้อมูล:** SQLite")
 
 # แสดงสถานะการเชื่อมต่อฐานข้อมูล
 try:
-    conn = sqlite3.connect(DB_PATH, timeout=30.0)
+    conn = sqlite3.connect(current_db_path(), timeout=30.0)
     conn.close()
     st.sidebar.success("🟢 เชื่อมต่อฐานข้อมูลสำเร็จ")
 except Exception as e:
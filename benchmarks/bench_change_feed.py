@@ -0,0 +1,87 @@
+# เปรียบเทียบการ refresh แบบ incremental (change feed) กับการโหลดใหม่ทั้งตาราง
+#   python benchmarks/bench_change_feed.py [จำนวนรายการ] [จำนวนการเขียนต่อรอบ]
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from common import seed_database
+from changefeed import IncrementalTransactions, changes_since, create_change_log
+from dimensions import DimensionLookup
+from typed_frames import read_transactions_typed
+
+
+def apply_writes(conn, lookup, n_writes, round_no):
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    borrower_id = lookup.borrower_id(conn, "ผู้เบิกใหม่")
+    department_id = lookup.department_id(conn, f"แผนกใหม่ {round_no}")
+    # ครึ่งหนึ่งเป็นการเบิกใหม่ อีกครึ่งเป็นการคืนรายการเดิม
+    for i in range(n_writes // 2):
+        conn.execute('''
+            INSERT INTO transactions
+            (id, equipment_id, equipment_name, borrower_id, department_id, quantity, returned_quantity,
+             remaining_quantity, unit, date, status, notes, fully_returned)
+            VALUES (?, 'EQ00001', 'เครื่องมือ 1', ?, ?, 2, 0, 2, 'อัน', ?, 'เบิกแล้ว', '', 0)
+        ''', (f"TXNEW{round_no:03d}{i:06d}", borrower_id, department_id, now))
+    conn.execute('''
+        UPDATE transactions
+        SET returned_quantity = quantity, remaining_quantity = 0, fully_returned = 1,
+            status = 'คืนครบแล้ว', last_return_date = ?
+        WHERE id IN (SELECT id FROM transactions WHERE fully_returned = 0 LIMIT ?)
+    ''', (now, n_writes - n_writes // 2))
+    conn.commit()
+
+
+def main(n_rows=1_000_000, n_writes=100, rounds=5):
+    path = os.path.join(tempfile.gettempdir(), "bench_change_feed.db")
+    print(f"สร้างข้อมูลจำลอง {n_rows:,} รายการ...")
+    seed_database(path, n_rows)
+    conn = sqlite3.connect(path)
+    create_change_log(conn.cursor())
+    conn.commit()
+
+    lookup = DimensionLookup()
+    feed = IncrementalTransactions()
+    start = time.perf_counter()
+    feed.refresh(conn)
+    print(f"โหลดครั้งแรก: {time.perf_counter() - start:.2f} s")
+
+    incremental_times = []
+    full_times = []
+    for round_no in range(rounds):
+        apply_writes(conn, lookup, n_writes, round_no)
+
+        start = time.perf_counter()
+        df_incremental = feed.refresh(conn)
+        incremental_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        df_full = read_transactions_typed(conn)
+        full_times.append(time.perf_counter() - start)
+
+    # ตรวจว่าผลลัพธ์ (รวมลำดับแถว) ตรงกับการโหลดใหม่ทั้งหมด
+    left = df_incremental.astype(str)
+    right = df_full.astype(str)
+    assert left.equals(right), "incremental refresh ไม่ตรงกับการโหลดใหม่"
+
+    start = time.perf_counter()
+    changes_since(conn, feed.version - n_writes)
+    poll_time = time.perf_counter() - start
+    conn.close()
+    os.remove(path)
+
+    incremental = sorted(incremental_times)[len(incremental_times) // 2]
+    full = sorted(full_times)[len(full_times) // 2]
+    print(f"เขียน {n_writes} รายการต่อรอบ, {rounds} รอบ (ค่ามัธยฐาน)")
+    print(f"full reload           : {full:8.3f} s")
+    print(f"incremental refresh   : {incremental:8.3f} s  (เร็วขึ้น {full / incremental:.0f} เท่า)")
+    print(f"changes_since (poll)  : {poll_time * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 100,
+    )
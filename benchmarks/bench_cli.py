@@ -0,0 +1,138 @@
+# งานเป็นชุดผ่าน command line (cli.py) เทียบกับการเรียกทีละรายการแบบหน้าเว็บ (connection + commit ต่อรายการ)
+# วัดเวลาเริ่มโปรแกรม (import) และปริมาณงานเบิก/คืน ทั้งแบบฐานข้อมูลเดียวและแบบ shard
+#   python benchmarks/bench_cli.py [จำนวนรายการ]
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import seed_database
+from database import init_database, insert_withdrawal
+from dimensions import DimensionLookup
+from sharding import SHARDS_ENV
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI = os.path.join(ROOT, 'cli.py')
+SHARD_KEYS = ("ICU", "ER", "OPD", "WARD")
+
+
+def run_cli(cwd, args, input_path, env=None):
+    start = time.perf_counter()
+    with open(input_path, 'rb') as f:
+        result = subprocess.run(
+            [sys.executable, CLI] + args, cwd=cwd, stdin=f, capture_output=True,
+            env=dict(os.environ, PYTHONPATH=ROOT, **(env or {}))
+        )
+    elapsed = time.perf_counter() - start
+    if result.returncode not in (0, 1):
+        raise SystemExit(result.stderr.decode())
+    return elapsed, [json.loads(line) for line in result.stdout.decode().splitlines()]
+
+
+def startup_time(code, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True, capture_output=True)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def write_jsonl(path, rows):
+    with open(path, 'w', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+
+def withdrawal_rows(n_rows, n_equipment, shard_keys=None):
+    return [{
+        'equipment_id': f"EQ{i % n_equipment:05d}",
+        'borrower_name': f"ผู้เบิก {i % 300}",
+        'borrower_dept': f"แผนก {i % 40}",
+        'quantity': 1,
+        **({'shard': shard_keys[i % len(shard_keys)]} if shard_keys else {}),
+    } for i in range(n_rows)]
+
+
+def main(n_rows=20_000, n_baseline=1_000, n_equipment=500):
+    base_dir = tempfile.mkdtemp(prefix="bench_cli_")
+    try:
+        app_startup = startup_time("import streamlit, cv2, plotly.express, pandas, qrcode")
+        cli_startup = startup_time(f"import sys; sys.argv = ['cli.py', '--help']; sys.path.insert(0, {ROOT!r})\n"
+                                   "import cli")
+        print(f"เวลาเริ่มโปรแกรม: import ของแอพ {app_startup * 1000:6.0f} ms  cli.py {cli_startup * 1000:6.0f} ms")
+
+        # ฐานข้อมูลเดียว
+        single_dir = os.path.join(base_dir, "single")
+        db_path = os.path.join(single_dir, "data", "medical_equipment.db")
+        os.makedirs(os.path.dirname(db_path))
+        print("สร้างข้อมูลจำลอง 100,000 รายการ...")
+        seed_database(db_path, 100_000, n_equipment=n_equipment)
+        init_database(db_path)
+        conn = sqlite3.connect(db_path)
+        conn.execute("UPDATE equipment SET quantity = 1000000")
+        conn.commit()
+        conn.close()
+
+        # แบบเดิม: เบิกทีละรายการ (connection + commit ต่อรายการเหมือนหน้าเว็บ)
+        lookup = DimensionLookup()
+        start = time.perf_counter()
+        for i, row in enumerate(withdrawal_rows(n_baseline, n_equipment)):
+            conn = sqlite3.connect(db_path, timeout=30.0)
+            try:
+                insert_withdrawal(conn, lookup, f"BASE{i:08d}", row['equipment_id'], row['borrower_name'],
+                                  row['borrower_dept'], row['quantity'])
+                conn.commit()
+            finally:
+                conn.close()
+        baseline = n_baseline / (time.perf_counter() - start)
+
+        withdraw_path = os.path.join(base_dir, "withdraw.jsonl")
+        write_jsonl(withdraw_path, withdrawal_rows(n_rows, n_equipment))
+        withdraw_time, withdrawn = run_cli(single_dir, ['withdraw'], withdraw_path)
+        assert all(result['ok'] for result in withdrawn), withdrawn[:3]
+
+        return_path = os.path.join(base_dir, "return.jsonl")
+        write_jsonl(return_path, [
+            {'transaction_id': result['transaction_id'], 'quantity': 1, 'key': f"k{result['line']}"}
+            for result in withdrawn
+        ])
+        return_time, returned = run_cli(single_dir, ['return'], return_path)
+        replay_time, replayed = run_cli(single_dir, ['return'], return_path)
+        assert all(result['status'] == 'applied' for result in returned)
+        assert all(result['status'] == 'duplicate' for result in replayed)
+
+        print(f"เบิกทีละรายการ (แบบหน้าเว็บ) : {baseline:10,.0f} รายการ/วินาที")
+        print(f"cli.py withdraw             : {n_rows / withdraw_time:10,.0f} รายการ/วินาที ({withdraw_time:.2f} s รวมเริ่มโปรแกรม)")
+        print(f"cli.py return               : {n_rows / return_time:10,.0f} รายการ/วินาที ({return_time:.2f} s)")
+        print(f"cli.py return (รันซ้ำ)       : {n_rows / replay_time:10,.0f} รายการ/วินาที  ไม่คืนซ้ำ")
+
+        # แบบ shard: worker หนึ่งตัวต่อ shard
+        sharded_dir = os.path.join(base_dir, "sharded")
+        shard_env = {SHARDS_ENV: ",".join(SHARD_KEYS)}
+        for key in SHARD_KEYS:
+            path = os.path.join(sharded_dir, "data", "shards", f"{key}.db")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            seed_database(path, 100_000 // len(SHARD_KEYS), n_equipment=n_equipment, seed=len(key))
+            init_database(path)
+            conn = sqlite3.connect(path)
+            conn.execute("UPDATE equipment SET quantity = 1000000")
+            conn.commit()
+            conn.close()
+        sharded_path = os.path.join(base_dir, "withdraw_sharded.jsonl")
+        write_jsonl(sharded_path, withdrawal_rows(n_rows, n_equipment, SHARD_KEYS))
+        for workers in (1, len(SHARD_KEYS)):
+            elapsed, results = run_cli(sharded_dir, ['withdraw', '--workers', str(workers)], sharded_path, shard_env)
+            assert all(result['ok'] for result in results), results[:3]
+            print(f"cli.py withdraw {len(SHARD_KEYS)} shard, {workers} worker : "
+                  f"{n_rows / elapsed:10,.0f} รายการ/วินาที (CPU {os.cpu_count()} คอร์)")
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20_000)
@@ -0,0 +1,97 @@
+# เปรียบเทียบตาราง transactions แบบเดิม (ชื่อผู้เบิก/แผนกเป็นข้อความ) กับแบบใช้ตารางมิติ
+# วัดขนาดไฟล์ฐานข้อมูล เวลา group by ตามแผนก/ผู้เบิก และเวลาโหลดรายการเบิกทั้งหมด
+#   python benchmarks/bench_dimensions.py [จำนวนรายการ]
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from common import best_of, seed_database
+from dimensions import migrate_transactions
+from typed_frames import TRANSACTION_COLUMNS, build_transactions_frame, read_transactions_typed
+
+LEGACY_QUERIES = {
+    'แผนก': '''
+        SELECT borrower_dept, COUNT(*), SUM(remaining_quantity)
+        FROM transactions GROUP BY borrower_dept
+    ''',
+    'ผู้เบิก': '''
+        SELECT borrower_name, COUNT(*), SUM(remaining_quantity)
+        FROM transactions GROUP BY borrower_name
+    ''',
+}
+
+# group by ด้วยรหัสแล้วค่อย join ชื่อ (ได้ผลเหมือนแบบเดิม)
+NORMALIZED_QUERIES = {
+    'แผนก': '''
+        SELECT d.name, g.n, g.remaining
+        FROM (SELECT department_id, COUNT(*) AS n, SUM(remaining_quantity) AS remaining
+              FROM transactions GROUP BY department_id) g
+        JOIN departments d ON d.id = g.department_id
+    ''',
+    'ผู้เบิก': '''
+        SELECT b.name, g.n, g.remaining
+        FROM (SELECT borrower_id, COUNT(*) AS n, SUM(remaining_quantity) AS remaining
+              FROM transactions GROUP BY borrower_id) g
+        JOIN borrowers b ON b.id = g.borrower_id
+    ''',
+}
+
+
+def main(n_rows=1_000_000):
+    base_dir = tempfile.mkdtemp(prefix="bench_dimensions_")
+    try:
+        legacy_path = os.path.join(base_dir, "legacy.db")
+        normalized_path = os.path.join(base_dir, "normalized.db")
+        print(f"สร้างข้อมูลจำลอง {n_rows:,} รายการ...")
+        seed_database(legacy_path, n_rows, normalized=False)
+        conn = sqlite3.connect(legacy_path)
+        conn.execute("VACUUM")
+        conn.close()
+        shutil.copy(legacy_path, normalized_path)
+
+        conn = sqlite3.connect(normalized_path)
+        start = time.perf_counter()
+        migrate_transactions(conn.cursor())
+        conn.commit()
+        conn.execute("VACUUM")
+        migrate_time = time.perf_counter() - start
+        conn.close()
+
+        legacy_mb = os.path.getsize(legacy_path) / 1024 ** 2
+        normalized_mb = os.path.getsize(normalized_path) / 1024 ** 2
+        print(f"ย้ายข้อมูล + VACUUM: {migrate_time:.2f} s")
+        print(f"ขนาดไฟล์ แบบเดิม {legacy_mb:8.1f} MB  ตารางมิติ {normalized_mb:8.1f} MB  "
+              f"(เล็กลง {(1 - normalized_mb / legacy_mb) * 100:.0f}%)")
+
+        legacy = sqlite3.connect(legacy_path)
+        normalized = sqlite3.connect(normalized_path)
+        try:
+            for label in LEGACY_QUERIES:
+                legacy_time, legacy_rows = best_of(lambda: legacy.execute(LEGACY_QUERIES[label]).fetchall())
+                normalized_time, normalized_rows = best_of(
+                    lambda: normalized.execute(NORMALIZED_QUERIES[label]).fetchall()
+                )
+                assert sorted(legacy_rows) == sorted(normalized_rows), f"ผล group by {label} ไม่ตรงกัน"
+                print(f"group by {label:<8}: แบบเดิม {legacy_time:6.3f} s  ตารางมิติ {normalized_time:6.3f} s  "
+                      f"(เร็วขึ้น {legacy_time / normalized_time:.1f} เท่า)")
+
+            legacy_load, df_legacy = best_of(lambda: build_transactions_frame(pd.read_sql_query(
+                f"SELECT {', '.join(TRANSACTION_COLUMNS)} FROM transactions ORDER BY created_at DESC", legacy
+            ).to_dict('list')))
+            view_load, df_view = best_of(lambda: read_transactions_typed(normalized))
+            assert df_legacy.astype(str).equals(df_view.astype(str)), "ข้อมูลจาก view ไม่ตรงกับแบบเดิม"
+            print(f"โหลดทั้งหมด     : แบบเดิม {legacy_load:6.2f} s  ผ่าน view {view_load:6.2f} s")
+        finally:
+            legacy.close()
+            normalized.close()
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,72 @@
+# สถิติตารางในแท็บฐานข้อมูล: COUNT(*) ทุกตาราง (แบบเดิม) เทียบกับอ่านจาก sqlite_stat1
+# และขนาดไฟล์หลังลบรายการเบิกทั้งหมด: auto_vacuum แบบเดิม (NONE) เทียบกับ INCREMENTAL + incremental_vacuum
+#   python benchmarks/bench_maintenance.py [จำนวนรายการ]
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from common import best_of, seed_database
+from maintenance import analyze, ensure_incremental_auto_vacuum, incremental_vacuum, page_stats, table_stats
+
+
+def count_all_tables(conn):
+    tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+    return {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in tables}
+
+
+def clear_transactions(path):
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("DELETE FROM transactions")
+        conn.execute("DELETE FROM return_history")
+        conn.commit()
+        start = time.perf_counter()
+        freed = incremental_vacuum(conn)
+        return freed, time.perf_counter() - start
+    finally:
+        conn.close()
+
+
+def main(n_rows=1_000_000):
+    base_dir = tempfile.mkdtemp(prefix="bench_maintenance_")
+    try:
+        legacy_path = os.path.join(base_dir, "legacy.db")
+        incremental_path = os.path.join(base_dir, "incremental.db")
+        print(f"สร้างข้อมูลจำลอง {n_rows:,} รายการ...")
+        seed_database(legacy_path, n_rows)
+        shutil.copy(legacy_path, incremental_path)
+
+        conn = sqlite3.connect(incremental_path)
+        start = time.perf_counter()
+        ensure_incremental_auto_vacuum(conn, vacuum=True)
+        convert_time = time.perf_counter() - start
+        start = time.perf_counter()
+        analyze(conn)
+        analyze_time = time.perf_counter() - start
+        try:
+            count_time, counts = best_of(lambda: count_all_tables(conn))
+            stat_time, estimates = best_of(lambda: table_stats(conn))
+            page_time, _ = best_of(lambda: page_stats(conn))
+        finally:
+            conn.close()
+        assert estimates["transactions"] == counts["transactions"]
+        print(f"เปลี่ยนเป็น INCREMENTAL (VACUUM ครั้งเดียว) {convert_time:.2f} s, ANALYZE {analyze_time:.2f} s")
+        print(f"COUNT(*) ทุกตาราง   : {count_time * 1000:9.1f} ms")
+        print(f"sqlite_stat1        : {stat_time * 1000:9.1f} ms  (เร็วขึ้น {count_time / stat_time:,.0f} เท่า)")
+        print(f"สถิติหน้า (PRAGMA)  : {page_time * 1000:9.1f} ms")
+
+        for label, path in (("auto_vacuum=NONE", legacy_path), ("auto_vacuum=INCREMENTAL", incremental_path)):
+            before = os.path.getsize(path) / 1024 ** 2
+            freed, vacuum_time = clear_transactions(path)
+            after = os.path.getsize(path) / 1024 ** 2
+            print(f"ลบรายการเบิกทั้งหมด {label:<24}: {before:7.1f} MB -> {after:7.1f} MB "
+                  f"(คืน {freed:,} หน้า ใน {vacuum_time:.2f} s)")
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,103 @@
+# อ่าน QR Code จากรูปที่อัพโหลดพร้อมกันหลายคน: อ่านใน script thread (แบบเดิม) เทียบกับ worker pool
+# งานผสมระหว่างรูปถ่ายจากกล้องมือถือที่มี QR Code กับรูปที่อ่านยาก (noise ขนาดใหญ่ ไม่มี QR Code)
+# วัด p50/p99 ของเวลาตั้งแต่อัพโหลดจนได้ผล เฉพาะรูปที่มี QR Code (สิ่งที่ผู้ใช้ส่วนใหญ่รอ)
+#   python benchmarks/bench_qr_decode.py [จำนวนรูป QR] [จำนวนรูปที่อ่านยาก] [จำนวนผู้ใช้พร้อมกัน]
+import json
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+import qrcode
+from PIL import Image
+
+import common  # noqa: F401  ให้ import โมดูลของแอพได้
+from qr_decode import SCAN_DONE, QrDecoder, decode_qr_image
+
+
+# รูปถ่าย 12MP (4000x3000 JPEG) ที่มี QR Code ของรายการเบิกหนึ่งรายการ
+def photo_with_qr(transaction_id, rng):
+    qr_image = qrcode.make(json.dumps({'transaction_id': transaction_id})).convert('RGB').resize((1400, 1400))
+    photo = Image.new('RGB', (4000, 3000), (rng.randint(180, 240),) * 3)
+    photo.paste(qr_image, (rng.randint(0, 2600), rng.randint(0, 1600)))
+    buffer = BytesIO()
+    photo.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+# รูป noise ขนาดใหญ่ (PNG) ตัวค้นหา QR Code ใช้เวลานานมากกับรูปแบบนี้
+def pathological_image(side, seed):
+    noise = np.random.default_rng(seed).integers(0, 256, (side, side), dtype=np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(noise).save(buffer, format='PNG', compress_level=1)
+    return buffer.getvalue()
+
+
+# แบบเดิม: เปิดรูปเต็มขนาดแล้วอ่านใน thread ของ request
+def decode_inline(image_bytes):
+    return decode_qr_image(Image.open(BytesIO(image_bytes)).convert('RGB'))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(label, scan, uploads, n_users):
+    def timed(upload):
+        kind, expected, image_bytes = upload
+        start = time.perf_counter()
+        data = scan(image_bytes)
+        return kind, expected, data, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(n_users) as pool:
+        results = list(pool.map(timed, uploads))
+    total = time.perf_counter() - start
+    qr_times = [elapsed for kind, _, _, elapsed in results if kind == 'qr']
+    hard_times = [elapsed for kind, _, _, elapsed in results if kind == 'hard']
+    decoded = sum(1 for kind, expected, data, _ in results if kind == 'qr' and data == expected)
+    print(f"{label:<26}: รูป QR p50 {percentile(qr_times, 0.5):6.2f} s p99 {percentile(qr_times, 0.99):6.2f} s "
+          f"| อ่านได้ {decoded}/{len(qr_times)} | รูปอ่านยากนานสุด {max(hard_times):6.2f} s | รวม {total:6.2f} s")
+    return decoded
+
+
+def main(n_qr=24, n_hard=4, n_users=8):
+    rng = random.Random(11)
+    print(f"สร้างรูปทดสอบ {n_qr} รูป QR + {n_hard} รูปอ่านยาก...")
+    uploads = []
+    for i in range(n_qr):
+        uploads.append(('qr', json.dumps({'transaction_id': 1000 + i}), photo_with_qr(1000 + i, rng)))
+    for i in range(n_hard):
+        uploads.append(('hard', None, pathological_image(6000, i)))
+    rng.shuffle(uploads)
+    # รูปอ่านยากมาถึงก่อน (กรณีแย่ที่สุดของแบบเดิม: งานหนักแย่ง CPU ตั้งแต่ต้น)
+    uploads.sort(key=lambda upload: upload[0] != 'hard')
+
+    inline_decoded = run("แบบเดิม (อ่านใน thread)", decode_inline, uploads, n_users)
+
+    decoder = QrDecoder()
+    try:
+        def scan(image_bytes):
+            job = decoder.submit(image_bytes)
+            job.wait()
+            return job.data if job.state == SCAN_DONE else None
+
+        pool_decoded = run("worker pool", scan, uploads, n_users)
+        repeat_start = time.perf_counter()
+        run("worker pool (อัพโหลดซ้ำ)", scan, uploads, n_users)
+        print(f"{'':<26}  อัพโหลดซ้ำใช้ผลเดิม {time.perf_counter() - repeat_start:6.3f} s | "
+              f"worker ถูกเริ่มใหม่ {decoder.restarts()} ครั้ง | {decoder.stats}")
+    finally:
+        decoder.shutdown()
+    assert pool_decoded >= inline_decoded, (pool_decoded, inline_decoded)
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 24,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 4,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 8,
+    )
@@ -0,0 +1,92 @@
+# ตรวจความสอดคล้องของยอด: ตรวจทั้งหมด เทียบกับตรวจเฉพาะแถวที่เปลี่ยนหลัง checkpoint
+# จำลองงานหนึ่งรอบ (เบิก/คืน/แก้ไขจำนวน) แล้วแทรกยอดที่ไม่ตรงกัน ตรวจว่าพบครบและซ่อมได้
+#   python benchmarks/bench_reconcile.py [จำนวนรายการเบิก] [จำนวนการเปลี่ยนแปลงต่อรอบ]
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from common import seed_database
+from database import init_database, set_equipment_quantity
+from reconcile import (ISSUE_OVER_RETURNED, ISSUE_REMAINING, ISSUE_RETURNED, ISSUE_STOCK, reconcile)
+from return_queue import apply_return
+
+
+def simulate_activity(conn, n_changes, rng):
+    outstanding = [row[0] for row in conn.execute(
+        "SELECT id FROM transactions WHERE fully_returned = FALSE LIMIT ?", (n_changes * 4,)
+    )]
+    conn.execute("BEGIN IMMEDIATE")
+    for transaction_id in rng.sample(outstanding, n_changes // 2):
+        apply_return(conn, transaction_id, 1)
+    for i in range(n_changes - n_changes // 2):
+        set_equipment_quantity(conn, f"EQ{rng.randrange(5000):05d}", rng.randint(0, 500))
+    conn.commit()
+
+
+def inject_drift(conn):
+    ids = [row[0] for row in conn.execute("SELECT id FROM transactions ORDER BY id DESC LIMIT 3")]
+    conn.execute("BEGIN IMMEDIATE")
+    # แก้ตารางตรงๆ โดยไม่ผ่านฟังก์ชันของแอพ (เหมือนแก้ด้วยมือหรือกู้คืนไม่ครบ)
+    conn.execute("UPDATE equipment SET quantity = quantity + 7 WHERE id = 'EQ00042'")
+    conn.execute("UPDATE transactions SET remaining_quantity = remaining_quantity + 1 WHERE id = ?", (ids[0],))
+    conn.execute("UPDATE transactions SET returned_quantity = returned_quantity + 2 WHERE id = ?", (ids[1],))
+    conn.execute('''
+        INSERT INTO return_history (transaction_id, returned_quantity, return_date) VALUES (?, 1000, '2024-06-01')
+    ''', (ids[2],))
+    conn.commit()
+    return {(ISSUE_STOCK, 'EQ00042'), (ISSUE_REMAINING, ids[0]), (ISSUE_RETURNED, ids[1]),
+            (ISSUE_OVER_RETURNED, ids[2])}
+
+
+def report(label, result):
+    print(f"{label:<32}: {result['duration'] * 1000:9.1f} ms | เครื่องมือ {result['equipment_checked']:>6,} "
+          f"รายการเบิก {result['transactions_checked']:>9,} | พบ {len(result['found']):,} ซ่อม {result['repaired']:,}")
+    return result
+
+
+def main(n_rows=1_000_000, n_changes=1000):
+    base_dir = tempfile.mkdtemp(prefix="bench_reconcile_")
+    rng = random.Random(7)
+    try:
+        db_path = os.path.join(base_dir, "medical_equipment.db")
+        print(f"สร้างข้อมูลจำลอง {n_rows:,} รายการ...")
+        seed_database(db_path, n_rows)
+        init_database(db_path)
+        conn = sqlite3.connect(db_path, timeout=30.0, isolation_level=None)
+        try:
+            report("ตรวจครั้งแรก (ทั้งหมด)", reconcile(conn))
+            report("ไม่มีการเปลี่ยนแปลง", reconcile(conn))
+
+            simulate_activity(conn, n_changes, rng)
+            started = time.perf_counter()
+            full = reconcile(conn, full=True)
+            report("ตรวจทั้งหมด (หลังงานหนึ่งรอบ)", full)
+            simulate_activity(conn, n_changes, rng)
+            incremental = report(f"ตรวจเฉพาะที่เปลี่ยน ({n_changes:,} ครั้ง)", reconcile(conn))
+            assert not full['found'] and not incremental['found']
+            print(f"{'':<32}  เร็วขึ้น {full['duration'] / incremental['duration']:,.0f} เท่า")
+
+            expected = inject_drift(conn)
+            found = report("หลังแทรกยอดที่ไม่ตรงกัน", reconcile(conn))
+            assert {(issue['kind'], issue['row_id']) for issue in found['found']} == expected, found['found']
+            repaired = report("ซ่อม (repair=True)", reconcile(conn, repair=True))
+            # คืนเกินจำนวนที่เบิกซ่อมอัตโนมัติไม่ได้ ยังค้างอยู่หนึ่งรายการ
+            assert repaired['open_issues'] == 1
+            confirmed = report("ตรวจทั้งหมดหลังซ่อม", reconcile(conn, full=True))
+            assert [issue['kind'] for issue in confirmed['found']] == [ISSUE_OVER_RETURNED]
+            print(f"ใช้เวลารวม {time.perf_counter() - started:.1f} s พบยอดไม่ตรงกันครบทุกรายการ")
+        finally:
+            conn.close()
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 1000,
+    )
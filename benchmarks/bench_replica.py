@@ -0,0 +1,92 @@
+# วัด latency ของการเบิก (writer) ระหว่างที่มีงานรายงานอ่านทั้งตารางวนซ้ำอยู่
+# เปรียบเทียบรายงานที่อ่านจากไฟล์หลัก กับรายงานที่อ่านจากสำเนาอ่านอย่างเดียว (ReadReplica)
+#   python benchmarks/bench_replica.py [จำนวนรายการ] [จำนวนการเบิก]
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+from multiprocessing import Event, Process, Queue
+
+from common import seed_database
+from replica import ReadReplica
+from typed_frames import read_transactions_typed
+
+
+def report_reader(db_path, replica_dir, use_replica, stop, results):
+    replica = ReadReplica(db_path, replica_dir=replica_dir, max_age=2.0) if use_replica else None
+    reports = 0
+    while not stop.is_set():
+        conn = replica.connect() if replica else sqlite3.connect(db_path, timeout=60.0)
+        try:
+            read_transactions_typed(conn)
+        finally:
+            conn.close()
+        reports += 1
+    results.put(reports)
+
+
+def withdraw_latencies(db_path, n_ops):
+    conn = sqlite3.connect(db_path, timeout=60.0, isolation_level=None)
+    latencies = []
+    try:
+        for i in range(n_ops):
+            start = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute('''
+                INSERT INTO transactions
+                (id, equipment_id, equipment_name, borrower_id, department_id, quantity, returned_quantity,
+                 remaining_quantity, unit, date, status, notes, fully_returned)
+                VALUES (?, 'EQ00001', 'เครื่องมือ', 1, 1, 1, 0, 1, 'อัน', ?, 'เบิกแล้ว', '', 0)
+            ''', (f"BENCH{time.time_ns()}{i}", datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+            conn.execute("UPDATE equipment SET quantity = quantity - 1 WHERE id = 'EQ00001'")
+            conn.execute("COMMIT")
+            latencies.append(time.perf_counter() - start)
+            time.sleep(0.01)
+    finally:
+        conn.close()
+    return sorted(latencies)
+
+
+def run(db_path, replica_dir, use_replica, n_ops):
+    stop = Event()
+    results = Queue()
+    reader = Process(target=report_reader, args=(db_path, replica_dir, use_replica, stop, results))
+    reader.start()
+    time.sleep(1.0)
+    latencies = withdraw_latencies(db_path, n_ops)
+    stop.set()
+    reports = results.get()
+    reader.join()
+    return latencies, reports
+
+
+def main(n_rows=300_000, n_ops=500):
+    base_dir = tempfile.mkdtemp(prefix="bench_replica_")
+    try:
+        db_path = os.path.join(base_dir, "medical_equipment.db")
+        print(f"สร้างข้อมูลจำลอง {n_rows:,} รายการ...")
+        seed_database(db_path, n_rows, n_equipment=500)
+        # ใช้ WAL เหมือนฐานข้อมูลของแอพ (init_database)
+        conn = sqlite3.connect(db_path)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.close()
+
+        print(f"เบิก {n_ops} ครั้ง ระหว่างที่มีรายงานอ่านทั้งตารางวนซ้ำ")
+        for label, use_replica in (("อ่านจากไฟล์หลัก", False), ("อ่านจากสำเนา", True)):
+            latencies, reports = run(db_path, os.path.join(base_dir, "replicas"), use_replica, n_ops)
+            p50 = latencies[len(latencies) // 2]
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            print(f"{label:<16}: p50 {p50 * 1000:8.1f} ms  p99 {p99 * 1000:8.1f} ms  "
+                  f"max {latencies[-1] * 1000:8.1f} ms  (รายงาน {reports} รอบ)")
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 300_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 500,
+    )
@@ -0,0 +1,51 @@
+# เปรียบเทียบกราฟแนวโน้มแบบส่งทุกรายการ กับแบบรวมช่วง/ลดจุดที่ server (charts.py)
+# และเวลาสร้างกราฟครั้งแรกเทียบกับการอ่านจาก cache (JSON)
+#   python benchmarks/bench_report_figures.py [จำนวนรายการ]
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import plotly.express as px
+
+from common import best_of, seed_database
+from charts import CHART_ACTIVITY, CHART_STATUS_PIE, CHART_TOP_EQUIPMENT, MAX_POINTS, build_figure_json
+from reports import build_report_bundle
+from typed_frames import read_transactions_typed
+
+
+def main(n_rows=1_000_000):
+    path = os.path.join(tempfile.gettempdir(), "bench_report_figures.db")
+    print(f"สร้างข้อมูลจำลอง {n_rows:,} รายการ...")
+    seed_database(path, n_rows)
+    conn = sqlite3.connect(path)
+    try:
+        df = read_transactions_typed(conn)
+    finally:
+        conn.close()
+    os.remove(path)
+    report = build_report_bundle(df, include_exports=False)
+
+    # แบบเดิม: ส่งทุกรายการไปให้ browser วาด
+    def naive_activity():
+        return px.line(df, x='date', y='quantity').to_json()
+
+    naive_time, naive_json = best_of(naive_activity, repeat=1)
+    binned_time, binned_json = best_of(lambda: build_figure_json(CHART_ACTIVITY, report, df), repeat=3)
+    points = max(len(trace['x']) for trace in json.loads(binned_json)['data'])
+
+    print(f"กราฟแนวโน้ม (ไม่เกิน {MAX_POINTS} จุด)")
+    print(f"ส่งทุกรายการ   : {naive_time:8.2f} s  JSON {len(naive_json) / 1e6:8.2f} MB  {len(df):,} จุด")
+    print(f"รวมช่วงที่ server: {binned_time:8.2f} s  JSON {len(binned_json) / 1e6:8.2f} MB  {points:,} จุด")
+
+    # cache เก็บ JSON ไว้แล้ว รอบถัดไปเหลือแค่แปลง JSON กลับเป็น dict ให้ st.plotly_chart
+    for chart_type in (CHART_STATUS_PIE, CHART_TOP_EQUIPMENT, CHART_ACTIVITY):
+        build_time, fig_json = best_of(lambda: build_figure_json(chart_type, report, df), repeat=3)
+        cached_time, _ = best_of(lambda: json.loads(fig_json), repeat=3)
+        print(f"{chart_type:<14}: สร้างใหม่ {build_time * 1000:8.1f} ms  จาก cache {cached_time * 1000:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
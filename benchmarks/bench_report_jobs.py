@@ -0,0 +1,82 @@
+# ไฟล์รายงาน Excel: สร้างระหว่าง render หน้าเว็บ (แบบเดิม) เทียบกับส่งงานเข้า process pool
+# วัดเวลาที่หน้าเว็บถูกบล็อก, ความหน่วงของ "rerun" ระหว่างที่งานทำอยู่, เวลาสร้างไฟล์จนเสร็จ
+# และคำขอซ้ำจากผู้ใช้หลายคนพร้อมกัน (ต้องสร้างไฟล์ครั้งเดียว ที่เหลือใช้ไฟล์เดิม)
+#   python benchmarks/bench_report_jobs.py [จำนวนรายการ] [จำนวนผู้ใช้ที่ขอพร้อมกัน]
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import seed_database
+from report_jobs import FORMAT_XLSX, JOB_DONE, JOB_FAILED, SOURCE_DATABASE, ReportJobs
+from reports import build_report_bundle
+from typed_frames import read_transactions_typed
+
+PARAMS = {'format': FORMAT_XLSX, 'start': None, 'end': None, 'status': None}
+
+
+def main(n_rows=200_000, n_users=8):
+    base_dir = tempfile.mkdtemp(prefix="bench_report_jobs_")
+    jobs = ReportJobs(os.path.join(base_dir, "reports"))
+    try:
+        db_path = os.path.join(base_dir, "medical_equipment.db")
+        print(f"สร้างข้อมูลจำลอง {n_rows:,} รายการ...")
+        seed_database(db_path, n_rows)
+        sources = [(SOURCE_DATABASE, db_path)]
+
+        conn = sqlite3.connect(db_path)
+        try:
+            start = time.perf_counter()
+            df_transactions = read_transactions_typed(conn)
+            build_report_bundle(df_transactions)
+            blocking = time.perf_counter() - start
+        finally:
+            conn.close()
+        print(f"แบบเดิม (สร้าง Excel ระหว่าง render)  : หน้าเว็บถูกบล็อก {blocking:6.2f} s")
+
+        # เริ่ม process pool ก่อน (ครั้งแรกของ process เท่านั้น) ไม่ให้นับรวมกับการส่งงาน
+        jobs.submit(dict(PARAMS, start='1900-01-01', end='1900-01-01'), 'warmup', sources)
+
+        start = time.perf_counter()
+        artifact_path = jobs.submit(PARAMS, 'v1', sources)
+        submit_time = time.perf_counter() - start
+
+        # ระหว่างงานทำอยู่ ผู้ใช้หลายคนส่งคำขอเดียวกัน และหน้าเว็บ rerun เพื่ออ่านความคืบหน้าทุก 100 ms
+        with ThreadPoolExecutor(n_users) as pool:
+            same = set(pool.map(lambda _: jobs.submit(PARAMS, 'v1', sources), range(n_users)))
+        ticks = []
+        while True:
+            tick = time.perf_counter()
+            status = jobs.status(artifact_path)
+            ticks.append(time.perf_counter() - tick)
+            if status['state'] in (JOB_DONE, JOB_FAILED):
+                break
+            time.sleep(0.1)
+        total = time.perf_counter() - start
+        assert status['state'] == JOB_DONE, status
+        assert same == {artifact_path}
+        ticks.sort()
+        print(f"process pool: ส่งงาน {submit_time * 1000:8.1f} ms | อ่านสถานะ p99 {ticks[int(len(ticks) * 0.99)] * 1000:6.2f} ms "
+              f"| ไฟล์เสร็จใน {total:6.2f} s ({status['rows']:,} รายการ, {status['bytes'] / 1024 ** 2:.1f} MB)")
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(n_users) as pool:
+            reused = set(pool.map(lambda _: jobs.submit(PARAMS, 'v1', sources), range(n_users)))
+        reuse_time = time.perf_counter() - start
+        assert reused == {artifact_path}
+        built = len([name for name in os.listdir(jobs.report_dir) if name.endswith('.xlsx')])
+        print(f"คำขอเดียวกันจาก {n_users} ผู้ใช้ (ไฟล์มีแล้ว): {reuse_time * 1000:8.1f} ms รวม | "
+              f"ไฟล์ที่สร้างจริง {built - 1} ไฟล์")
+    finally:
+        jobs.shutdown()
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 200_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 8,
+    )
@@ -0,0 +1,95 @@
+# replay คิวลองใหม่ของการคืน: ซิงค์ครั้งแรก (คืนจริง) กับการซิงค์ซ้ำทั้งชุด (ack หาย) ซึ่งต้องไม่คืนซ้ำ
+# เทียบกับการคืนทีละรายการแบบเดิม (เปิด connection + commit ต่อรายการ)
+#   python benchmarks/bench_return_queue.py [จำนวนการคืนในคิว]
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from common import seed_database
+from ledger import create_stock_ledger
+from return_queue import (
+    RETURN_APPLIED, RETURN_DUPLICATE, ReturnQueue, apply_return, create_return_dedup, new_idempotency_key
+)
+
+
+def stock_total(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT SUM(quantity) FROM equipment").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def main(n_events=100_000, n_baseline=2_000):
+    base_dir = tempfile.mkdtemp(prefix="bench_return_queue_")
+    try:
+        path = os.path.join(base_dir, "medical_equipment.db")
+        n_rows = n_events * 2
+        print(f"สร้างข้อมูลจำลอง {n_rows:,} รายการ...")
+        seed_database(path, n_rows, n_equipment=500)
+        conn = sqlite3.connect(path)
+        create_return_dedup(conn.cursor())
+        create_stock_ledger(conn.cursor())
+        conn.commit()
+        targets = conn.execute('''
+            SELECT id FROM transactions WHERE remaining_quantity > 0 LIMIT ?
+        ''', (n_events + n_baseline,)).fetchall()
+        conn.close()
+        targets = [row[0] for row in targets]
+        if len(targets) < n_events + n_baseline:
+            raise SystemExit("รายการเบิกที่ยังไม่คืนมีไม่พอ")
+
+        # แบบเดิม: คืนทีละรายการ
+        start = time.perf_counter()
+        for transaction_id in targets[n_events:]:
+            conn = sqlite3.connect(path, timeout=30.0)
+            try:
+                apply_return(conn, transaction_id, 1, "", new_idempotency_key())
+                conn.commit()
+            finally:
+                conn.close()
+        baseline = (time.perf_counter() - start) / n_baseline
+
+        # บันทึกการสแกนลงคิว (ไม่ fsync ทุกรายการเพื่อให้สร้างคิวขนาดใหญ่ได้เร็ว)
+        journal = os.path.join(base_dir, "return_queue.jsonl")
+        queue = ReturnQueue(journal, durable=False)
+        start = time.perf_counter()
+        for transaction_id in targets[:n_events]:
+            queue.enqueue(transaction_id, 1, "คืนจากคิว")
+        enqueue_time = time.perf_counter() - start
+        journal_size = os.path.getsize(journal)
+        shutil.copy(journal, journal + ".lost_ack")
+
+        stock_before = stock_total(path)
+        start = time.perf_counter()
+        first = queue.sync(lambda transaction_id: path)
+        first_time = time.perf_counter() - start
+        stock_after_first = stock_total(path)
+
+        # ack หาย: ส่งทั้งชุดซ้ำอีกครั้ง ต้องไม่คืนซ้ำ
+        shutil.copy(journal + ".lost_ack", journal)
+        start = time.perf_counter()
+        replay = queue.sync(lambda transaction_id: path)
+        replay_time = time.perf_counter() - start
+        stock_after_replay = stock_total(path)
+
+        assert first[RETURN_APPLIED] == n_events, first
+        assert replay[RETURN_DUPLICATE] == n_events, replay
+        assert stock_after_first - stock_before == n_events
+        assert stock_after_replay == stock_after_first, "replay ทำให้สต็อกเปลี่ยน"
+
+        print(f"คิว {n_events:,} รายการ journal {journal_size / 1e6:.1f} MB "
+              f"({journal_size / n_events:.0f} ไบต์/รายการ) เขียนคิว {enqueue_time:.2f} s")
+        print(f"คืนทีละรายการ (แบบเดิม) : {1 / baseline:10,.0f} รายการ/วินาที")
+        print(f"ซิงค์เป็นชุด (ครั้งแรก) : {n_events / first_time:10,.0f} รายการ/วินาที ({first_time:.2f} s)")
+        print(f"replay ซ้ำทั้งชุด       : {n_events / replay_time:10,.0f} รายการ/วินาที ({replay_time:.2f} s)"
+              f"  ซ้ำ {replay[RETURN_DUPLICATE]:,} รายการ สต็อกไม่เปลี่ยน")
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
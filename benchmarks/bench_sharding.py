@@ -0,0 +1,95 @@
+# เปรียบเทียบ throughput การเขียนพร้อมกันหลาย process: ฐานข้อมูลเดียว กับแยก shard ตามหอผู้ป่วย
+# และเวลาอ่านรายงานรวมจากทุก shard แบบขนาน (fan-out)
+#   python benchmarks/bench_sharding.py [จำนวน process] [จำนวนการเบิกต่อ process]
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+from multiprocessing import Pool
+
+from common import seed_database
+from sharding import ShardRouter
+from typed_frames import concat_transactions, read_transactions_typed
+
+
+# จำลองการเบิก: ตรวจจำนวนคงเหลือ เพิ่มรายการเบิก แล้วตัดสต็อก ในธุรกรรมเดียว (เหมือน withdraw_equipment)
+def withdraw_worker(args):
+    path, worker_id, n_ops = args
+    conn = sqlite3.connect(path, timeout=60.0, isolation_level=None)
+    try:
+        for i in range(n_ops):
+            eq_id = f"EQ{(worker_id * n_ops + i) % 500:05d}"
+            conn.execute("BEGIN IMMEDIATE")
+            quantity = conn.execute("SELECT quantity FROM equipment WHERE id = ?", (eq_id,)).fetchone()[0]
+            conn.execute('''
+                INSERT INTO transactions
+                (id, equipment_id, equipment_name, borrower_id, department_id, quantity, returned_quantity,
+                 remaining_quantity, unit, date, status, notes, fully_returned)
+                VALUES (?, ?, 'เครื่องมือ', 1, 1, 1, 0, 1, 'อัน', ?, 'เบิกแล้ว', '', 0)
+            ''', (f"W{worker_id:03d}-{i:06d}", eq_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+            conn.execute("UPDATE equipment SET quantity = ? WHERE id = ?", (max(quantity - 1, 0), eq_id))
+            conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+def run_writers(paths, n_workers, n_ops):
+    jobs = [(paths[i % len(paths)], i, n_ops) for i in range(n_workers)]
+    with Pool(n_workers) as pool:
+        start = time.perf_counter()
+        pool.map(withdraw_worker, jobs)
+        return time.perf_counter() - start
+
+
+def main(n_workers=8, n_ops=500, n_rows=200_000):
+    base_dir = tempfile.mkdtemp(prefix="bench_sharding_")
+    try:
+        single = ShardRouter(default_path=os.path.join(base_dir, "single.db"))
+        keys = [f"WARD{i}" for i in range(n_workers)]
+        sharded = ShardRouter(keys, shard_dir=base_dir)
+
+        print(f"สร้างข้อมูลจำลอง {n_rows:,} รายการ (แบ่งเท่ากันใน {len(keys)} shard)...")
+        seed_database(single.path_for(), n_rows, n_equipment=500)
+        for key in keys:
+            seed_database(sharded.path_for(key), n_rows // len(keys), n_equipment=500)
+
+        total_ops = n_workers * n_ops
+        single_time = run_writers(single.paths(), n_workers, n_ops)
+        sharded_time = run_writers(sharded.paths(), n_workers, n_ops)
+
+        print(f"{n_workers} process เขียนพร้อมกัน คนละ {n_ops} การเบิก")
+        print(f"ฐานข้อมูลเดียว     : {total_ops / single_time:8.0f} การเบิก/วินาที ({single_time:.2f} s)")
+        print(f"{len(keys)} shard          : {total_ops / sharded_time:8.0f} การเบิก/วินาที ({sharded_time:.2f} s)"
+              f"  (เร็วขึ้น {single_time / sharded_time:.1f} เท่า)")
+
+        # รายงานรวม: อ่านจาก shard เดียว กับ fan-out อ่านทุก shard แล้วรวมกัน
+        def read_shard(key, path):
+            conn = sqlite3.connect(path)
+            try:
+                return read_transactions_typed(conn)
+            finally:
+                conn.close()
+
+        start = time.perf_counter()
+        df_single = single.fan_out(read_shard)[single.default_key]
+        single_read = time.perf_counter() - start
+
+        start = time.perf_counter()
+        df_sharded = concat_transactions(list(sharded.fan_out(read_shard).values()))
+        sharded_read = time.perf_counter() - start
+
+        print(f"อ่านรายงานรวม ({len(df_single):,} / {len(df_sharded):,} รายการ)")
+        print(f"ฐานข้อมูลเดียว     : {single_read:8.2f} s")
+        print(f"fan-out {len(keys)} shard  : {sharded_read:8.2f} s")
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 8,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 500,
+    )
@@ -0,0 +1,148 @@
+# N worker process เริ่มพร้อมกัน (เหมือนหลาย Streamlit process หลัง load balancer) แต่ละตัวต้องใช้
+# ข้อมูลเครื่องมือ, รายการเบิก (typed) และรายงานสรุป: ต่างคนต่างโหลด/คำนวณ เทียบกับใช้ cache ร่วมบนดิสก์
+# แล้วตรวจว่าหลังมีการเขียนข้อมูล และหลัง clear() จาก worker หนึ่ง ทุก worker เห็นข้อมูลใหม่ตรงกัน
+#   python benchmarks/bench_shared_cache.py [จำนวนรายการ] [จำนวน worker]
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from common import seed_database
+from changefeed import cache_version, create_change_log
+from reports import build_report_bundle, equipment_overview
+from shared_cache import SharedCache
+from typed_frames import read_transactions_typed
+
+
+def load_all(db_path, cache):
+    conn = sqlite3.connect(db_path, timeout=30.0)
+    try:
+        version = cache_version(conn)
+
+        def compute(namespace, func):
+            return func() if cache is None else cache.get_or_compute(namespace, db_path, version, func)
+
+        df_equipment = compute('equipment', lambda: pd.read_sql_query(
+            "SELECT * FROM equipment ORDER BY id", conn
+        ))
+        df_transactions = compute('transactions', lambda: read_transactions_typed(conn))
+        overview = compute('overview', lambda: equipment_overview(df_equipment, df_transactions))
+        report = compute('report', lambda: build_report_bundle(df_transactions, include_exports=False))
+        return version, len(df_transactions), int(overview['borrowed_quantity'].sum()), report['summary']
+    finally:
+        conn.close()
+
+
+# worker หนึ่งตัว: รอสัญญาณเริ่ม โหลดข้อมูล แล้วรอคำสั่งถัดไป (โหลดใหม่ / clear / จบ)
+def worker(db_path, cache_dir, start_event, commands, results):
+    cache = SharedCache(cache_dir) if cache_dir else None
+    start_event.wait()
+    while True:
+        command = commands.get()
+        if command == 'stop':
+            return
+        if command == 'clear' and cache is not None:
+            cache.clear()
+            results.put(None)
+            continue
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        summary = load_all(db_path, cache)
+        results.put((os.getpid(), time.perf_counter() - started, time.process_time() - cpu_started, summary))
+
+
+def run_round(processes, commands, results, command='load'):
+    for _ in processes:
+        commands.put(command)
+    return [results.get() for _ in processes]
+
+
+def start_workers(n_workers, db_path, cache_dir):
+    start_event = multiprocessing.Event()
+    commands = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=worker, args=(db_path, cache_dir, start_event, commands, results))
+        for _ in range(n_workers)
+    ]
+    for process in processes:
+        process.start()
+    start_event.set()
+    return processes, commands, results
+
+
+def stop_workers(processes, commands):
+    for _ in processes:
+        commands.put('stop')
+    for process in processes:
+        process.join()
+
+
+def report(label, started, round_results):
+    wall = time.perf_counter() - started
+    cpu = sum(result[2] for result in round_results)
+    slowest = max(result[1] for result in round_results)
+    print(f"{label:<34}: พร้อมครบทุก worker {wall:6.2f} s | CPU รวม {cpu:6.2f} s | worker ช้าสุด {slowest:6.2f} s")
+    return round_results
+
+
+def main(n_rows=200_000, n_workers=4):
+    base_dir = tempfile.mkdtemp(prefix="bench_shared_cache_")
+    try:
+        db_path = os.path.join(base_dir, "medical_equipment.db")
+        cache_dir = os.path.join(base_dir, "cache")
+        print(f"สร้างข้อมูลจำลอง {n_rows:,} รายการ, {n_workers} worker (CPU {os.cpu_count()} core)...")
+        seed_database(db_path, n_rows)
+        conn = sqlite3.connect(db_path)
+        create_change_log(conn.cursor())
+        conn.commit()
+        conn.close()
+
+        processes, commands, results = start_workers(n_workers, db_path, None)
+        started = time.perf_counter()
+        report("ต่างคนต่างโหลด (st.cache_data)", started, run_round(processes, commands, results))
+        stop_workers(processes, commands)
+
+        processes, commands, results = start_workers(n_workers, db_path, cache_dir)
+        try:
+            started = time.perf_counter()
+            first = report("cache ร่วม (ครั้งแรก)", started, run_round(processes, commands, results))
+            started = time.perf_counter()
+            report("cache ร่วม (worker เริ่มใหม่ / rerun)", started, run_round(processes, commands, results))
+            assert len({repr(result[3]) for result in first}) == 1
+
+            # เขียนข้อมูลใหม่ 1 รายการ: ทุก worker ต้องเห็นเวอร์ชันใหม่และจำนวนรายการใหม่
+            conn = sqlite3.connect(db_path)
+            conn.execute("DELETE FROM transactions WHERE rowid = (SELECT MAX(rowid) FROM transactions)")
+            conn.commit()
+            conn.close()
+            started = time.perf_counter()
+            after_write = report("หลังเขียนข้อมูล (เวอร์ชันใหม่)", started, run_round(processes, commands, results))
+            assert len({repr(result[3]) for result in after_write}) == 1
+            assert after_write[0][3][1] == first[0][3][1] - 1
+
+            # clear() จาก worker หนึ่ง ทุก worker ต้องคำนวณใหม่ (ไม่มีใครได้ค่าจาก generation เก่า)
+            commands.put('clear')
+            results.get()
+            started = time.perf_counter()
+            after_clear = report("หลัง clear() จาก worker หนึ่ง", started, run_round(processes, commands, results))
+            assert len({repr(result[3]) for result in after_clear}) == 1
+            cache_stats = SharedCache(cache_dir).stats()
+            print(f"ไฟล์ใน cache {cache_stats['entries']} ไฟล์ {cache_stats['bytes'] / 1024 ** 2:.1f} MB "
+                  f"generation {cache_stats['generation']} ทุก worker ได้ผลตรงกันทุกรอบ")
+        finally:
+            stop_workers(processes, commands)
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 200_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 4,
+    )
@@ -0,0 +1,104 @@
+# ยอดคงเหลือย้อนหลัง (as of) จากสมุดบัญชีสต็อก: replay ทั้งสมุดบัญชี เทียบกับ snapshot ล่าสุด + delta หลัง snapshot
+#   python benchmarks/bench_stock_ledger.py [จำนวนรายการในสมุดบัญชี]
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from common import best_of
+from ledger import (DATE_FORMAT, SNAPSHOT_EVERY_ENTRIES, STOCK_BASELINE, STOCK_RETURN, STOCK_WITHDRAW,
+                    create_stock_ledger, stock_as_of, take_stock_snapshot)
+
+N_EQUIPMENT = 5000
+START = "2025-01-01 00:00:00"
+SECONDS_PER_ENTRY = 3
+
+
+def seed_ledger(conn, n_entries):
+    conn.execute("CREATE TABLE equipment (id TEXT PRIMARY KEY, quantity INTEGER NOT NULL)")
+    create_stock_ledger(conn)
+    conn.execute('''
+        WITH RECURSIVE eq(n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM eq WHERE n + 1 < ?)
+        INSERT INTO stock_ledger (equipment_id, delta, cause, reference, at)
+        SELECT printf('EQ%05d', n), 1000, ?, NULL, ? FROM eq
+    ''', (N_EQUIPMENT, STOCK_BASELINE, START))
+    # เบิก (delta ติดลบ) และคืน (delta บวก) สุ่มเครื่องมือ เวลาเพิ่มขึ้นตาม seq
+    conn.execute('''
+        WITH RECURSIVE entry(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM entry WHERE n < ?)
+        INSERT INTO stock_ledger (equipment_id, delta, cause, reference, at)
+        SELECT printf('EQ%05d', abs(random()) % ?), d, CASE WHEN d < 0 THEN ? ELSE ? END, NULL,
+               strftime('%Y-%m-%d %H:%M:%S', ?, '+' || (n * ?) || ' seconds')
+        FROM (SELECT n, CASE WHEN abs(random()) % 2 THEN -1 - abs(random()) % 5 ELSE 1 + abs(random()) % 5 END AS d
+              FROM entry)
+    ''', (n_entries - N_EQUIPMENT, N_EQUIPMENT, STOCK_WITHDRAW, STOCK_RETURN, START, SECONDS_PER_ENTRY))
+    conn.commit()
+
+
+# สร้าง snapshot ทุก every_entries รายการ (เหมือนงานดูแลฐานข้อมูลที่ทำเป็นรอบ) โดยสะสมยอดทีละช่วง
+def seed_snapshots(conn, every_entries):
+    latest = conn.execute("SELECT MAX(seq) FROM stock_ledger").fetchone()[0]
+    quantities = {}
+    through_seq = 0
+    while through_seq + every_entries <= latest:
+        upto = through_seq + every_entries
+        for equipment_id, delta in conn.execute(
+            "SELECT equipment_id, SUM(delta) FROM stock_ledger WHERE seq > ? AND seq <= ? GROUP BY equipment_id",
+            (through_seq, upto)
+        ):
+            quantities[equipment_id] = quantities.get(equipment_id, 0) + delta
+        taken_at = conn.execute("SELECT at FROM stock_ledger WHERE seq = ?", (upto,)).fetchone()[0]
+        snapshot_id = conn.execute(
+            "INSERT INTO stock_snapshots (taken_at, through_seq) VALUES (?, ?)", (taken_at, upto)
+        ).lastrowid
+        conn.executemany(
+            "INSERT INTO stock_snapshot_rows (snapshot_id, equipment_id, quantity) VALUES (?, ?, ?)",
+            ((snapshot_id, equipment_id, quantity) for equipment_id, quantity in quantities.items())
+        )
+        through_seq = upto
+    conn.commit()
+    # ยอดปัจจุบันในตาราง equipment = replay ทั้งหมด (ใช้วัดเวลาสร้าง snapshot จริง)
+    conn.executemany(
+        "INSERT INTO equipment (id, quantity) VALUES (?, ?)",
+        stock_as_of(conn, "9999-12-31 23:59:59", use_snapshots=False).items()
+    )
+    conn.commit()
+
+
+def main(n_entries=10_000_000):
+    base_dir = tempfile.mkdtemp(prefix="bench_stock_ledger_")
+    try:
+        path = os.path.join(base_dir, "ledger.db")
+        conn = sqlite3.connect(path, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("BEGIN")
+        print(f"สร้างสมุดบัญชีจำลอง {n_entries:,} รายการ...")
+        start = time.perf_counter()
+        seed_ledger(conn, n_entries)
+        conn.execute("BEGIN")
+        seed_snapshots(conn, SNAPSHOT_EVERY_ENTRIES)
+        n_snapshots = conn.execute("SELECT COUNT(*) FROM stock_snapshots").fetchone()[0]
+        print(f"สร้างเสร็จใน {time.perf_counter() - start:.1f} s, snapshot {n_snapshots:,} ชุด "
+              f"(ทุก {SNAPSHOT_EVERY_ENTRIES:,} รายการ), ไฟล์ {os.path.getsize(path) / 1024 ** 2:,.0f} MB")
+
+        first, last = conn.execute("SELECT MIN(at), MAX(at) FROM stock_ledger").fetchone()
+        first_ts = time.mktime(time.strptime(first, DATE_FORMAT))
+        last_ts = time.mktime(time.strptime(last, DATE_FORMAT))
+        for fraction in (0.1, 0.5, 0.9, 1.0):
+            at = time.strftime(DATE_FORMAT, time.localtime(first_ts + (last_ts - first_ts) * fraction))
+            replay_time, replayed = best_of(lambda: stock_as_of(conn, at, use_snapshots=False), repeat=1)
+            snapshot_time, from_snapshot = best_of(lambda: stock_as_of(conn, at))
+            assert replayed == from_snapshot
+            print(f"ยอด ณ {at}: replay ทั้งหมด {replay_time * 1000:8.1f} ms | "
+                  f"snapshot + delta {snapshot_time * 1000:6.1f} ms  (เร็วขึ้น {replay_time / snapshot_time:,.0f} เท่า)")
+
+        snapshot_time, _ = best_of(lambda: take_stock_snapshot(conn), repeat=1)
+        print(f"สร้าง snapshot ใหม่หนึ่งชุด ({N_EQUIPMENT:,} เครื่องมือ): {snapshot_time * 1000:.1f} ms")
+        conn.close()
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000)
@@ -0,0 +1,39 @@
+# เปรียบเทียบหน่วยความจำและเวลาโหลดระหว่าง SELECT * แบบเดิมกับ loader แบบ typed
+#   python benchmarks/bench_typed_transactions.py [จำนวนรายการ]
+import sqlite3
+import sys
+import tempfile
+import os
+
+import pandas as pd
+
+from common import best_of, seed_database
+from dimensions import TRANSACTIONS_VIEW
+from typed_frames import read_transactions_typed
+
+
+def main(n_rows=1_000_000):
+    path = os.path.join(tempfile.gettempdir(), "bench_typed_transactions.db")
+    print(f"สร้างข้อมูลจำลอง {n_rows:,} รายการ...")
+    seed_database(path, n_rows)
+
+    conn = sqlite3.connect(path)
+    try:
+        default_time, df_default = best_of(
+            lambda: pd.read_sql_query(f"SELECT * FROM {TRANSACTIONS_VIEW} ORDER BY created_at DESC", conn)
+        )
+        typed_time, df_typed = best_of(lambda: read_transactions_typed(conn))
+    finally:
+        conn.close()
+
+    default_mb = df_default.memory_usage(deep=True).sum() / 1024 ** 2
+    typed_mb = df_typed.memory_usage(deep=True).sum() / 1024 ** 2
+
+    print(f"SELECT * (default dtypes): {default_mb:8.1f} MB  {default_time:6.2f} s")
+    print(f"typed loader             : {typed_mb:8.1f} MB  {typed_time:6.2f} s")
+    print(f"ลดหน่วยความจำ {default_mb / typed_mb:.1f} เท่า, เวลาโหลด {default_time / typed_time:.2f} เท่า")
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,127 @@
+# ฟังก์ชันช่วยสำหรับ benchmark: สร้างฐานข้อมูลชั่วคราวและข้อมูลจำลองจำนวนมาก
+# รันจากโฟลเดอร์หลักของโปรเจกต์ เช่น  python benchmarks/bench_typed_transactions.py
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+# ให้ import โมดูลของแอพได้เมื่อรันจากโฟลเดอร์ benchmarks
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dimensions import migrate_transactions
+
+STATUSES = ("เบิกแล้ว", "คืนบางส่วน", "คืนครบแล้ว")
+UNITS = ("เครื่อง", "อัน", "คู่", "ขวด", "กล่อง")
+
+
+# โครงสร้างตารางแบบเดิม (transactions เก็บชื่อผู้เบิก/แผนกเป็นข้อความ)
+def create_legacy_schema(conn):
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS equipment (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            category TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            unit TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS transactions (
+            id TEXT PRIMARY KEY,
+            equipment_id TEXT NOT NULL,
+            equipment_name TEXT NOT NULL,
+            borrower_name TEXT NOT NULL,
+            borrower_dept TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            returned_quantity INTEGER DEFAULT 0,
+            remaining_quantity INTEGER NOT NULL,
+            unit TEXT NOT NULL,
+            date TEXT NOT NULL,
+            status TEXT NOT NULL,
+            notes TEXT,
+            fully_returned BOOLEAN DEFAULT FALSE,
+            last_return_date TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS return_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            transaction_id TEXT NOT NULL,
+            returned_quantity INTEGER NOT NULL,
+            return_date TEXT NOT NULL,
+            notes TEXT
+        );
+    ''')
+
+
+# สร้างฐานข้อมูลจำลองที่มีรายการเบิก n_transactions รายการ
+# normalized=True ย้ายไปใช้ตารางมิติผู้เบิก/แผนกแบบเดียวกับแอพ (False = คงโครงสร้างแบบเดิมไว้)
+def seed_database(path, n_transactions, n_equipment=5000, n_borrowers=2000, n_depts=40, seed=42, normalized=True):
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    create_legacy_schema(conn)
+
+    equipment = [
+        (f"EQ{i:05d}", f"เครื่องมือ {i}", f"หมวด {i % 20}", rng.randint(0, 500), UNITS[i % len(UNITS)])
+        for i in range(n_equipment)
+    ]
+    conn.executemany("INSERT INTO equipment (id, name, category, quantity, unit) VALUES (?, ?, ?, ?, ?)", equipment)
+
+    start = datetime(2024, 1, 1)
+    batch = []
+    history = []
+    for i in range(n_transactions):
+        eq_id, eq_name, _, _, unit = equipment[rng.randrange(n_equipment)]
+        quantity = rng.randint(1, 10)
+        returned = rng.choice((0, quantity, rng.randint(0, quantity)))
+        remaining = quantity - returned
+        borrowed_at = start + timedelta(minutes=i)
+        date = borrowed_at.strftime("%Y-%m-%d %H:%M:%S")
+        last_return = None
+        if returned:
+            last_return = (borrowed_at + timedelta(hours=rng.randint(1, 240))).strftime("%Y-%m-%d %H:%M:%S")
+            history.append((f"TX{i:09d}", returned, last_return, ""))
+        status = STATUSES[0] if returned == 0 else (STATUSES[2] if remaining == 0 else STATUSES[1])
+        batch.append((
+            f"TX{i:09d}", eq_id, eq_name, f"ผู้เบิก {rng.randrange(n_borrowers)}",
+            f"แผนก {rng.randrange(n_depts)}", quantity, returned, remaining, unit,
+            date, status, "" if i % 3 else "หมายเหตุ", remaining == 0, last_return, date
+        ))
+        if len(batch) >= 50000:
+            _flush(conn, batch, history)
+    _flush(conn, batch, history)
+    conn.commit()
+    if normalized:
+        migrate_transactions(conn.cursor())
+        conn.commit()
+        conn.execute("VACUUM")
+    conn.close()
+
+
+def _flush(conn, batch, history):
+    conn.executemany('''
+        INSERT INTO transactions
+        (id, equipment_id, equipment_name, borrower_name, borrower_dept, quantity, returned_quantity,
+         remaining_quantity, unit, date, status, notes, fully_returned, last_return_date, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', batch)
+    conn.executemany('''
+        INSERT INTO return_history (transaction_id, returned_quantity, return_date, notes)
+        VALUES (?, ?, ?, ?)
+    ''', history)
+    batch.clear()
+    history.clear()
+
+
+# วัดเวลาที่ดีที่สุดจากการรันหลายรอบ (วินาที)
+def best_of(func, repeat=3):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
@@ -0,0 +1,310 @@
+# change feed แบบ append-only: trigger บันทึกทุกการเปลี่ยนแปลงของ equipment, transactions และ return_history
+# ลงตาราง change_log ที่มีลำดับ (seq) เพิ่มขึ้นเสมอ ใช้ seq ล่าสุดเป็นเวอร์ชันข้อมูลของทั้งฐานข้อมูล
+# ผู้ใช้ (cache ในแอพหรือ dashboard ภายนอก) ขอเฉพาะ "การเปลี่ยนแปลงตั้งแต่เวอร์ชัน V" แทนการอ่านทั้งตาราง
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from typed_frames import TRANSACTION_COLUMNS, concat_transactions, read_transactions_typed, sort_transactions
+
+CHANGE_TABLES = ("equipment", "transactions", "return_history")
+
+OP_INSERT = "I"
+OP_UPDATE = "U"
+OP_DELETE = "D"
+
+# checkpoint ที่ไม่ได้อัพเดทนานกว่านี้ (ผู้อ่านเลิกใช้/process ตายไปแล้ว) ไม่กันการบีบอัด log
+CHECKPOINT_MAX_AGE_DAYS = 30
+# ผู้อ่านใน process (change feed ของ cache) บันทึก checkpoint ไม่บ่อยกว่านี้ (วินาที)
+CHECKPOINT_INTERVAL = 300.0
+
+
+# สร้างตาราง change_log และ trigger (เรียกจาก init_database)
+def create_change_log(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id TEXT NOT NULL,
+            op TEXT NOT NULL,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # seq ล่าสุดของแต่ละตาราง (table_versions) อ่านจาก index ได้โดยไม่สแกน log
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_change_log_table_seq ON change_log(table_name, seq)")
+    # เก็บว่าบีบอัด log ไปถึง seq ไหนแล้ว ผู้ที่มีเวอร์ชันเก่ากว่านี้ต้องโหลดใหม่ทั้งหมด
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            compacted_through INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO change_log_state (id, compacted_through) VALUES (1, 0)")
+    # รหัสสุ่มของฐานข้อมูลไฟล์นี้ ฐานข้อมูลที่สร้างใหม่เริ่มเวอร์ชันจาก 0 อีกครั้งแต่รหัสไม่ซ้ำเดิม
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log_origin (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            origin TEXT NOT NULL
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO change_log_origin (id, origin) VALUES (1, ?)", (uuid.uuid4().hex,))
+    # seq ล่าสุดที่ผู้อ่าน log แต่ละตัว (snapshot, งานตรวจยอด, cache) ประมวลผลแล้ว
+    # การบีบอัดลบได้เฉพาะ log ที่ทุกตัวอ่านไปแล้ว ผู้อ่านจึงไม่ต้องกลับไปโหลดใหม่ทั้งหมด
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log_checkpoints (
+            name TEXT PRIMARY KEY,
+            seq INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    for table in CHANGE_TABLES:
+        for action, op, ref in (("INSERT", OP_INSERT, "NEW"), ("UPDATE", OP_UPDATE, "NEW"), ("DELETE", OP_DELETE, "OLD")):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS change_log_{table}_{action.lower()}
+                AFTER {action} ON {table}
+                BEGIN
+                    INSERT INTO change_log (table_name, row_id, op)
+                    VALUES ('{table}', CAST({ref}.id AS TEXT), '{op}');
+                END
+            ''')
+
+
+# เวอร์ชันข้อมูลปัจจุบัน = seq ล่าสุดที่เคยออก (ไม่ลดลงแม้บีบอัด log แล้ว)
+def current_version(conn):
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+    return row[0] if row else 0
+
+
+# รหัสของฐานข้อมูล (None ถ้ายังไม่ได้ init)
+def database_origin(conn):
+    try:
+        row = conn.execute("SELECT origin FROM change_log_origin WHERE id = 1").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+# เวอร์ชันสำหรับใช้เป็น key ของ cache ที่อยู่นานกว่าไฟล์ฐานข้อมูล (cache บนดิสก์ที่ใช้ร่วมหลาย process)
+# รวมรหัสฐานข้อมูลไว้ด้วย ฐานข้อมูลที่ถูกสร้างใหม่จึงไม่ได้ค่าของฐานข้อมูลเดิมที่เวอร์ชันเดียวกัน
+def cache_version(conn):
+    return f"{database_origin(conn)}:{current_version(conn)}"
+
+
+# เวอร์ชันของแต่ละตาราง = seq ล่าสุดที่เปลี่ยนตารางนั้น (รวมรหัสฐานข้อมูลเหมือน cache_version)
+# ใช้ตัดสินว่างานที่อ่านเฉพาะบางตารางต้องคำนวณใหม่หรือไม่ ตารางที่ log ถูกบีบอัดหมดใช้ seq ที่บีบอัดถึง
+def table_versions(conn):
+    origin = database_origin(conn)
+    through = compacted_through(conn)
+    versions = {}
+    for table in CHANGE_TABLES:
+        seq = conn.execute("SELECT MAX(seq) FROM change_log WHERE table_name = ?", (table,)).fetchone()[0]
+        versions[table] = f"{origin}:{seq if seq is not None else through}"
+    return versions
+
+
+def compacted_through(conn):
+    row = conn.execute("SELECT compacted_through FROM change_log_state WHERE id = 1").fetchone()
+    return row[0] if row else 0
+
+
+# การเปลี่ยนแปลงตั้งแต่เวอร์ชัน since (ไม่รวม) ถึงเวอร์ชันปัจจุบัน
+# คืนค่า {'version', 'reset', 'changes': {table: {'upserted': [...], 'deleted': [...]}}}
+# reset=True แปลว่า log ช่วงนั้นถูกบีบอัดไปแล้ว ผู้เรียกต้องโหลดใหม่ทั้งหมด
+def changes_since(conn, since):
+    version = current_version(conn)
+    result = {
+        'version': version,
+        'reset': since < compacted_through(conn) or since > version,
+        'changes': {table: {'upserted': [], 'deleted': []} for table in CHANGE_TABLES},
+    }
+    if result['reset'] or since == version:
+        return result
+
+    # ใช้เฉพาะการเปลี่ยนแปลงล่าสุดของแต่ละแถว
+    rows = conn.execute('''
+        SELECT c.table_name, c.row_id, c.op
+        FROM change_log c
+        JOIN (
+            SELECT MAX(seq) AS seq FROM change_log
+            WHERE seq > ? AND seq <= ?
+            GROUP BY table_name, row_id
+        ) latest ON latest.seq = c.seq
+    ''', (since, version)).fetchall()
+    for table_name, row_id, op in rows:
+        bucket = 'deleted' if op == OP_DELETE else 'upserted'
+        result['changes'][table_name][bucket].append(row_id)
+    return result
+
+
+# บันทึกว่าผู้อ่านชื่อ name ประมวลผล log ถึง seq แล้ว (ไม่ commit ให้ผู้เรียกบันทึกในธุรกรรมเดียวกับงานของตัวเอง)
+def save_checkpoint(conn, name, seq):
+    conn.execute('''
+        INSERT INTO change_log_checkpoints (name, seq, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (name) DO UPDATE SET seq = excluded.seq, updated_at = excluded.updated_at
+    ''', (name, seq))
+
+
+# seq ต่ำสุดของ checkpoint ที่ยังใช้งานอยู่ (None ถ้าไม่มี)
+def lowest_checkpoint(conn, max_age_days=CHECKPOINT_MAX_AGE_DAYS):
+    return conn.execute(
+        "SELECT MIN(seq) FROM change_log_checkpoints WHERE updated_at >= datetime('now', ?)",
+        (f'-{int(max_age_days)} days',)
+    ).fetchone()[0]
+
+
+# ลบ log ที่เก่ากว่า keep_days วัน (เก็บ log ล่าสุดไว้อย่างน้อย keep_last รายการ)
+# และไม่ลบเกิน checkpoint ต่ำสุด คืนค่าจำนวนแถวที่ลบ
+def compact_change_log(conn, keep_days=7, keep_last=1000, checkpoint_max_age_days=CHECKPOINT_MAX_AGE_DAYS):
+    own_transaction = not conn.in_transaction
+    if own_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    try:
+        through = conn.execute('''
+            SELECT MAX(seq) FROM change_log
+            WHERE changed_at < datetime('now', ?)
+              AND seq <= (SELECT COALESCE(MAX(seq), 0) FROM change_log) - ?
+        ''', (f'-{int(keep_days)} days', keep_last)).fetchone()[0]
+        # checkpoint ที่ค้างนาน (เช่น worker ที่ปิดไปแล้ว) ถูกลบ ผู้อ่านนั้นถ้ากลับมาจะโหลดใหม่ทั้งหมด
+        conn.execute(
+            "DELETE FROM change_log_checkpoints WHERE updated_at < datetime('now', ?)",
+            (f'-{int(checkpoint_max_age_days)} days',)
+        )
+        lowest = lowest_checkpoint(conn, checkpoint_max_age_days)
+        if through is not None and lowest is not None:
+            through = min(through, lowest)
+        removed = 0
+        if through is not None and through > compacted_through(conn):
+            removed = conn.execute("DELETE FROM change_log WHERE seq <= ?", (through,)).rowcount
+            conn.execute(
+                "UPDATE change_log_state SET compacted_through = MAX(compacted_through, ?) WHERE id = 1", (through,)
+            )
+        if own_transaction:
+            conn.commit()
+        return removed
+    except Exception:
+        if own_transaction:
+            conn.rollback()
+        raise
+
+
+# บันทึก checkpoint ของผู้อ่านใน process นี้ลงฐานข้อมูลหลักเป็นระยะ (ไม่เกินหนึ่งครั้งต่อ interval วินาที)
+# ใช้กับ change feed ที่อ่านจากสำเนาอ่านอย่างเดียว บันทึกไม่สำเร็จ (ฐานข้อมูลไม่ว่าง) ก็ลองใหม่ในรอบถัดไป
+class CheckpointRecorder:
+    def __init__(self, db_path, name, interval=CHECKPOINT_INTERVAL):
+        self._db_path = db_path
+        self._name = name
+        self._interval = interval
+        self._saved = (None, None)
+
+    def __call__(self, seq):
+        saved_seq, saved_at = self._saved
+        now = time.monotonic()
+        if seq == saved_seq or (saved_at is not None and now - saved_at < self._interval):
+            return
+        try:
+            conn = sqlite3.connect(self._db_path, timeout=5.0)
+            try:
+                save_checkpoint(conn, self._name, seq)
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return
+        self._saved = (seq, now)
+
+
+# DataFrame รายการเบิกที่อัพเดทแบบ incremental จาก change feed
+# ทุกครั้งที่ refresh จะอ่านเฉพาะแถวที่เปลี่ยนแล้วสร้าง DataFrame ใหม่ (ไม่แก้ตัวเดิมที่ session อื่นอาจใช้อยู่)
+# load_full(conn): โหลดทั้งหมดเมื่อยังไม่มีข้อมูลหรือ log ถูกบีบอัด (เช่น อ่านจาก cache ที่ใช้ร่วมหลาย process)
+# checkpoint(seq): เรียกหลัง refresh ทุกครั้ง (เช่น CheckpointRecorder) ให้การบีบอัด log ไม่ลบส่วนที่ยังไม่ได้อ่าน
+class IncrementalTransactions:
+    def __init__(self, load_full=None, checkpoint=None):
+        self._load_full = load_full or read_transactions_typed
+        self._checkpoint = checkpoint
+        self._lock = threading.Lock()
+        self.version = None
+        self.df = None
+
+    def reset(self):
+        with self._lock:
+            self.version = None
+            self.df = None
+
+    def refresh(self, conn):
+        df = self._refresh(conn)
+        # นอก lock: การเขียน checkpoint ไม่ทำให้ session อื่นต้องรอ
+        if self._checkpoint is not None:
+            self._checkpoint(self.version)
+        return df
+
+    def _refresh(self, conn):
+        with self._lock:
+            if self.df is None:
+                return self._reload(conn)
+
+            feed = changes_since(conn, self.version)
+            if feed['reset']:
+                return self._reload(conn)
+            if feed['version'] == self.version:
+                return self.df
+
+            changes = feed['changes']['transactions']
+            changed_ids = changes['upserted'] + changes['deleted']
+            if changed_ids:
+                self.df = patch_transactions(self.df, conn, changes['upserted'], changed_ids)
+            self.version = feed['version']
+            return self.df
+
+    def _reload(self, conn):
+        # อ่านเวอร์ชันก่อนโหลด ถ้ามีการเขียนระหว่างโหลดจะถูกดึงซ้ำในรอบถัดไป (ไม่หาย)
+        self.version = current_version(conn)
+        self.df = self._load_full(conn)
+        return self.df
+
+
+# สร้าง DataFrame ใหม่จากตัวเดิม: ตัดแถวที่ถูกลบออก แล้วใส่แถวล่าสุดจากฐานข้อมูล
+# ลำดับเหมือน sort_transactions (เหมือนการโหลดใหม่ทุกแถว) โดยไม่ต้องเรียงทั้ง DataFrame ใหม่ทุกครั้ง:
+# - แถวที่แก้ไข (เช่น คืนบางส่วน) ที่วันที่เบิกไม่เปลี่ยน ใส่แทนที่ตำแหน่งเดิม
+# - แถวใหม่ (วันที่และรหัสมากกว่าทุกแถวเดิม) ต่อไว้ด้านหน้า
+# เรียงใหม่ทั้งหมดเฉพาะเมื่อมีแถวที่ต้องย้ายตำแหน่ง (วันที่เปลี่ยน หรือแถวใหม่ที่ไม่ได้อยู่ก่อนทุกแถวเดิม)
+def patch_transactions(df, conn, upserted_ids, changed_ids):
+    if upserted_ids:
+        fetched = read_transactions_typed(
+            conn, "WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(upserted_ids),)
+        )
+    else:
+        fetched = df.iloc[:0]
+
+    # ตำแหน่งของแถวเดิมที่เปลี่ยน (ถูกลบหรือแก้ไข) ทำงานกับเฉพาะแถวเหล่านี้ ไม่แปลงทั้งคอลัมน์
+    positions = np.flatnonzero(df['id'].isin(changed_ids).to_numpy())
+    old_dates = pd.Series(df['date'].take(positions).to_numpy(), index=df['id'].take(positions).to_numpy())
+    in_place = old_dates.reindex(fetched['id'].to_numpy()).to_numpy() == fetched['date'].to_numpy()
+    moved = fetched[~in_place]
+    updated = fetched[in_place]
+    updated_position = pd.Series(np.arange(len(updated)), index=updated['id'].to_numpy())
+
+    # ลำดับแถวของผลลัพธ์ใน combined = [moved, df, updated]: แถวใหม่ก่อน ตามด้วยแถวเดิม
+    # แถวเดิมที่แก้ไขชี้ไปยังค่าใหม่ใน updated แถวที่ถูกลบ (หรือย้ายตำแหน่ง) ตัดออก
+    n_moved, n = len(moved), len(df)
+    order = np.arange(n_moved, n_moved + n)
+    replace = np.isin(old_dates.index.to_numpy(), updated_position.index.to_numpy())
+    order[positions[replace]] = n_moved + n + updated_position[old_dates.index[replace]].to_numpy()
+    order = np.concatenate([np.arange(n_moved), np.delete(order, positions[~replace])])
+    result = concat_transactions([moved, df, updated]).take(order).reset_index(drop=True)
+
+    if 0 < n_moved < len(result) and not _sorts_before(result.iloc[n_moved - 1], result.iloc[n_moved]):
+        return sort_transactions(result)[TRANSACTION_COLUMNS]
+    return result[TRANSACTION_COLUMNS]
+
+
+# แถว a อยู่ก่อนแถว b ตาม sort_transactions หรือไม่ (วันที่มากกว่า หรือวันที่เท่ากันและรหัสมากกว่า)
+def _sorts_before(a, b):
+    if pd.isna(a['date']) or pd.isna(b['date']):
+        return False
+    return a['date'] > b['date'] or (a['date'] == b['date'] and a['id'] > b['id'])
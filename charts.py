@@ -0,0 +1,122 @@
+# สร้างกราฟของหน้ารายงาน (ไม่พึ่ง Streamlit) และส่งออกเป็น JSON สำหรับเก็บใน cache
+# กราฟอนุกรมเวลาจะถูกรวมเป็นช่วง (binning) และลดจำนวนจุด (downsampling) ที่ฝั่ง server
+# จึงส่งไปยัง browser ไม่เกิน MAX_POINTS จุดต่อเส้น ไม่ว่าจะมีรายการเบิกกี่รายการ
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+MAX_POINTS = 500
+
+CHART_STATUS_PIE = 'status_pie'
+CHART_TOP_EQUIPMENT = 'top_equipment'
+CHART_ACTIVITY = 'activity'
+
+# ขนาดช่วงเวลาที่เลือกใช้ได้ (เรียงจากละเอียดไปหยาบ) และความยาวโดยประมาณเป็นวินาที
+TIME_BINS = (
+    ('h', 'ชั่วโมง', 3600),
+    ('D', 'วัน', 86400),
+    ('W', 'สัปดาห์', 7 * 86400),
+    ('MS', 'เดือน', 31 * 86400),
+    ('QS', 'ไตรมาส', 92 * 86400),
+    ('YS', 'ปี', 366 * 86400),
+)
+
+
+# เลือกช่วงเวลาที่ละเอียดที่สุดที่ทำให้จำนวนช่วงไม่เกิน max_points
+def choose_time_bin(start, end, max_points=MAX_POINTS):
+    span = max((end - start).total_seconds(), 0)
+    for freq, label, seconds in TIME_BINS:
+        if span / seconds + 1 <= max_points:
+            return freq, label
+    freq, label, _ = TIME_BINS[-1]
+    return freq, label
+
+
+# ลดจำนวนจุดโดยแบ่งเป็นกลุ่มแล้วเก็บจุดต่ำสุดและสูงสุดของแต่ละกลุ่ม (ยอดแหลมของกราฟไม่หาย)
+def downsample_minmax(series, max_points=MAX_POINTS):
+    if len(series) <= max_points:
+        return series
+    n_buckets = max(max_points // 2, 1)
+    values = series.to_numpy()
+    edges = np.linspace(0, len(values), n_buckets + 1).astype(int)
+    keep = []
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        if hi <= lo:
+            continue
+        bucket = values[lo:hi]
+        keep.extend(sorted({lo + int(np.argmin(bucket)), lo + int(np.argmax(bucket))}))
+    return series.iloc[keep]
+
+
+# จำนวนรายการเบิกและจำนวนชิ้นที่เบิกต่อช่วงเวลา (รวมเป็นช่วงที่ server ก่อนส่งไปวาด)
+def bin_activity(df_transactions, max_points=MAX_POINTS):
+    dates = pd.to_datetime(df_transactions['date']).dropna()
+    if dates.empty:
+        return pd.DataFrame(columns=['date', 'transactions', 'quantity']), None
+
+    freq, label = choose_time_bin(dates.min(), dates.max(), max_points)
+    quantity = df_transactions.loc[dates.index, 'quantity'].to_numpy()
+    binned = pd.DataFrame(
+        {'transactions': 1, 'quantity': quantity}, index=pd.DatetimeIndex(dates)
+    ).resample(freq).sum()
+
+    if len(binned) > max_points:
+        binned = binned.loc[downsample_minmax(binned['transactions'], max_points).index]
+    return binned.rename_axis('date').reset_index(), label
+
+
+def status_pie_figure(status_counts):
+    return px.pie(
+        values=status_counts.values,
+        names=status_counts.index,
+        title="สัดส่วนสถานะการเบิก-คืน"
+    )
+
+
+def top_equipment_figure(equipment_counts):
+    fig = px.bar(
+        x=equipment_counts.values,
+        y=equipment_counts.index,
+        orientation='h',
+        title="เครื่องมือที่เบิกมากที่สุด (Top 10)",
+        labels={'x': 'จำนวนครั้ง', 'y': 'เครื่องมือ'}
+    )
+    fig.update_layout(yaxis={'categoryorder': 'total ascending'})
+    return fig
+
+
+def activity_figure(df_binned, bin_label):
+    fig = px.line(
+        df_binned,
+        x='date',
+        y=['transactions', 'quantity'],
+        title=f"แนวโน้มการเบิก (รายการต่อ{bin_label})",
+        labels={'date': 'วันที่', 'value': 'จำนวน', 'variable': ''}
+    )
+    fig.for_each_trace(lambda trace: trace.update(
+        name={'transactions': 'รายการเบิก', 'quantity': 'จำนวนชิ้น'}[trace.name]
+    ))
+    return fig
+
+
+# สร้างกราฟตามชนิดแล้วคืนเป็น JSON (None ถ้าไม่มีข้อมูลให้วาด)
+# status_filter ใช้กับกราฟแนวโน้มเท่านั้น (None = ทุกสถานะ)
+def build_figure_json(chart_type, report, df_transactions, status_filter=None, max_points=MAX_POINTS):
+    if chart_type == CHART_STATUS_PIE:
+        if report['status_counts'].empty:
+            return None
+        fig = status_pie_figure(report['status_counts'])
+    elif chart_type == CHART_TOP_EQUIPMENT:
+        if report['top_equipment'].empty:
+            return None
+        fig = top_equipment_figure(report['top_equipment'])
+    elif chart_type == CHART_ACTIVITY:
+        if status_filter is not None:
+            df_transactions = df_transactions[df_transactions['status'] == status_filter]
+        df_binned, bin_label = bin_activity(df_transactions, max_points)
+        if df_binned.empty:
+            return None
+        fig = activity_figure(df_binned, bin_label)
+    else:
+        raise ValueError(f"ไม่รู้จักชนิดกราฟ: {chart_type}")
+    return fig.to_json()
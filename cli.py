@@ -0,0 +1,430 @@
+# คำสั่ง command line สำหรับงานเป็นชุด (เช่น รันจาก cron) โดยไม่ต้องเปิดหน้าเว็บ
+# ไม่ import app.py (ซึ่งตั้งค่าหน้าเว็บและโหลด cv2/plotly) ใช้ database.py แทน
+# pandas ถูก import เฉพาะคำสั่ง export คำสั่งเขียนข้อมูลจึงเริ่มทำงานได้เร็ว
+#
+# ข้อมูลเข้าเป็น JSON ทีละบรรทัด (ค่าเริ่มต้น) หรือ CSV อ่านจากไฟล์หรือ stdin ทีละชุด
+# ผลลัพธ์เป็น JSON ทีละบรรทัดตามลำดับข้อมูลเข้า เขียนออกทันทีที่จบแต่ละชุด
+# โหมด shard ประมวลผลแต่ละ shard ขนานกัน (หนึ่ง worker ต่อ shard เพราะ SQLite เขียนได้ทีละ connection ต่อไฟล์)
+#
+#   python cli.py init
+#   python cli.py init --reset-db        (ลบฐานข้อมูลเดิมทุก shard แล้วสร้างใหม่)
+#   python cli.py add-equipment equipment.csv --format csv
+#   python cli.py withdraw withdrawals.jsonl > results.jsonl
+#   cat returns.jsonl | python cli.py return
+#   python cli.py export --format csv --output report.csv
+#   python cli.py reconcile --repair
+#   python cli.py vacuum
+import argparse
+import csv
+import json
+import logging
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from database import DB_PATH, init_database, insert_equipment, insert_withdrawal, remove_database
+from maintenance import ensure_incremental_auto_vacuum, incremental_vacuum, page_stats
+from reconcile import run_reconcile
+from dimensions import TRANSACTIONS_VIEW, DimensionLookup
+from return_queue import RETURN_DUPLICATE, RETURN_REJECTED, apply_return_batch, new_idempotency_key
+from sharding import ShardRouter
+
+BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 50000
+
+
+class InputError(ValueError):
+    pass
+
+
+# อ่านข้อมูลเข้าทีละแถว คืนค่า (เลขบรรทัด, dict หรือ None, ข้อผิดพลาด)
+def read_rows(stream, input_format):
+    if input_format == 'csv':
+        for line_no, row in enumerate(csv.DictReader(stream), start=1):
+            yield line_no, row, None
+        return
+    for line_no, raw in enumerate(stream, start=1):
+        raw = raw.strip()
+        if not raw:
+            continue
+        try:
+            yield line_no, json.loads(raw), None
+        except json.JSONDecodeError as e:
+            yield line_no, None, f"JSON ไม่ถูกต้อง: {e}"
+
+
+def batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def required(row, *fields):
+    missing = [field for field in fields if row.get(field) in (None, "")]
+    if missing:
+        raise InputError(f"ขาดข้อมูล: {', '.join(missing)}")
+    return [row[field] for field in fields]
+
+
+def parse_int(value, field, minimum=1):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise InputError(f"{field} ต้องเป็นตัวเลข")
+    if number < minimum:
+        raise InputError(f"{field} ต้องไม่น้อยกว่า {minimum}")
+    return number
+
+
+def open_input(path):
+    if path in (None, '-'):
+        return sys.stdin
+    return open(path, encoding='utf-8-sig', newline='')
+
+
+def write_result(out, result):
+    out.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+
+# แบ่งแต่ละชุดตาม shard แล้วให้ process(key, path, items) ของแต่ละ shard ทำงานขนานกัน
+# items เป็น [(เลขบรรทัด, แถว)] คืนค่า [(เลขบรรทัด, ผลลัพธ์)] ผลรวมทุก shard เขียนออกตามลำดับบรรทัด
+def run_batches(router, rows, shard_of, process, out, batch_size=BATCH_SIZE, workers=None):
+    summary = {'ok': 0, 'failed': 0}
+    with ThreadPoolExecutor(max_workers=workers or len(router.shards)) as pool:
+        for batch in batched(rows, batch_size):
+            results = []
+            by_shard = {}
+            for line_no, row, error in batch:
+                if error is None:
+                    try:
+                        key = shard_of(row)
+                        if key not in router.shards:
+                            raise InputError(f"ไม่พบ shard: {key}")
+                    except InputError as e:
+                        error = str(e)
+                if error is not None:
+                    results.append((line_no, {'line': line_no, 'ok': False, 'error': error}))
+                    continue
+                by_shard.setdefault(key, []).append((line_no, row))
+
+            futures = {key: pool.submit(process, key, router.shards[key], items) for key, items in by_shard.items()}
+            for key, future in futures.items():
+                try:
+                    results.extend(future.result())
+                except sqlite3.Error as e:
+                    # ฐานข้อมูลของ shard นี้ใช้ไม่ได้ (ถูกล็อกนาน/เสีย) ทั้งชุดของ shard นี้ล้มเหลว shard อื่นทำต่อ
+                    results.extend(
+                        (line_no, {'line': line_no, 'ok': False, 'error': f"ฐานข้อมูล {key}: {e}"})
+                        for line_no, _ in by_shard[key]
+                    )
+
+            for _, result in sorted(results, key=lambda item: item[0]):
+                summary['ok' if result['ok'] else 'failed'] += 1
+                write_result(out, result)
+            out.flush()
+    return summary
+
+
+# ทำงานทีละแถวภายในธุรกรรมเดียวต่อชุด แถวที่ผิดพลาดย้อนกลับเฉพาะแถวนั้น (SAVEPOINT)
+def apply_rows(conn, items, apply_row):
+    results = []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for line_no, row in items:
+            conn.execute("SAVEPOINT cli_row")
+            try:
+                result = apply_row(row, line_no)
+                conn.execute("RELEASE cli_row")
+                results.append((line_no, dict({'line': line_no, 'ok': True}, **result)))
+            except (InputError, ValueError, sqlite3.IntegrityError) as e:
+                conn.execute("ROLLBACK TO cli_row")
+                conn.execute("RELEASE cli_row")
+                results.append((line_no, {'line': line_no, 'ok': False, 'error': str(e)}))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.rollback()
+        raise
+    return results
+
+
+def connect(path):
+    return sqlite3.connect(path, timeout=30.0, isolation_level=None)
+
+
+def connect_readonly(path):
+    return sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True, timeout=30.0)
+
+
+def command_init(router, args, out):
+    for path in router.paths():
+        if args.reset_db:
+            remove_database(path)
+        init_database(path)
+    return {'ok': len(router.shards), 'failed': 0}
+
+
+# แถว: {"id", "name", "category", "quantity", "unit", "shard"?}
+def command_add_equipment(router, args, out):
+    def process(key, path, items):
+        def apply_row(row, line_no):
+            eq_id, name, category, unit = required(row, 'id', 'name', 'category', 'unit')
+            quantity = parse_int(row.get('quantity') or 0, 'quantity', minimum=0)
+            try:
+                insert_equipment(conn, eq_id, name, category, quantity, unit)
+            except sqlite3.IntegrityError:
+                raise InputError(f"รหัสเครื่องมือ {eq_id} มีอยู่แล้ว")
+            return {'id': eq_id}
+
+        conn = connect(path)
+        try:
+            return apply_rows(conn, items, apply_row)
+        finally:
+            conn.close()
+
+    return run_batches(
+        router, read_rows(open_input(args.input), args.format),
+        lambda row: row.get('shard') or args.shard or router.default_key,
+        process, out, args.batch_size, args.workers
+    )
+
+
+# แถว: {"equipment_id", "borrower_name", "borrower_dept", "quantity", "notes"?, "shard"?}
+# รหัสการเบิกใช้เวลาเริ่มคำสั่งต่อด้วยเลขบรรทัด จึงไม่ซ้ำกันภายในการรันเดียวกัน
+def command_withdraw(router, args, out):
+    started = datetime.now()
+    lookups = {key: DimensionLookup() for key in router.shards}
+
+    def process(key, path, items):
+        lookup = lookups[key]
+
+        def apply_row(row, line_no):
+            equipment_id, borrower_name, borrower_dept = required(row, 'equipment_id', 'borrower_name', 'borrower_dept')
+            quantity = parse_int(row.get('quantity'), 'quantity')
+            transaction_id = router.new_transaction_id(key, started, sequence=line_no)
+            insert_withdrawal(
+                conn, lookup, transaction_id, equipment_id, borrower_name, borrower_dept, quantity,
+                row.get('notes') or ""
+            )
+            return {'transaction_id': transaction_id}
+
+        conn = connect(path)
+        try:
+            # ชื่อใหม่ถูกเพิ่มใน SAVEPOINT ของแถว แถวที่ล้มเหลวจึงไม่ทิ้งชื่อค้างในตารางมิติ
+            return apply_rows(conn, items, apply_row)
+        finally:
+            conn.close()
+
+    return run_batches(
+        router, read_rows(open_input(args.input), args.format),
+        lambda row: row.get('shard') or args.shard or router.default_key,
+        process, out, args.batch_size, args.workers
+    )
+
+
+# แถว: {"transaction_id", "quantity", "notes"?, "key"?, "returned_at"?}
+# ควรส่ง key (idempotency key) มาด้วยเพื่อให้รันไฟล์เดิมซ้ำได้โดยไม่คืนซ้ำ ถ้าไม่ส่งจะสร้างใหม่ทุกครั้ง
+def command_return(router, args, out):
+    def process(key, path, items):
+        results = []
+        events = []
+        for line_no, row in items:
+            try:
+                transaction_id, = required(row, 'transaction_id')
+                events.append((line_no, {
+                    'key': row.get('key') or new_idempotency_key(),
+                    'transaction_id': transaction_id,
+                    'quantity': parse_int(row.get('quantity'), 'quantity'),
+                    'notes': row.get('notes') or "",
+                    'scanned_at': row.get('returned_at'),
+                }))
+            except InputError as e:
+                results.append((line_no, {'line': line_no, 'ok': False, 'error': str(e)}))
+
+        conn = connect(path)
+        try:
+            applied = apply_return_batch(conn, [event for _, event in events])
+        finally:
+            conn.close()
+        seen = set()
+        for line_no, event in events:
+            status, message = applied[event['key']]
+            # key เดียวกันซ้ำในชุดเดียวกัน แถวหลังถือเป็นการส่งซ้ำ
+            if event['key'] in seen:
+                status = RETURN_DUPLICATE
+            seen.add(event['key'])
+            results.append((line_no, {
+                'line': line_no, 'ok': status != RETURN_REJECTED, 'status': status,
+                'key': event['key'], 'transaction_id': event['transaction_id'], 'message': message,
+            }))
+        return results
+
+    return run_batches(
+        router, read_rows(open_input(args.input), args.format),
+        lambda row: router.shard_for_transaction(row.get('transaction_id', '')),
+        process, out, args.batch_size, args.workers
+    )
+
+
+# export รายงาน (คอลัมน์เดียวกับไฟล์ CSV ของหน้ารายงาน) อ่านจากฐานข้อมูลแบบอ่านอย่างเดียว
+# csv / jsonl อ่านและเขียนทีละ chunk (ใช้หน่วยความจำคงที่) เรียงล่าสุดก่อนภายในแต่ละ shard
+# xlsx ต้องมีข้อมูลครบก่อนสร้างไฟล์ จึงโหลดทุก shard แบบขนานแล้วรวมกันเหมือนหน้ารายงาน
+def command_export(router, args, out):
+    import pandas as pd
+
+    from reports import DISPLAY_COLUMNS, build_export_frame, build_report_bundle
+    from typed_frames import merge_shard_transactions, read_transactions_typed
+
+    output_path = args.output
+    if args.format == 'xlsx':
+        def load(key, path):
+            conn = connect_readonly(path)
+            try:
+                return read_transactions_typed(conn)
+            finally:
+                conn.close()
+
+        df_transactions = merge_shard_transactions(router.fan_out(load, max_workers=args.workers).values())
+        report = build_report_bundle(df_transactions)
+        if output_path in (None, '-'):
+            sys.stdout.buffer.write(report['excel'])
+        else:
+            with open(output_path, 'wb') as f:
+                f.write(report['excel'])
+        return {'ok': len(df_transactions), 'failed': 0}
+
+    stream = sys.stdout if output_path in (None, '-') else open(
+        output_path, 'w', encoding='utf-8-sig' if args.format == 'csv' else 'utf-8', newline=''
+    )
+    exported = 0
+    try:
+        for path in router.paths():
+            conn = connect_readonly(path)
+            try:
+                chunks = pd.read_sql_query(
+                    f"SELECT {', '.join(DISPLAY_COLUMNS)} FROM {TRANSACTIONS_VIEW} ORDER BY created_at DESC",
+                    conn, chunksize=args.chunk_size
+                )
+                for chunk in chunks:
+                    df_export = build_export_frame(chunk)
+                    if args.format == 'csv':
+                        df_export.to_csv(stream, index=False, header=exported == 0, lineterminator='\n')
+                    else:
+                        df_export.to_json(stream, orient='records', lines=True, force_ascii=False)
+                    exported += len(df_export)
+                    stream.flush()
+            finally:
+                conn.close()
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+    return {'ok': exported, 'failed': 0}
+
+
+# ตรวจความสอดคล้องของยอดทุก shard (เฉพาะแถวที่เปลี่ยนตั้งแต่รอบก่อน) เขียนปัญหาที่พบทีละบรรทัด
+# failed = จำนวนปัญหาที่ยังค้างอยู่ (exit code 1 ให้ cron แจ้งเตือนได้)
+def command_reconcile(router, args, out):
+    def process(key, path):
+        return run_reconcile(path, repair=args.repair, full=args.full)
+
+    open_count = 0
+    checked = 0
+    for key, result in router.fan_out(process, max_workers=args.workers).items():
+        for issue in result['found']:
+            out.write(json.dumps(dict(issue, shard=key), ensure_ascii=False) + "\n")
+        checked += result['equipment_checked'] + result['transactions_checked']
+        open_count += result['open_issues']
+    out.flush()
+    return {'ok': checked, 'failed': open_count}
+
+
+# เปลี่ยนฐานข้อมูลเดิมเป็น auto_vacuum=INCREMENTAL (VACUUM ทั้งไฟล์หนึ่งครั้ง) แล้วคืนหน้าว่างทั้งหมด
+# ล็อกฐานข้อมูลตลอดการทำงาน ควรรันนอกเวลาใช้งาน เขียนสรุปของแต่ละ shard ทีละบรรทัด
+def command_vacuum(router, args, out):
+    def process(key, path):
+        conn = connect(path)
+        try:
+            converted = ensure_incremental_auto_vacuum(conn, vacuum=True)
+            vacuumed_pages = incremental_vacuum(conn)
+            stats = page_stats(conn)
+        finally:
+            conn.close()
+        return {
+            'shard': key, 'converted': converted, 'vacuumed_pages': vacuumed_pages,
+            'auto_vacuum': stats['auto_vacuum'], 'file_bytes': stats['file_bytes'],
+        }
+
+    results = router.fan_out(process, max_workers=args.workers)
+    for result in results.values():
+        out.write(json.dumps(result, ensure_ascii=False) + "\n")
+    out.flush()
+    return {'ok': len(results), 'failed': 0}
+
+
+COMMANDS = {
+    'init': command_init,
+    'add-equipment': command_add_equipment,
+    'withdraw': command_withdraw,
+    'return': command_return,
+    'export': command_export,
+    'reconcile': command_reconcile,
+    'vacuum': command_vacuum,
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="ระบบเบิกเครื่องมือแพทย์ (command line)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    init = subparsers.add_parser('init', help="สร้าง/อัพเดทโครงสร้างฐานข้อมูลทุก shard")
+    init.add_argument('--reset-db', action='store_true',
+                      help="ลบฐานข้อมูลเดิม (รวมไฟล์ -wal/-shm) แล้วสร้างใหม่ ข้อมูลทั้งหมดหายไป")
+
+    for name, help_text in (
+        ('add-equipment', "เพิ่มเครื่องมือเป็นชุด"),
+        ('withdraw', "เบิกเครื่องมือเป็นชุด"),
+        ('return', "คืนเครื่องมือเป็นชุด (idempotent เมื่อส่ง key)"),
+    ):
+        sub = subparsers.add_parser(name, help=help_text)
+        sub.add_argument('input', nargs='?', default='-', help="ไฟล์ข้อมูลเข้า (- = stdin)")
+        sub.add_argument('--format', choices=('jsonl', 'csv'), default='jsonl')
+        sub.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        sub.add_argument('--workers', type=int, default=None, help="จำนวน worker (ค่าเริ่มต้น = จำนวน shard)")
+        if name != 'return':
+            sub.add_argument('--shard', default=None, help="shard ของแถวที่ไม่ได้ระบุ shard")
+
+    export = subparsers.add_parser('export', help="export รายงานรายการเบิก-คืน")
+    export.add_argument('--format', choices=('csv', 'jsonl', 'xlsx'), default='csv')
+    export.add_argument('--output', default='-', help="ไฟล์ผลลัพธ์ (- = stdout)")
+    export.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+    export.add_argument('--workers', type=int, default=None)
+
+    reconcile = subparsers.add_parser('reconcile', help="ตรวจความสอดคล้องของยอดคงเหลือ รายการเบิก และประวัติการคืน")
+    reconcile.add_argument('--repair', action='store_true', help="ซ่อมปัญหาที่ซ่อมอัตโนมัติได้")
+    reconcile.add_argument('--full', action='store_true', help="ตรวจทุกแถว (ไม่ใช้ checkpoint)")
+    reconcile.add_argument('--workers', type=int, default=None)
+
+    vacuum = subparsers.add_parser('vacuum', help="เปลี่ยนเป็น auto_vacuum=INCREMENTAL และคืนพื้นที่ว่าง (ล็อกฐานข้อมูล)")
+    vacuum.add_argument('--workers', type=int, default=None)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # ข้อความความคืบหน้า (เช่น จาก init_database) ออก stderr
+    logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stderr)
+    router = ShardRouter.from_env(DB_PATH)
+    # ผลลัพธ์ของคำสั่งเขียนข้อมูลออก stdout สรุปออก stderr (ไม่ปนกับข้อมูลที่ส่งต่อให้โปรแกรมอื่น)
+    summary = COMMANDS[args.command](router, args, sys.stdout)
+    print(json.dumps({'command': args.command, **summary}, ensure_ascii=False), file=sys.stderr)
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+# การเข้าถึงฐานข้อมูลที่ไม่ขึ้นกับ Streamlit ใช้ร่วมกันระหว่างหน้าเว็บ (app.py) และ command line (cli.py)
+# ฟังก์ชันเขียนข้อมูลรับ connection และไม่ commit เอง (ผู้เรียกเป็นคน commit) เหมือน apply_return
+import logging
+import os
+import sqlite3
+from datetime import datetime
+
+from dimensions import (
+    create_dimension_tables, create_transactions_table, create_transactions_view, migrate_transactions
+)
+from ledger import (
+    STOCK_ADJUST, STOCK_INITIAL, STOCK_WITHDRAW, backfill_stock_ledger, create_stock_ledger, record_stock_change
+)
+from maintenance import ensure_incremental_auto_vacuum
+from reconcile import create_reconcile_tables
+from return_queue import create_return_dedup
+
+# ข้อความความคืบหน้าออกทาง logging (ไม่ใช่ stdout ซึ่งคำสั่ง cli.py ใช้ส่งผลลัพธ์ให้โปรแกรมอื่น)
+logger = logging.getLogger(__name__)
+
+# ใช้ path ของฐานข้อมูลที่ชัดเจน
+DB_PATH = os.path.join('data', 'medical_equipment.db')
+
+
+# ฟังก์ชันสร้างฐานข้อมูล (สร้างตาราง/view/trigger/index ที่ยังไม่มี และย้ายข้อมูลแบบเดิม)
+def init_database(db_path=DB_PATH):
+    # changefeed ใช้ pandas จึง import เมื่อต้องสร้างฐานข้อมูลเท่านั้น (คำสั่ง CLI อื่นไม่ต้องโหลด pandas)
+    from changefeed import create_change_log
+    
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30.0)
+    cursor = conn.cursor()
+    
+    try:
+        # เปิด auto_vacuum แบบ INCREMENTAL ให้ฐานข้อมูลใหม่ เพื่อให้คืนพื้นที่หลังลบข้อมูลได้
+        # (ฐานข้อมูลเดิมต้อง VACUUM ทั้งไฟล์ ไม่ทำที่นี่เพราะถูกเรียกทุกครั้งที่เปิดหน้าเว็บ ใช้ python cli.py vacuum)
+        ensure_incremental_auto_vacuum(conn)
+        
+        # WAL: ผู้อ่าน (สำเนาอ่านอย่างเดียว, รายงาน, snapshot) ไม่กันการเขียน และการเขียนไม่กันผู้อ่าน
+        # ค่านี้เก็บในไฟล์ฐานข้อมูล connection อื่นใช้ WAL ตามโดยไม่ต้องตั้งเอง
+        conn.execute("PRAGMA journal_mode = WAL")
+        
+        # สร้างตาราง equipment
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS equipment (
+                id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                category TEXT NOT NULL,
+                quantity INTEGER NOT NULL,
+                unit TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # สร้างตารางมิติผู้เบิก/แผนก และตาราง transactions (เก็บรหัสผู้เบิก/แผนกแทนชื่อ)
+        create_dimension_tables(cursor)
+        create_transactions_table(cursor)
+        
+        # สร้างตาราง return_history
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS return_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                transaction_id TEXT NOT NULL,
+                returned_quantity INTEGER NOT NULL,
+                return_date TEXT NOT NULL,
+                notes TEXT
+            )
+        ''')
+        
+        # ย้ายข้อมูลจากตาราง transactions แบบเดิม (ถ้ามี) แล้วสร้าง view สำหรับอ่านข้อมูลแบบมีชื่อ
+        migrated = migrate_transactions(cursor)
+        if migrated:
+            logger.info("ย้ายรายการเบิก %d รายการไปใช้ตารางผู้เบิก/แผนกแล้ว", migrated)
+        create_transactions_view(cursor)
+        
+        # change log (append-only) บันทึกทุกการเปลี่ยนแปลงผ่าน trigger ใช้เป็นเวอร์ชันข้อมูลและ change feed
+        create_change_log(cursor)
+        
+        # idempotency key ของการคืน (กันการคืนซ้ำจากการกดซ้ำหรือซิงค์คิวซ้ำ)
+        create_return_dedup(cursor)
+        
+        # สมุดบัญชีสต็อก (append-only) และ snapshot สำหรับดูยอดคงเหลือย้อนหลัง
+        create_stock_ledger(cursor)
+        
+        # checkpoint และปัญหาที่พบจากการตรวจความสอดคล้องของยอด
+        create_reconcile_tables(cursor)
+        
+        # index สำหรับค้นหารายการที่เปลี่ยนตามวันที่ (ใช้กับ snapshot แบบ incremental)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions(date)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_last_return_date ON transactions(last_return_date)")
+        
+        # index สำหรับโหลดประวัติการคืนแบบรวมหลายรายการและไทม์ไลน์
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_return_history_transaction_id ON return_history(transaction_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_return_history_return_date ON return_history(return_date)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_equipment_id ON transactions(equipment_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_department_id ON transactions(department_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_borrower_id ON transactions(borrower_id)")
+        
+        # ใส่ข้อมูลเริ่มต้น (ถ้ายังไม่มี)
+        cursor.execute("SELECT COUNT(*) FROM equipment")
+        if cursor.fetchone()[0] == 0:
+            initial_equipment = [
+                ("EQ001", "เครื่องวัดความดัน", "การตรวจ", 10, "เครื่อง"),
+                ("EQ002", "หูฟังแพทย์", "การตรวจ", 5, "อัน"),
+                ("EQ003", "เทอร์โมมิเตอร์", "การตรวจ", 15, "อัน"),
+                ("EQ004", "ถุงมือยาง", "อุปกรณ์ความปลอดภัย", 100, "คู่"),
+                ("EQ005", "แอลกอฮอล์เจล", "อุปกรณ์ความปลอดภัย", 50, "ขวด")
+            ]
+            
+            cursor.executemany('''
+                INSERT INTO equipment (id, name, category, quantity, unit)
+                VALUES (?, ?, ?, ?, ?)
+            ''', initial_equipment)
+            logger.info("เพิ่มข้อมูลเครื่องมือเริ่มต้นสำเร็จ")
+        
+        # ฐานข้อมูลที่ยังไม่มีสมุดบัญชี สร้างย้อนหลังจากรายการเบิก-คืนที่มีอยู่
+        backfilled = backfill_stock_ledger(cursor)
+        if backfilled:
+            logger.info("สร้างสมุดบัญชีสต็อกย้อนหลัง %d รายการ", backfilled)
+        
+        conn.commit()
+        logger.info("เริ่มต้นฐานข้อมูลสำเร็จ (%s)", db_path)
+        
+    except Exception:
+        logger.exception("เกิดข้อผิดพลาดในการเริ่มต้นฐานข้อมูล (%s)", db_path)
+        conn.rollback()
+    finally:
+        conn.close()
+
+
+# ลบฐานข้อมูลทั้งไฟล์พร้อมไฟล์ -wal/-shm (ใช้กับ python cli.py init --reset-db เท่านั้น) คืนค่ารายชื่อไฟล์ที่ลบ
+# ต้องไม่มี process อื่นเปิดฐานข้อมูลอยู่ ไม่อย่างนั้น process นั้นยังเขียนลงไฟล์ -wal ที่ถูกลบไปแล้ว
+def remove_database(db_path):
+    removed = []
+    for path in (db_path, db_path + "-wal", db_path + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+            removed.append(path)
+    if removed:
+        logger.warning("ลบฐานข้อมูลเก่าแล้ว: %s", ", ".join(removed))
+    return removed
+
+
+# อ่านฐานข้อมูลทั้งไฟล์เป็น bytes สำหรับดาวน์โหลดสำรอง
+# ใช้ SQLite แทนการอ่านไฟล์ตรง ๆ เพราะในโหมด WAL ข้อมูลที่ commit แล้วบางส่วนยังอยู่ในไฟล์ -wal
+def dump_database(db_path):
+    conn = sqlite3.connect(db_path, timeout=30.0)
+    try:
+        return conn.serialize()
+    finally:
+        conn.close()
+
+
+# กู้คืนฐานข้อมูลจาก bytes ของไฟล์สำรอง ผ่าน backup API (ไม่เขียนทับไฟล์ตรง ๆ ซึ่งจะไม่ตรงกับไฟล์ -wal ที่ค้างอยู่)
+# backup_path: สำรองฐานข้อมูลปัจจุบันไว้ก่อน ไฟล์ที่ไม่ใช่ฐานข้อมูล SQLite จะเกิด sqlite3.DatabaseError
+def restore_database(db_path, data, backup_path=None):
+    tmp_path = f"{db_path}.restore-{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    try:
+        source = sqlite3.connect(tmp_path)
+        target = sqlite3.connect(db_path, timeout=30.0)
+        try:
+            if source.execute("PRAGMA quick_check").fetchone()[0] != "ok":
+                raise sqlite3.DatabaseError("ไฟล์สำรองเสียหาย")
+            if backup_path:
+                backup = sqlite3.connect(backup_path)
+                try:
+                    target.backup(backup)
+                    # ไฟล์สำรองเป็นไฟล์เดียวจบ (ไม่ใช้ WAL ต่อจากต้นฉบับ)
+                    backup.execute("PRAGMA journal_mode = DELETE")
+                finally:
+                    backup.close()
+            # ฐานข้อมูล WAL เปลี่ยนขนาดหน้าระหว่าง backup ไม่ได้ จึงแปลงไฟล์สำรองให้ขนาดหน้าตรงกันก่อน
+            page_size = target.execute("PRAGMA page_size").fetchone()[0]
+            source.execute("PRAGMA journal_mode = DELETE")
+            if source.execute("PRAGMA page_size").fetchone()[0] != page_size:
+                source.execute(f"PRAGMA page_size = {int(page_size)}")
+                source.execute("VACUUM")
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+    finally:
+        for path in (tmp_path, tmp_path + "-wal", tmp_path + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+# เพิ่มเครื่องมือใหม่ (รหัสซ้ำจะเกิด sqlite3.IntegrityError)
+def insert_equipment(conn, eq_id, name, category, quantity, unit):
+    conn.execute('''
+        INSERT INTO equipment (id, name, category, quantity, unit)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (eq_id, name, category, quantity, unit))
+    record_stock_change(conn, eq_id, quantity, STOCK_INITIAL)
+
+
+# แก้ไขจำนวนคงเหลือด้วยมือ บันทึกผลต่างลงสมุดบัญชี คืนค่าผลต่าง (ไม่พบเครื่องมือจะเกิด ValueError)
+def set_equipment_quantity(conn, eq_id, new_quantity):
+    row = conn.execute("SELECT quantity FROM equipment WHERE id = ?", (eq_id,)).fetchone()
+    if row is None:
+        raise ValueError(f"ไม่พบเครื่องมือ {eq_id}")
+    delta = new_quantity - row[0]
+    conn.execute('''
+        UPDATE equipment 
+        SET quantity = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', (new_quantity, eq_id))
+    if delta:
+        record_stock_change(conn, eq_id, delta, STOCK_ADJUST)
+    return delta
+
+
+# บันทึกการเบิกและลดจำนวนคงเหลือ (ไม่ระบุชื่อ/หน่วยจะอ่านจากตาราง equipment)
+# ถ้าไม่พบเครื่องมือหรือคงเหลือไม่พอจะเกิด ValueError ผู้เรียกต้อง rollback
+# ชื่อผู้เบิก/แผนกใหม่ที่ lookup (DimensionLookup) เพิ่มอยู่ในธุรกรรมเดียวกับรายการเบิก (rollback ไปด้วยกัน)
+# ถ้ายังไม่มีธุรกรรมจะเปิดใหม่ (BEGIN IMMEDIATE) ผู้เรียก commit หรือ rollback ทั้งหมดพร้อมกัน
+def insert_withdrawal(conn, lookup, transaction_id, equipment_id, borrower_name, borrower_dept, quantity,
+                      notes="", equipment_name=None, unit=None, date=None):
+    if not conn.in_transaction:
+        lookup.begin(conn)
+    borrower_id = lookup.borrower_id(conn, borrower_name)
+    department_id = lookup.department_id(conn, borrower_dept)
+    
+    if equipment_name is None or unit is None:
+        row = conn.execute("SELECT name, unit FROM equipment WHERE id = ?", (equipment_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"ไม่พบเครื่องมือ {equipment_id}")
+        equipment_name, unit = row
+    
+    cursor = conn.cursor()
+    # ลดจำนวนเครื่องมือ (เฉพาะเมื่อคงเหลือพอ กันการเบิกพร้อมกันจนติดลบ)
+    cursor.execute('''
+        UPDATE equipment 
+        SET quantity = quantity - ?, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND quantity >= ?
+    ''', (quantity, equipment_id, quantity))
+    if cursor.rowcount == 0:
+        raise ValueError(f"จำนวนคงเหลือของ {equipment_id} ไม่พอ")
+    
+    # เพิ่มรายการเบิก
+    date = date or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    cursor.execute('''
+        INSERT INTO transactions 
+        (id, equipment_id, equipment_name, borrower_id, department_id, 
+         quantity, returned_quantity, remaining_quantity, unit, date, status, notes, fully_returned)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (transaction_id, equipment_id, equipment_name, borrower_id, 
+          department_id, quantity, 0, quantity, unit, date,
+          "เบิกแล้ว", notes, False))
+    # เวลาในสมุดบัญชีเป็นเวลาที่ยอดในระบบเปลี่ยน ไม่ใช่วันที่เบิก (date อาจย้อนหลังได้)
+    record_stock_change(conn, equipment_id, -quantity, STOCK_WITHDRAW, transaction_id)
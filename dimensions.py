@@ -0,0 +1,175 @@
+# ตารางมิติของผู้เบิกและแผนก (borrowers / departments) ใช้รหัสตัวเลขแทนข้อความในตาราง transactions
+# ตาราง transactions เก็บเฉพาะ borrower_id / department_id ส่วนการอ่านทั้งหมดผ่าน view transaction_details
+# ซึ่งมีคอลัมน์เหมือนตาราง transactions แบบเดิมทุกคอลัมน์ (borrower_name, borrower_dept) ผลลัพธ์ของรายงานจึงไม่เปลี่ยน
+import threading
+
+TRANSACTIONS_VIEW = "transaction_details"
+
+DIMENSION_TABLES = ("borrowers", "departments")
+
+
+def create_dimension_tables(cursor):
+    for table in DIMENSION_TABLES:
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE
+            )
+        ''')
+
+
+def create_transactions_table(cursor, table_name="transactions"):
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            id TEXT PRIMARY KEY,
+            equipment_id TEXT NOT NULL,
+            equipment_name TEXT NOT NULL,
+            borrower_id INTEGER NOT NULL REFERENCES borrowers(id),
+            department_id INTEGER NOT NULL REFERENCES departments(id),
+            quantity INTEGER NOT NULL,
+            returned_quantity INTEGER DEFAULT 0,
+            remaining_quantity INTEGER NOT NULL,
+            unit TEXT NOT NULL,
+            date TEXT NOT NULL,
+            status TEXT NOT NULL,
+            notes TEXT,
+            fully_returned BOOLEAN DEFAULT FALSE,
+            last_return_date TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+# view ที่มีคอลัมน์และลำดับคอลัมน์เหมือนตาราง transactions แบบเดิม
+def create_transactions_view(cursor):
+    cursor.execute(f'''
+        CREATE VIEW IF NOT EXISTS {TRANSACTIONS_VIEW} AS
+        SELECT t.id, t.equipment_id, t.equipment_name,
+               b.name AS borrower_name, d.name AS borrower_dept,
+               t.quantity, t.returned_quantity, t.remaining_quantity, t.unit, t.date, t.status,
+               t.notes, t.fully_returned, t.last_return_date, t.created_at
+        FROM transactions t
+        JOIN borrowers b ON b.id = t.borrower_id
+        JOIN departments d ON d.id = t.department_id
+    ''')
+
+
+def has_legacy_transactions(cursor):
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(transactions)").fetchall()}
+    return "borrower_name" in columns
+
+
+# ย้ายตาราง transactions แบบเดิม (เก็บชื่อผู้เบิก/แผนกเป็นข้อความ) มาใช้ตารางมิติ
+# สร้างตารางใหม่แล้วสลับชื่อ (SQLite ลบคอลัมน์ที่มี index ไม่ได้) คืนค่าจำนวนแถวที่ย้าย
+# trigger และ index ของตารางเดิมถูกลบไปพร้อมตาราง ผู้เรียกต้องสร้างใหม่หลังจากนี้
+def migrate_transactions(cursor):
+    if not has_legacy_transactions(cursor):
+        return 0
+
+    create_dimension_tables(cursor)
+    cursor.execute('''
+        INSERT OR IGNORE INTO departments (name)
+        SELECT DISTINCT borrower_dept FROM transactions ORDER BY borrower_dept
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO borrowers (name)
+        SELECT DISTINCT borrower_name FROM transactions ORDER BY borrower_name
+    ''')
+
+    cursor.execute(f"DROP VIEW IF EXISTS {TRANSACTIONS_VIEW}")
+    cursor.execute("DROP TABLE IF EXISTS transactions_normalized")
+    create_transactions_table(cursor, "transactions_normalized")
+    cursor.execute('''
+        INSERT INTO transactions_normalized
+        (id, equipment_id, equipment_name, borrower_id, department_id, quantity, returned_quantity,
+         remaining_quantity, unit, date, status, notes, fully_returned, last_return_date, created_at)
+        SELECT t.id, t.equipment_id, t.equipment_name, b.id, d.id, t.quantity, t.returned_quantity,
+               t.remaining_quantity, t.unit, t.date, t.status, t.notes, t.fully_returned,
+               t.last_return_date, t.created_at
+        FROM transactions t
+        JOIN borrowers b ON b.name = t.borrower_name
+        JOIN departments d ON d.name = t.borrower_dept
+    ''')
+    migrated = cursor.rowcount
+    cursor.execute("DROP TABLE transactions")
+    cursor.execute("ALTER TABLE transactions_normalized RENAME TO transactions")
+    create_transactions_view(cursor)
+    return migrated
+
+
+# ชื่อทั้งหมดของตารางมิติเรียงตามชื่อ (เช่น ตัวเลือกแผนก) อ่านตารางมิติเล็ก ๆ แทนการอ่านตาราง transactions
+def dimension_names(conn, table):
+    return [row[0] for row in conn.execute(f"SELECT name FROM {table} ORDER BY name")]
+
+
+# cache ในหน่วยความจำของ ชื่อ -> รหัส (หนึ่งตัวต่อฐานข้อมูล) ชื่อที่ยังไม่มีจะถูกเพิ่มลงตารางมิติใน SAVEPOINT
+# ผู้เรียกควรเปิดธุรกรรมก่อน (เช่น insert_withdrawal) ชื่อใหม่จึงอยู่ในธุรกรรมเดียวกับรายการที่อ้างถึง
+# และ rollback ไปด้วยกัน (นอกธุรกรรม RELEASE ตัวนอกสุดคือ commit ชื่อใหม่ทันที)
+# ชื่อที่เพิ่มในธุรกรรมที่ยังไม่จบเก็บแยกต่อ connection และไม่เข้า cache เพราะรหัสอาจหายไปถ้า rollback
+# เมื่อธุรกรรมจบแล้ว ครั้งถัดไปที่ค้นชื่อนั้นจะอ่านจากตาราง (ถ้า commit แล้วจะพบและเก็บใน cache)
+class DimensionLookup:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = {table: None for table in DIMENSION_TABLES}
+        # id(conn) -> (conn, {(table, name)}) ชื่อที่เพิ่มในธุรกรรมที่ยังเปิดอยู่ของ connection นั้น
+        self._pending = {}
+
+    def reset(self):
+        with self._lock:
+            self._ids = {table: None for table in DIMENSION_TABLES}
+            self._pending = {}
+
+    # เปิดธุรกรรมใหม่ ชื่อค้างของ connection นี้มาจากธุรกรรมก่อนที่จบไปแล้ว จึงลืมได้
+    def begin(self, conn):
+        conn.execute("BEGIN IMMEDIATE")
+        with self._lock:
+            self._pending.pop(id(conn), None)
+
+    def borrower_id(self, conn, name):
+        return self._resolve(conn, "borrowers", name)
+
+    def department_id(self, conn, name):
+        return self._resolve(conn, "departments", name)
+
+    def _resolve(self, conn, table, name):
+        with self._lock:
+            ids = self._ids[table]
+            if ids is None:
+                ids = {row_name: row_id for row_id, row_name in conn.execute(f"SELECT id, name FROM {table}")}
+                self._ids[table] = ids
+            if name in ids:
+                return ids[name]
+            self._drop_finished()
+            pending = self._pending.get(id(conn), (conn, set()))[1]
+            row = conn.execute(f"SELECT id FROM {table} WHERE name = ?", (name,)).fetchone()
+            if row is not None:
+                # connection อื่นไม่เห็นแถวที่ยังไม่ commit ชื่อที่พบจึง commit แล้ว ยกเว้นชื่อที่ connection นี้เพิ่งเพิ่มเอง
+                if (table, name) not in pending:
+                    ids[name] = row[0]
+                return row[0]
+            in_transaction = conn.in_transaction
+            conn.execute("SAVEPOINT dimension_insert")
+            try:
+                conn.execute(f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", (name,))
+                row_id = conn.execute(f"SELECT id FROM {table} WHERE name = ?", (name,)).fetchone()[0]
+                conn.execute("RELEASE dimension_insert")
+            except Exception:
+                conn.execute("ROLLBACK TO dimension_insert")
+                conn.execute("RELEASE dimension_insert")
+                raise
+            if in_transaction:
+                pending.add((table, name))
+                self._pending[id(conn)] = (conn, pending)
+            else:
+                ids[name] = row_id
+            return row_id
+
+    # ลืมชื่อที่ค้างของ connection ที่ธุรกรรมจบแล้ว (commit หรือ rollback) หรือถูกปิดไปแล้ว
+    def _drop_finished(self):
+        for key, (conn, _) in list(self._pending.items()):
+            try:
+                finished = not conn.in_transaction
+            except Exception:
+                finished = True
+            if finished:
+                del self._pending[key]
@@ -0,0 +1,80 @@
+# ดัชนีเครื่องมือในหน่วยความจำ สำหรับค้นหาแบบพิมพ์แล้วแสดงผล (type-ahead)
+# สร้างครั้งเดียวต่อ data version แล้วใช้ร่วมกันทุก session
+from bisect import bisect_left
+
+
+def _normalize(text):
+    return str(text).strip().casefold()
+
+
+class EquipmentIndex:
+    def __init__(self, df_equipment):
+        # id -> ข้อมูลแถว (dict) สำหรับค้นหาแบบ O(1)
+        records = df_equipment.to_dict('records')
+        self._rows = {row['id']: row for row in records}
+
+        # รายการ key ที่เรียงแล้ว สำหรับค้นหาด้วย prefix ผ่าน bisect
+        self._id_keys = sorted((_normalize(row['id']), row['id']) for row in records)
+        self._name_keys = sorted((_normalize(row['name']), row['id']) for row in records)
+
+        # ลำดับตามรหัส สำหรับกรณีที่ยังไม่ได้พิมพ์คำค้น
+        self._ordered_ids = [eq_id for _, eq_id in self._id_keys]
+
+        # จำนวนรายการที่ยังมีคงเหลือ นับครั้งเดียวตอนสร้าง (ไม่สแกนทุกรายการทุก rerun)
+        self._in_stock_count = sum(1 for row in records if row['quantity'] > 0)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def get(self, eq_id):
+        return self._rows.get(eq_id)
+
+    def in_stock_count(self):
+        return self._in_stock_count
+
+    # ข้อความที่แสดงในตัวเลือก
+    def label(self, eq_id, show_stock=False):
+        row = self._rows.get(eq_id)
+        if row is None:
+            return str(eq_id)
+        if show_stock:
+            return f"{row['id']} - {row['name']} (คงเหลือ: {row['quantity']} {row['unit']})"
+        return f"{row['id']} - {row['name']}"
+
+    def _prefix_ids(self, keys, query):
+        start = bisect_left(keys, (query,))
+        for key, eq_id in keys[start:]:
+            if not key.startswith(query):
+                break
+            yield eq_id
+
+    # ค้นหาตามรหัสหรือชื่อ คืนค่าเฉพาะ limit รายการแรกที่ตรงที่สุด
+    # ลำดับความสำคัญ: รหัสขึ้นต้นด้วยคำค้น > ชื่อขึ้นต้นด้วยคำค้น > ชื่อมีคำค้นอยู่ข้างใน
+    def search(self, query, limit=20, in_stock_only=False):
+        query = _normalize(query or "")
+        results = []
+        seen = set()
+
+        def collect(eq_ids):
+            for eq_id in eq_ids:
+                if eq_id in seen:
+                    continue
+                row = self._rows[eq_id]
+                if in_stock_only and row['quantity'] <= 0:
+                    continue
+                seen.add(eq_id)
+                results.append(row)
+                if len(results) >= limit:
+                    return True
+            return False
+
+        if not query:
+            collect(self._ordered_ids)
+            return results
+
+        if collect(self._prefix_ids(self._id_keys, query)):
+            return results
+        if collect(self._prefix_ids(self._name_keys, query)):
+            return results
+        collect(eq_id for key, eq_id in self._name_keys if query in key)
+        return results
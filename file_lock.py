@@ -0,0 +1,58 @@
+# ล็อกระหว่าง process ด้วยไฟล์ล็อก (flock บน POSIX, msvcrt.locking บน Windows)
+# ใช้กับไฟล์ที่หลาย worker เขียนร่วมกัน (journal คิวการคืน) และงานที่ควรทำทีละ process (งานดูแลฐานข้อมูล)
+# ล็อกเป็นของ file descriptor ระบบปล่อยให้เองเมื่อ process ตาย จึงไม่มีไฟล์ล็อกค้างแบบ O_EXCL
+import contextlib
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+LOCK_POLL_INTERVAL = 0.05
+
+
+# ถือล็อกแบบ exclusive ของไฟล์ path ระหว่างอยู่ใน with คืนค่า True ถ้าได้ล็อก
+# blocking=False: ถ้ามี process อื่นถือล็อกอยู่ได้ค่า False ทันที (ไม่รอ)
+@contextlib.contextmanager
+def file_lock(path, blocking=True):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        locked = _lock(fd, blocking)
+        try:
+            yield locked
+        finally:
+            if locked:
+                _unlock(fd)
+    finally:
+        os.close(fd)
+
+
+def _lock(fd, blocking):
+    if fcntl is not None:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            return False
+        return True
+    while True:
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            if not blocking:
+                return False
+            time.sleep(LOCK_POLL_INTERVAL)
+
+
+def _unlock(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,98 @@
+# โหลดประวัติการคืนแบบรวมหลายรายการในคำสั่งเดียว และสร้างไทม์ไลน์เหตุการณ์เบิก-คืน
+# ใช้ json_each ส่งรายการรหัสทั้งหมดเป็นพารามิเตอร์เดียว จึงไม่ติดข้อจำกัดจำนวนพารามิเตอร์ของ SQLite
+import json
+
+import pandas as pd
+
+from dimensions import TRANSACTIONS_VIEW
+from typed_frames import DATE_FORMAT
+
+EVENT_BORROW = "เบิก"
+EVENT_RETURN = "คืน"
+
+
+def _date_range_bounds(start=None, end=None):
+    # end เป็นวันที่ (รวมทั้งวัน) จึงใช้ < วันถัดไป
+    lower = pd.Timestamp(start).strftime(DATE_FORMAT) if start is not None else None
+    upper = (pd.Timestamp(end) + pd.Timedelta(days=1)).strftime(DATE_FORMAT) if end is not None else None
+    return lower, upper
+
+
+# ประวัติการคืนของหลายรายการเบิก (และ/หรือช่วงวันที่) ในคำสั่งเดียว
+def read_return_history_batch(conn, transaction_ids=None, start=None, end=None):
+    conditions = []
+    params = []
+    if transaction_ids is not None:
+        conditions.append("transaction_id IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(list(transaction_ids)))
+    lower, upper = _date_range_bounds(start, end)
+    if lower is not None:
+        conditions.append("return_date >= ?")
+        params.append(lower)
+    if upper is not None:
+        conditions.append("return_date < ?")
+        params.append(upper)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return pd.read_sql_query(f'''
+        SELECT * FROM return_history
+        {where}
+        ORDER BY return_date DESC
+    ''', conn, params=params)
+
+
+# ไทม์ไลน์เหตุการณ์เบิกและคืนทั้งหมดของเครื่องมือหรือแผนก เรียงจากล่าสุด
+def read_timeline(conn, equipment_id=None, borrower_dept=None, start=None, end=None):
+    conditions = []
+    params = []
+    if equipment_id is not None:
+        conditions.append("t.equipment_id = ?")
+        params.append(equipment_id)
+    if borrower_dept is not None:
+        conditions.append("t.borrower_dept = ?")
+        params.append(borrower_dept)
+    transaction_filter = " AND ".join(conditions) or "1 = 1"
+
+    lower, upper = _date_range_bounds(start, end)
+    borrow_range = ""
+    return_range = ""
+    range_params = []
+    if lower is not None:
+        borrow_range += " AND t.date >= ?"
+        return_range += " AND r.return_date >= ?"
+        range_params.append(lower)
+    if upper is not None:
+        borrow_range += " AND t.date < ?"
+        return_range += " AND r.return_date < ?"
+        range_params.append(upper)
+
+    df = pd.read_sql_query(f'''
+        SELECT t.date AS event_date, '{EVENT_BORROW}' AS event, t.id AS transaction_id,
+               t.equipment_id, t.equipment_name, t.borrower_name, t.borrower_dept,
+               t.quantity, t.unit, t.notes
+        FROM {TRANSACTIONS_VIEW} t
+        WHERE {transaction_filter}{borrow_range}
+        UNION ALL
+        SELECT r.return_date AS event_date, '{EVENT_RETURN}' AS event, r.transaction_id,
+               t.equipment_id, t.equipment_name, t.borrower_name, t.borrower_dept,
+               r.returned_quantity AS quantity, t.unit, r.notes
+        FROM return_history r
+        JOIN {TRANSACTIONS_VIEW} t ON t.id = r.transaction_id
+        WHERE {transaction_filter}{return_range}
+        ORDER BY event_date DESC
+    ''', conn, params=params + range_params + params + range_params)
+    df['event_date'] = pd.to_datetime(df['event_date'], format=DATE_FORMAT, errors='coerce')
+    return df
+
+
+# สรุปยอดต่อรายการเบิกจากไทม์ไลน์ (จำนวนเบิก / คืน ภายในช่วงที่เลือก)
+def summarize_timeline(df_timeline):
+    if df_timeline.empty:
+        return pd.DataFrame(columns=["transaction_id", "borrower_name", "borrower_dept", "borrowed", "returned"])
+    borrowed = df_timeline['quantity'].where(df_timeline['event'] == EVENT_BORROW, 0)
+    returned = df_timeline['quantity'].where(df_timeline['event'] == EVENT_RETURN, 0)
+    summary = (df_timeline.assign(borrowed=borrowed, returned=returned)
+               .groupby(['transaction_id', 'borrower_name', 'borrower_dept'], sort=False)[['borrowed', 'returned']]
+               .sum()
+               .reset_index())
+    return summary
@@ -0,0 +1,178 @@
+# สมุดบัญชีสต็อก (stock ledger) แบบ append-only: ทุกครั้งที่ equipment.quantity เปลี่ยนจะบันทึกผลต่าง (delta)
+# พร้อมสาเหตุ (เบิก / คืน / ปรับยอด / เพิ่มเครื่องมือ) และรหัสอ้างอิง ตาราง equipment เก็บเฉพาะยอดปัจจุบัน
+#
+# จำนวนคงเหลือ ณ เวลาใดก็ได้ = ยอดใน snapshot ล่าสุดก่อนเวลานั้น + ผลรวม delta หลัง snapshot ถึงเวลานั้น
+# snapshot ถูกสร้างเป็นรอบ (งานดูแลฐานข้อมูล) การค้นย้อนหลังจึงอ่าน delta ไม่เกินหนึ่งรอบ snapshot
+# ลำดับ seq ของสมุดบัญชีเรียงตามเวลาที่บันทึก (เวลาในเครื่องแม่ข่าย) จึงใช้ seq เป็นขอบเขตของ snapshot ได้
+from datetime import datetime
+
+STOCK_BASELINE = 'baseline'
+STOCK_INITIAL = 'initial'
+STOCK_WITHDRAW = 'withdraw'
+STOCK_RETURN = 'return'
+STOCK_ADJUST = 'adjust'
+STOCK_RECONCILE = 'reconcile'
+
+STOCK_CAUSE_LABELS = {
+    STOCK_BASELINE: "ยอดตั้งต้น",
+    STOCK_INITIAL: "เพิ่มเครื่องมือ",
+    STOCK_WITHDRAW: "เบิก",
+    STOCK_RETURN: "คืน",
+    STOCK_ADJUST: "ปรับยอด",
+    STOCK_RECONCILE: "ปรับยอดจากการตรวจสอบ",
+}
+
+# สร้าง snapshot ใหม่เมื่อมี delta หลัง snapshot ล่าสุดอย่างน้อยเท่านี้
+SNAPSHOT_EVERY_ENTRIES = 50000
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def create_stock_ledger(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stock_ledger (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            equipment_id TEXT NOT NULL,
+            delta INTEGER NOT NULL,
+            cause TEXT NOT NULL,
+            reference TEXT,
+            at TEXT NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_stock_ledger_at ON stock_ledger(at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_stock_ledger_equipment_id ON stock_ledger(equipment_id)")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stock_snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            taken_at TEXT NOT NULL,
+            through_seq INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_stock_snapshots_taken_at ON stock_snapshots(taken_at)")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stock_snapshot_rows (
+            snapshot_id INTEGER NOT NULL,
+            equipment_id TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            PRIMARY KEY (snapshot_id, equipment_id)
+        ) WITHOUT ROWID
+    ''')
+
+
+# บันทึกการเปลี่ยนจำนวนหนึ่งรายการภายในธุรกรรมของ conn (ผู้เรียกเป็นคน commit)
+# at เป็นเวลาที่บันทึกเสมอ (ไม่รับเวลาจากผู้เรียก) แม้รายการเบิก/คืนจะระบุวันที่ย้อนหลัง
+# เพื่อให้ at เรียงตาม seq ซึ่ง snapshot และ stock_as_of ใช้เป็นขอบเขต
+def record_stock_change(conn, equipment_id, delta, cause, reference=None):
+    conn.execute('''
+        INSERT INTO stock_ledger (equipment_id, delta, cause, reference, at)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (equipment_id, delta, cause, reference, datetime.now().strftime(DATE_FORMAT)))
+
+
+# สร้างสมุดบัญชีย้อนหลังให้ฐานข้อมูลเดิมที่ยังไม่มี (คืนค่าจำนวนแถวที่สร้าง)
+# ใช้รายการเบิกและประวัติการคืนที่มีอยู่ ยอดตั้งต้นคำนวณย้อนจากยอดปัจจุบันให้ผลรวมตรงกับ equipment.quantity
+# (การแก้ไขจำนวนด้วยมือก่อนหน้านี้ไม่มีบันทึก จึงถูกรวมไว้ในยอดตั้งต้น)
+def backfill_stock_ledger(cursor, now=None):
+    if cursor.execute("SELECT EXISTS (SELECT 1 FROM stock_ledger)").fetchone()[0]:
+        return 0
+    if not cursor.execute("SELECT EXISTS (SELECT 1 FROM equipment)").fetchone()[0]:
+        return 0
+
+    now = now or datetime.now().strftime(DATE_FORMAT)
+    cursor.execute('''
+        INSERT INTO stock_ledger (equipment_id, delta, cause, reference, at)
+        SELECT equipment_id, delta, cause, reference, at FROM (
+            SELECT e.id AS equipment_id,
+                   e.quantity + COALESCE(w.total, 0) - COALESCE(r.total, 0) AS delta,
+                   ? AS cause, NULL AS reference,
+                   COALESCE((SELECT MIN(date) FROM transactions), ?) AS at, 0 AS step
+            FROM equipment e
+            LEFT JOIN (SELECT equipment_id, SUM(quantity) AS total FROM transactions GROUP BY equipment_id) w
+                ON w.equipment_id = e.id
+            LEFT JOIN (
+                SELECT t.equipment_id, SUM(h.returned_quantity) AS total
+                FROM return_history h JOIN transactions t ON t.id = h.transaction_id
+                GROUP BY t.equipment_id
+            ) r ON r.equipment_id = e.id
+            UNION ALL
+            SELECT equipment_id, -quantity, ?, id, date, 1 FROM transactions
+            UNION ALL
+            SELECT t.equipment_id, h.returned_quantity, ?, h.transaction_id, h.return_date, 2
+            FROM return_history h JOIN transactions t ON t.id = h.transaction_id
+        )
+        ORDER BY at, step
+    ''', (STOCK_BASELINE, now, STOCK_WITHDRAW, STOCK_RETURN))
+    return cursor.rowcount
+
+
+# สร้าง snapshot ยอดคงเหลือของทุกเครื่องมือ ณ ตอนนี้ (ยอดปัจจุบันในตาราง equipment)
+# เรียกนอกธุรกรรม ใช้ BEGIN IMMEDIATE เพื่อให้ยอดและ seq ตรงกัน คืนค่ารหัส snapshot
+def take_stock_snapshot(conn, now=None):
+    taken_at = now or datetime.now().strftime(DATE_FORMAT)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        through_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM stock_ledger").fetchone()[0]
+        cursor = conn.execute(
+            "INSERT INTO stock_snapshots (taken_at, through_seq) VALUES (?, ?)", (taken_at, through_seq)
+        )
+        snapshot_id = cursor.lastrowid
+        conn.execute('''
+            INSERT INTO stock_snapshot_rows (snapshot_id, equipment_id, quantity)
+            SELECT ?, id, quantity FROM equipment
+        ''', (snapshot_id,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return snapshot_id
+
+
+# สร้าง snapshot ถ้ามี delta หลัง snapshot ล่าสุดมากพอ คืนค่ารหัส snapshot หรือ None
+def snapshot_if_due(conn, every_entries=SNAPSHOT_EVERY_ENTRIES):
+    last = conn.execute("SELECT COALESCE(MAX(through_seq), 0) FROM stock_snapshots").fetchone()[0]
+    latest = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM stock_ledger").fetchone()[0]
+    if latest - last < every_entries:
+        return None
+    return take_stock_snapshot(conn)
+
+
+# ยอดคงเหลือของทุกเครื่องมือ ณ เวลา at คืนค่า {รหัสเครื่องมือ: จำนวน}
+# (เครื่องมือที่ยังไม่มีในเวลานั้นจะไม่อยู่ในผล) use_snapshots=False คือ replay ทั้งสมุดบัญชี
+def stock_as_of(conn, at, use_snapshots=True):
+    at = at.strftime(DATE_FORMAT) if isinstance(at, datetime) else at
+    snapshot_id, through_seq = None, 0
+    if use_snapshots:
+        row = conn.execute('''
+            SELECT id, through_seq FROM stock_snapshots
+            WHERE taken_at <= ? ORDER BY taken_at DESC, id DESC LIMIT 1
+        ''', (at,)).fetchone()
+        if row:
+            snapshot_id, through_seq = row
+
+    # seq สุดท้ายที่บันทึกไม่เกินเวลา at (ใช้ index ของ at)
+    row = conn.execute('''
+        SELECT seq FROM stock_ledger WHERE at <= ? ORDER BY at DESC, seq DESC LIMIT 1
+    ''', (at,)).fetchone()
+    upto_seq = row[0] if row else 0
+
+    quantities = {}
+    if snapshot_id is not None:
+        quantities = dict(conn.execute(
+            "SELECT equipment_id, quantity FROM stock_snapshot_rows WHERE snapshot_id = ?", (snapshot_id,)
+        ))
+    for equipment_id, delta in conn.execute('''
+        SELECT equipment_id, SUM(delta) FROM stock_ledger
+        WHERE seq > ? AND seq <= ?
+        GROUP BY equipment_id
+    ''', (through_seq, upto_seq)):
+        quantities[equipment_id] = quantities.get(equipment_id, 0) + delta
+    return quantities
+
+
+# รายการเปลี่ยนแปลงล่าสุดของเครื่องมือหนึ่งรายการ (ใหม่สุดก่อน)
+def stock_history(conn, equipment_id, limit=50):
+    cursor = conn.execute('''
+        SELECT seq, delta, cause, reference, at FROM stock_ledger
+        WHERE equipment_id = ? ORDER BY seq DESC LIMIT ?
+    ''', (equipment_id, limit))
+    return [dict(zip(("seq", "delta", "cause", "reference", "at"), row)) for row in cursor]
@@ -0,0 +1,224 @@
+# งานดูแลฐานข้อมูล SQLite: auto_vacuum แบบ INCREMENTAL, คืนพื้นที่ว่างเป็นรอบ, WAL checkpoint (init_database เปิด WAL),
+# ANALYZE / PRAGMA optimize, snapshot สต็อกตามรอบ และสถิติตาราง/หน้า (page) แบบไม่ต้องสแกนตาราง
+#
+# การลบข้อมูล (ลบรายการเบิกทั้งหมด, ลบ change log เก่า) ทำให้เกิดหน้าว่างใน freelist แต่ไฟล์ไม่เล็กลง
+# เมื่อเปิด auto_vacuum=INCREMENTAL แล้ว PRAGMA incremental_vacuum จะตัดหน้าว่างออกจากท้ายไฟล์ได้ทีละส่วน
+# โดยไม่ต้อง VACUUM ทั้งไฟล์ (ซึ่งล็อกฐานข้อมูลนานและต้องใช้พื้นที่ดิสก์เท่าไฟล์เดิม)
+import logging
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from datetime import datetime
+
+from file_lock import file_lock
+from ledger import snapshot_if_due
+
+logger = logging.getLogger(__name__)
+
+AUTO_VACUUM_MODES = {0: "NONE", 1: "FULL", 2: "INCREMENTAL"}
+AUTO_VACUUM_INCREMENTAL = 2
+
+# คืนพื้นที่เมื่อหน้าว่างเกินสัดส่วนนี้ของไฟล์ ครั้งละไม่เกิน VACUUM_PAGES_PER_RUN หน้า (ไม่ล็อกนาน)
+FRAGMENTATION_THRESHOLD = 0.1
+VACUUM_PAGES_PER_RUN = 10000
+MAINTENANCE_INTERVAL = 3600.0
+
+
+# เปิด auto_vacuum=INCREMENTAL (ต้องเรียกนอกธุรกรรม) ฐานข้อมูลใหม่ (ยังไม่มีตาราง) ตั้งค่าได้ทันที
+# ฐานข้อมูลเดิมต้อง VACUUM ทั้งไฟล์หนึ่งครั้ง (ล็อกฐานข้อมูลตลอดและใช้พื้นที่ดิสก์เท่าไฟล์เดิม)
+# จึงทำเฉพาะเมื่อ vacuum=True (คำสั่ง python cli.py vacuum) คืนค่า True ถ้ามีการ VACUUM
+def ensure_incremental_auto_vacuum(conn, vacuum=False):
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+        return False
+    has_tables = conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] > 0
+    if has_tables and not vacuum:
+        return False
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    if has_tables:
+        conn.execute("VACUUM")
+    return has_tables
+
+
+# สถิติระดับหน้าของไฟล์ฐานข้อมูล (อ่านจาก header ทั้งหมด ไม่สแกนข้อมูล)
+def page_stats(conn):
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return {
+        'page_size': page_size,
+        'page_count': page_count,
+        'freelist_count': freelist_count,
+        'file_bytes': page_size * page_count,
+        'free_bytes': page_size * freelist_count,
+        'fragmentation': freelist_count / page_count if page_count else 0.0,
+        'auto_vacuum': AUTO_VACUUM_MODES.get(conn.execute("PRAGMA auto_vacuum").fetchone()[0], "?"),
+        'journal_mode': conn.execute("PRAGMA journal_mode").fetchone()[0],
+    }
+
+
+# คืนหน้าว่างจากท้ายไฟล์ไม่เกิน max_pages หน้า (None = ทั้งหมด) คืนค่าจำนวนหน้าที่คืนได้
+# ใช้ได้เฉพาะเมื่อ auto_vacuum=INCREMENTAL ถ้าเป็นโหมดอื่นจะไม่ทำอะไร
+def incremental_vacuum(conn, max_pages=None):
+    before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if before == 0:
+        return 0
+    # pragma นี้คืนหน้าว่างทีละหน้าต่อการ step หนึ่งครั้ง และไม่มีคอลัมน์ผลลัพธ์ execute() จึง step แค่ครั้งเดียว
+    # executescript step จนจบคำสั่ง (และ commit ธุรกรรมที่ค้างอยู่ก่อน)
+    pages = "" if max_pages is None else f"({int(max_pages)})"
+    conn.executescript(f"PRAGMA incremental_vacuum{pages};")
+    return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+# เขียนหน้าใน WAL กลับเข้าไฟล์หลัก คืนค่า (busy, หน้าใน log, หน้าที่ checkpoint แล้ว)
+# ฐานข้อมูลที่ไม่ได้ใช้ WAL คืนค่า None
+def checkpoint(conn, mode="PASSIVE"):
+    if conn.execute("PRAGMA journal_mode").fetchone()[0].lower() != "wal":
+        return None
+    return tuple(conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone())
+
+
+# เก็บสถิติสำหรับ query planner (sqlite_stat1) ทั้งฐานข้อมูล
+def analyze(conn):
+    conn.execute("ANALYZE")
+    conn.commit()
+
+
+# ให้ SQLite ANALYZE เฉพาะตารางที่สถิติล้าสมัย (เบากว่า ANALYZE ทั้งหมด เหมาะกับการเรียกเป็นรอบ)
+def optimize(conn):
+    conn.execute("PRAGMA optimize")
+    conn.commit()
+
+
+def has_statistics(conn):
+    return conn.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+    ).fetchone()[0] > 0
+
+
+# จำนวนแถวโดยประมาณของทุกตารางจาก sqlite_stat1 (ค่า ณ ANALYZE / optimize ครั้งล่าสุด)
+# ตัวเลขแรกของคอลัมน์ stat คือจำนวนแถวของตาราง ตารางที่ยังไม่มีสถิติได้ค่า None
+def table_stats(conn):
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+    )]
+    rows = {table: None for table in tables}
+    if has_statistics(conn):
+        for table, stat in conn.execute("SELECT tbl, stat FROM sqlite_stat1"):
+            if table in rows and stat:
+                estimate = int(stat.split()[0])
+                rows[table] = max(rows[table] or 0, estimate)
+    return rows
+
+
+# งานดูแลหนึ่งรอบของฐานข้อมูลหนึ่งไฟล์ คืนค่าสรุปผล
+def run_maintenance(db_path, fragmentation_threshold=FRAGMENTATION_THRESHOLD, vacuum_pages=VACUUM_PAGES_PER_RUN):
+    # changefeed ใช้ pandas จึง import เมื่อใช้งาน (เหมือน init_database)
+    from changefeed import compact_change_log
+
+    conn = sqlite3.connect(db_path, timeout=30.0, isolation_level=None)
+    try:
+        started = time.perf_counter()
+        summary = {'checkpoint': checkpoint(conn), 'vacuumed_pages': 0}
+        stats = page_stats(conn)
+        if stats['fragmentation'] >= fragmentation_threshold:
+            summary['vacuumed_pages'] = incremental_vacuum(conn, vacuum_pages)
+        # ลบ change log ที่ทุกผู้อ่านประมวลผลแล้ว (ก่อนคืนพื้นที่ หน้าที่ว่างจากการลบจะถูกคืนในรอบถัดไป)
+        summary['change_log_removed'] = compact_change_log(conn)
+        # snapshot ยอดคงเหลือ (ถ้ามีการเปลี่ยนแปลงมากพอ) ให้การค้นยอดย้อนหลังไม่ต้อง replay ยาว
+        summary['stock_snapshot'] = snapshot_if_due(conn)
+        if has_statistics(conn):
+            optimize(conn)
+        else:
+            analyze(conn)
+        summary['page_stats'] = page_stats(conn)
+        summary['duration'] = time.perf_counter() - started
+        return summary
+    finally:
+        conn.close()
+
+
+# ตัวจัดตารางงานดูแลฐานข้อมูล ทำงานใน background thread เดียวต่อ process ทุก interval วินาที
+# task(db_path) คืนค่าสรุปผลของฐานข้อมูลหนึ่งไฟล์ (ค่าเริ่มต้นคืองานดูแลฐานข้อมูล ใช้กับงานตรวจยอดได้ด้วย)
+#
+# ทุก worker process มี service ของตัวเอง แต่งานของฐานข้อมูลหนึ่งไฟล์ทำทีละ process:
+# - ไฟล์ {db_path}.{name}.lease ถือล็อกระหว่างทำงาน process อื่นที่ล็อกไม่ได้ข้ามรอบนั้นไป
+# - ไฟล์ {db_path}.{name}.done แตะ mtime เมื่อทำเสร็จ ถ้า process ใดทำไปแล้วไม่ถึง interval วินาทีก็ข้าม
+#   (ยกเว้นรอบที่ขอด้วย run_now) งานจึงทำประมาณครั้งเดียวต่อ interval ไม่ว่าจะมีกี่ worker
+class MaintenanceService:
+    def __init__(self, db_paths, interval=MAINTENANCE_INTERVAL, task=run_maintenance, name="db-maintenance"):
+        self._db_paths = list(db_paths)
+        self._interval = interval
+        self._task = task
+        self._name = name
+        self._lock = threading.Lock()
+        self._forced = False
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_run = None
+        self.last_results = {}
+        self.last_error = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    # ขอให้ทำงานดูแลรอบใหม่ทันที (เช่น หลังลบข้อมูลจำนวนมาก)
+    def run_now(self):
+        with self._lock:
+            self._forced = True
+        self._wake.set()
+
+    # force=True: ทำแม้ process อื่นเพิ่งทำไป (แต่ไม่ทำซ้อนกับ process ที่กำลังทำอยู่)
+    def run_once(self, force=False):
+        results = {}
+        ran = False
+        for db_path in self._db_paths:
+            with file_lock(f"{db_path}.{self._name}.lease", blocking=False) as locked:
+                if not locked:
+                    logger.debug("%s: %s กำลังทำโดย process อื่น ข้าม", self._name, db_path)
+                    continue
+                done_path = f"{db_path}.{self._name}.done"
+                if not force and self._ran_recently(done_path):
+                    continue
+                ran = True
+                try:
+                    results[db_path] = self._task(db_path)
+                except sqlite3.Error:
+                    # ฐานข้อมูลไม่ว่าง/ถูกล็อก ข้ามไปรอบถัดไป ฐานข้อมูลอื่นยังทำต่อ
+                    self.last_error = traceback.format_exc()
+                    logger.error("%s error (%s):\n%s", self._name, db_path, self.last_error)
+                    continue
+                with open(done_path, 'a'):
+                    pass
+                os.utime(done_path)
+        if ran:
+            with self._lock:
+                self.last_results.update(results)
+                self.last_run = datetime.now()
+        return results
+
+    def _ran_recently(self, done_path):
+        try:
+            return time.time() - os.path.getmtime(done_path) < self._interval
+        except OSError:
+            return False
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            with self._lock:
+                force, self._forced = self._forced, False
+            self.run_once(force=force)
+            self._wake.wait(self._interval)
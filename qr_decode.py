@@ -0,0 +1,373 @@
+# อ่าน QR Code จากรูปใน worker process แยก (ไม่บล็อก script thread ของ Streamlit)
+#
+# pool มี worker process จำนวนจำกัด แต่ละตัวมี thread ผู้ดูแลหนึ่งตัวในฝั่งแอพ รับงานจากคิวที่มีขนาดจำกัด
+# งานที่เกินเวลา (QR_DECODE_TIMEOUT) หรือถูกยกเลิกระหว่างทำ จะถูกหยุดโดย kill worker ตัวนั้นแล้วเริ่มตัวใหม่
+# จึงไม่มีรูปใดกิน CPU ได้นานเกินกำหนด คิวเต็มจะตอบทันทีว่าไม่ว่าง (ผู้ใช้ป้อนข้อมูลด้วยมือแทน)
+#
+# หน่วยความจำต่องาน: ประเมินจากขนาดรูปใน header ก่อนถอดรหัสรูป (รูปใหญ่เกินถูกปฏิเสธทันที)
+# และจำกัด address space ของ worker (RLIMIT_AS) เป็นด่านสุดท้ายบนระบบที่รองรับ
+# รูป JPEG ขนาดใหญ่ถูกถอดรหัสแบบย่อขนาด (draft) และทุกรูปถูกย่อด้านยาวไม่เกิน MAX_DECODE_SIDE
+import hashlib
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+
+SCAN_PENDING = 'pending'
+SCAN_RUNNING = 'running'
+SCAN_DONE = 'done'
+SCAN_FAILED = 'failed'
+
+# สาเหตุที่อ่านไม่สำเร็จ (SCAN_FAILED)
+REASON_TIMEOUT = 'timeout'
+REASON_MEMORY = 'memory'
+REASON_BUSY = 'busy'
+REASON_CANCELLED = 'cancelled'
+REASON_ERROR = 'error'
+
+REASON_LABELS = {
+    REASON_TIMEOUT: "ใช้เวลาอ่านนานเกินไป",
+    REASON_MEMORY: "รูปมีขนาดใหญ่เกินไป",
+    REASON_BUSY: "ระบบอ่าน QR Code ไม่ว่าง",
+    REASON_CANCELLED: "ยกเลิกแล้ว",
+    REASON_ERROR: "ไฟล์รูปไม่ถูกต้อง",
+}
+
+QR_DECODE_WORKERS = 2
+# เวลาสูงสุดต่องาน (วินาที นับจากเริ่มอ่านใน worker ไม่รวมเวลารอคิว)
+QR_DECODE_TIMEOUT = 5.0
+# หน่วยความจำสูงสุดที่งานหนึ่งใช้ได้ (MB)
+QR_DECODE_MEMORY_MB = 512
+# จำนวนงานที่รอคิวได้ (เกินนี้ตอบว่าไม่ว่างทันที)
+QR_QUEUE_LIMIT = 16
+# ย่อรูปให้ด้านยาวไม่เกินเท่านี้ก่อนค้นหา QR Code (รูปจากกล้องมือถือ 12MP ค้นหาช้ามากโดยไม่ได้ผลดีขึ้น)
+MAX_DECODE_SIDE = 2000
+# ประมาณหน่วยความจำต่อพิกเซลระหว่างอ่าน (RGB + grayscale + ภาพที่ผ่านการปรับหลายชุด)
+BYTES_PER_PIXEL = 8
+# รูปย่อที่ส่งกลับไปแสดงในหน้าเว็บ (ด้านยาวไม่เกินเท่านี้ Streamlit แสดงได้เลยโดยไม่ต้องถอดรหัส/ย่อใหม่)
+PREVIEW_SIDE = 300
+# เก็บผลของรูปเดิม (hash ของไฟล์) ไว้กี่รูป รูปที่อัพโหลดซ้ำ/rerun ไม่ต้องอ่านใหม่
+RESULT_CACHE_SIZE = 256
+# ลบงานที่เสร็จแล้วออกจากตารางงานหลังผ่านไปกี่วินาที
+FINISHED_JOB_TTL = 600.0
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+# เปิดรูปจาก bytes และย่อขนาด ปฏิเสธรูปที่จะใช้หน่วยความจำเกิน memory_bytes
+def _open_image(image_bytes, memory_bytes):
+    from PIL import Image
+
+    image = Image.open(BytesIO(image_bytes))
+    if image.format == 'JPEG':
+        # ถอดรหัสที่ขนาด 1/2, 1/4, 1/8 ได้เลยโดยไม่ต้องถอดรหัสเต็มขนาดก่อน
+        image.draft('RGB', (MAX_DECODE_SIDE, MAX_DECODE_SIDE))
+    width, height = image.size
+    if width * height * BYTES_PER_PIXEL > memory_bytes:
+        raise ImageTooLarge(f"{width}x{height}")
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    if max(width, height) > MAX_DECODE_SIDE:
+        image.thumbnail((MAX_DECODE_SIDE, MAX_DECODE_SIDE))
+    return image
+
+
+# ค้นหาและอ่าน QR Code จาก PIL Image คืนค่าข้อความ หรือ None ถ้าไม่พบ
+def decode_qr_image(image):
+    import cv2
+    import numpy as np
+
+    # แปลง PIL Image เป็น numpy array
+    img_array = np.array(image)
+
+    # แปลงเป็น grayscale ถ้าเป็นรูปสี
+    if len(img_array.shape) == 3:
+        gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+    else:
+        gray = img_array
+
+    # ปรับปรุงคุณภาพภาพ
+    gray = cv2.convertScaleAbs(gray, alpha=1.5, beta=0)
+    gray = cv2.medianBlur(gray, 5)
+
+    # ใช้ cv2 อ่าน QR Code
+    detector = cv2.QRCodeDetector()
+    data, vertices_array, _ = detector.detectAndDecode(gray)
+    if vertices_array is not None and data:
+        return data
+
+    # ลองวิธีอื่นถ้าไม่ได้
+    _, thresh = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY)
+    data, vertices_array, _ = detector.detectAndDecode(thresh)
+    if vertices_array is not None and data:
+        return data
+
+    # ลองกลับสี
+    data, vertices_array, _ = detector.detectAndDecode(cv2.bitwise_not(thresh))
+    if vertices_array is not None and data:
+        return data
+    return None
+
+
+# รูปย่อสำหรับแสดงในหน้าเว็บ (JPEG bytes)
+def _make_preview(image):
+    preview = image.copy()
+    preview.thumbnail((PREVIEW_SIDE, PREVIEW_SIDE))
+    buffer = BytesIO()
+    preview.save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+
+# อ่านจากไฟล์รูป (bytes) ทั้งขั้นตอน (ใช้ใน worker และเมื่อต้องการอ่านแบบ synchronous)
+def decode_qr_bytes(image_bytes, memory_bytes=QR_DECODE_MEMORY_MB * 1024 ** 2):
+    return decode_qr_image(_open_image(image_bytes, memory_bytes))
+
+
+def _limit_memory(memory_bytes):
+    try:
+        import resource
+    except ImportError:
+        # Windows ไม่มี RLIMIT_AS ใช้การตรวจขนาดรูปอย่างเดียว
+        return
+    # นับจากขนาดที่ใช้อยู่หลัง import (cv2/numpy จอง address space ไว้มาก)
+    try:
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return
+    limit = current + memory_bytes
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+# worker process: รับ (รหัสงาน, bytes) ทาง pipe ตอบ (รหัสงาน, ผล, รูปย่อ, สาเหตุที่ล้มเหลว)
+def _worker_main(conn, memory_bytes):
+    import cv2
+    import numpy  # noqa: F401
+    from PIL.Image import DecompressionBombError
+
+    # worker หลายตัวทำงานพร้อมกันอยู่แล้ว ให้ OpenCV ใช้ thread เดียวต่อ worker (ไม่แย่ง CPU กันเอง)
+    cv2.setNumThreads(1)
+    _limit_memory(memory_bytes)
+    conn.send(('ready', None, None, None))
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        job_id, image_bytes = message
+        try:
+            image = _open_image(image_bytes, memory_bytes)
+            preview = _make_preview(image)
+            conn.send((job_id, decode_qr_image(image), preview, None))
+        except (ImageTooLarge, DecompressionBombError, MemoryError):
+            conn.send((job_id, None, None, REASON_MEMORY))
+        except Exception:
+            conn.send((job_id, None, None, REASON_ERROR))
+
+
+class ScanJob:
+    def __init__(self, job_id, digest):
+        self.id = job_id
+        self.digest = digest
+        self.state = SCAN_PENDING
+        self.data = None
+        self.preview = None
+        self.reason = None
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self.cancelled = False
+        self._done = threading.Event()
+
+    @property
+    def finished(self):
+        return self.state in (SCAN_DONE, SCAN_FAILED)
+
+    # เวลาตั้งแต่ส่งงานจนเสร็จ (หรือถึงตอนนี้ถ้ายังไม่เสร็จ)
+    def elapsed(self):
+        return (self.finished_at or time.monotonic()) - self.submitted_at
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def _finish(self, state, data=None, reason=None, preview=None):
+        self.state = state
+        self.data = data
+        self.preview = preview
+        self.reason = reason
+        self.finished_at = time.monotonic()
+        self._done.set()
+
+
+# worker process หนึ่งตัวและ thread ผู้ดูแล (ส่งงาน รอผล kill เมื่อเกินเวลา/ถูกยกเลิก)
+class _WorkerSlot:
+    def __init__(self, decoder, index):
+        self._decoder = decoder
+        self._index = index
+        self._process = None
+        self._conn = None
+        self.restarts = 0
+        self._thread = threading.Thread(target=self._run, name=f"qr-decode-{index}", daemon=True)
+        self._thread.start()
+
+    def _start_process(self):
+        parent_conn, child_conn = self._decoder._context.Pipe()
+        process = self._decoder._context.Process(
+            target=_worker_main, args=(child_conn, self._decoder.memory_bytes),
+            name=f"qr-decode-{self._index}", daemon=True
+        )
+        process.start()
+        child_conn.close()
+        # รอให้ worker import cv2 เสร็จ งานแรกจึงไม่ถูกนับเวลารวมกับการเริ่ม process
+        if parent_conn.poll(60.0):
+            parent_conn.recv()
+        self._process, self._conn = process, parent_conn
+
+    def _stop_process(self):
+        if self._process is not None:
+            self._process.kill()
+            self._process.join(5.0)
+            self._conn.close()
+        self._process, self._conn = None, None
+
+    def _run(self):
+        self._start_process()
+        while True:
+            job = self._decoder._queue.get()
+            if job is None:
+                self._stop_process()
+                return
+            if job.cancelled:
+                continue
+            if self._process is None or not self._process.is_alive():
+                self._start_process()
+            self._decoder._run_job(self, job)
+            # worker ถูกหยุด (เกินเวลา/ยกเลิก/ตาย) เริ่มตัวใหม่ทันทีให้พร้อมสำหรับงานถัดไป
+            if self._process is None:
+                self._start_process()
+
+    # ส่งงานให้ worker รอผลจนเสร็จ เกินเวลา หรือถูกยกเลิก คืนค่า (ผล, รูปย่อ, สาเหตุ)
+    def decode(self, job, image_bytes, timeout):
+        try:
+            self._conn.send((job.id, image_bytes))
+            deadline = job.started_at + timeout
+            while not job.cancelled:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if self._conn.poll(min(remaining, 0.05)):
+                    job_id, data, preview, reason = self._conn.recv()
+                    if job_id == job.id:
+                        return data, preview, reason
+        except (EOFError, OSError):
+            # worker ตาย (เช่น ใช้หน่วยความจำเกิน RLIMIT_AS)
+            self._stop_process()
+            self.restarts += 1
+            return None, None, REASON_MEMORY
+        # เกินเวลาหรือถูกยกเลิกระหว่างอ่าน: หยุด worker ตัวนี้แล้วเริ่มใหม่สำหรับงานถัดไป
+        self._stop_process()
+        self.restarts += 1
+        return None, None, REASON_CANCELLED if job.cancelled else REASON_TIMEOUT
+
+
+class QrDecoder:
+    def __init__(self, workers=QR_DECODE_WORKERS, timeout=QR_DECODE_TIMEOUT, memory_mb=QR_DECODE_MEMORY_MB,
+                 queue_limit=QR_QUEUE_LIMIT):
+        self.timeout = timeout
+        self.memory_bytes = memory_mb * 1024 ** 2
+        # spawn: process ลูกไม่ได้ copy thread / lock ของ Streamlit มาด้วย
+        self._context = multiprocessing.get_context('spawn')
+        self._queue = queue.Queue()
+        self._queue_limit = queue_limit
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._jobs = {}
+        self._payloads = {}
+        self._results = OrderedDict()
+        self.stats = {'submitted': 0, 'cached': 0, 'busy': 0, 'timeout': 0, 'cancelled': 0}
+        self._slots = [_WorkerSlot(self, i) for i in range(workers)]
+
+    # ส่งรูป (bytes) ให้อ่าน คืนค่า ScanJob (รูปที่เคยอ่านแล้วได้ผลทันที คิวเต็มได้ SCAN_FAILED/REASON_BUSY)
+    def submit(self, image_bytes):
+        digest = hashlib.sha1(image_bytes).hexdigest()
+        with self._lock:
+            self._prune()
+            job = ScanJob(next(self._ids), digest)
+            self._jobs[job.id] = job
+            self.stats['submitted'] += 1
+            if digest in self._results:
+                self._results.move_to_end(digest)
+                self.stats['cached'] += 1
+                data, preview = self._results[digest]
+                job._finish(SCAN_DONE, data, preview=preview)
+                return job
+            if sum(1 for j in self._jobs.values() if j.state == SCAN_PENDING) > self._queue_limit:
+                self.stats['busy'] += 1
+                job._finish(SCAN_FAILED, reason=REASON_BUSY)
+                return job
+            self._payloads[job.id] = image_bytes
+        self._queue.put(job)
+        return job
+
+    def job(self, job_id):
+        return self._jobs.get(job_id)
+
+    # ยกเลิกงาน (งานที่รอคิวถูกข้าม งานที่กำลังอ่านอยู่ worker ถูกหยุด)
+    def cancel(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return False
+        job.cancelled = True
+        with self._lock:
+            if job.state == SCAN_PENDING:
+                self._payloads.pop(job.id, None)
+                self.stats['cancelled'] += 1
+                job._finish(SCAN_FAILED, reason=REASON_CANCELLED)
+        return True
+
+    def pending_count(self):
+        return sum(1 for job in list(self._jobs.values()) if not job.finished)
+
+    def restarts(self):
+        return sum(slot.restarts for slot in self._slots)
+
+    def shutdown(self):
+        for _ in self._slots:
+            self._queue.put(None)
+        for slot in self._slots:
+            slot._thread.join(10.0)
+
+    def _run_job(self, slot, job):
+        with self._lock:
+            if job.cancelled or job.finished:
+                return
+            image_bytes = self._payloads.pop(job.id)
+            job.state = SCAN_RUNNING
+            job.started_at = time.monotonic()
+        data, preview, reason = slot.decode(job, image_bytes, self.timeout)
+        with self._lock:
+            if reason is None:
+                self._results[job.digest] = (data, preview)
+                if len(self._results) > RESULT_CACHE_SIZE:
+                    self._results.popitem(last=False)
+                job._finish(SCAN_DONE, data, preview=preview)
+            else:
+                if reason in (REASON_TIMEOUT, REASON_CANCELLED):
+                    self.stats[reason] += 1
+                job._finish(SCAN_FAILED, reason=reason)
+
+    def _prune(self):
+        expired = time.monotonic() - FINISHED_JOB_TTL
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and job.finished_at < expired]:
+            del self._jobs[job_id]
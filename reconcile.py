@@ -0,0 +1,361 @@
+# ตรวจความสอดคล้องของยอด (reconcile) แบบ incremental ด้วย SQL แบบ set-based
+#
+# ข้อกำหนดที่ตรวจ
+# - equipment.quantity = ผลรวม delta ในสมุดบัญชีสต็อกของเครื่องมือนั้น และต้องไม่ติดลบ
+# - transactions.returned_quantity = ผลรวม return_history.returned_quantity ของรายการนั้น
+# - transactions.remaining_quantity = quantity - ผลรวมการคืน และ fully_returned ตรงกับคงเหลือเป็น 0
+# - ผลรวมการคืนต้องไม่เกินจำนวนที่เบิก
+#
+# แต่ละรอบตรวจเฉพาะแถวที่เปลี่ยนหลัง checkpoint (seq ของ change_log และ seq ของสมุดบัญชี)
+# รวมกับแถวที่ยังมีปัญหาค้างอยู่ ผลเก็บในตาราง reconcile_issues (หายไปเองเมื่อยอดกลับมาตรงกัน)
+# ผลรวมสมุดบัญชีถึง checkpoint เก็บไว้ใน reconcile_stock_totals แต่ละรอบจึงรวมเฉพาะ delta ใหม่
+# (ไม่ใช้ snapshot ของสมุดบัญชี เพราะ snapshot คัดลอกจาก equipment.quantity ยอดที่ผิดอยู่แล้วจะถูกนับเป็นยอดถูก)
+# ตรวจทั้งหมดเมื่อยังไม่เคยตรวจ, log ช่วงนั้นถูกบีบอัดไปแล้ว หรือมีการลบประวัติการคืน
+# (แถวที่ถูกลบไม่เหลือรหัสรายการเบิกให้ตามไปตรวจ)
+import sqlite3
+import time
+from datetime import datetime
+
+from ledger import DATE_FORMAT, STOCK_RECONCILE, record_stock_change
+
+ISSUE_STOCK = 'stock_ledger'
+ISSUE_NEGATIVE_STOCK = 'negative_stock'
+ISSUE_RETURNED = 'returned_quantity'
+ISSUE_REMAINING = 'remaining_quantity'
+ISSUE_FULLY_RETURNED = 'fully_returned'
+ISSUE_OVER_RETURNED = 'over_returned'
+
+ISSUE_LABELS = {
+    ISSUE_STOCK: "คงเหลือไม่ตรงกับสมุดบัญชีสต็อก",
+    ISSUE_NEGATIVE_STOCK: "คงเหลือติดลบ",
+    ISSUE_RETURNED: "จำนวนที่คืนไม่ตรงกับประวัติการคืน",
+    ISSUE_REMAINING: "จำนวนค้างคืนไม่ตรงกับประวัติการคืน",
+    ISSUE_FULLY_RETURNED: "สถานะคืนครบไม่ตรงกับจำนวนค้างคืน",
+    ISSUE_OVER_RETURNED: "คืนเกินจำนวนที่เบิก",
+}
+
+EQUIPMENT_ISSUES = (ISSUE_STOCK, ISSUE_NEGATIVE_STOCK)
+TRANSACTION_ISSUES = (ISSUE_RETURNED, ISSUE_REMAINING, ISSUE_FULLY_RETURNED, ISSUE_OVER_RETURNED)
+# ปัญหาที่ซ่อมอัตโนมัติได้ (คงเหลือติดลบและคืนเกินต้องให้เจ้าหน้าที่ตรวจนับ/แก้ไขเอง)
+REPAIRABLE_ISSUES = (ISSUE_STOCK, ISSUE_RETURNED, ISSUE_REMAINING, ISSUE_FULLY_RETURNED)
+
+RECONCILE_INTERVAL = 300.0
+
+
+# สร้างตาราง checkpoint และตารางปัญหาที่พบ (เรียกจาก init_database)
+def create_reconcile_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reconcile_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            checked_through INTEGER NOT NULL,
+            ledger_through INTEGER NOT NULL,
+            checked_at TEXT NOT NULL,
+            full_checked_at TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reconcile_issues (
+            kind TEXT NOT NULL,
+            row_id TEXT NOT NULL,
+            expected INTEGER,
+            actual INTEGER,
+            first_seen TEXT NOT NULL,
+            last_seen TEXT NOT NULL,
+            PRIMARY KEY (kind, row_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reconcile_stock_totals (
+            equipment_id TEXT PRIMARY KEY,
+            total INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+
+def _has_table(conn, name):
+    return conn.execute(
+        "SELECT EXISTS (SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?)", (name,)
+    ).fetchone()[0]
+
+
+def _kinds_sql(kinds):
+    return ", ".join(f"'{kind}'" for kind in kinds)
+
+
+# ตารางชั่วคราวของ connection นี้: รหัสที่ต้องตรวจในรอบนี้ และปัญหาที่พบ
+def _prepare_scope(conn):
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS reconcile_equipment (id TEXT PRIMARY KEY) WITHOUT ROWID")
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS reconcile_transactions (id TEXT PRIMARY KEY) WITHOUT ROWID")
+    conn.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS reconcile_ledger_delta (equipment_id TEXT PRIMARY KEY, delta INTEGER NOT NULL)
+        WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS reconcile_found (
+            kind TEXT NOT NULL, row_id TEXT NOT NULL, expected INTEGER, actual INTEGER,
+            PRIMARY KEY (kind, row_id)
+        ) WITHOUT ROWID
+    ''')
+    for table in ("reconcile_equipment", "reconcile_transactions", "reconcile_ledger_delta", "reconcile_found"):
+        conn.execute(f"DELETE FROM temp.{table}")
+
+
+# รวม delta ของสมุดบัญชีช่วง (since, through] ต่อเครื่องมือเข้า temp.reconcile_ledger_delta
+def _add_ledger_range(conn, since, through):
+    conn.execute('''
+        INSERT INTO temp.reconcile_ledger_delta (equipment_id, delta)
+        SELECT equipment_id, SUM(delta) FROM stock_ledger WHERE seq > ? AND seq <= ? GROUP BY equipment_id
+        ON CONFLICT (equipment_id) DO UPDATE SET delta = delta + excluded.delta
+    ''', (since, through))
+
+
+# เลือกแถวที่ต้องตรวจ: เปลี่ยนหลัง checkpoint (since, through] หรือยังมีปัญหาค้างอยู่
+def _fill_scope(conn, full_equipment, full_transactions, since, through, check_stock):
+    if full_equipment:
+        conn.execute("INSERT INTO temp.reconcile_equipment SELECT id FROM equipment")
+    else:
+        conn.execute('''
+            INSERT OR IGNORE INTO temp.reconcile_equipment
+            SELECT row_id FROM change_log WHERE seq > ? AND seq <= ? AND table_name = 'equipment'
+        ''', (since, through))
+        if check_stock:
+            conn.execute('''
+                INSERT OR IGNORE INTO temp.reconcile_equipment SELECT equipment_id FROM temp.reconcile_ledger_delta
+            ''')
+        conn.execute(f'''
+            INSERT OR IGNORE INTO temp.reconcile_equipment
+            SELECT row_id FROM reconcile_issues WHERE kind IN ({_kinds_sql(EQUIPMENT_ISSUES)})
+        ''')
+
+    if full_transactions:
+        conn.execute("INSERT INTO temp.reconcile_transactions SELECT id FROM transactions")
+    else:
+        conn.execute('''
+            INSERT OR IGNORE INTO temp.reconcile_transactions
+            SELECT row_id FROM change_log WHERE seq > ? AND seq <= ? AND table_name = 'transactions'
+        ''', (since, through))
+        conn.execute('''
+            INSERT OR IGNORE INTO temp.reconcile_transactions
+            SELECT h.transaction_id FROM change_log c
+            JOIN return_history h ON h.id = CAST(c.row_id AS INTEGER)
+            WHERE c.seq > ? AND c.seq <= ? AND c.table_name = 'return_history'
+        ''', (since, through))
+        conn.execute(f'''
+            INSERT OR IGNORE INTO temp.reconcile_transactions
+            SELECT row_id FROM reconcile_issues WHERE kind IN ({_kinds_sql(TRANSACTION_ISSUES)})
+        ''')
+
+
+# ตรวจแถวในขอบเขตทั้งหมดในไม่กี่คำสั่ง SQL ผลอยู่ใน temp.reconcile_found
+# CROSS JOIN บังคับให้วนจากตารางขอบเขต (เล็ก) แล้วค้นด้วย primary key (ไม่ให้ planner สแกนตารางหลัก)
+# ยอดตามสมุดบัญชี = ผลรวมถึง checkpoint ก่อน (use_totals=False เมื่อตรวจทั้งหมด) + delta ในรอบนี้
+def _check(conn, check_stock, use_totals):
+    conn.execute("DELETE FROM temp.reconcile_found")
+    if check_stock:
+        conn.execute(f'''
+            INSERT INTO temp.reconcile_found (kind, row_id, expected, actual)
+            SELECT '{ISSUE_STOCK}', id, expected, quantity FROM (
+                SELECT e.id, e.quantity,
+                       COALESCE((SELECT t.total FROM reconcile_stock_totals t WHERE t.equipment_id = e.id AND ?), 0)
+                       + COALESCE((SELECT d.delta FROM temp.reconcile_ledger_delta d WHERE d.equipment_id = e.id), 0)
+                       AS expected
+                FROM temp.reconcile_equipment s CROSS JOIN equipment e ON e.id = s.id
+            )
+            WHERE quantity != expected
+        ''', (use_totals,))
+    conn.execute(f'''
+        INSERT INTO temp.reconcile_found (kind, row_id, expected, actual)
+        SELECT '{ISSUE_NEGATIVE_STOCK}', e.id, 0, e.quantity
+        FROM temp.reconcile_equipment s CROSS JOIN equipment e ON e.id = s.id
+        WHERE e.quantity < 0
+    ''')
+    conn.execute(f'''
+        WITH checked AS (
+            SELECT t.id, t.quantity, COALESCE(t.returned_quantity, 0) AS returned,
+                   t.remaining_quantity AS remaining, COALESCE(t.fully_returned, 0) != 0 AS fully_returned,
+                   (SELECT COALESCE(SUM(h.returned_quantity), 0) FROM return_history h
+                    WHERE h.transaction_id = t.id) AS history_total
+            FROM temp.reconcile_transactions s CROSS JOIN transactions t ON t.id = s.id
+        )
+        INSERT INTO temp.reconcile_found (kind, row_id, expected, actual)
+        SELECT '{ISSUE_OVER_RETURNED}', id, quantity, history_total FROM checked
+        WHERE history_total > quantity
+        UNION ALL
+        SELECT '{ISSUE_RETURNED}', id, history_total, returned FROM checked
+        WHERE history_total <= quantity AND returned != history_total
+        UNION ALL
+        SELECT '{ISSUE_REMAINING}', id, quantity - history_total, remaining FROM checked
+        WHERE history_total <= quantity AND remaining != quantity - history_total
+        UNION ALL
+        SELECT '{ISSUE_FULLY_RETURNED}', id, history_total = quantity, fully_returned FROM checked
+        WHERE history_total <= quantity AND fully_returned != (history_total = quantity)
+    ''')
+
+
+# ซ่อมแถวที่พบปัญหา (ต้องอยู่ในธุรกรรมเขียน) คืนค่าจำนวนแถวที่ซ่อม
+# - รายการเบิก: ประวัติการคืน (append-only) เป็นหลัก คำนวณจำนวนคืน/ค้างคืน/สถานะใหม่จากประวัติ
+# - ยอดคงเหลือ: ยอดในตาราง equipment คือยอดที่ผู้ใช้เห็นและเบิกจริง จึงบันทึกรายการปรับยอดในสมุดบัญชี
+#   ให้ผลรวมตรงกับยอดนั้น (ไม่แก้ประวัติเดิม) ยอดที่ต่างถูกบันทึกไว้ตรวจสอบย้อนหลังได้
+def _repair(conn):
+    cursor = conn.execute(f'''
+        UPDATE transactions
+        SET returned_quantity = h.total,
+            remaining_quantity = quantity - h.total,
+            fully_returned = (h.total = quantity),
+            status = CASE WHEN h.total = 0 THEN 'เบิกแล้ว' WHEN h.total = quantity THEN 'คืนครบแล้ว' ELSE 'คืนบางส่วน' END
+        FROM (
+            SELECT f.row_id AS transaction_id,
+                   (SELECT COALESCE(SUM(r.returned_quantity), 0) FROM return_history r
+                    WHERE r.transaction_id = f.row_id) AS total
+            FROM temp.reconcile_found f
+            WHERE f.kind IN ({_kinds_sql((ISSUE_RETURNED, ISSUE_REMAINING, ISSUE_FULLY_RETURNED))})
+            GROUP BY f.row_id
+        ) h
+        WHERE transactions.id = h.transaction_id AND h.total <= transactions.quantity
+    ''')
+    repaired = cursor.rowcount
+
+    drift = conn.execute(f'''
+        SELECT row_id, actual - expected FROM temp.reconcile_found WHERE kind = '{ISSUE_STOCK}'
+    ''').fetchall()
+    for equipment_id, delta in drift:
+        record_stock_change(conn, equipment_id, delta, STOCK_RECONCILE)
+    return repaired + len(drift)
+
+
+# เลื่อนผลรวมสมุดบัญชีที่เก็บไว้ไปถึง checkpoint ใหม่
+def _save_stock_totals(conn, full):
+    if full:
+        conn.execute("DELETE FROM reconcile_stock_totals")
+    conn.execute('''
+        INSERT INTO reconcile_stock_totals (equipment_id, total)
+        SELECT equipment_id, delta FROM temp.reconcile_ledger_delta WHERE true
+        ON CONFLICT (equipment_id) DO UPDATE SET total = total + excluded.total
+    ''')
+
+
+# บันทึกผลของขอบเขตที่ตรวจลง reconcile_issues (ปัญหาที่หายแล้วถูกลบ ปัญหาเดิมคงเวลาที่พบครั้งแรก)
+def _record_issues(conn, now):
+    for kinds, scope in ((EQUIPMENT_ISSUES, "reconcile_equipment"), (TRANSACTION_ISSUES, "reconcile_transactions")):
+        conn.execute(f'''
+            DELETE FROM reconcile_issues
+            WHERE kind IN ({_kinds_sql(kinds)})
+              AND row_id IN (SELECT id FROM temp.{scope})
+              AND NOT EXISTS (
+                  SELECT 1 FROM temp.reconcile_found f
+                  WHERE f.kind = reconcile_issues.kind AND f.row_id = reconcile_issues.row_id
+              )
+        ''')
+    conn.execute('''
+        INSERT INTO reconcile_issues (kind, row_id, expected, actual, first_seen, last_seen)
+        SELECT kind, row_id, expected, actual, ?, ? FROM temp.reconcile_found WHERE true
+        ON CONFLICT (kind, row_id) DO UPDATE
+        SET expected = excluded.expected, actual = excluded.actual, last_seen = excluded.last_seen
+    ''', (now, now))
+
+
+# ตรวจหนึ่งรอบ (เรียกนอกธุรกรรม) repair=True ซ่อมปัญหาที่ซ่อมได้ full=True ตรวจทุกแถว
+# คืนค่าสรุปผล: ขอบเขตที่ตรวจ, ปัญหาที่พบในรอบนี้, จำนวนที่ซ่อม และจำนวนปัญหาที่ยังค้างทั้งหมด
+def reconcile(conn, repair=False, full=False):
+    # changefeed ใช้ pandas จึง import เมื่อใช้งาน (เหมือน init_database)
+    from changefeed import compacted_through, current_version, save_checkpoint
+
+    started = time.perf_counter()
+    now = datetime.now().strftime(DATE_FORMAT)
+    check_stock = _has_table(conn, 'stock_ledger')
+
+    # อ่านทั้งหมดใน snapshot เดียว การเขียนหลังจากนี้มี seq มากกว่า checkpoint จึงถูกตรวจในรอบถัดไป
+    conn.execute("BEGIN")
+    try:
+        through = current_version(conn)
+        ledger_through = conn.execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM stock_ledger"
+        ).fetchone()[0] if check_stock else 0
+        state = conn.execute(
+            "SELECT checked_through, ledger_through FROM reconcile_state WHERE id = 1"
+        ).fetchone()
+        since, ledger_since = state if state else (None, None)
+        full_equipment = (
+            full or state is None or since < compacted_through(conn) or since > through
+            or ledger_since > ledger_through
+        )
+        full_transactions = full_equipment or conn.execute('''
+            SELECT EXISTS (
+                SELECT 1 FROM change_log WHERE seq > ? AND seq <= ? AND table_name = 'return_history' AND op = 'D'
+            )
+        ''', (since, through)).fetchone()[0]
+
+        _prepare_scope(conn)
+        if check_stock:
+            _add_ledger_range(conn, 0 if full_equipment else ledger_since, ledger_through)
+        _fill_scope(conn, full_equipment, full_transactions, since, through, check_stock)
+        _check(conn, check_stock, not full_equipment)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    found = [
+        dict(zip(("kind", "row_id", "expected", "actual"), row))
+        for row in conn.execute("SELECT kind, row_id, expected, actual FROM temp.reconcile_found ORDER BY kind, row_id")
+    ]
+    repaired = 0
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if repair and any(issue['kind'] in REPAIRABLE_ISSUES for issue in found):
+            repaired = _repair(conn)
+            # รวมรายการปรับยอดที่เพิ่งบันทึก แล้วตรวจขอบเขตเดิมอีกครั้ง ปัญหาที่เหลือคือปัญหาที่ซ่อมอัตโนมัติไม่ได้
+            if check_stock:
+                repaired_through = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM stock_ledger").fetchone()[0]
+                _add_ledger_range(conn, ledger_through, repaired_through)
+                ledger_through = repaired_through
+            _check(conn, check_stock, not full_equipment)
+        if check_stock:
+            _save_stock_totals(conn, full_equipment)
+        _record_issues(conn, now)
+        conn.execute('''
+            INSERT INTO reconcile_state (id, checked_through, ledger_through, checked_at, full_checked_at)
+            VALUES (1, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE
+            SET checked_through = excluded.checked_through, ledger_through = excluded.ledger_through,
+                checked_at = excluded.checked_at,
+                full_checked_at = COALESCE(excluded.full_checked_at, full_checked_at)
+        ''', (through, ledger_through, now, now if full_equipment else None))
+        save_checkpoint(conn, 'reconcile', through)
+        open_count = conn.execute("SELECT COUNT(*) FROM reconcile_issues").fetchone()[0]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return {
+        'full': bool(full_equipment),
+        'full_transactions': bool(full_transactions),
+        'checked_through': through,
+        'equipment_checked': conn.execute("SELECT COUNT(*) FROM temp.reconcile_equipment").fetchone()[0],
+        'transactions_checked': conn.execute("SELECT COUNT(*) FROM temp.reconcile_transactions").fetchone()[0],
+        'found': found,
+        'repaired': repaired,
+        'open_issues': open_count,
+        'checked_at': now,
+        'duration': time.perf_counter() - started,
+    }
+
+
+# ปัญหาที่ยังค้างอยู่ทั้งหมด (ใหม่สุดก่อน)
+def open_issues(conn, limit=1000):
+    cursor = conn.execute('''
+        SELECT kind, row_id, expected, actual, first_seen, last_seen FROM reconcile_issues
+        ORDER BY last_seen DESC, kind, row_id LIMIT ?
+    ''', (limit,))
+    return [dict(zip(("kind", "row_id", "expected", "actual", "first_seen", "last_seen"), row)) for row in cursor]
+
+
+# ตรวจหนึ่งรอบของฐานข้อมูลหนึ่งไฟล์ (ใช้กับ MaintenanceService และ command line)
+def run_reconcile(db_path, repair=False, full=False):
+    conn = sqlite3.connect(db_path, timeout=30.0, isolation_level=None)
+    try:
+        return reconcile(conn, repair=repair, full=full)
+    finally:
+        conn.close()
@@ -0,0 +1,166 @@
+# สำเนาฐานข้อมูลแบบอ่านอย่างเดียว (read replica) สำหรับงานรายงานที่ใช้เวลานาน
+# รายงาน / export อ่านจากสำเนาแทนไฟล์หลัก จึงไม่ถือ read lock ค้างไว้ระหว่างที่มีการเบิก-คืน
+#
+# สำเนาถูกสร้างด้วย SQLite backup API ไฟล์หลักใช้ WAL (init_database) การคัดลอกจึงอ่านจาก snapshot
+# โดยไม่กันการเขียนของ process อื่น เมื่อสำเนาอายุเกิน max_age วินาที (กำหนดได้ด้วย MEDICAL_EQUIPMENT_REPLICA_MAX_AGE)
+# จะเทียบเวอร์ชัน (cache_version = รหัสฐานข้อมูล + seq ของ change_log) กับไฟล์หลัก และเปลี่ยนสำเนาเฉพาะเมื่อข้อมูลเปลี่ยน
+#
+# สำเนาใช้ร่วมกันทุก worker process: หนึ่งไฟล์ต่อเวอร์ชันข้อมูล ({stem}--{digest ของ cache_version}.db)
+# process แรกที่ต้องการเวอร์ชันใหม่เป็นคนคัดลอก (ถือ file_lock ของฐานข้อมูลนั้น) ลงไฟล์ชั่วคราวแล้ว os.replace
+# process อื่นที่รอล็อกอยู่ใช้ไฟล์นั้นต่อ ไฟล์หลักจึงถูกคัดลอกครั้งเดียวต่อเวอร์ชัน ไม่ใช่ครั้งเดียวต่อ process
+# connection ที่เปิดสำเนาเก่าอยู่อ่านต่อได้จนจบ สำเนาเวอร์ชันเก่าที่ไม่มี process ใดแตะ (ทุกครั้งที่ตรวจเวอร์ชัน)
+# นานเกิน STALE_REPLICA_SECONDS จะถูกลบ
+import glob
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from changefeed import cache_version, current_version, database_origin
+from file_lock import file_lock
+
+REPLICA_MAX_AGE_ENV = 'MEDICAL_EQUIPMENT_REPLICA_MAX_AGE'
+REPLICA_DIR = os.path.join('data', 'replicas')
+DEFAULT_MAX_AGE = 30.0
+# สำเนาเวอร์ชันเก่าที่ไม่มี process ใดใช้นานกว่านี้ (วินาที) ถูกลบ (อย่างน้อย 2 เท่าของ max_age)
+STALE_REPLICA_SECONDS = 600.0
+
+
+def max_age_from_env(default=DEFAULT_MAX_AGE):
+    value = os.environ.get(REPLICA_MAX_AGE_ENV, '').strip()
+    return float(value) if value else default
+
+
+class ReadReplica:
+    def __init__(self, db_path, replica_dir=REPLICA_DIR, max_age=DEFAULT_MAX_AGE):
+        self.db_path = db_path
+        self.replica_dir = replica_dir
+        self.max_age = max_age
+        self._stem = os.path.splitext(os.path.basename(db_path))[0]
+        self._lock = threading.Lock()
+        self.path = None
+        self.version = None
+        self.origin = None
+        self.refreshed_at = None
+
+    def age(self):
+        if self.refreshed_at is None:
+            return None
+        return time.time() - self.refreshed_at
+
+    def is_stale(self):
+        return self.refreshed_at is None or self.age() > self.max_age
+
+    # คัดลอกไฟล์หลักเป็นสำเนาใหม่ทันที (แม้เวอร์ชันเดิม เช่น หลังกู้คืนฐานข้อมูล)
+    def refresh(self):
+        with self._lock:
+            return self._update(force=True)
+
+    # เมื่อสำเนาเก่ากว่า max_age ตรวจเวอร์ชันของไฟล์หลัก ถ้าเปลี่ยนแล้วใช้สำเนาของเวอร์ชันใหม่
+    # (ถ้าหลาย thread เรียกพร้อมกันจะตรวจ/คัดลอกครั้งเดียว)
+    def ensure_fresh(self):
+        if self.is_stale():
+            with self._lock:
+                if self.is_stale():
+                    self._update()
+        return self
+
+    # เปิด connection แบบอ่านอย่างเดียวไปยังสำเนาล่าสุด
+    def connect(self):
+        self.ensure_fresh()
+        return sqlite3.connect(f"{Path(self.path).resolve().as_uri()}?mode=ro", uri=True, timeout=30.0)
+
+    def _update(self, force=False):
+        checked_at = time.time()
+        source = sqlite3.connect(self.db_path, timeout=30.0)
+        try:
+            # อ่านแค่ seq ล่าสุดและรหัสฐานข้อมูล ไม่คัดลอก
+            version = cache_version(source)
+        finally:
+            source.close()
+        path = self._path_for(version)
+        if not force and path == self.path and self._touch(path):
+            self.refreshed_at = checked_at
+            return self
+
+        os.makedirs(self.replica_dir, exist_ok=True)
+        with file_lock(os.path.join(self.replica_dir, f"{self._stem}.lock")):
+            # process อื่นอาจคัดลอกเวอร์ชันนี้ไว้แล้วระหว่างที่รอล็อก
+            if force or not self._touch(path):
+                path = self._copy()
+        self._use(path, checked_at)
+        self._remove_old_versions()
+        return self
+
+    def _path_for(self, version):
+        digest = hashlib.sha1(version.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.replica_dir, f"{self._stem}--{digest}.db")
+
+    # แตะไฟล์ให้ process อื่นเห็นว่าสำเนานี้ยังใช้อยู่ คืนค่า False ถ้าไม่มีไฟล์
+    def _touch(self, path):
+        try:
+            os.utime(path)
+        except OSError:
+            return False
+        return True
+
+    # คัดลอกไฟล์หลักลงไฟล์ชั่วคราวแล้วสลับเข้าที่ชื่อของเวอร์ชันที่คัดลอกได้ (อาจใหม่กว่าที่ตรวจไว้)
+    def _copy(self):
+        tmp_path = os.path.join(self.replica_dir, f"{self._stem}.{os.getpid()}.tmp")
+        try:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            source = sqlite3.connect(self.db_path, timeout=30.0)
+            try:
+                target = sqlite3.connect(tmp_path)
+                try:
+                    # คัดลอกทั้งไฟล์ในขั้นเดียว (ถ้าแบ่งหลายขั้น การเขียนระหว่างคัดลอกจะทำให้ต้องเริ่มใหม่)
+                    # ไฟล์หลักใช้ WAL จึงถือแค่ read snapshot ระหว่างคัดลอก ผู้เขียนไม่ต้องรอ
+                    source.backup(target)
+                    # สำเนาเปิดแบบอ่านอย่างเดียว ใช้ journal แบบปกติเพื่อไม่ต้องมีไฟล์ -wal/-shm
+                    target.execute("PRAGMA journal_mode = DELETE")
+                    path = self._path_for(cache_version(target))
+                finally:
+                    target.close()
+            finally:
+                source.close()
+            try:
+                os.replace(tmp_path, path)
+            except OSError:
+                # Windows: process อื่นเปิดสำเนาของเวอร์ชันเดียวกันอยู่ ใช้ไฟล์เดิมได้ (ข้อมูลเวอร์ชันเดียวกัน)
+                if not os.path.exists(path):
+                    raise
+            return path
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _use(self, path, checked_at):
+        conn = sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True)
+        try:
+            version = current_version(conn)
+            origin = database_origin(conn)
+        finally:
+            conn.close()
+        self.path = path
+        self.version = version
+        self.origin = origin
+        self.refreshed_at = checked_at
+
+    # ลบสำเนาเวอร์ชันอื่นที่ไม่มี process ใดแตะนานเกินเกณฑ์ (process ที่ใช้อยู่แตะไฟล์ทุกครั้งที่ตรวจเวอร์ชัน
+    # คือทุก max_age วินาที) ถ้ายังมี connection เปิดอยู่ บน POSIX อ่านต่อได้ บน Windows จะลองลบอีกครั้งในรอบถัดไป
+    def _remove_old_versions(self):
+        stale_before = time.time() - max(self.max_age * 2, STALE_REPLICA_SECONDS)
+        prefix = f"{self._stem}--"
+        for path in glob.glob(os.path.join(self.replica_dir, f"{prefix}*.db")):
+            name = os.path.basename(path)
+            # ชื่อ {stem}--{digest 16 หลัก}.db ไฟล์ของฐานข้อมูลอื่นที่ชื่อขึ้นต้นเหมือนกันไม่ใช่ของเรา
+            if path == self.path or len(name) != len(prefix) + 16 + len('.db'):
+                continue
+            try:
+                if os.path.getmtime(path) < stale_before:
+                    os.remove(path)
+            except OSError:
+                pass
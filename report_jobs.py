@@ -0,0 +1,275 @@
+# งานสร้างไฟล์รายงาน (Excel / CSV) เบื้องหลังใน process pool แทนการสร้างระหว่าง render หน้าเว็บ
+# ไฟล์ที่สร้างเสร็จเก็บไว้ที่ data/reports ตั้งชื่อตามพารามิเตอร์และเวอร์ชันข้อมูล
+# คำขอเดียวกันจากผู้ใช้คนอื่น (หรือ worker process อื่น) จึงได้ไฟล์เดิมทันทีโดยไม่สร้างใหม่
+#
+# แต่ละงานมีไฟล์สถานะ <ไฟล์รายงาน>.json ที่ process ลูกอัพเดทระหว่างทำงาน (ขั้นตอน, จำนวนแถว)
+# ทุก process อ่านสถานะจากไฟล์นี้ได้ งานที่กำลังทำอยู่จึงไม่ถูกส่งซ้ำจาก process อื่น
+import hashlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+REPORT_DIR = os.path.join('data', 'reports')
+
+FORMAT_XLSX = 'xlsx'
+FORMAT_CSV = 'csv'
+
+SOURCE_DATABASE = 'database'
+SOURCE_SNAPSHOT = 'snapshot'
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_MISSING = 'missing'
+
+STAGE_LABELS = {
+    'queued': "รอคิว",
+    'load': "อ่านข้อมูล",
+    'write': "เขียนไฟล์",
+    'save': "บันทึกไฟล์",
+    'done': "เสร็จแล้ว",
+}
+
+REPORT_JOB_WORKERS = 2
+# เขียนไฟล์ทีละกี่แถว (อัพเดทความคืบหน้าทุก chunk)
+WRITE_CHUNK_ROWS = 20000
+# ไฟล์สถานะที่ไม่ถูกอัพเดทนานเกินนี้ (วินาที) ถือว่า process ที่ทำงานนั้นตายไปแล้ว ส่งงานใหม่ได้
+STALE_JOB_SECONDS = 120.0
+# ลบไฟล์รายงานที่ไม่ได้ใช้นานเกินนี้ (วินาที)
+ARTIFACT_MAX_AGE = 24 * 3600.0
+
+
+# key ของไฟล์รายงาน: พารามิเตอร์ + เวอร์ชันข้อมูลของแหล่งข้อมูลทุกตัว
+def artifact_key(params, data_version):
+    return hashlib.sha1(repr((sorted(params.items()), data_version)).encode('utf-8')).hexdigest()[:20]
+
+
+def _status_path(artifact_path):
+    return artifact_path + '.json'
+
+
+def _write_status(artifact_path, **status):
+    status['updated_at'] = time.time()
+    path = _status_path(artifact_path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(status, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def read_status(artifact_path):
+    try:
+        with open(_status_path(artifact_path), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# อ่านรายการเบิกของแหล่งข้อมูลหนึ่งตามช่วงวันที่และสถานะ (start/end เป็นวันที่ 'YYYY-MM-DD' รวมวัน end)
+def _load_source(source, location, params):
+    from typed_frames import read_transactions_typed
+
+    start = params.get('start')
+    end = params.get('end')
+    end_exclusive = None
+    if end:
+        end_exclusive = (datetime.strptime(end, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    status = params.get('status')
+
+    if source == SOURCE_SNAPSHOT:
+        import pandas as pd
+
+        from snapshots import read_snapshot
+
+        df = read_snapshot('transactions', location)
+        if df is None:
+            return None
+        mask = pd.Series(True, index=df.index)
+        if start:
+            mask &= df['date'] >= start
+        if end_exclusive:
+            mask &= df['date'] < end_exclusive
+        if status:
+            mask &= df['status'] == status
+        return df[mask].reset_index(drop=True)
+
+    conditions, values = [], []
+    if start:
+        conditions.append("date >= ?")
+        values.append(start)
+    if end_exclusive:
+        conditions.append("date < ?")
+        values.append(end_exclusive)
+    if status:
+        conditions.append("status = ?")
+        values.append(status)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    conn = sqlite3.connect(f"{Path(location).resolve().as_uri()}?mode=ro", uri=True, timeout=30.0)
+    try:
+        return read_transactions_typed(conn, where, tuple(values))
+    finally:
+        conn.close()
+
+
+def _write_excel(path, df_export, summary, progress):
+    import pandas as pd
+
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        # เขียนทีละ chunk ลง sheet เดียวกัน เพื่อรายงานความคืบหน้าได้ระหว่างเขียน
+        total = len(df_export)
+        for start in range(0, max(total, 1), WRITE_CHUNK_ROWS):
+            df_export.iloc[start:start + WRITE_CHUNK_ROWS].to_excel(
+                writer, sheet_name='รายการเบิก-คืน', index=False,
+                header=start == 0, startrow=0 if start == 0 else start + 1
+            )
+            progress(min(start + WRITE_CHUNK_ROWS, total), total)
+
+        summary_df = pd.DataFrame({
+            'รายการ': ['รายการเบิกทั้งหมด', 'คืนครบแล้ว', 'คืนบางส่วน', 'ยังไม่คืน'],
+            'จำนวน': [summary['total'], summary['fully_returned'], summary['partial_returned'], summary['not_returned']]
+        })
+        summary_df.to_excel(writer, sheet_name='สรุป', index=False)
+        # openpyxl เขียนไฟล์จริงตอนปิด writer (ใช้เวลาพอ ๆ กับขั้นเขียน)
+        progress(total, total, 'save')
+
+
+def _write_csv(path, df_export, progress):
+    total = len(df_export)
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        for start in range(0, max(total, 1), WRITE_CHUNK_ROWS):
+            df_export.iloc[start:start + WRITE_CHUNK_ROWS].to_csv(f, index=False, header=start == 0, lineterminator='\n')
+            progress(min(start + WRITE_CHUNK_ROWS, total), total)
+
+
+# สร้างไฟล์รายงานหนึ่งไฟล์ (ทำงานใน process ลูก) sources: [(ชนิดแหล่งข้อมูล, path), ...] หนึ่งตัวต่อ shard
+def build_report_artifact(artifact_path, params, sources):
+    from reports import build_export_frame, summarize_transactions
+    from typed_frames import merge_shard_transactions
+
+    # ไฟล์ชั่วคราวต้องมีนามสกุลเดิม (ExcelWriter เลือกรูปแบบไฟล์จากนามสกุล)
+    root, ext = os.path.splitext(artifact_path)
+    tmp_path = f"{root}.{os.getpid()}.tmp{ext}"
+    try:
+        frames = []
+        for done, (source, location) in enumerate(sources):
+            _write_status(artifact_path, state=JOB_RUNNING, stage='load', done=done, total=len(sources), pid=os.getpid())
+            frames.append(_load_source(source, location, params))
+        df_transactions = merge_shard_transactions(frames)
+        if df_transactions is None:
+            raise ValueError("ไม่พบข้อมูลสำหรับสร้างรายงาน")
+
+        summary = summarize_transactions(df_transactions)
+        df_export = build_export_frame(df_transactions)
+
+        def progress(done, total, stage='write'):
+            _write_status(artifact_path, state=JOB_RUNNING, stage=stage, done=done, total=total, pid=os.getpid())
+
+        if params['format'] == FORMAT_XLSX:
+            _write_excel(tmp_path, df_export, summary, progress)
+        else:
+            _write_csv(tmp_path, df_export, progress)
+        os.replace(tmp_path, artifact_path)
+        _write_status(artifact_path, state=JOB_DONE, stage='done', done=len(df_export), total=len(df_export),
+                      rows=len(df_export), bytes=os.path.getsize(artifact_path))
+        return artifact_path
+    except Exception as e:
+        _write_status(artifact_path, state=JOB_FAILED, stage='done', error=str(e), detail=traceback.format_exc())
+        raise
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# ตัวจัดการงานสร้างรายงานของ process หนึ่ง (process pool สร้างเมื่อมีงานแรก)
+class ReportJobs:
+    def __init__(self, report_dir=REPORT_DIR, max_workers=REPORT_JOB_WORKERS):
+        self.report_dir = report_dir
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._executor = None
+        self._futures = {}
+
+    def artifact_path(self, params, data_version):
+        return os.path.join(self.report_dir, f"report-{artifact_key(params, data_version)}.{params['format']}")
+
+    # ส่งงานสร้างรายงาน คืนค่า path ของไฟล์รายงาน (ใช้ถามสถานะด้วย status())
+    # ถ้ามีไฟล์อยู่แล้ว หรือมีงานเดียวกันกำลังทำอยู่ (ใน process ใดก็ได้) จะไม่ส่งงานใหม่
+    def submit(self, params, data_version, sources):
+        os.makedirs(self.report_dir, exist_ok=True)
+        artifact_path = self.artifact_path(params, data_version)
+        with self._lock:
+            state = self.status(artifact_path)['state']
+            if state in (JOB_DONE, JOB_PENDING, JOB_RUNNING):
+                if state == JOB_DONE:
+                    os.utime(artifact_path)
+                return artifact_path
+
+            self._remove_old_artifacts()
+            _write_status(artifact_path, state=JOB_PENDING, stage='queued', done=0, total=0)
+            future = self._get_executor().submit(build_report_artifact, artifact_path, params, list(sources))
+            self._futures[artifact_path] = future
+            future.add_done_callback(lambda f, path=artifact_path: self._on_done(path, f))
+        return artifact_path
+
+    # สถานะของงาน: {'state', 'stage', 'done', 'total', 'error', ...}
+    def status(self, artifact_path):
+        status = read_status(artifact_path)
+        if status is None:
+            if os.path.exists(artifact_path):
+                return {'state': JOB_DONE, 'stage': 'done', 'done': 0, 'total': 0}
+            return {'state': JOB_MISSING, 'stage': None, 'done': 0, 'total': 0}
+        if status['state'] == JOB_DONE and not os.path.exists(artifact_path):
+            return {'state': JOB_MISSING, 'stage': None, 'done': 0, 'total': 0}
+        if status['state'] in (JOB_PENDING, JOB_RUNNING) and artifact_path not in self._futures:
+            # งานของ process อื่น ถ้าสถานะไม่ถูกอัพเดทนานเกินไปถือว่า process นั้นตายไปแล้ว
+            if time.time() - status['updated_at'] > STALE_JOB_SECONDS:
+                return dict(status, state=JOB_FAILED, error="งานหยุดทำงานกลางคัน")
+        return status
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait, cancel_futures=True)
+                self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            # spawn: process ลูกไม่ได้ copy thread / lock ของ Streamlit มาด้วย (fork จาก process ที่มี thread อาจค้าง)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._executor
+
+    def _on_done(self, artifact_path, future):
+        with self._lock:
+            self._futures.pop(artifact_path, None)
+        if future.cancelled():
+            _write_status(artifact_path, state=JOB_FAILED, stage='done', error="งานถูกยกเลิก")
+            return
+        error = future.exception()
+        if error is None:
+            return
+        status = read_status(artifact_path)
+        if status is None or status['state'] != JOB_FAILED:
+            # process ลูกตายก่อนเขียนสถานะ (เช่น หน่วยความจำไม่พอ)
+            _write_status(artifact_path, state=JOB_FAILED, stage='done', error=str(error))
+
+    def _remove_old_artifacts(self):
+        expired = time.time() - ARTIFACT_MAX_AGE
+        for path in Path(self.report_dir).glob('report-*'):
+            path = str(path)
+            if '.tmp' in path or path in self._futures:
+                continue
+            try:
+                if os.path.getmtime(path) < expired:
+                    os.remove(path)
+            except OSError:
+                pass
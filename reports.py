@@ -0,0 +1,132 @@
+# ฟังก์ชันคำนวณข้อมูลรายงาน (ไม่พึ่ง Streamlit) ใช้ได้ทั้งตอน render หน้าเว็บและใน background scheduler
+from datetime import datetime, timedelta
+from io import BytesIO
+
+import pandas as pd
+
+# จำนวนวันที่ถือว่าค้างคืนเกินกำหนด
+OVERDUE_DAYS = 7
+
+DISPLAY_COLUMNS = [
+    "id", "equipment_name", "borrower_name", "borrower_dept",
+    "quantity", "returned_quantity", "remaining_quantity", "unit", "date", "status", "notes"
+]
+
+STATUS_LABELS_ENG = {
+    'เบิกแล้ว': 'Not Returned',
+    'คืนบางส่วน': 'Partial Return',
+    'คืนครบแล้ว': 'Fully Returned'
+}
+
+
+# สถิติรวมของรายการเบิก-คืน
+def summarize_transactions(df_transactions):
+    partial_returns = df_transactions[df_transactions['returned_quantity'] > 0]
+    return {
+        'total': len(df_transactions),
+        'fully_returned': int((df_transactions['fully_returned'] == True).sum()),
+        'partial_returned': int(((df_transactions['returned_quantity'] > 0) & (df_transactions['fully_returned'] == False)).sum()),
+        'not_returned': int((df_transactions['returned_quantity'] == 0).sum()),
+        'has_returns': not partial_returns.empty,
+        'returns_borrowed': int(partial_returns['quantity'].sum()),
+        'returns_returned': int(partial_returns['returned_quantity'].sum()),
+        'returns_remaining': int(partial_returns['remaining_quantity'].sum()),
+    }
+
+
+# ข้อมูลสำหรับกราฟ: จำนวนรายการตามสถานะ และเครื่องมือที่เบิกมากที่สุด
+def status_counts(df_transactions):
+    counts = df_transactions['status'].value_counts()
+    return counts[counts > 0]
+
+
+def top_equipment_counts(df_transactions, n=10):
+    counts = df_transactions['equipment_name'].value_counts()
+    return counts[counts > 0].head(n)
+
+
+# รวมจำนวนที่ยังไม่คืนของแต่ละเครื่องมือ แล้วรวมกับข้อมูลเครื่องมือ
+def equipment_overview(df_equipment, df_transactions):
+    not_returned = df_transactions[df_transactions['fully_returned'] == False].groupby('equipment_id', observed=True)['remaining_quantity'].sum().reset_index()
+    not_returned.columns = ['id', 'borrowed_quantity']
+    not_returned['id'] = not_returned['id'].astype(str)
+
+    df_display = df_equipment.merge(not_returned, on='id', how='left')
+    df_display['borrowed_quantity'] = df_display['borrowed_quantity'].fillna(0)
+    df_display['borrowed_quantity'] = df_display['borrowed_quantity'].astype(int)
+    df_display['total_quantity'] = df_display['quantity'] + df_display['borrowed_quantity']
+    return df_display
+
+
+# รายการที่ยังไม่คืนครบและเบิกไปนานเกิน days วัน เรียงจากค้างนานที่สุด
+def overdue_loans(df_transactions, days=OVERDUE_DAYS, now=None):
+    now = now or datetime.now()
+    dates = pd.to_datetime(df_transactions['date'])
+    mask = (df_transactions['fully_returned'] == False) & (dates < now - timedelta(days=days))
+    df_overdue = df_transactions.loc[mask, [
+        "id", "equipment_name", "borrower_name", "borrower_dept", "remaining_quantity", "unit", "date"
+    ]].copy()
+    df_overdue['days_overdue'] = (now - dates[mask]).dt.days
+    return df_overdue.sort_values('days_overdue', ascending=False).reset_index(drop=True)
+
+
+# เตรียมข้อมูลสำหรับ export
+def build_export_frame(df_transactions):
+    df_export = df_transactions[DISPLAY_COLUMNS].copy()
+
+    # แปลงข้อมูลสถานะให้อ่านง่าย
+    df_export['status_eng'] = df_export['status'].astype(object).map(STATUS_LABELS_ENG)
+
+    # แปลงวันที่ให้อ่านง่าย
+    df_export['date_formatted'] = pd.to_datetime(df_export['date']).dt.strftime('%d/%m/%Y %H:%M')
+
+    # จัดเรียงคอลัมน์ใหม่
+    df_export = df_export[['id', 'equipment_name', 'borrower_name', 'borrower_dept',
+                           'quantity', 'returned_quantity', 'remaining_quantity',
+                           'unit', 'date_formatted', 'status_eng', 'notes']].copy()
+
+    df_export.columns = [
+        "Transaction_ID", "Equipment_Name", "Borrower_Name", "Department",
+        "Total_Quantity", "Returned_Quantity", "Remaining_Quantity",
+        "Unit", "Borrow_Date", "Status", "Notes"
+    ]
+    return df_export
+
+
+# สร้างไฟล์ Excel (sheet รายการเบิก-คืน + sheet สรุป)
+def build_excel_report(df_export, summary):
+    output = BytesIO()
+
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        # Sheet ข้อมูลหลัก
+        df_export.to_excel(writer, sheet_name='รายการเบิก-คืน', index=False)
+
+        # Sheet สรุป
+        summary_data = {
+            'รายการ': ['รายการเบิกทั้งหมด', 'คืนครบแล้ว', 'คืนบางส่วน', 'ยังไม่คืน'],
+            'จำนวน': [summary['total'], summary['fully_returned'], summary['partial_returned'], summary['not_returned']]
+        }
+        summary_df = pd.DataFrame(summary_data)
+        summary_df.to_excel(writer, sheet_name='สรุป', index=False)
+
+    return output.getvalue()
+
+
+def build_csv_report(df_export):
+    return df_export.to_csv(index=False, encoding='utf-8-sig')
+
+
+# คำนวณทุกอย่างที่หน้ารายงานต้องใช้ในครั้งเดียว
+def build_report_bundle(df_transactions, include_exports=True):
+    summary = summarize_transactions(df_transactions)
+    bundle = {
+        'summary': summary,
+        'status_counts': status_counts(df_transactions),
+        'top_equipment': top_equipment_counts(df_transactions),
+        'overdue': overdue_loans(df_transactions),
+    }
+    if include_exports:
+        df_export = build_export_frame(df_transactions)
+        bundle['excel'] = build_excel_report(df_export, summary)
+        bundle['csv'] = build_csv_report(df_export)
+    return bundle
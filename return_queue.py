@@ -0,0 +1,314 @@
+# การคืนเครื่องมือแบบ idempotent และคิวลองใหม่ฝั่งเซิร์ฟเวอร์เมื่อฐานข้อมูลไม่ว่าง
+#
+# ฝั่งฐานข้อมูล: การคืนทุกครั้งมี idempotency key (สร้างจากฝั่งผู้ใช้) บันทึกไว้ในตาราง applied_returns
+# ถ้าส่ง key เดิมซ้ำ (กดปุ่มซ้ำ / ซิงค์คิวซ้ำ) จะไม่คืนซ้ำ แต่ตอบผลเดิมกลับไป
+#
+# คิวลองใหม่: เมื่อการคืนเจอฐานข้อมูลถูกล็อก/busy เกิน timeout แอพ (process บนเซิร์ฟเวอร์) บันทึกการคืนลง journal
+# (JSON ทีละบรรทัด ต่อท้ายไฟล์อย่างเดียว) แล้วค่อยซิงค์เข้าฐานข้อมูลเป็นชุด เมื่อซิงค์แล้วจะต่อท้าย ack ของ key นั้น
+# รายการที่ยังไม่มี ack คือรายการที่ยังค้างอยู่ ถ้าซิงค์สำเร็จแต่ ack หายก็ส่งซ้ำได้อย่างปลอดภัย
+# คิวนี้ไม่ใช่คิวออฟไลน์ของเครื่องผู้ใช้: เครื่องที่ติดต่อเซิร์ฟเวอร์ไม่ได้ยังบันทึกการคืนไม่ได้
+# หลาย worker ใช้ journal ไฟล์เดียวกัน การเขียน/อ่าน/compact จึงถือไฟล์ล็อก ({journal}.lock) ร่วมกัน
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+
+from file_lock import file_lock
+from ledger import STOCK_RETURN, record_stock_change
+
+RETURN_QUEUE_PATH = os.path.join('data', 'return_queue.jsonl')
+
+RETURN_APPLIED = 'applied'
+RETURN_DUPLICATE = 'duplicate'
+RETURN_REJECTED = 'rejected'
+
+
+def new_idempotency_key():
+    return uuid.uuid4().hex
+
+
+# error ที่แปลว่าฐานข้อมูลไม่ว่างชั่วคราว (ถูกล็อก/busy เกิน timeout) เก็บการคืนไว้ในคิวแล้วลองใหม่ภายหลังได้
+# error อื่น (ไฟล์เสีย, schema ไม่ตรง, เปิดไฟล์ไม่ได้) ลองใหม่ก็ไม่หาย ต้องแจ้งผู้ใช้
+def is_database_busy(error):
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    message = str(error).lower()
+    return 'database is locked' in message or 'busy' in message
+
+
+# สร้างตาราง applied_returns (เรียกจาก init_database)
+def create_return_dedup(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS applied_returns (
+            idempotency_key TEXT PRIMARY KEY,
+            transaction_id TEXT NOT NULL,
+            return_history_id INTEGER,
+            message TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+# คืนเครื่องมือหนึ่งรายการภายในธุรกรรมของ conn (ผู้เรียกเป็นคน commit) ถ้ายังไม่มีธุรกรรมจะเปิด BEGIN IMMEDIATE
+# คืนค่า (สถานะ, ข้อความ) โดยสถานะเป็น RETURN_APPLIED / RETURN_DUPLICATE / RETURN_REJECTED
+#
+# key ถูกจองด้วย INSERT OR IGNORE ก่อนอ่านข้อมูลใด ๆ: ถ้าอีก process กำลังคืนด้วย key เดียวกัน คำสั่งนี้รอจน
+# process นั้น commit แล้วเห็นแถวของมัน จึงตอบ RETURN_DUPLICATE (ไม่ใช่ IntegrityError)
+# การคืนที่ถูกปฏิเสธยกเลิกการจอง key ด้วย ROLLBACK TO (ส่ง key เดิมใหม่หลังแก้ข้อมูลได้)
+def apply_return(conn, transaction_id, return_quantity, notes="", idempotency_key=None, return_date=None):
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    if idempotency_key is None:
+        status, message, _ = _apply_return(conn, transaction_id, return_quantity, notes, return_date)
+        return status, message
+
+    cursor = conn.cursor()
+    cursor.execute("SAVEPOINT apply_return")
+    try:
+        cursor.execute('''
+            INSERT OR IGNORE INTO applied_returns (idempotency_key, transaction_id) VALUES (?, ?)
+        ''', (idempotency_key, transaction_id))
+        if cursor.rowcount == 0:
+            cursor.execute("SELECT message FROM applied_returns WHERE idempotency_key = ?", (idempotency_key,))
+            status, message = RETURN_DUPLICATE, cursor.fetchone()[0]
+        else:
+            status, message, history_id = _apply_return(conn, transaction_id, return_quantity, notes, return_date)
+            if status == RETURN_APPLIED:
+                cursor.execute('''
+                    UPDATE applied_returns SET return_history_id = ?, message = ? WHERE idempotency_key = ?
+                ''', (history_id, message, idempotency_key))
+            else:
+                cursor.execute("ROLLBACK TO apply_return")
+    except Exception:
+        cursor.execute("ROLLBACK TO apply_return")
+        cursor.execute("RELEASE apply_return")
+        raise
+    cursor.execute("RELEASE apply_return")
+    return status, message
+
+
+# คืนค่า (สถานะ, ข้อความ, id ของประวัติการคืน)
+def _apply_return(conn, transaction_id, return_quantity, notes, return_date):
+    cursor = conn.cursor()
+    # ดึงข้อมูลการเบิก
+    cursor.execute('''
+        SELECT equipment_id, remaining_quantity, quantity FROM transactions
+        WHERE id = ? AND fully_returned = FALSE
+    ''', (transaction_id,))
+
+    result = cursor.fetchone()
+    if not result:
+        return RETURN_REJECTED, "ไม่พบรายการเบิกหรือคืนครบแล้ว", None
+
+    equipment_id, current_remaining, total_quantity = result
+
+    # ตรวจสอบจำนวนที่คืน
+    if return_quantity > current_remaining:
+        return RETURN_REJECTED, f"จำนวนที่คืนเกินกว่าที่เหลือ (เหลือ {current_remaining} ชิ้น)", None
+
+    if return_quantity <= 0:
+        return RETURN_REJECTED, "จำนวนที่คืนต้องมากกว่า 0", None
+
+    # คำนวณจำนวนใหม่
+    new_returned_quantity = total_quantity - current_remaining + return_quantity
+    new_remaining_quantity = current_remaining - return_quantity
+    is_fully_returned = new_remaining_quantity == 0
+    return_date = return_date or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    # อัพเดทข้อมูลการเบิก
+    cursor.execute('''
+        UPDATE transactions
+        SET returned_quantity = ?,
+            remaining_quantity = ?,
+            fully_returned = ?,
+            last_return_date = ?,
+            status = ?
+        WHERE id = ?
+    ''', (new_returned_quantity, new_remaining_quantity, is_fully_returned, return_date,
+          "คืนครบแล้ว" if is_fully_returned else "คืนบางส่วน",
+          transaction_id))
+
+    # บันทึกประวัติการคืน
+    cursor.execute('''
+        INSERT INTO return_history (transaction_id, returned_quantity, return_date, notes)
+        VALUES (?, ?, ?, ?)
+    ''', (transaction_id, return_quantity, return_date, notes))
+    history_id = cursor.lastrowid
+
+    # เพิ่มจำนวนเครื่องมือกลับ
+    cursor.execute('''
+        UPDATE equipment
+        SET quantity = quantity + ?, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', (return_quantity, equipment_id))
+    # เวลาในสมุดบัญชีเป็นเวลาที่ยอดในระบบเปลี่ยน (คิวซิงค์ช้ากว่าเวลาสแกนได้) เพื่อให้ seq เรียงตามเวลา
+    record_stock_change(conn, equipment_id, return_quantity, STOCK_RETURN, transaction_id)
+
+    message = f"คืนสำเร็จ {return_quantity} ชิ้น (เหลือ {new_remaining_quantity} ชิ้น)"
+    return RETURN_APPLIED, message, history_id
+
+
+# คืนหลายรายการในธุรกรรมเดียว (ใช้ตอนซิงค์คิว) คืนค่า {key: (สถานะ, ข้อความ)}
+# รายการที่ถูกปฏิเสธไม่ทำให้รายการอื่นในชุดล้มเหลว แต่ถ้าเกิด error ของฐานข้อมูลจะ rollback ทั้งชุด
+def apply_return_batch(conn, events):
+    results = {}
+    keys = [event['key'] for event in events]
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        # ตรวจ key ที่เคยคืนแล้วทั้งชุดในคำสั่งเดียว (ภายในธุรกรรม ไม่มีใครคืน key เดียวกันแทรกได้)
+        for key, message in conn.execute('''
+            SELECT idempotency_key, message FROM applied_returns
+            WHERE idempotency_key IN (SELECT value FROM json_each(?))
+        ''', (json.dumps(keys),)):
+            results[key] = (RETURN_DUPLICATE, message)
+        for event in events:
+            if event['key'] in results:
+                continue
+            results[event['key']] = apply_return(
+                conn, event['transaction_id'], event['quantity'], event.get('notes', ""),
+                idempotency_key=event['key'], return_date=event.get('scanned_at')
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return results
+
+
+# คิวลองใหม่ของการคืนที่เจอฐานข้อมูลไม่ว่าง เก็บใน journal ไฟล์เดียวบนเซิร์ฟเวอร์
+# บรรทัดรายการ: {"k": key, "t": รหัสการเบิก, "q": จำนวน, "n": หมายเหตุ, "at": เวลาสแกน}
+# บรรทัด ack:   {"ack": key, "s": สถานะ}
+class ReturnQueue:
+    def __init__(self, journal_path=RETURN_QUEUE_PATH, batch_size=1000, durable=True):
+        self.journal_path = journal_path
+        self.batch_size = batch_size
+        self.durable = durable
+        self._lock = threading.Lock()
+
+    # บันทึกการสแกนคืนลง journal คืนค่า idempotency key ของรายการ
+    def enqueue(self, transaction_id, quantity, notes="", idempotency_key=None, scanned_at=None):
+        key = idempotency_key or new_idempotency_key()
+        self._append([{
+            'k': key,
+            't': transaction_id,
+            'q': int(quantity),
+            'n': notes,
+            'at': scanned_at or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }])
+        return key
+
+    # รายการที่ยังไม่ได้ซิงค์ (เรียงตามลำดับที่สแกน)
+    def pending(self):
+        with self._locked():
+            events, _ = self._read()
+        return events
+
+    def pending_count(self):
+        return len(self.pending())
+
+    # ซิงค์รายการค้างเข้าฐานข้อมูลเป็นชุด path_for(transaction_id) บอกว่ารายการอยู่ฐานข้อมูลไหน
+    # ถ้าฐานข้อมูลยังไม่ว่าง/เปิดไม่ได้จะหยุดและเก็บรายการที่เหลือไว้ซิงค์รอบถัดไป
+    def sync(self, path_for):
+        summary = {RETURN_APPLIED: 0, RETURN_DUPLICATE: 0, RETURN_REJECTED: 0, 'pending': 0, 'error': None}
+        events = self.pending()
+
+        # แยกชุดตามฐานข้อมูล (shard) โดยคงลำดับการสแกนภายในแต่ละฐานข้อมูล
+        by_path = {}
+        for event in events:
+            by_path.setdefault(path_for(event['transaction_id']), []).append(event)
+
+        for path, path_events in by_path.items():
+            try:
+                conn = sqlite3.connect(path, timeout=30.0, isolation_level=None)
+            except sqlite3.Error as e:
+                summary['error'] = str(e)
+                summary['pending'] += len(path_events)
+                continue
+            try:
+                for start in range(0, len(path_events), self.batch_size):
+                    batch = path_events[start:start + self.batch_size]
+                    try:
+                        results = apply_return_batch(conn, batch)
+                    except sqlite3.Error as e:
+                        summary['error'] = str(e)
+                        summary['pending'] += len(path_events) - start
+                        break
+                    self._append([{'ack': key, 's': status} for key, (status, _) in results.items()])
+                    for status, _ in results.values():
+                        summary[status] += 1
+            finally:
+                conn.close()
+
+        if summary['pending'] == 0:
+            self.compact()
+        return summary
+
+    # เขียน journal ใหม่ให้เหลือเฉพาะรายการที่ยังค้าง
+    def compact(self):
+        with self._locked():
+            events, acked = self._read()
+            if not acked:
+                return 0
+            tmp_path = f"{self.journal_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for event in events:
+                    f.write(json.dumps(self._to_line(event), ensure_ascii=False, separators=(',', ':')) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.journal_path)
+            return len(acked)
+
+    # ถือล็อกของ thread และของไฟล์ (process อื่น) ระหว่างใช้ journal
+    @contextlib.contextmanager
+    def _locked(self):
+        with self._lock, file_lock(f"{self.journal_path}.lock"):
+            yield
+
+    def _append(self, lines):
+        with self._locked():
+            directory = os.path.dirname(self.journal_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(line, ensure_ascii=False, separators=(',', ':')) + '\n' for line in lines))
+                f.flush()
+                if self.durable:
+                    os.fsync(f.fileno())
+
+    # อ่าน journal คืนค่า (รายการที่ยังค้าง, key ที่ ack แล้ว)
+    def _read(self):
+        if not os.path.exists(self.journal_path):
+            return [], set()
+        events = {}
+        acked = set()
+        with open(self.journal_path, encoding='utf-8') as f:
+            for raw in f:
+                try:
+                    line = json.loads(raw)
+                except json.JSONDecodeError:
+                    # บรรทัดสุดท้ายที่เขียนไม่จบ (เครื่องดับระหว่างเขียน) ข้ามไป
+                    continue
+                if 'ack' in line:
+                    acked.add(line['ack'])
+                elif line['k'] not in events:
+                    events[line['k']] = {
+                        'key': line['k'],
+                        'transaction_id': line['t'],
+                        'quantity': line['q'],
+                        'notes': line.get('n', ""),
+                        'scanned_at': line.get('at'),
+                    }
+        return [event for key, event in events.items() if key not in acked], acked
+
+    def _to_line(self, event):
+        return {
+            'k': event['key'],
+            't': event['transaction_id'],
+            'q': event['quantity'],
+            'n': event['notes'],
+            'at': event['scanned_at'],
+        }
@@ -0,0 +1,130 @@
+# ตัวจัดตารางคำนวณล่วงหน้า (background precompute) สำหรับหน้ารายงานและหน้ารายการเครื่องมือ
+# ทำงานใน background thread เดียวต่อ process คำนวณใหม่เมื่อเวอร์ชันข้อมูลเปลี่ยนหรือครบรอบเวลา
+# แล้วเก็บผลไว้ใน cache ที่ทุก session อ่านร่วมกัน หน้าเว็บเพียงอ่านผลที่คำนวณไว้แล้ว
+#
+# job ที่ระบุ inputs จะคำนวณใหม่เฉพาะเมื่อเวอร์ชันของข้อมูลที่ใช้ (data['input_versions']) เปลี่ยน
+# ถ้าไม่เปลี่ยน ผลเดิมถูกใช้ต่อกับเวอร์ชันข้อมูลใหม่ job ที่ error ไม่ทำให้ job อื่นในรอบเดียวกันถูกข้าม
+import logging
+import threading
+import time
+import traceback
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class PrecomputedResult:
+    def __init__(self, value, data_version, computed_at, duration):
+        self.value = value
+        self.data_version = data_version
+        self.computed_at = computed_at
+        self.duration = duration
+
+
+class PrecomputeScheduler:
+    # version_func: คืนค่าเวอร์ชันข้อมูลปัจจุบัน
+    # load_inputs: โหลดข้อมูลตั้งต้นครั้งเดียวต่อรอบ แล้วส่งให้ทุก job
+    #              (dict ที่มี 'input_versions': {ชื่อข้อมูล: เวอร์ชัน} สำหรับ job ที่ระบุ inputs)
+    # interval: คำนวณใหม่อย่างน้อยทุกกี่วินาที แม้ข้อมูลไม่เปลี่ยน (เช่น รายการค้างคืนที่ขึ้นกับเวลา)
+    # poll_interval: ตรวจเวอร์ชันข้อมูลทุกกี่วินาที
+    def __init__(self, version_func, load_inputs, interval=300.0, poll_interval=2.0):
+        self._version_func = version_func
+        self._load_inputs = load_inputs
+        self._interval = interval
+        self._poll_interval = poll_interval
+        self._jobs = {}
+        self._job_inputs = {}
+        self._job_keys = {}
+        self._results = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_version = None
+        self._last_run = 0.0
+        self.last_error = None
+        self.job_errors = {}
+
+    # inputs: ชื่อข้อมูลใน data['input_versions'] ที่ job ใช้ (None = คำนวณใหม่ทุกครั้งที่เวอร์ชันข้อมูลเปลี่ยน)
+    def register(self, name, func, inputs=None):
+        self._jobs[name] = func
+        self._job_inputs[name] = tuple(inputs) if inputs is not None else None
+        return self
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="precompute-scheduler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    # ขอให้ตรวจเวอร์ชันข้อมูลและคำนวณ job ที่ข้อมูลเปลี่ยนทันที (เช่น หลังบันทึกข้อมูล)
+    def refresh_now(self):
+        self._wake.set()
+
+    # อ่านผลที่คำนวณไว้ ถ้ายังไม่มี (หรือยังไม่ใช่ของ data_version ที่ระบุ) ให้รอได้ไม่เกิน wait วินาที
+    def get(self, name, wait=0.0, data_version=None):
+        deadline = time.monotonic() + wait
+        with self._ready:
+            while True:
+                result = self._results.get(name)
+                if result is not None and (data_version is None or result.data_version == data_version):
+                    return result
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._ready.wait(remaining)
+
+    def _run(self):
+        while not self._stop.is_set():
+            woken = self._wake.is_set()
+            self._wake.clear()
+            try:
+                version = self._version_func()
+                due = time.monotonic() - self._last_run >= self._interval
+                if version != self._last_version or due or woken:
+                    # ครบรอบเวลา: คำนวณทุก job ใหม่ (ผลบางอย่างขึ้นกับเวลาปัจจุบัน เช่น รายการค้างคืน)
+                    self.run_once(version, force=due)
+            except Exception:
+                self.last_error = traceback.format_exc()
+                logger.error("precompute scheduler error:\n%s", self.last_error)
+            self._wake.wait(self._poll_interval)
+
+    # คำนวณ job ที่ข้อมูลเปลี่ยนหนึ่งรอบ (force=True คำนวณทุก job) เรียกตรงได้ถ้าไม่ต้องการ background thread
+    def run_once(self, version=None, force=False):
+        if version is None:
+            version = self._version_func()
+        data = self._load_inputs()
+        input_versions = data.get('input_versions', {}) if isinstance(data, dict) else {}
+        for name, func in self._jobs.items():
+            inputs = self._job_inputs[name]
+            key = version if inputs is None else tuple(input_versions.get(input_name) for input_name in inputs)
+            previous = self._results.get(name)
+            if not force and previous is not None and self._job_keys.get(name) == key:
+                # ข้อมูลที่ job นี้ใช้ไม่เปลี่ยน ผลเดิมยังถูกต้องสำหรับเวอร์ชันใหม่
+                result = PrecomputedResult(previous.value, version, previous.computed_at, previous.duration)
+            else:
+                started = time.perf_counter()
+                try:
+                    value = func(data)
+                except Exception:
+                    # เก็บผลเดิมไว้ (ยังเป็นของเวอร์ชันเก่า หน้าเว็บจะแสดงว่ากำลังอัพเดท) แล้วทำ job ถัดไป
+                    self.last_error = self.job_errors[name] = traceback.format_exc()
+                    logger.error("precompute job %s error:\n%s", name, self.last_error)
+                    continue
+                result = PrecomputedResult(value, version, datetime.now(), time.perf_counter() - started)
+                self._job_keys[name] = key
+                self.job_errors.pop(name, None)
+            with self._ready:
+                self._results[name] = result
+                self._ready.notify_all()
+        self._last_version = version
+        if force or self._last_run == 0.0:
+            self._last_run = time.monotonic()
@@ -0,0 +1,82 @@
+# โหมดแยกฐานข้อมูลตามหอผู้ป่วย/ไซต์ (sharding)
+# แต่ละ shard เป็นไฟล์ SQLite ของตัวเอง จึงไม่ต้องแย่ง write lock เดียวกันทั้งโรงพยาบาล
+#
+# เปิดใช้โดยกำหนด environment variable เช่น
+#   MEDICAL_EQUIPMENT_SHARDS=ICU,ER,OPD
+# จะได้ไฟล์ data/shards/ICU.db, data/shards/ER.db, data/shards/OPD.db
+# ถ้าไม่กำหนดจะใช้ฐานข้อมูลเดียว (data/medical_equipment.db) เหมือนเดิม
+#
+# รหัสการเบิกในโหมด shard จะขึ้นต้นด้วยรหัส shard เช่น ICU-TX20250611162200
+# จึงหา shard ของรายการเบิกได้จากรหัสโดยตรง (รหัสแบบเดิมที่ไม่มี prefix จะอยู่ใน shard แรก)
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+SHARDS_ENV = 'MEDICAL_EQUIPMENT_SHARDS'
+SHARD_DIR = os.path.join('data', 'shards')
+DEFAULT_SHARD = 'main'
+
+_SHARD_KEY_PATTERN = re.compile(r'^[A-Za-z0-9_]+$')
+
+
+class ShardRouter:
+    def __init__(self, shard_keys=None, default_path=os.path.join('data', 'medical_equipment.db'), shard_dir=SHARD_DIR):
+        shard_keys = [key.strip() for key in (shard_keys or []) if key.strip()]
+        for key in shard_keys:
+            if not _SHARD_KEY_PATTERN.match(key):
+                raise ValueError(f"รหัส shard ไม่ถูกต้อง: {key!r} (ใช้ได้เฉพาะ A-Z, a-z, 0-9 และ _)")
+
+        self.sharded = bool(shard_keys)
+        if self.sharded:
+            self.shards = {key: os.path.join(shard_dir, f'{key}.db') for key in shard_keys}
+        else:
+            self.shards = {DEFAULT_SHARD: default_path}
+        self.default_key = next(iter(self.shards))
+
+    @classmethod
+    def from_env(cls, default_path, shard_dir=SHARD_DIR):
+        value = os.environ.get(SHARDS_ENV, '')
+        return cls(value.split(','), default_path=default_path, shard_dir=shard_dir)
+
+    def keys(self):
+        return list(self.shards)
+
+    def paths(self):
+        return list(self.shards.values())
+
+    def path_for(self, key=None):
+        key = key or self.default_key
+        if key not in self.shards:
+            raise KeyError(f"ไม่พบ shard: {key}")
+        return self.shards[key]
+
+    # หา shard จาก prefix ของรหัสการเบิก
+    def shard_for_transaction(self, transaction_id):
+        prefix, separator, _ = str(transaction_id).partition('-')
+        if separator and prefix in self.shards:
+            return prefix
+        return self.default_key
+
+    def path_for_transaction(self, transaction_id):
+        return self.shards[self.shard_for_transaction(transaction_id)]
+
+    # สร้างรหัสการเบิกใหม่ (มี prefix ของ shard เมื่อเปิดโหมด shard)
+    # sequence ใช้เมื่อสร้างหลายรายการในวินาทีเดียวกัน (เช่น เบิกเป็นชุดจาก command line)
+    def new_transaction_id(self, key=None, now=None, sequence=None):
+        base = f"TX{(now or datetime.now()).strftime('%Y%m%d%H%M%S')}"
+        if sequence is not None:
+            base = f"{base}-{sequence:06d}"
+        if not self.sharded:
+            return base
+        return f"{key or self.default_key}-{base}"
+
+    # เรียก func(key, path) กับทุก shard แบบขนาน แล้วคืนผลเป็น dict ตามลำดับ shard
+    # (sqlite3 ปล่อย GIL ระหว่างรัน query จึงใช้ thread ได้)
+    def fan_out(self, func, max_workers=None):
+        if len(self.shards) == 1:
+            key, path = next(iter(self.shards.items()))
+            return {key: func(key, path)}
+        with ThreadPoolExecutor(max_workers=max_workers or len(self.shards)) as pool:
+            futures = {key: pool.submit(func, key, path) for key, path in self.shards.items()}
+            return {key: future.result() for key, future in futures.items()}
@@ -0,0 +1,327 @@
+# cache บนดิสก์ที่ใช้ร่วมกันทุก process (หลาย worker หลัง load balancer) เก็บที่ data/cache
+# st.cache_data อยู่ในหน่วยความจำของ process เดียว แต่ละ worker จึงต้องโหลด/คำนวณซ้ำเอง
+# cache นี้ให้ worker แรกที่ต้องการค่าเป็นคนคำนวณแล้วเขียนลงไฟล์ worker อื่นอ่านไฟล์เดียวกัน
+#
+# key ของทุกรายการประกอบด้วย version (เวอร์ชันข้อมูลของฐานข้อมูล) และ generation ของ cache
+# - ข้อมูลเปลี่ยน -> version เปลี่ยน -> process ที่อ่านข้อมูลเวอร์ชันใหม่มองไม่เห็นค่าเก่าทันที
+#   แต่ process ที่ยังอ่านสำเนารุ่นก่อนอยู่ยังใช้ค่าเก่าได้ ไฟล์เวอร์ชันเก่าจึงถูกลบเมื่อไม่มีใครอ่านนานเกิน stale_after วินาที
+# - clear() เพิ่ม generation ในไฟล์ GENERATION ทุก process เห็นพร้อมกัน (เช่น หลังกู้คืนฐานข้อมูล)
+#
+# DataFrame เก็บเป็นไฟล์ Arrow IPC (ต้องมี pyarrow) อ่านแบบ memory-map แต่ to_pandas() ยังคัดลอกข้อมูล
+# เข้าหน่วยความจำของแต่ละ process ที่อ่าน (ประหยัดเวลาคำนวณ ไม่ได้ประหยัดหน่วยความจำ)
+# ค่าอื่นเก็บเป็น JSON เท่านั้น (ไม่ใช้ pickle เพราะไฟล์ในไดเรกทอรีร่วมใครก็เขียนได้ การโหลด pickle คือการรันโค้ด)
+# รับเฉพาะ dict (key เป็น str), list, str, int, float, bool, None, datetime และ DataFrame/Series ที่อยู่ข้างใน
+# ค่าชนิดอื่นจะคำนวณใหม่ทุกครั้งโดยไม่เขียน cache
+# การเขียนใช้ไฟล์ชั่วคราวแล้ว os.replace จึงไม่มีใครอ่านไฟล์ที่เขียนไม่เสร็จ
+import base64
+import glob
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+SHARED_CACHE_DIR = os.path.join('data', 'cache')
+GENERATION_FILE = 'GENERATION'
+
+# ขนาดรวมสูงสุดของไฟล์ใน cache (เกินแล้วลบรายการที่ใช้ล่าสุดนานที่สุดก่อน)
+SHARED_CACHE_MAX_BYTES = 1024 ** 3
+# process อื่นกำลังคำนวณ key เดียวกันอยู่ รอผลได้ไม่เกินกี่วินาที (เกินแล้วคำนวณเองโดยไม่เขียน cache)
+# ล็อกเป็น file_lock (flock/msvcrt) ระบบปล่อยล็อกเองเมื่อ process ที่ถือตาย จึงไม่มีการลบล็อกที่ "ค้าง"
+LOCK_TIMEOUT = 60.0
+LOCK_POLL_INTERVAL = 0.05
+# ค่าของ key เดียวกันเวอร์ชันอื่นที่ไม่มีใครอ่านนานเกินนี้ (วินาที) จะถูกลบตอนเขียนเวอร์ชันใหม่
+STALE_ENTRY_SECONDS = 600.0
+
+FRAME_SUFFIX = '.arrow'
+JSON_SUFFIX = '.json'
+ENTRY_SUFFIXES = (FRAME_SUFFIX, JSON_SUFFIX)
+# DataFrame/Series ที่อยู่ในค่า JSON เก็บเป็น Arrow IPC (base64) และ datetime เก็บเป็น ISO 8601 ใต้ key เหล่านี้
+FRAME_TAG = '__frame__'
+SERIES_TAG = '__series__'
+SERIES_COLUMN = '__value__'
+DATETIME_TAG = '__datetime__'
+VALUE_TAGS = (FRAME_TAG, SERIES_TAG, DATETIME_TAG)
+
+
+def _digest(value, length=16):
+    return hashlib.sha1(repr(value).encode('utf-8')).hexdigest()[:length]
+
+
+def _has_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _frame_table(df):
+    import pyarrow as pa
+
+    return pa.Table.from_pandas(df, preserve_index=not isinstance(df.index, pd.RangeIndex))
+
+
+def _frame_to_base64(df):
+    import pyarrow as pa
+
+    table = _frame_table(df)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return base64.b64encode(sink.getvalue().to_pybytes()).decode('ascii')
+
+
+def _frame_from_base64(data):
+    import pyarrow as pa
+
+    return pa.ipc.open_file(pa.py_buffer(base64.b64decode(data))).read_all().to_pandas()
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if FRAME_TAG in value:
+            return _frame_from_base64(value[FRAME_TAG])
+        if SERIES_TAG in value:
+            return _frame_from_base64(value[SERIES_TAG])[SERIES_COLUMN].rename(value['name'])
+        if DATETIME_TAG in value:
+            if value.get('pandas'):
+                return pd.Timestamp(value[DATETIME_TAG])
+            return datetime.fromisoformat(value[DATETIME_TAG])
+        return {key: _decode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    return value
+
+
+class SharedCache:
+    def __init__(self, cache_dir=SHARED_CACHE_DIR, max_bytes=SHARED_CACHE_MAX_BYTES, lock_timeout=LOCK_TIMEOUT,
+                 stale_after=STALE_ENTRY_SECONDS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock_timeout = lock_timeout
+        self.stale_after = stale_after
+        self._use_arrow = _has_pyarrow()
+        self.hits = 0
+        self.misses = 0
+
+    # generation ปัจจุบันของ cache (เพิ่มขึ้นทุกครั้งที่ clear จาก process ใดก็ได้)
+    def generation(self):
+        try:
+            with open(os.path.join(self.cache_dir, GENERATION_FILE), encoding='utf-8') as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    # ล้าง cache ของทุก process: เพิ่ม generation แล้วลบไฟล์ทั้งหมด
+    def clear(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        generation = self.generation() + 1
+        path = os.path.join(self.cache_dir, GENERATION_FILE)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(str(generation))
+        os.replace(tmp_path, path)
+        for entry in self._entries():
+            self._remove(entry)
+        return generation
+
+    # อ่านค่า คืนค่า (True, value) ถ้ามี หรือ (False, None)
+    def get(self, namespace, key, version):
+        path = self._find(namespace, key, version)
+        if path is None:
+            return False, None
+        try:
+            value = self._read(path)
+        except (OSError, ValueError):
+            # ไฟล์ถูกลบ/แทนที่ระหว่างอ่าน หรืออ่านไม่ได้ ถือว่าไม่มี
+            return False, None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return True, value
+
+    # เขียนค่า ค่าชนิดที่เก็บไม่ได้ (ดูด้านบน) ทำให้เกิด TypeError ก่อนเขียนไฟล์
+    def put(self, namespace, key, version, value):
+        is_frame = isinstance(value, pd.DataFrame)
+        if is_frame:
+            self._encode(value)
+        else:
+            payload = json.dumps(self._encode(value), ensure_ascii=False)
+        os.makedirs(os.path.join(self.cache_dir, namespace), exist_ok=True)
+        generation = self.generation()
+        stem = self._stem(namespace, key, version, generation)
+        path = stem + (FRAME_SUFFIX if is_frame else JSON_SUFFIX)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            if is_frame:
+                self._write_frame(tmp_path, value)
+            else:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(payload)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._remove_other_versions(namespace, key, path, generation)
+        self._evict()
+        return path
+
+    # อ่านค่าจาก cache ถ้าไม่มีให้คำนวณ (ถ้า process อื่นกำลังคำนวณ key เดียวกันอยู่ จะรอใช้ผลของ process นั้น)
+    # ล็อกหนึ่งไฟล์ต่อ key (ไม่แยกตามเวอร์ชัน) จำนวนไฟล์ล็อกจึงไม่เพิ่มตามเวอร์ชันข้อมูล และไม่ต้องลบไฟล์ล็อก
+    def get_or_compute(self, namespace, key, version, compute):
+        found, value = self.get(namespace, key, version)
+        if found:
+            self.hits += 1
+            return value
+
+        lock_path = os.path.join(self.cache_dir, namespace, f"{_digest(key)}.lock")
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            with file_lock(lock_path, blocking=False) as locked:
+                if locked:
+                    # อาจมี process อื่นเขียนเสร็จระหว่างรอ lock
+                    found, value = self.get(namespace, key, version)
+                    if found:
+                        self.hits += 1
+                        return value
+                    self.misses += 1
+                    value = compute()
+                    try:
+                        self.put(namespace, key, version, value)
+                    except TypeError as e:
+                        logger.warning("shared cache: ไม่เขียน %s/%s ลง cache (%s)", namespace, key, e)
+                    return value
+            time.sleep(LOCK_POLL_INTERVAL)
+            found, value = self.get(namespace, key, version)
+            if found:
+                self.hits += 1
+                return value
+            if time.monotonic() > deadline:
+                # รอนานเกินไป คำนวณเองโดยไม่เขียน cache
+                self.misses += 1
+                return compute()
+
+    # จำนวนไฟล์และขนาดรวมของ cache
+    def stats(self):
+        entries = self._entries()
+        size = 0
+        for entry in entries:
+            try:
+                size += os.path.getsize(entry)
+            except OSError:
+                pass
+        return {
+            'entries': len(entries), 'bytes': size, 'generation': self.generation(),
+            'hits': self.hits, 'misses': self.misses,
+        }
+
+    # ชื่อไฟล์: {key}--{generation}-{version} (generation อยู่ในชื่อเพื่อให้รู้ว่าไฟล์ไหนเป็นของรุ่นก่อน)
+    def _stem(self, namespace, key, version, generation=None):
+        if generation is None:
+            generation = self.generation()
+        return os.path.join(self.cache_dir, namespace, f"{_digest(key)}--{generation}-{_digest(version, 12)}")
+
+    def _find(self, namespace, key, version):
+        stem = self._stem(namespace, key, version)
+        for suffix in ENTRY_SUFFIXES:
+            if os.path.exists(stem + suffix):
+                return stem + suffix
+        return None
+
+    def _read(self, path):
+        if path.endswith(FRAME_SUFFIX):
+            import pyarrow as pa
+
+            # to_pandas() คัดลอกข้อมูลจาก memory-map เข้าหน่วยความจำของ process นี้
+            with pa.memory_map(path) as source:
+                return pa.ipc.open_file(source).read_all().to_pandas()
+        with open(path, encoding='utf-8') as f:
+            return _decode(json.load(f))
+
+    # แปลงค่าเป็นรูปที่ json.dumps รับได้ ค่าชนิดอื่น (หรือ DataFrame เมื่อไม่มี pyarrow) เป็น TypeError
+    def _encode(self, value):
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            if not self._use_arrow:
+                raise TypeError("ต้องมี pyarrow จึงเก็บ DataFrame/Series ได้")
+            if isinstance(value, pd.DataFrame):
+                return {FRAME_TAG: _frame_to_base64(value)}
+            return {SERIES_TAG: _frame_to_base64(value.to_frame(SERIES_COLUMN)), 'name': self._encode(value.name)}
+        if isinstance(value, dict):
+            if not all(isinstance(key, str) for key in value) or any(tag in value for tag in VALUE_TAGS):
+                raise TypeError("key ของ dict ต้องเป็น str และไม่ซ้ำกับ key ที่ใช้เก็บ DataFrame/Series/datetime")
+            return {key: self._encode(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._encode(item) for item in value]
+        if isinstance(value, datetime):
+            return {DATETIME_TAG: value.isoformat(), 'pandas': type(value) is not datetime}
+        if isinstance(value, np.generic):
+            return self._encode(value.item())
+        if value is None or isinstance(value, (str, bool, int, float)):
+            return value
+        raise TypeError(f"เก็บค่าชนิด {type(value).__name__} ใน cache ร่วมไม่ได้")
+
+    def _write_frame(self, path, df):
+        import pyarrow as pa
+
+        table = _frame_table(df)
+        with pa.OSFile(path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+    def _entries(self):
+        return [
+            path for path in glob.glob(os.path.join(self.cache_dir, '*', '*'))
+            if path.endswith(ENTRY_SUFFIXES)
+        ]
+
+    # ค่าของ key เดียวกันเวอร์ชันอื่นอาจยังถูกใช้โดย process ที่อ่านสำเนาข้อมูลรุ่นก่อน จึงลบเฉพาะไฟล์ของ
+    # generation ก่อนหน้า หรือไฟล์ที่ไม่มีใครอ่านนานเกิน stale_after วินาที (get() แตะ mtime ทุกครั้งที่อ่าน)
+    def _remove_other_versions(self, namespace, key, keep_path, generation):
+        stale_before = time.time() - self.stale_after
+        for path in glob.glob(os.path.join(self.cache_dir, namespace, f"{_digest(key)}--*")):
+            if path == keep_path or not path.endswith(ENTRY_SUFFIXES):
+                continue
+            try:
+                entry_generation = int(os.path.basename(path).split('--', 1)[1].split('-', 1)[0])
+            except (IndexError, ValueError):
+                # ชื่อไฟล์แบบเก่าที่ไม่มี generation
+                entry_generation = -1
+            try:
+                used_at = os.path.getmtime(path)
+            except OSError:
+                continue
+            if entry_generation < generation or used_at < stale_before:
+                self._remove(path)
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for path in self._entries():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            # ยังเปิดอ่านอยู่ (Windows) จะถูกลบในรอบถัดไป
+            pass
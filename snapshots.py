@@ -0,0 +1,283 @@
+# ส่งออก snapshot สำหรับงานรายงาน (Parquet แบ่ง partition รายเดือน + ไฟล์ Arrow สำหรับอ่านแบบ memory-map)
+# เพื่อให้รายงานและการ export ไม่ต้องอ่านจากไฟล์ SQLite ที่ใช้เบิก-คืนอยู่
+#
+# โครงสร้างไฟล์:
+#   data/snapshots/manifest.json
+#   data/snapshots/equipment/equipment.parquet               (เขียนใหม่ทั้งไฟล์ทุกครั้ง ตารางเล็ก)
+#   data/snapshots/transactions/month=YYYY-MM/part-<seq>.parquet
+#   data/snapshots/return_history/month=YYYY-MM/part-<seq>.parquet
+#   data/snapshots/transactions.arrow, return_history.arrow  (สถานะล่าสุด สำหรับอ่านแบบ memory-map)
+#
+# แต่ละรอบจะเขียนเฉพาะแถวที่เปลี่ยนตั้งแต่ snapshot ก่อนหน้าเป็น part ใหม่
+# แถวเดียวกันอาจอยู่หลาย part ได้ ตอนรวมจะเลือกแถวจาก part ที่ใหม่ที่สุด (_snapshot_seq สูงสุด)
+# แถวที่เปลี่ยนดูจาก change_log (seq มากกว่า change_seq ที่บันทึกใน manifest) ไม่ใช้วันที่เบิก/คืน
+# เพราะวันที่ทางธุรกิจไม่ใช่เวลาที่แก้ไข (การซ่อมยอด, คิวคืนที่ใช้เวลาสแกน, ธุรกรรมที่ commit ช้า)
+import json
+import os
+import shutil
+import sqlite3
+from datetime import datetime
+
+import pandas as pd
+
+from changefeed import OP_DELETE, compacted_through, current_version, database_origin, save_checkpoint
+from typed_frames import CATEGORY_COLUMNS, DATE_FORMAT, read_transactions_typed
+
+SNAPSHOT_DIR = os.path.join('data', 'snapshots')
+MANIFEST_FILE = 'manifest.json'
+
+# จำนวน part สูงสุดต่อ partition ก่อนจะรวมเป็นไฟล์เดียว
+MAX_PARTS_PER_PARTITION = 16
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise ImportError("ต้องติดตั้ง pyarrow เพื่อใช้งาน snapshot (pip install pyarrow)") from e
+
+
+def load_manifest(snapshot_dir=SNAPSHOT_DIR):
+    path = os.path.join(snapshot_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save_manifest(snapshot_dir, manifest):
+    path = os.path.join(snapshot_dir, MANIFEST_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+# แปลง DataFrame เป็น Arrow table โดยให้คอลัมน์ categorical ใช้ dictionary แบบ int32 เสมอ
+# (pandas อาจใช้ code แบบ int8/int16 ทำให้ schema ของแต่ละ part ไม่ตรงกัน)
+def _to_arrow(df):
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    fields = []
+    for field in table.schema:
+        if pa.types.is_dictionary(field.type):
+            field = field.with_type(pa.dictionary(pa.int32(), pa.string()))
+        elif pa.types.is_null(field.type):
+            # คอลัมน์ที่เป็น None ทั้งหมดใน part นี้ ให้เป็น string เหมือน part อื่น
+            field = field.with_type(pa.string())
+        elif pa.types.is_timestamp(field.type):
+            field = field.with_type(pa.timestamp('us'))
+        fields.append(field)
+    return table.cast(pa.schema(fields))
+
+
+def _write_partitions(df, table_dir, month_column, seq):
+    import pyarrow.parquet as pq
+
+    if df.empty:
+        return 0
+    months = df[month_column].dt.strftime('%Y-%m').fillna('unknown')
+    for month, part in df.groupby(months, sort=False):
+        partition_dir = os.path.join(table_dir, f'month={month}')
+        os.makedirs(partition_dir, exist_ok=True)
+        pq.write_table(_to_arrow(part), os.path.join(partition_dir, f'part-{seq:06d}.parquet'))
+        _compact_partition(partition_dir)
+    return len(df)
+
+
+# รวม part ใน partition เดียวกันเป็นไฟล์เดียวเมื่อมีมากเกินไป (เก็บเฉพาะแถวล่าสุดของแต่ละ id)
+def _compact_partition(partition_dir):
+    import pyarrow.parquet as pq
+
+    parts = sorted(name for name in os.listdir(partition_dir) if name.endswith('.parquet'))
+    if len(parts) <= MAX_PARTS_PER_PARTITION:
+        return
+    df = _dedupe(pq.read_table(partition_dir).to_pandas())
+    latest = parts[-1]
+    tmp_path = os.path.join(partition_dir, latest + '.tmp')
+    pq.write_table(_to_arrow(df), tmp_path)
+    for name in parts:
+        os.remove(os.path.join(partition_dir, name))
+    os.replace(tmp_path, os.path.join(partition_dir, latest))
+
+
+def _dedupe(df):
+    if df.empty:
+        return df
+    return (df.sort_values('_snapshot_seq', kind='stable')
+              .drop_duplicates('id', keep='last')
+              .reset_index(drop=True))
+
+
+def _read_transactions_changed(conn, since, through):
+    if since is None:
+        return read_transactions_typed(conn)
+    return read_transactions_typed(conn, '''
+        WHERE id IN (
+            SELECT row_id FROM change_log WHERE table_name = 'transactions' AND seq > ? AND seq <= ?
+        )
+    ''', (since, through))
+
+
+def _read_return_history(conn, since, through):
+    where, params = "", ()
+    if since is not None:
+        where = '''
+            WHERE id IN (
+                SELECT CAST(row_id AS INTEGER) FROM change_log
+                WHERE table_name = 'return_history' AND seq > ? AND seq <= ?
+            )
+        '''
+        params = (since, through)
+    df = pd.read_sql_query(f'''
+        SELECT id, transaction_id, returned_quantity, return_date, notes
+        FROM return_history
+        {where}
+        ORDER BY id
+    ''', conn, params=params)
+    df['return_date'] = pd.to_datetime(df['return_date'], format=DATE_FORMAT, errors='coerce')
+    df['transaction_id'] = df['transaction_id'].astype('category')
+    return df
+
+
+# สร้างไฟล์ Arrow (IPC) ของสถานะล่าสุดจาก partition ทั้งหมด สำหรับอ่านแบบ memory-map
+def _materialize(snapshot_dir, table_name, sort_column):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table_dir = os.path.join(snapshot_dir, table_name)
+    target = os.path.join(snapshot_dir, f'{table_name}.arrow')
+    if not os.path.isdir(table_dir) or not os.listdir(table_dir):
+        if os.path.exists(target):
+            os.remove(target)
+        return
+    df = _dedupe(pq.read_table(table_dir).to_pandas())
+    df = df.drop(columns=['_snapshot_seq', 'month'], errors='ignore')
+    df = df.sort_values(sort_column, ascending=False, kind='stable').reset_index(drop=True)
+    tmp_path = target + '.tmp'
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        table = _to_arrow(df)
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, target)
+
+
+# ส่งออก snapshot แบบ incremental (full=True เพื่อสร้างใหม่ทั้งหมด)
+def export_snapshot(db_path, snapshot_dir=SNAPSHOT_DIR, full=False):
+    _require_pyarrow()
+    import pyarrow.parquet as pq
+
+    manifest = load_manifest(snapshot_dir)
+    taken_at = datetime.now()
+
+    conn = sqlite3.connect(db_path, timeout=30.0)
+    try:
+        # อ่านทุกตารางใน read transaction เดียวเพื่อให้ได้ข้อมูลจากจุดเวลาเดียวกัน
+        conn.execute("BEGIN")
+        # change_log ถึง seq นี้รวมอยู่ใน snapshot รอบนี้ (อ่านในธุรกรรมเดียวกับข้อมูล จึงไม่มีแถวตกหล่น)
+        change_seq = current_version(conn)
+        origin = database_origin(conn)
+
+        # สร้างใหม่ทั้งหมดเมื่อ: manifest แบบเก่า (ไม่มี change_seq), เป็นฐานข้อมูลอื่น (กู้คืน/สร้างใหม่),
+        # log ช่วงนั้นถูกบีบอัดไปแล้ว หรือมีการลบแถว (เช่น ลบรายการเบิกทั้งหมด)
+        if manifest is not None:
+            since = manifest.get('change_seq')
+            full = full or (
+                since is None
+                or manifest.get('origin') != origin
+                or since > change_seq
+                or compacted_through(conn) > since
+                or conn.execute('''
+                    SELECT EXISTS (
+                        SELECT 1 FROM change_log
+                        WHERE seq > ? AND seq <= ? AND op = ? AND table_name IN ('transactions', 'return_history')
+                    )
+                ''', (since, change_seq, OP_DELETE)).fetchone()[0]
+            )
+        if full or manifest is None:
+            if os.path.isdir(snapshot_dir):
+                shutil.rmtree(snapshot_dir)
+            manifest = None
+        os.makedirs(snapshot_dir, exist_ok=True)
+
+        seq = 1 if manifest is None else manifest['seq'] + 1
+        since = None if manifest is None else manifest['change_seq']
+
+        df_transactions = _read_transactions_changed(conn, since, change_seq)
+        df_history = _read_return_history(conn, since, change_seq)
+        df_equipment = pd.read_sql_query("SELECT * FROM equipment ORDER BY id", conn)
+        conn.rollback()
+    finally:
+        conn.close()
+
+    df_transactions['_snapshot_seq'] = seq
+    df_history['_snapshot_seq'] = seq
+    written_transactions = _write_partitions(
+        df_transactions, os.path.join(snapshot_dir, 'transactions'), 'date', seq
+    )
+    written_history = _write_partitions(
+        df_history, os.path.join(snapshot_dir, 'return_history'), 'return_date', seq
+    )
+
+    equipment_dir = os.path.join(snapshot_dir, 'equipment')
+    os.makedirs(equipment_dir, exist_ok=True)
+    pq.write_table(_to_arrow(df_equipment), os.path.join(equipment_dir, 'equipment.parquet'))
+
+    if written_transactions or manifest is None:
+        _materialize(snapshot_dir, 'transactions', 'date')
+    if written_history or manifest is None:
+        _materialize(snapshot_dir, 'return_history', 'return_date')
+
+    manifest = {
+        'seq': seq,
+        'taken_at': taken_at.strftime(DATE_FORMAT),
+        'origin': origin,
+        'change_seq': change_seq,
+    }
+    _save_manifest(snapshot_dir, manifest)
+    # บอกการบีบอัด change log ว่า snapshot อ่านถึง seq นี้แล้ว (รอบถัดไปต่อยอดได้โดยไม่ต้องสร้างใหม่ทั้งหมด)
+    conn = sqlite3.connect(db_path, timeout=30.0)
+    try:
+        save_checkpoint(conn, 'snapshot', change_seq)
+        conn.commit()
+    finally:
+        conn.close()
+    return {
+        'seq': seq,
+        'full': since is None,
+        'transactions': written_transactions,
+        'return_history': written_history,
+        'equipment': len(df_equipment),
+    }
+
+
+# อ่าน snapshot ล่าสุดของตาราง transactions หรือ return_history จากไฟล์ Arrow แบบ memory-map
+# (ไม่ต้อง parse หรือแปลงชนิดข้อมูลเหมือนอ่านจาก SQLite) แต่ to_pandas() คัดลอกข้อมูลเข้าหน่วยความจำของ process
+# ไม่ใช่ zero-copy: DataFrame ที่ได้ไม่ผูกกับไฟล์ ไฟล์จึงถูกแทนที่ระหว่างที่ยังใช้ DataFrame อยู่ได้
+def read_snapshot(table_name, snapshot_dir=SNAPSHOT_DIR):
+    _require_pyarrow()
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if table_name == 'equipment':
+        path = os.path.join(snapshot_dir, 'equipment', 'equipment.parquet')
+        if not os.path.exists(path):
+            return None
+        return pq.read_table(path, memory_map=True).to_pandas()
+
+    path = os.path.join(snapshot_dir, f'{table_name}.arrow')
+    if not os.path.exists(path):
+        return None
+    with pa.memory_map(path, 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+    df = table.to_pandas()
+    # คอลัมน์ categorical ที่ไม่มีข้อมูลเลยอาจถูกอ่านกลับมาเป็นชนิดอื่น
+    for column in CATEGORY_COLUMNS:
+        if column in df and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+    # part ที่เขียนไว้ตอนที่ borrower_name ยังเป็น categorical อ่านกลับมาเป็น categorical ให้เป็นข้อความเหมือนแถวอื่น
+    for column in df.columns:
+        if column not in CATEGORY_COLUMNS and isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(object)
+    return df
@@ -0,0 +1,51 @@
+# fixture ที่ใช้ร่วมกันของชุดทดสอบ: ฐานข้อมูลว่างที่สร้างด้วย init_database ในโฟลเดอร์ชั่วคราวของแต่ละการทดสอบ
+# รันจากโฟลเดอร์หลักของโปรเจกต์:  python -m pytest -q
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# ให้ import โมดูลของแอพได้เมื่อรันจากโฟลเดอร์ tests (เหมือน benchmarks/common.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import init_database, insert_equipment, insert_withdrawal
+from dimensions import DimensionLookup
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "data" / "medical_equipment.db")
+    init_database(path)
+    return path
+
+
+@pytest.fixture
+def conn(db_path):
+    conn = sqlite3.connect(db_path, timeout=30.0)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def lookup():
+    return DimensionLookup()
+
+
+# เพิ่มเครื่องมือแล้ว commit
+@pytest.fixture
+def add_equipment(conn):
+    def add(eq_id, quantity=10, name=None, category="หมวด 1", unit="อัน"):
+        insert_equipment(conn, eq_id, name or f"เครื่องมือ {eq_id}", category, quantity, unit)
+        conn.commit()
+    return add
+
+
+# เบิกหนึ่งรายการแล้ว commit (date กำหนดวันที่เบิกได้ เพื่อให้ลำดับรายการแน่นอน)
+@pytest.fixture
+def withdraw(conn, lookup):
+    def add(transaction_id, equipment_id, quantity=1, borrower_name="ผู้เบิก 1", borrower_dept="แผนก 1", date=None):
+        insert_withdrawal(conn, lookup, transaction_id, equipment_id, borrower_name, borrower_dept, quantity,
+                          date=date)
+        conn.commit()
+    return add
@@ -0,0 +1,96 @@
+import pandas as pd
+import pytest
+
+from changefeed import IncrementalTransactions, changes_since, compact_change_log, current_version
+from return_queue import apply_return
+from typed_frames import CATEGORY_COLUMNS, read_transactions_typed
+
+
+# categories ของ DataFrame ที่ patch อาจมีค่าที่ไม่มีแถวใช้แล้ว (เช่น แถวที่ถูกลบ) จึงเทียบเป็นข้อความ
+def _plain(df):
+    return df.astype({column: object for column in CATEGORY_COLUMNS})
+
+
+@pytest.fixture
+def loans(add_equipment, withdraw):
+    add_equipment("EQ1", 100)
+    add_equipment("EQ2", 100)
+    for day in range(1, 6):
+        withdraw(f"TX{day}", "EQ1" if day % 2 else "EQ2", 2, date=f"2024-01-0{day} 09:00:00")
+    # วันที่ซ้ำกัน ลำดับตัดสินด้วยรหัส
+    withdraw("TX6", "EQ1", 1, date="2024-01-03 09:00:00")
+
+
+def test_changes_since_reports_latest_change_per_row(conn, loans):
+    since = current_version(conn)
+    conn.execute("UPDATE transactions SET notes = 'แก้ไข' WHERE id = 'TX1'")
+    conn.execute("UPDATE transactions SET notes = 'แก้ไขอีกครั้ง' WHERE id = 'TX1'")
+    conn.execute("DELETE FROM transactions WHERE id = 'TX2'")
+    conn.commit()
+
+    feed = changes_since(conn, since)
+    assert feed['version'] == current_version(conn)
+    assert not feed['reset']
+    assert feed['changes']['transactions'] == {'upserted': ['TX1'], 'deleted': ['TX2']}
+    assert changes_since(conn, feed['version'])['changes']['transactions'] == {'upserted': [], 'deleted': []}
+
+
+def test_changes_since_resets_when_log_was_compacted_or_version_is_unknown(conn, loans):
+    since = current_version(conn)
+    conn.execute("UPDATE transactions SET notes = 'แก้ไข' WHERE id = 'TX1'")
+    conn.commit()
+
+    # เวอร์ชันที่มากกว่าปัจจุบันมาจากฐานข้อมูลอื่น (เช่น ไฟล์ที่ถูกสร้างใหม่)
+    assert changes_since(conn, current_version(conn) + 1)['reset']
+
+    conn.execute("UPDATE change_log SET changed_at = '2000-01-01 00:00:00'")
+    conn.commit()
+    assert compact_change_log(conn, keep_days=0, keep_last=0) > 0
+    assert changes_since(conn, since)['reset']
+    assert not changes_since(conn, current_version(conn))['reset']
+
+
+@pytest.mark.parametrize("change", [
+    # เบิกใหม่ (วันที่ล่าสุด ต่อไว้ด้านหน้า)
+    "INSERT INTO transactions (id, equipment_id, equipment_name, borrower_id, department_id, quantity, "
+    "returned_quantity, remaining_quantity, unit, date, status, notes, fully_returned) "
+    "SELECT 'TX7', equipment_id, equipment_name, borrower_id, department_id, 1, 0, 1, unit, "
+    "'2024-02-01 09:00:00', status, '', 0 FROM transactions WHERE id = 'TX1'",
+    # เบิกย้อนหลัง (วันที่เก่ากว่าทุกแถว ต้องเรียงใหม่)
+    "INSERT INTO transactions (id, equipment_id, equipment_name, borrower_id, department_id, quantity, "
+    "returned_quantity, remaining_quantity, unit, date, status, notes, fully_returned) "
+    "SELECT 'TX0', equipment_id, equipment_name, borrower_id, department_id, 1, 0, 1, unit, "
+    "'2023-12-31 09:00:00', status, '', 0 FROM transactions WHERE id = 'TX1'",
+    # แก้ไขโดยวันที่ไม่เปลี่ยน (แทนที่ตำแหน่งเดิม)
+    "UPDATE transactions SET notes = 'แก้ไข' WHERE id IN ('TX2', 'TX6')",
+    # แก้วันที่เบิก (แถวต้องย้ายตำแหน่ง)
+    "UPDATE transactions SET date = '2024-01-03 09:00:00' WHERE id = 'TX5'",
+    "DELETE FROM transactions WHERE id IN ('TX1', 'TX3')",
+])
+def test_incremental_refresh_matches_full_reload(conn, loans, change):
+    incremental = IncrementalTransactions()
+    incremental.refresh(conn)
+
+    conn.execute(change)
+    conn.commit()
+
+    patched = incremental.refresh(conn)
+    assert incremental.version == current_version(conn)
+    pd.testing.assert_frame_equal(_plain(patched), _plain(read_transactions_typed(conn)), check_dtype=False)
+
+
+def test_incremental_refresh_after_returns_and_withdrawals(conn, loans, withdraw):
+    incremental = IncrementalTransactions()
+    before = incremental.refresh(conn)
+
+    apply_return(conn, "TX2", 1, return_date="2024-01-10 09:00:00")
+    apply_return(conn, "TX4", 2, return_date="2024-01-10 09:00:00")
+    conn.commit()
+    withdraw("TX8", "EQ2", 3, borrower_name="ผู้เบิกใหม่", borrower_dept="แผนกใหม่", date="2024-03-01 09:00:00")
+
+    patched = incremental.refresh(conn)
+    assert patched is not before
+    assert list(patched['id'][:1]) == ["TX8"]
+    pd.testing.assert_frame_equal(_plain(patched), _plain(read_transactions_typed(conn)), check_dtype=False)
+    # ไม่แก้ DataFrame เดิมที่ผู้อื่นอาจใช้อยู่
+    assert "TX8" not in set(before['id'])
@@ -0,0 +1,39 @@
+import pytest
+
+from database import insert_withdrawal
+from ledger import STOCK_WITHDRAW
+
+
+@pytest.fixture
+def stocked(add_equipment):
+    add_equipment("EQ1", 5)
+
+
+def _counts(conn):
+    return (
+        conn.execute("SELECT quantity FROM equipment WHERE id = 'EQ1'").fetchone()[0],
+        conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0],
+        conn.execute("SELECT COUNT(*) FROM stock_ledger WHERE cause = ?", (STOCK_WITHDRAW,)).fetchone()[0],
+    )
+
+
+def test_withdrawal_larger_than_stock_is_rejected(conn, lookup, stocked):
+    with pytest.raises(ValueError, match="ไม่พอ"):
+        insert_withdrawal(conn, lookup, "TX1", "EQ1", "ผู้เบิก 1", "แผนก 1", 6)
+    conn.rollback()
+    assert _counts(conn) == (5, 0, 0)
+
+    insert_withdrawal(conn, lookup, "TX1", "EQ1", "ผู้เบิก 1", "แผนก 1", 5)
+    conn.commit()
+    assert _counts(conn) == (0, 1, 1)
+    with pytest.raises(ValueError):
+        insert_withdrawal(conn, lookup, "TX2", "EQ1", "ผู้เบิก 1", "แผนก 1", 1)
+    conn.rollback()
+    assert _counts(conn) == (0, 1, 1)
+
+
+def test_withdrawal_of_unknown_equipment_is_rejected(conn, lookup, stocked):
+    with pytest.raises(ValueError, match="ไม่พบเครื่องมือ"):
+        insert_withdrawal(conn, lookup, "TX1", "EQ9", "ผู้เบิก 1", "แผนก 1", 1)
+    conn.rollback()
+    assert _counts(conn) == (5, 0, 0)
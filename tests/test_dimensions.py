@@ -0,0 +1,38 @@
+import pytest
+
+from database import insert_withdrawal
+from dimensions import dimension_names
+
+
+@pytest.fixture
+def stocked(add_equipment):
+    add_equipment("EQ1", 5)
+
+
+def _names(conn):
+    return dimension_names(conn, "borrowers"), dimension_names(conn, "departments")
+
+
+# ชื่อใหม่อยู่ในธุรกรรมเดียวกับรายการเบิก การเบิกที่ล้มเหลวจึงไม่ทิ้งชื่อค้างในตารางมิติ
+def test_failed_withdrawal_leaves_no_new_names(conn, lookup, stocked):
+    with pytest.raises(ValueError):
+        insert_withdrawal(conn, lookup, "TX1", "EQ1", "ผู้เบิกใหม่", "แผนกใหม่", 6)
+    conn.rollback()
+    assert _names(conn) == ([], [])
+
+    # รหัสที่ถูก rollback ไม่ค้างใน cache
+    insert_withdrawal(conn, lookup, "TX1", "EQ1", "ผู้เบิกใหม่", "แผนกใหม่", 1)
+    conn.commit()
+    assert _names(conn) == (["ผู้เบิกใหม่"], ["แผนกใหม่"])
+    assert conn.execute(
+        "SELECT borrower_name, borrower_dept FROM transaction_details WHERE id = 'TX1'"
+    ).fetchone() == ("ผู้เบิกใหม่", "แผนกใหม่")
+
+
+def test_committed_names_are_reused(conn, lookup, stocked, withdraw):
+    withdraw("TX1", "EQ1", 1, borrower_name="ผู้เบิก 1", borrower_dept="แผนก 1")
+    withdraw("TX2", "EQ1", 1, borrower_name="ผู้เบิก 1", borrower_dept="แผนก 1")
+    assert _names(conn) == (["ผู้เบิก 1"], ["แผนก 1"])
+    assert lookup.borrower_id(conn, "ผู้เบิก 1") == conn.execute(
+        "SELECT borrower_id FROM transactions WHERE id = 'TX2'"
+    ).fetchone()[0]
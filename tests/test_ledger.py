@@ -0,0 +1,65 @@
+from datetime import datetime
+
+import pytest
+
+from ledger import snapshot_if_due, stock_as_of, take_stock_snapshot
+
+
+# เปลี่ยนยอดพร้อมบันทึกสมุดบัญชีด้วยเวลาที่กำหนด (record_stock_change ใช้เวลาปัจจุบันเสมอ)
+def _change(conn, equipment_id, delta, at):
+    conn.execute('''
+        INSERT INTO equipment (id, name, category, quantity, unit) VALUES (?, ?, 'หมวด 1', 0, 'อัน')
+        ON CONFLICT (id) DO NOTHING
+    ''', (equipment_id, f"เครื่องมือ {equipment_id}"))
+    conn.execute("UPDATE equipment SET quantity = quantity + ? WHERE id = ?", (delta, equipment_id))
+    conn.execute(
+        "INSERT INTO stock_ledger (equipment_id, delta, cause, at) VALUES (?, ?, 'adjust', ?)",
+        (equipment_id, delta, at)
+    )
+    conn.commit()
+
+
+@pytest.fixture
+def history(conn):
+    # เริ่มจากสมุดบัญชีว่าง (ไม่มีเครื่องมือเริ่มต้นที่ init_database ใส่ไว้)
+    conn.execute("DELETE FROM equipment")
+    conn.execute("DELETE FROM stock_ledger")
+    _change(conn, "EQ1", 10, "2024-01-01 08:00:00")
+    _change(conn, "EQ1", -3, "2024-01-02 08:00:00")
+    _change(conn, "EQ2", 5, "2024-01-02 09:00:00")
+    take_stock_snapshot(conn, now="2024-01-02 12:00:00")
+    # บันทึกหลัง snapshot แต่อยู่ในวินาทีเดียวกัน
+    _change(conn, "EQ1", -2, "2024-01-02 12:00:00")
+    _change(conn, "EQ1", 1, "2024-01-03 08:00:00")
+    _change(conn, "EQ3", 4, "2024-01-03 09:00:00")
+    take_stock_snapshot(conn, now="2024-01-04 00:00:00")
+    _change(conn, "EQ2", -5, "2024-01-05 08:00:00")
+
+
+@pytest.mark.parametrize("at, expected", [
+    ("2024-01-01 07:59:59", {}),
+    ("2024-01-02 08:00:00", {"EQ1": 7}),
+    ("2024-01-02 11:59:59", {"EQ1": 7, "EQ2": 5}),
+    ("2024-01-02 12:00:00", {"EQ1": 5, "EQ2": 5}),
+    ("2024-01-03 08:30:00", {"EQ1": 6, "EQ2": 5}),
+    ("2024-01-04 00:00:00", {"EQ1": 6, "EQ2": 5, "EQ3": 4}),
+    ("2024-01-06 00:00:00", {"EQ1": 6, "EQ2": 0, "EQ3": 4}),
+])
+def test_stock_as_of_matches_full_replay_around_snapshots(conn, history, at, expected):
+    assert stock_as_of(conn, at) == expected
+    assert stock_as_of(conn, at, use_snapshots=False) == expected
+
+
+def test_stock_as_of_accepts_datetime_and_ends_at_current_stock(conn, history):
+    assert stock_as_of(conn, datetime(2024, 1, 3, 8, 30)) == {"EQ1": 6, "EQ2": 5}
+    assert stock_as_of(conn, "2099-01-01 00:00:00") == dict(conn.execute("SELECT id, quantity FROM equipment"))
+
+
+def test_snapshot_if_due_waits_for_enough_new_entries(conn, history):
+    assert snapshot_if_due(conn, every_entries=2) is None
+    _change(conn, "EQ3", -1, "2024-01-06 08:00:00")
+    snapshot_id = snapshot_if_due(conn, every_entries=2)
+    assert snapshot_id is not None
+    assert dict(conn.execute(
+        "SELECT equipment_id, quantity FROM stock_snapshot_rows WHERE snapshot_id = ?", (snapshot_id,)
+    )) == {"EQ1": 6, "EQ2": 0, "EQ3": 3}
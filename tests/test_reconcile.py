@@ -0,0 +1,86 @@
+import pytest
+
+from ledger import STOCK_RECONCILE, stock_as_of
+from reconcile import (
+    ISSUE_OVER_RETURNED, ISSUE_REMAINING, ISSUE_RETURNED, ISSUE_STOCK, open_issues, run_reconcile
+)
+from return_queue import apply_return
+
+
+@pytest.fixture
+def loan(conn, add_equipment, withdraw):
+    add_equipment("EQ1", 10)
+    withdraw("TX1", "EQ1", 4)
+    apply_return(conn, "TX1", 1)
+    conn.commit()
+
+
+def _kinds(result):
+    return {(issue['kind'], issue['row_id']) for issue in result['found']}
+
+
+def test_consistent_database_has_no_issues(db_path, loan):
+    result = run_reconcile(db_path)
+    assert result['full']
+    assert result['found'] == []
+    assert result['open_issues'] == 0
+
+    # รอบถัดไปตรวจเฉพาะแถวที่เปลี่ยน
+    result = run_reconcile(db_path)
+    assert not result['full']
+    assert result['equipment_checked'] == 0 and result['transactions_checked'] == 0
+
+
+def test_stock_drift_is_found_and_repaired(db_path, conn, loan):
+    run_reconcile(db_path)
+    # แก้ยอดตรง ๆ โดยไม่บันทึกสมุดบัญชี
+    conn.execute("UPDATE equipment SET quantity = quantity + 3 WHERE id = 'EQ1'")
+    conn.commit()
+
+    result = run_reconcile(db_path)
+    assert not result['full']
+    assert result['found'] == [{'kind': ISSUE_STOCK, 'row_id': "EQ1", 'expected': 7, 'actual': 10}]
+    assert [(issue['kind'], issue['row_id']) for issue in open_issues(conn)] == [(ISSUE_STOCK, "EQ1")]
+
+    result = run_reconcile(db_path, repair=True)
+    assert result['repaired'] == 1
+    assert result['open_issues'] == 0
+    # ยอดในตาราง equipment เป็นหลัก สมุดบัญชีได้รายการปรับยอดเท่าผลต่าง
+    assert conn.execute(
+        "SELECT delta FROM stock_ledger WHERE cause = ? AND equipment_id = 'EQ1'", (STOCK_RECONCILE,)
+    ).fetchall() == [(3,)]
+    assert stock_as_of(conn, "2099-01-01 00:00:00")["EQ1"] == 10
+    assert run_reconcile(db_path)['found'] == []
+    assert run_reconcile(db_path, full=True)['found'] == []
+
+
+def test_transaction_drift_is_repaired_from_return_history(db_path, conn, loan):
+    run_reconcile(db_path)
+    conn.execute("UPDATE transactions SET returned_quantity = 0, remaining_quantity = 4 WHERE id = 'TX1'")
+    conn.commit()
+
+    result = run_reconcile(db_path, repair=True)
+    assert _kinds(result) == {(ISSUE_RETURNED, "TX1"), (ISSUE_REMAINING, "TX1")}
+    assert result['open_issues'] == 0
+    assert conn.execute(
+        "SELECT returned_quantity, remaining_quantity, fully_returned, status FROM transactions WHERE id = 'TX1'"
+    ).fetchone() == (1, 3, 0, "คืนบางส่วน")
+
+
+def test_over_return_is_reported_but_not_repaired(db_path, conn, loan):
+    run_reconcile(db_path)
+    conn.execute('''
+        INSERT INTO return_history (transaction_id, returned_quantity, return_date, notes)
+        VALUES ('TX1', 5, '2024-01-01 00:00:00', '')
+    ''')
+    conn.commit()
+
+    result = run_reconcile(db_path, repair=True)
+    assert _kinds(result) == {(ISSUE_OVER_RETURNED, "TX1")}
+    assert result['repaired'] == 0
+    assert result['open_issues'] == 1
+
+    # แก้ข้อมูลแล้ว ปัญหาหายไปเองในรอบถัดไป
+    conn.execute("DELETE FROM return_history WHERE returned_quantity = 5")
+    conn.commit()
+    assert run_reconcile(db_path)['open_issues'] == 0
@@ -0,0 +1,88 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from return_queue import (
+    RETURN_APPLIED, RETURN_DUPLICATE, RETURN_REJECTED, apply_return, apply_return_batch, new_idempotency_key
+)
+
+
+@pytest.fixture
+def loan(add_equipment, withdraw):
+    add_equipment("EQ1", 10)
+    withdraw("TX1", "EQ1", 4)
+
+
+def _state(conn):
+    return (
+        conn.execute("SELECT quantity FROM equipment WHERE id = 'EQ1'").fetchone()[0],
+        conn.execute("SELECT returned_quantity, remaining_quantity FROM transactions WHERE id = 'TX1'").fetchone(),
+        conn.execute("SELECT COUNT(*) FROM return_history").fetchone()[0],
+        conn.execute("SELECT COALESCE(SUM(delta), 0) FROM stock_ledger WHERE cause = 'return'").fetchone()[0],
+    )
+
+
+def test_same_key_is_applied_once(conn, loan):
+    key = new_idempotency_key()
+    status, message = apply_return(conn, "TX1", 3, idempotency_key=key)
+    conn.commit()
+    assert status == RETURN_APPLIED
+    applied = _state(conn)
+
+    # กดซ้ำ/ซิงค์ซ้ำ: ไม่คืนซ้ำ และตอบข้อความเดิม
+    assert apply_return(conn, "TX1", 3, idempotency_key=key) == (RETURN_DUPLICATE, message)
+    conn.commit()
+    assert _state(conn) == applied == (9, (3, 1), 1, 3)
+
+
+# หลาย connection คืนด้วย key เดียวกันพร้อมกัน (เช่น สอง worker ซิงค์คิวเดียวกัน) มีเพียงตัวเดียวที่คืนจริง
+def test_same_key_from_concurrent_connections_is_applied_once(db_path, conn, loan):
+    key = new_idempotency_key()
+
+    def submit(_):
+        worker = sqlite3.connect(db_path, timeout=30.0)
+        try:
+            status, _ = apply_return(worker, "TX1", 3, idempotency_key=key)
+            worker.commit()
+            return status
+        finally:
+            worker.close()
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        statuses = sorted(pool.map(submit, range(4)))
+    assert statuses == [RETURN_APPLIED] + [RETURN_DUPLICATE] * 3
+    assert _state(conn) == (9, (3, 1), 1, 3)
+
+
+def test_rejected_return_releases_the_key(conn, loan):
+    key = new_idempotency_key()
+    status, _ = apply_return(conn, "TX1", 5, idempotency_key=key)
+    conn.commit()
+    assert status == RETURN_REJECTED
+    assert conn.execute("SELECT COUNT(*) FROM applied_returns").fetchone()[0] == 0
+
+    # ส่ง key เดิมใหม่หลังแก้จำนวนได้
+    assert apply_return(conn, "TX1", 4, idempotency_key=key)[0] == RETURN_APPLIED
+    conn.commit()
+    assert _state(conn) == (10, (4, 0), 1, 4)
+
+
+def test_batch_skips_keys_already_applied_and_repeated_in_the_batch(conn, loan):
+    first, second = new_idempotency_key(), new_idempotency_key()
+    apply_return(conn, "TX1", 1, idempotency_key=first)
+    conn.commit()
+
+    results = apply_return_batch(conn, [
+        {'key': first, 'transaction_id': "TX1", 'quantity': 1},
+        {'key': second, 'transaction_id': "TX1", 'quantity': 2},
+        {'key': second, 'transaction_id': "TX1", 'quantity': 2},
+    ])
+    assert results[first][0] == RETURN_DUPLICATE
+    assert results[second][0] == RETURN_APPLIED
+    assert _state(conn) == (9, (3, 1), 2, 3)
+
+    # ซิงค์ทั้งชุดซ้ำ (ack หาย) ไม่เปลี่ยนอะไร
+    replayed = apply_return_batch(conn, [{'key': second, 'transaction_id': "TX1", 'quantity': 2}])
+    assert replayed[second] == (RETURN_DUPLICATE, results[second][1])
+    assert _state(conn) == (9, (3, 1), 2, 3)
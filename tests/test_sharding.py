@@ -0,0 +1,98 @@
+import os
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from database import init_database, insert_equipment, insert_withdrawal
+from dimensions import DimensionLookup
+from sharding import DEFAULT_SHARD, SHARDS_ENV, ShardRouter
+from typed_frames import merge_shard_transactions, read_transactions_typed
+
+
+def test_single_database_router(tmp_path):
+    default_path = str(tmp_path / "medical_equipment.db")
+    router = ShardRouter(default_path=default_path)
+    assert not router.sharded
+    assert router.keys() == [DEFAULT_SHARD]
+    assert router.path_for() == default_path
+    assert router.path_for_transaction("ICU-TX20240101090000") == default_path
+    assert router.new_transaction_id(now=datetime(2024, 1, 1, 9, 0, 0)) == "TX20240101090000"
+
+
+def test_sharded_router_routes_by_transaction_prefix(tmp_path):
+    router = ShardRouter([" ICU", "ER ", ""], shard_dir=str(tmp_path))
+    assert router.sharded
+    assert router.keys() == ["ICU", "ER"]
+    assert router.path_for("ER") == os.path.join(str(tmp_path), "ER.db")
+
+    transaction_id = router.new_transaction_id("ER", datetime(2024, 1, 1, 9, 0, 0), sequence=7)
+    assert transaction_id == "ER-TX20240101090000-000007"
+    assert router.shard_for_transaction(transaction_id) == "ER"
+    # รหัสแบบเดิม (ไม่มี prefix) และ prefix ที่ไม่ใช่ shard อยู่ใน shard แรก
+    assert router.shard_for_transaction("TX20240101090000") == "ICU"
+    assert router.shard_for_transaction("OPD-TX20240101090000") == "ICU"
+
+    with pytest.raises(KeyError):
+        router.path_for("OPD")
+    with pytest.raises(ValueError):
+        ShardRouter(["ICU", "../ER"])
+
+
+def test_router_from_env(tmp_path, monkeypatch):
+    monkeypatch.setenv(SHARDS_ENV, "ICU,ER")
+    assert ShardRouter.from_env("unused.db", shard_dir=str(tmp_path)).keys() == ["ICU", "ER"]
+    monkeypatch.delenv(SHARDS_ENV)
+    assert ShardRouter.from_env("main.db").paths() == ["main.db"]
+
+
+def test_fan_out_returns_results_in_shard_order(tmp_path):
+    router = ShardRouter(["ICU", "ER", "OPD"], shard_dir=str(tmp_path))
+    assert list(router.fan_out(lambda key, path: os.path.basename(path))) == ["ICU", "ER", "OPD"]
+
+
+@pytest.fixture
+def shards(tmp_path):
+    router = ShardRouter(["ICU", "ER"], shard_dir=str(tmp_path / "shards"))
+    loans = {
+        "ICU": [("2024-01-01 09:00:00", 1), ("2024-01-03 09:00:00", 2), ("2024-01-05 09:00:00", 3)],
+        "ER": [("2024-01-02 09:00:00", 1), ("2024-01-03 09:00:00", 2), ("2024-01-06 09:00:00", 3)],
+    }
+    for key, path in router.shards.items():
+        init_database(path)
+        conn = sqlite3.connect(path, timeout=30.0)
+        try:
+            insert_equipment(conn, f"{key}1", f"เครื่องมือ {key}", "หมวด 1", 10, "อัน")
+            for date, sequence in loans[key]:
+                transaction_id = router.new_transaction_id(key, datetime(2024, 1, 1), sequence=sequence)
+                insert_withdrawal(conn, DimensionLookup(), transaction_id, f"{key}1", "ผู้เบิก 1", f"แผนก {key}", 1,
+                                  date=date)
+            conn.commit()
+        finally:
+            conn.close()
+    return router
+
+
+def test_merge_shard_transactions_orders_latest_first(shards):
+    def read(key, path):
+        conn = sqlite3.connect(path, timeout=30.0)
+        try:
+            return read_transactions_typed(conn)
+        finally:
+            conn.close()
+
+    frames = list(shards.fan_out(read).values())
+    merged = merge_shard_transactions(frames + [None])
+
+    assert list(merged['id']) == [
+        "ER-TX20240101000000-000003",
+        "ICU-TX20240101000000-000003",
+        # วันที่ซ้ำกันข้าม shard เรียงตามรหัสจากมากไปน้อย
+        "ICU-TX20240101000000-000002",
+        "ER-TX20240101000000-000002",
+        "ER-TX20240101000000-000001",
+        "ICU-TX20240101000000-000001",
+    ]
+    assert set(merged['borrower_dept'].cat.categories) == {"แผนก ICU", "แผนก ER"}
+    assert merged['borrower_dept'].iloc[0] == "แผนก ER"
+    assert merge_shard_transactions([frames[0], None]) is frames[0]
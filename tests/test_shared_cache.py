@@ -0,0 +1,90 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from shared_cache import SharedCache
+
+pytest.importorskip("pyarrow")
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SharedCache(cache_dir=str(tmp_path / "cache"))
+
+
+@pytest.fixture
+def frame():
+    return pd.DataFrame({
+        'id': ["TX1", "TX2", "TX3"],
+        'borrower_dept': pd.Categorical(["ICU", "ER", "ICU"]),
+        'quantity': pd.array([1, 2, 3], dtype="int32"),
+        'date': pd.to_datetime(["2024-01-01 09:00:00", "2024-01-02 10:30:00", None]),
+        'fully_returned': [True, False, True],
+    })
+
+
+def test_frame_round_trip_keeps_categorical_and_datetime_columns(cache, frame):
+    path = cache.put("reports", "transactions", "origin:1", frame)
+    assert path.endswith(".arrow")
+
+    found, value = SharedCache(cache_dir=cache.cache_dir).get("reports", "transactions", "origin:1")
+    assert found
+    pd.testing.assert_frame_equal(value, frame)
+    assert isinstance(value['borrower_dept'].dtype, pd.CategoricalDtype)
+
+
+def test_json_round_trip_of_nested_values(cache, frame):
+    value = {
+        'summary': {'total': 6, 'ratio': 0.5, 'label': "แผนก", 'empty': None},
+        'rows': [1, "สอง", [3.0, False]],
+        'frame': frame.set_index('id'),
+        'series': frame.set_index('id')['borrower_dept'].rename("แผนก"),
+        'checked_at': datetime(2024, 1, 2, 3, 4, 5),
+        'latest': pd.Timestamp("2024-01-02 10:30:00"),
+    }
+    path = cache.put("reports", ("summary", 2024), "origin:1", value)
+    assert path.endswith(".json")
+
+    found, restored = cache.get("reports", ("summary", 2024), "origin:1")
+    assert found
+    assert restored['summary'] == value['summary']
+    assert restored['rows'] == value['rows']
+    pd.testing.assert_frame_equal(restored['frame'], value['frame'])
+    pd.testing.assert_series_equal(restored['series'], value['series'])
+    assert type(restored['checked_at']) is datetime and restored['checked_at'] == value['checked_at']
+    assert isinstance(restored['latest'], pd.Timestamp) and restored['latest'] == value['latest']
+
+
+def test_new_version_or_clear_hides_old_values(cache, frame):
+    cache.put("reports", "transactions", "origin:1", frame)
+    assert cache.get("reports", "transactions", "origin:2") == (False, None)
+
+    cache.clear()
+    assert cache.get("reports", "transactions", "origin:1") == (False, None)
+
+
+def test_get_or_compute_computes_once(cache):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {'value': len(calls)}
+
+    assert cache.get_or_compute("reports", "key", "origin:1", compute) == {'value': 1}
+    assert SharedCache(cache_dir=cache.cache_dir).get_or_compute("reports", "key", "origin:1", compute) == {'value': 1}
+    assert len(calls) == 1
+
+
+def test_values_that_cannot_be_stored_are_computed_every_time(cache):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {1, 2}
+
+    with pytest.raises(TypeError):
+        cache.put("reports", "key", "origin:1", {1, 2})
+    assert cache.get_or_compute("reports", "key", "origin:1", compute) == {1, 2}
+    assert cache.get_or_compute("reports", "key", "origin:1", compute) == {1, 2}
+    assert len(calls) == 2
@@ -0,0 +1,111 @@
+# แปลงข้อมูลการเบิกเป็น DataFrame แบบกำหนดชนิดข้อมูล (typed/columnar)
+# ใช้ categorical กับคอลัมน์ที่ค่าซ้ำกันมาก, datetime64 กับวันที่ และ integer แบบแคบ
+# เพื่อลดหน่วยความจำและเวลาโหลดเมื่อมีรายการเบิกจำนวนมาก
+import logging
+
+import numpy as np
+import pandas as pd
+
+from dimensions import TRANSACTIONS_VIEW
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# คอลัมน์ที่หน้าแอพใช้จริง
+TRANSACTION_COLUMNS = [
+    "id", "equipment_id", "equipment_name", "borrower_name", "borrower_dept",
+    "quantity", "returned_quantity", "remaining_quantity", "unit",
+    "date", "status", "notes", "fully_returned", "last_return_date"
+]
+
+# categorical เฉพาะคอลัมน์ที่มีค่าไม่กี่แบบ (เครื่องมือ แผนก หน่วย สถานะ) ชื่อผู้เบิกมีค่าต่างกันเกือบทุกแถว
+# ถ้าเป็น categorical ทุกผู้เบิกใหม่จะเพิ่ม categories และการรวม DataFrame ต้อง union categories ทุกครั้ง จึงเก็บเป็นข้อความ
+CATEGORY_COLUMNS = ("equipment_id", "equipment_name", "borrower_dept", "unit", "status")
+INTEGER_COLUMNS = ("quantity", "returned_quantity", "remaining_quantity")
+DATETIME_COLUMNS = ("date", "last_return_date")
+
+logger = logging.getLogger(__name__)
+
+
+# แปลงวันที่ ข้อมูลจากไฟล์สำรองเก่าอาจใช้รูปแบบต่างออกไป จึงลองแบบ mixed เมื่อรูปแบบมาตรฐานใช้ไม่ได้
+# ค่าที่แปลงไม่ได้เลยกลายเป็น NaT (แถวนั้นจะไม่อยู่ในตัวกรองวันที่และรายงาน) จึงนับและบันทึก log ทุกครั้ง
+def _to_datetime(values, column=None):
+    try:
+        return pd.to_datetime(values, format=DATE_FORMAT)
+    except (ValueError, TypeError):
+        parsed = pd.to_datetime(values, format="mixed", errors="coerce")
+    invalid = [value for value, result in zip(values, parsed) if not pd.isna(value) and pd.isna(result)]
+    if invalid:
+        logger.warning(
+            "คอลัมน์ %s: แปลงวันที่ไม่ได้ %d แถว (เช่น %s) แถวเหล่านี้จะไม่อยู่ในตัวกรองวันที่และรายงาน",
+            column, len(invalid), ", ".join(repr(value) for value in invalid[:5])
+        )
+    return parsed
+
+
+# สร้าง DataFrame แบบ typed จาก dict ของคอลัมน์ (ชื่อคอลัมน์ -> list ของค่า)
+def build_transactions_frame(columns):
+    data = {}
+    for name in TRANSACTION_COLUMNS:
+        values = columns.get(name, [])
+        if name in CATEGORY_COLUMNS:
+            data[name] = pd.Categorical(values)
+        elif name in INTEGER_COLUMNS:
+            data[name] = pd.Series(values, dtype="float64").fillna(0).astype("int32").to_numpy()
+        elif name in DATETIME_COLUMNS:
+            data[name] = _to_datetime(values, name)
+        elif name == "fully_returned":
+            data[name] = pd.Series(values, dtype="float64").fillna(0).astype(bool).to_numpy()
+        else:
+            data[name] = pd.Series(values, dtype=object).to_numpy()
+    return pd.DataFrame(data, columns=TRANSACTION_COLUMNS)
+
+
+# ลำดับมาตรฐานของรายการเบิก: วันที่เบิกล่าสุดก่อน วันที่เท่ากันเรียงตามรหัสจากมากไปน้อย
+# ทุกที่ที่ได้ DataFrame รายการเบิก (โหลดทั้งหมด, patch จาก change feed, รวมหลาย shard) เรียงด้วยฟังก์ชันนี้
+# ผลจึงเหมือนกันไม่ว่าจะได้มาทางไหน เรียงตามวันที่ก่อน (เร็ว) แล้วเรียงด้วยรหัสเฉพาะแถวที่วันที่ซ้ำกัน
+def sort_transactions(df):
+    df = df.sort_values('date', ascending=False, kind='stable')
+    tied = df['date'].duplicated(keep=False).to_numpy()
+    if tied.any():
+        positions = np.flatnonzero(tied)
+        ties = df[['date', 'id']].iloc[positions].set_axis(positions)
+        order = np.arange(len(df))
+        order[positions] = ties.sort_values(['date', 'id'], ascending=False).index.to_numpy()
+        df = df.take(order)
+    return df.reset_index(drop=True)
+
+
+# โหลดรายการเบิกแบบ typed โดยเลือกเฉพาะคอลัมน์ที่ต้องใช้ (เรียงด้วย sort_transactions)
+def read_transactions_typed(conn, where="", params=()):
+    cursor = conn.execute(f"SELECT {', '.join(TRANSACTION_COLUMNS)} FROM {TRANSACTIONS_VIEW} {where}", params)
+    rows = cursor.fetchall()
+    if not rows:
+        return build_transactions_frame({})
+    return sort_transactions(build_transactions_frame(dict(zip(TRANSACTION_COLUMNS, (list(col) for col in zip(*rows))))))
+
+
+# รวม DataFrame แบบ typed หลายชุดเข้าด้วยกันโดยยังคงเป็น categorical
+# (pd.concat จะแปลง categorical ที่มี categories ต่างกันเป็น object)
+def concat_transactions(frames):
+    frames = [df for df in frames if df is not None]
+    if not frames:
+        return build_transactions_frame({})
+    categories = {}
+    for column in CATEGORY_COLUMNS:
+        categories[column] = frames[0][column].cat.categories
+        for df in frames[1:]:
+            categories[column] = categories[column].union(df[column].cat.categories)
+    # ใช้ assign เพื่อไม่แก้ DataFrame ต้นฉบับ (อาจเป็นตัวที่ cache ใช้ร่วมกันอยู่)
+    aligned = [
+        df.assign(**{column: df[column].cat.set_categories(categories[column]) for column in CATEGORY_COLUMNS})
+        for df in frames
+    ]
+    return pd.concat(aligned, ignore_index=True)
+
+
+# รวมรายการเบิกจากหลาย shard (ล่าสุดก่อน)
+def merge_shard_transactions(frames):
+    frames = [df for df in frames if df is not None]
+    if len(frames) <= 1:
+        return frames[0] if frames else None
+    return sort_transactions(concat_transactions(frames))